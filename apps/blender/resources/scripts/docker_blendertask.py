@@ -2,6 +2,7 @@ from __future__ import print_function
 
 from multiprocessing import cpu_count
 import os
+import shutil
 import sys
 import subprocess
 
@@ -10,6 +11,8 @@ import params  # This module is generated before this script is run
 BLENDER_COMMAND = "blender"
 WORK_DIR = "/golem/work"
 OUTPUT_DIR = "/golem/output"
+# set when the requestor wants partial results (finished frames)
+PARTIAL_RESULTS_DIR = getattr(params, "partial_results_dir", None)
 
 
 def exec_cmd(cmd):
@@ -32,6 +35,18 @@ def format_blender_render_cmd(outfilebasename, scene_file, script_file,
     return cmd
 
 
+def send_partial_results(files, frame):
+    """ Copy files of a finished frame to the partial results directory.
+    Files are copied under a name starting with a dot and renamed after
+    the frame when complete, so incomplete copies are not sent """
+    for file_path in files:
+        _, ext = os.path.splitext(file_path)
+        tmp_path = os.path.join(PARTIAL_RESULTS_DIR, ".{}{}".format(frame, ext))
+        shutil.copyfile(file_path, tmp_path)
+        os.rename(tmp_path,
+                  os.path.join(PARTIAL_RESULTS_DIR, "{}{}".format(frame, ext)))
+
+
 def run_blender_task(outfilebasename, scene_file, script_src, start_task,
                      frames, output_format):
     scene_file = os.path.normpath(scene_file)
@@ -44,13 +59,19 @@ def run_blender_task(outfilebasename, scene_file, script_src, start_task,
     with open(blender_script_path, "w") as script_file:
         script_file.write(script_src)
 
-    for frame in frames:
+    for i, frame in enumerate(frames):
+        rendered = set(os.listdir(OUTPUT_DIR))
         cmd = format_blender_render_cmd(outfilebasename, scene_file,
                                         script_file.name, start_task, frame, output_format)
         print(cmd, file=sys.stderr)
         exit_code = exec_cmd(cmd)
         if exit_code is not 0:
             sys.exit(exit_code)
+        # the last frame is sent with the final results
+        if PARTIAL_RESULTS_DIR and i < len(frames) - 1:
+            new_files = sorted(set(os.listdir(OUTPUT_DIR)) - rendered)
+            send_partial_results([os.path.join(OUTPUT_DIR, f)
+                                  for f in new_files], frame)
 
 
 run_blender_task(params.outfilebasename, params.scene_file, params.script_src, params.start_task, params.frames,
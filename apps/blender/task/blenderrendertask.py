@@ -5,7 +5,7 @@ import os
 import random
 from collections import OrderedDict
 
-from PIL import Image, ImageChops
+from PIL import Image
 
 from golem.core.fileshelper import has_ext
 from golem.resource.dirmanager import get_test_task_path
@@ -17,7 +17,6 @@ from apps.blender.resources.scenefileeditor import generate_blender_crop_file
 from apps.blender.task.verificator import BlenderVerificator
 from apps.core.task.coretask import TaskTypeInfo, AcceptClientVerdict
 from apps.rendering.resources.imgrepr import load_as_pil
-from apps.rendering.resources.renderingtaskcollector import RenderingTaskCollector
 from apps.rendering.task.framerenderingtask import FrameRenderingTask, FrameRenderingTaskBuilder, FrameRendererOptions
 from apps.rendering.task.renderingtaskstate import RenderingTaskDefinition, RendererDefaults
 
@@ -43,6 +42,10 @@ class PreviewUpdater(object):
         # pairs of (subtask_number, its_image_filepath)
         # careful: chunks' numbers start from 1
         self.chunks = {}
+        # last subtask number covered by a chunk that spans several parts
+        self.chunk_ends = {}
+        # subtask numbers whose partial results were pasted
+        self.partial_chunks = set()
         self.preview_res_x = preview_res_x
         self.preview_res_y = preview_res_y
         self.preview_file_path = preview_file_path
@@ -59,47 +62,69 @@ class PreviewUpdater(object):
             return self.expected_offsets[subtask_number]
         return self.preview_res_y
 
-    def update_preview(self, subtask_path, subtask_number):
+    def update_preview(self, subtask_path, subtask_number, end_number=None):
+        if end_number is None:
+            end_number = subtask_number
         if subtask_number not in self.chunks:
             self.chunks[subtask_number] = subtask_path
+            self.chunk_ends[subtask_number] = end_number
         
         try:
             img = load_as_pil(subtask_path)
 
-            offset = self.get_offset(subtask_number)
             if subtask_number == self.perfectly_placed_subtasks + 1:
                 _, img_y = img.size
                 self.perfect_match_area_y += img_y
-                self.perfectly_placed_subtasks += 1
+                self.perfectly_placed_subtasks = end_number
 
-            # this is the last task
-            if subtask_number + 1 >= len(self.expected_offsets):
-                height = self.preview_res_y - self.expected_offsets[subtask_number]
-            else:
-                height = self.expected_offsets[subtask_number + 1] - self.expected_offsets[subtask_number]
-            
-            img = img.resize((self.preview_res_x, height), resample=Image.BILINEAR)
-            if not os.path.exists(self.preview_file_path) or len(self.chunks) == 1:
-                img_offset = Image.new("RGB", (self.preview_res_x, self.preview_res_y))
-                img_offset.paste(img, (0, offset))
-                img_offset.save(self.preview_file_path, "BMP")
-                img_offset.close()
-            else:
-                img_current = Image.open(self.preview_file_path)
-                img_current.paste(img, (0, offset))
-                img_current.save(self.preview_file_path, "BMP")
-                img_current.close()
-            img.close()
+            new_preview = len(self.chunks) == 1 and not self.partial_chunks
+            self._paste(img, subtask_number, end_number, new_preview=new_preview)
 
         except Exception:
             logger.exception("Error in Blender update preview:")
             return
+
+    def update_partial_preview(self, subtask_path, subtask_number, end_number=None):
+        """ Paste a partial result of subtasks that are still being computed. The chunk is not registered,
+        so it is replaced by the final result later. """
+        if end_number is None:
+            end_number = subtask_number
+        try:
+            new_preview = not self.chunks and not self.partial_chunks
+            self._paste(load_as_pil(subtask_path), subtask_number, end_number, new_preview=new_preview)
+            self.partial_chunks.add(subtask_number)
+        except Exception:
+            logger.exception("Error in Blender update partial preview:")
+
+    def _paste(self, img, subtask_number, end_number, new_preview=False):
+        offset = self.get_offset(subtask_number)
+        # this is the last task
+        if end_number + 1 >= len(self.expected_offsets):
+            height = self.preview_res_y - self.expected_offsets[subtask_number]
+        else:
+            height = self.expected_offsets[end_number + 1] - self.expected_offsets[subtask_number]
+
+        img = img.resize((self.preview_res_x, height), resample=Image.BILINEAR)
+        if not os.path.exists(self.preview_file_path) or new_preview:
+            img_offset = Image.new("RGB", (self.preview_res_x, self.preview_res_y))
+            img_offset.paste(img, (0, offset))
+            img_offset.save(self.preview_file_path, "BMP")
+            img_offset.close()
+        else:
+            img_current = Image.open(self.preview_file_path)
+            img_current.paste(img, (0, offset))
+            img_current.save(self.preview_file_path, "BMP")
+            img_current.close()
+        img.close()
         
-        if subtask_number == self.perfectly_placed_subtasks and (subtask_number + 1) in self.chunks:
-            self.update_preview(self.chunks[subtask_number + 1], subtask_number + 1)
+        next_number = end_number + 1
+        if end_number == self.perfectly_placed_subtasks and next_number in self.chunks:
+            self.update_preview(self.chunks[next_number], next_number,
+                                self.chunk_ends[next_number])
 
     def restart(self):
         self.chunks = {}
+        self.chunk_ends = {}
         self.perfect_match_area_y = 0
         self.perfectly_placed_subtasks = 0
         if os.path.exists(self.preview_file_path):
@@ -247,6 +272,10 @@ class BlenderRenderTask(FrameRenderingTask):
 
         FrameRenderingTask.__init__(self, task_definition=task_definition, **kwargs)
 
+        # subtasks rendering several frames send the finished ones before the last frame is rendered
+        if self.use_frames and self.total_tasks < len(self.frames):
+            self.stream_partial_results = True
+
         self.verificator.compositing = self.compositing
         self.verificator.output_format = self.output_format
         self.verificator.src_code = self.src_code
@@ -297,17 +326,25 @@ class BlenderRenderTask(FrameRenderingTask):
 
             return self.ExtraData(should_wait=should_wait)
 
-        start_task, end_task = self._get_next_task()
+        return self._query_extra_data(perf_index, num_cores, node_id, node_name)
+
+    def _query_extra_data(self, perf_index, num_cores=0, node_id=None, node_name=None):
+        start_task, end_task = self._get_next_task(perf_index, node_id)
+        if start_task is None or end_task is None:
+            self._release_client(node_id)
+            return self.ExtraData()
+
         scene_file = self._get_scene_file_rel_path()
 
         if self.use_frames:
-            frames, parts = self._choose_frames(self.frames, start_task, self.total_tasks)
+            frames, parts = self._choose_frames(self.frames, start_task, self.total_tasks,
+                                                end_task)
         else:
             frames = [1]
             parts = 1
 
         if not self.use_frames:
-            min_y, max_y = self._get_min_max_y(start_task)
+            min_y, max_y = self._get_min_max_y(start_task, end_task)
         elif parts > 1:
             min_y = (parts - self._count_part(start_task, parts)) * (1.0 / parts)
             max_y = (parts - self._count_part(start_task, parts) + 1) * (1.0 / parts)
@@ -339,6 +376,9 @@ class BlenderRenderTask(FrameRenderingTask):
         self.subtasks_given[hash]['perf'] = perf_index
         self.subtasks_given[hash]['node_id'] = node_id
         self.subtasks_given[hash]['parts'] = parts
+        if self.partitioner:
+            self.partitioner.subtask_started(hash, node_id, end_task - start_task + 1,
+                                             perf_index)
 
         if not self.use_frames:
             self._update_task_preview()
@@ -400,12 +440,17 @@ class BlenderRenderTask(FrameRenderingTask):
 
         return self._new_compute_task_def(hash, extra_data, None, 0)
 
-    def _get_min_max_y(self, start_task):
+    def _get_min_max_y(self, start_task, end_task=None):
         if self.use_frames:
             parts = int(self.total_tasks / len(self.frames))
         else:
             parts = self.total_tasks
-        return get_min_max_y(start_task, parts, self.res_y)
+        if end_task is None:
+            end_task = start_task
+        # strips are numbered from the top while blender borders start at the bottom
+        min_y, _ = get_min_max_y(end_task, parts, self.res_y)
+        _, max_y = get_min_max_y(start_task, parts, self.res_y)
+        return min_y, max_y
 
     def after_test(self, results, tmp_dir):
         return_data = dict()
@@ -423,8 +468,33 @@ class BlenderRenderTask(FrameRenderingTask):
 
         return return_data
 
-    def _update_preview(self, new_chunk_file_path, num_start):
-        self.preview_updater.update_preview(new_chunk_file_path, num_start)
+    def _update_preview(self, new_chunk_file_path, num_start, num_end=None):
+        self.preview_updater.update_preview(new_chunk_file_path, num_start, num_end)
+
+    def partial_results_received(self, subtask_id, files):
+        if not super(BlenderRenderTask, self).partial_results_received(subtask_id, files):
+            return False
+        subtask = self.subtasks_given[subtask_id]
+        for file_path in files:
+            if not has_ext(file_path, '.' + self.output_format):
+                continue
+            if not self.use_frames:
+                self.preview_updater.update_partial_preview(file_path, subtask['start_task'],
+                                                            subtask['end_task'])
+                continue
+            # finished frames are named after their numbers (see docker_blendertask.py)
+            frame = self._get_partial_frame_num(file_path)
+            if frame in subtask['frames'] and subtask['parts'] == 1:
+                self._update_frame_preview(file_path, frame, final=True)
+        return True
+
+    @staticmethod
+    def _get_partial_frame_num(file_path):
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        try:
+            return int(name)
+        except ValueError:
+            return None
 
     def _update_frame_preview(self, new_chunk_file_path, frame_num, part=1, final=False):
         num = self.frames.index(frame_num)
@@ -447,17 +517,17 @@ class BlenderRenderTask(FrameRenderingTask):
         logger.debug('_put_image_together() out: %r', output_file_name)
         self.collected_file_names = OrderedDict(sorted(self.collected_file_names.items()))
         if not self._use_outer_task_collector():
-            collector = CustomCollector(paste=True, width=self.res_x, height=self.res_y)
-            for file in self.collected_file_names.values():
-                collector.add_img_file(file)
-            collector.finalize().save(output_file_name, self.output_format)
+            self._save_collected(None, output_file_name)
         else:
             self._put_collected_files_together(os.path.join(self.tmp_dir, output_file_name),
                                                self.collected_file_names.values(), "paste")
             
-    def mark_part_on_preview(self, part, img_task, color, preview_updater, frame_index=0):
+    def mark_part_on_preview(self, part, img_task, color, preview_updater, frame_index=0,
+                             end_part=None):
+        if end_part is None:
+            end_part = part
         lower = preview_updater.get_offset(part)
-        upper = preview_updater.get_offset(part + 1)
+        upper = preview_updater.get_offset(end_part + 1)
         res_x = preview_updater.preview_res_x
         for i in range(0, res_x):
                 for j in range(lower, upper):
@@ -465,7 +535,8 @@ class BlenderRenderTask(FrameRenderingTask):
 
     def _mark_task_area(self, subtask, img_task, color, frame_index=0):
         if not self.use_frames:
-            self.mark_part_on_preview(subtask['start_task'], img_task, color, self.preview_updater)
+            self.mark_part_on_preview(subtask['start_task'], img_task, color, self.preview_updater,
+                                      end_part=subtask['end_task'])
         elif self.total_tasks <= len(self.frames):
             for i in range(0, int(math.floor(self.res_x * self.scale_factor))):
                 for j in range(0, int(math.floor(self.res_y * self.scale_factor))):
@@ -483,10 +554,7 @@ class BlenderRenderTask(FrameRenderingTask):
         collected = self.frames_given[frame_key]
         collected = OrderedDict(sorted(collected.items()))
         if not self._use_outer_task_collector():
-            collector = CustomCollector(paste=True, width=self.res_x, height=self.res_y)
-            for file in collected.values():
-                collector.add_img_file(file)
-            collector.finalize().save(output_file_name, self.output_format)
+            self._save_collected(frame_key, output_file_name)
         else:
             self._put_collected_files_together(output_file_name, collected.values(), "paste")
         self.collected_file_names[frame_num] = output_file_name
@@ -502,22 +570,6 @@ class BlenderRenderTaskBuilder(FrameRenderingTaskBuilder):
     DEFAULTS = BlenderDefaults
 
 
-class CustomCollector(RenderingTaskCollector):
-    def __init__(self, paste=False, width=1, height=1):
-        RenderingTaskCollector.__init__(self, paste, width, height)
-        self.current_offset = 0
-    
-    def _paste_image(self, final_img, new_part, num):
-        img_offset = Image.new("RGB", (self.width, self.height))
-        offset = self.current_offset
-        _, new_img_res_y = new_part.size
-        self.current_offset += new_img_res_y
-        img_offset.paste(new_part, (0, offset))
-        result = ImageChops.add(final_img, img_offset)
-        img_offset.close()
-        return result
-
-
 def generate_expected_offsets(parts, res_x, res_y):
     logger.debug('generate_expected_offsets(%r, %r, %r)', parts, res_x, res_y)
     # returns expected offsets for preview; the highest value is preview's height
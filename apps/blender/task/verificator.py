@@ -10,6 +10,14 @@ from apps.blender.resources.imgcompare import check_size
 
 
 class BlenderVerificator(FrameRenderingVerificator):
+    # reference boxes are rendered with the same seed and samples
+    METRIC_THRESHOLDS = {
+        'psnr': 30,
+        'ssim': 0.8,
+        'edges': 0.8,
+        'histogram': 0.3,
+    }
+
     def __init__(self, *args, **kwargs):
         super(BlenderVerificator, self).__init__(*args, **kwargs)
         self.box_size = [1, 1]
@@ -61,8 +69,10 @@ class BlenderVerificator(FrameRenderingVerificator):
 
     def _get_part_size(self, subtask_info):
         start_task = subtask_info['start_task']
+        end_task = subtask_info.get('end_task', start_task)
         if not self.use_frames:
-            res_y = self._get_part_size_from_subtask_number(start_task)
+            res_y = sum(self._get_part_size_from_subtask_number(num)
+                        for num in range(start_task, end_task + 1))
         elif len(self.frames) >= self.total_tasks:
             res_y = self.res_y
         else:
@@ -33,6 +33,9 @@ class AcceptClientVerdict(Enum):
 
 
 MAX_PENDING_CLIENT_RESULTS = 1
+# When all parts of a task are assigned and no more than this number of parts
+# is still being computed, idle nodes receive duplicates of these parts
+SPECULATIVE_THRESHOLD = 2
 
 
 class TaskTypeInfo(object):
@@ -72,7 +75,8 @@ class CoreTask(Task):
 
     def __init__(self, src_code, task_definition, node_name, environment, resource_size=0,
                  owner_address="", owner_port=0, owner_key_id="",
-                 max_pending_client_results=MAX_PENDING_CLIENT_RESULTS):
+                 max_pending_client_results=MAX_PENDING_CLIENT_RESULTS,
+                 speculative_threshold=SPECULATIVE_THRESHOLD):
         """Create more specific task implementation
 
         """
@@ -115,11 +119,13 @@ class CoreTask(Task):
         self.stdout = {}  # for each subtask keep info about stdout received from computing node
         self.stderr = {}  # for each subtask keep info about stderr received from computing node
         self.results = {}  # for each subtask keep info about files containing results
+        self.partial_results = {}  # for each subtask being computed: file name -> newest partial result file
 
         self.res_files = {}
         self.tmp_dir = None
         self.verificator = self.VERIFICATOR_CLASS()
         self.max_pending_client_results = max_pending_client_results
+        self.speculative_threshold = speculative_threshold
 
     def is_docker_task(self):
         return hasattr(self.header, 'docker_images') and len(self.header.docker_images) > 0
@@ -129,30 +135,47 @@ class CoreTask(Task):
         self.verificator.tmp_dir = self.tmp_dir
 
     def needs_computation(self):
-        return (self.last_task != self.total_tasks) or (self.num_failed_subtasks > 0)
+        return (self.last_task != self.total_tasks) or (self.num_failed_subtasks > 0) or \
+            self._get_speculative_subtask() is not None
 
     def finished_computation(self):
         return self.num_tasks_received == self.total_tasks
 
     def computation_failed(self, subtask_id):
+        self.partial_results.pop(subtask_id, None)
         self._mark_subtask_failed(subtask_id)
 
     def computation_finished(self, subtask_id, task_result, result_type=0):
+        ver_state = self.verify_results(subtask_id, task_result, result_type)
+        self.results_verified(subtask_id, ver_state)
+
+    def verify_results(self, subtask_id, task_result, result_type=0):
+        """ Interpret and verify results of a subtask. Only the results of this subtask are stored,
+        so it may be called in a worker thread.
+        :return SubtaskVerificationState|None: None if results should not be accepted
+        """
         if not self.should_accept(subtask_id):
+            return None
+        self.interpret_task_results(subtask_id, task_result, result_type)
+        return self.verificator.verify(subtask_id, self.subtasks_given.get(subtask_id),
+                                       self.results.get(subtask_id), self)
+
+    def results_verified(self, subtask_id, ver_state):
+        self.partial_results.pop(subtask_id, None)
+        # the subtask may have been cancelled while its results were verified
+        if ver_state is None or not self.should_accept(subtask_id):
             logger.info("Not accepting results for {}".format(subtask_id))
             return
-        self.interpret_task_results(subtask_id, task_result, result_type)
-        result_files = self.results.get(subtask_id)
-        ver_state = self.verificator.verify(subtask_id, self.subtasks_given.get(subtask_id),
-                                            result_files, self)
         if ver_state == SubtaskVerificationState.VERIFIED:
-            self.accept_results(subtask_id, result_files)
+            self.accept_results(subtask_id, self.results.get(subtask_id))
         # TODO Add support for different verification states
         else:
             self.computation_failed(subtask_id)
 
     def accept_results(self, subtask_id, result_files):
         self.subtasks_given[subtask_id]['status'] = SubtaskStatus.finished
+        for duplicate_id in self.get_duplicated_subtasks(subtask_id):
+            self._cancel_subtask(duplicate_id)
 
     @handle_key_error
     def verify_subtask(self, subtask_id):
@@ -177,6 +200,7 @@ class CoreTask(Task):
     @handle_key_error
     def restart_subtask(self, subtask_id):
         subtask_info = self.subtasks_given[subtask_id]
+        self.partial_results.pop(subtask_id, None)
         was_failure_before = subtask_info['status'] in [SubtaskStatus.failure,
                                                         SubtaskStatus.resent]
 
@@ -236,6 +260,30 @@ class CoreTask(Task):
     def get_results(self, subtask_id):
         return self.results.get(subtask_id, [])
 
+    def partial_results_received(self, subtask_id, files):
+        subtask = self.subtasks_given.get(subtask_id)
+        if subtask is None or subtask['status'] != SubtaskStatus.starting:
+            logger.debug("Ignoring partial results of subtask %r", subtask_id)
+            return False
+        # a newer snapshot of a file replaces the previous one
+        received = self.partial_results.setdefault(subtask_id, {})
+        for file_path in files:
+            received[os.path.basename(file_path)] = file_path
+        return True
+
+    def get_partial_results(self, subtask_id):
+        """ Return the newest partial result files of a subtask that is still being computed """
+        return sorted(self.partial_results.get(subtask_id, {}).values())
+
+    def get_duplicated_subtasks(self, subtask_id):
+        part = self._get_part(self.subtasks_given.get(subtask_id))
+        if part is None:
+            return []
+        return [sub_id for sub_id, sub in self.subtasks_given.items()
+                if sub_id != subtask_id and self._get_part(sub) == part and
+                (SubtaskStatus.is_computed(sub['status']) or
+                 sub['status'] == SubtaskStatus.cancelled)]
+
     #########################
     # Specific task methods #
     #########################
@@ -263,6 +311,34 @@ class CoreTask(Task):
         self.counting_nodes[self.subtasks_given[subtask_id]['node_id']].finish()
         self.subtasks_given[subtask_id]['status'] = SubtaskStatus.downloading
 
+    def query_extra_data_batch(self, perf_index, num_cores=1, node_id=None, node_name=None, max_subtasks=1):
+        """ Assign up to max_subtasks subtasks to the node at once. The limit of pending results is checked
+        once for the whole batch, every subtask of the batch is still counted as started, so the node gets
+        another batch when all results are coming. Duplicates of other nodes' subtasks are never batched.
+        """
+        extra_data = self.query_extra_data(perf_index, num_cores, node_id, node_name)
+        results = [extra_data]
+        if extra_data.should_wait or extra_data.ctd is None:
+            return results
+
+        client = self.counting_nodes[node_id]
+        while len(results) < max_subtasks:
+            if self.last_task == self.total_tasks and self.num_failed_subtasks == 0:
+                break
+            client.start()
+            extra_data = self._query_extra_data(perf_index, num_cores, node_id, node_name)
+            if extra_data.ctd is None:
+                break
+            results.append(extra_data)
+        return results
+
+    def _query_extra_data(self, perf_index, num_cores=0, node_id=None, node_name=None):
+        """ Return ExtraData with the next subtask for a node that has already been accepted
+        with _accept_client. If there is nothing to compute, release the node and return empty ExtraData.
+        """
+        self._release_client(node_id)
+        return self.ExtraData()  # Implement in derived methods
+
     def query_extra_data_for_test_task(self):
         return None  # Implement in derived methods
 
@@ -348,7 +424,76 @@ class CoreTask(Task):
     def _mark_subtask_failed(self, subtask_id):
         self.subtasks_given[subtask_id]['status'] = SubtaskStatus.failure
         self.counting_nodes[self.subtasks_given[subtask_id]['node_id']].reject()
-        self.num_failed_subtasks += 1
+        if self._is_part_covered(subtask_id):
+            # another node is computing or has computed the same part
+            self.subtasks_given[subtask_id]['status'] = SubtaskStatus.resent
+        else:
+            self.num_failed_subtasks += 1
+
+    @staticmethod
+    def _get_part(subtask_info):
+        if not subtask_info or subtask_info.get('start_task') is None:
+            return None
+        return subtask_info['start_task'], subtask_info.get('end_task')
+
+    def _is_part_covered(self, subtask_id):
+        part = self._get_part(self.subtasks_given[subtask_id])
+        if part is None:
+            return False
+        return any(self._get_part(sub) == part and
+                   (SubtaskStatus.is_computed(sub['status']) or
+                    sub['status'] == SubtaskStatus.finished)
+                   for sub_id, sub in self.subtasks_given.items()
+                   if sub_id != subtask_id)
+
+    @handle_key_error
+    def _cancel_subtask(self, subtask_id):
+        subtask_info = self.subtasks_given[subtask_id]
+        if not SubtaskStatus.is_computed(subtask_info['status']):
+            return
+        finishing = subtask_info['status'] == SubtaskStatus.downloading
+        subtask_info['status'] = SubtaskStatus.cancelled
+        self.counting_nodes[subtask_info['node_id']].cancel(finishing)
+        logger.info("Subtask {} cancelled, the same part was computed by "
+                    "another node".format(subtask_id))
+
+    def _get_speculative_subtask(self, perf_index=None, node_id=None):
+        """ Choose a subtask which part should also be given to another node.
+        Duplicates are given only when all parts of the task were assigned, none is waiting
+        for a resend and at most speculative_threshold parts are still being computed.
+        A part is duplicated only once, never for the node that computes it and only
+        for a faster node. Parts computed by the slowest nodes are duplicated first.
+        :param float perf_index: performance of the node asking for a subtask, None if any
+        :param node_id: id of the node asking for a subtask
+        :return: id of the subtask to duplicate or None
+        """
+        if self.last_task != self.total_tasks or self.num_failed_subtasks > 0:
+            return None
+
+        computed = [(sub_id, sub) for sub_id, sub in self.subtasks_given.items()
+                    if SubtaskStatus.is_computed(sub['status']) and self._get_part(sub)]
+        parts = {}
+        for _, sub in computed:
+            part = self._get_part(sub)
+            parts[part] = parts.get(part, 0) + 1
+        if not parts or len(parts) > self.speculative_threshold:
+            return None
+
+        candidates = []
+        for sub_id, sub in computed:
+            if sub['status'] != SubtaskStatus.starting:
+                continue
+            if parts[self._get_part(sub)] > 1:
+                continue
+            if node_id is not None and sub.get('node_id') == node_id:
+                continue
+            if perf_index is not None and perf_index <= sub.get('perf', 0):
+                continue
+            candidates.append((sub.get('perf', 0), sub_id))
+
+        if not candidates:
+            return None
+        return min(candidates)[1]
 
     def _unpack_task_result(self, trp, output_dir):
         tr = CBORSerializer.loads(trp)
@@ -373,6 +518,12 @@ class CoreTask(Task):
         client.start()
         return AcceptClientVerdict.ACCEPTED
 
+    def _release_client(self, node_id):
+        """ Undo _accept_client when no subtask was assigned to the node """
+        client = self.counting_nodes.get(node_id)
+        if client:
+            client.cancel()
+
 
 class CoreTaskBuilder(TaskBuilder):
     TASK_CLASS = CoreTask
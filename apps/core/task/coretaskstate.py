@@ -59,6 +59,8 @@ class TaskDefinition(object):
         self.verification_options = None
         self.options = Options()
         self.docker_images = None
+        # ask providers to send partial results while computing subtasks
+        self.stream_partial_results = False
 
     def is_valid(self):
         if not path.exists(self.main_program_file):
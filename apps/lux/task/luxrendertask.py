@@ -20,7 +20,7 @@ from apps.lux.luxenvironment import LuxRenderEnvironment
 from apps.lux.resources.scenefileeditor import regenerate_lux_file
 from apps.lux.resources.scenefilereader import make_scene_analysis
 from apps.lux.task.verificator import LuxRenderVerificator
-from apps.rendering.resources.imgrepr import load_img, blend
+from apps.rendering.resources.imgrepr import blend, load_array_img
 from apps.rendering.task import renderingtask
 from apps.rendering.task import renderingtaskstate
 
@@ -180,9 +180,20 @@ class LuxTask(renderingtask.RenderingTask):
 
             return self.ExtraData(should_wait=should_wait)
 
-        start_task, end_task = self._get_next_task()
+        return self._query_extra_data(perf_index, num_cores, node_id,
+                                      node_name)
+
+    def _query_extra_data(
+            self,
+            perf_index,
+            num_cores=0,
+            node_id=None,
+            node_name=None
+            ):
+        start_task, end_task = self._get_next_task(perf_index, node_id)
         if start_task is None or end_task is None:
             logger.error("Task already computed")
+            self._release_client(node_id)
             return self.ExtraData()
 
         if self.halttime > 0:
@@ -406,11 +417,11 @@ class LuxTask(renderingtask.RenderingTask):
 
     def _update_preview_from_exr(self, new_chunk_file):
         if self.preview_exr is None:
-            self.preview_exr = load_img(new_chunk_file)
+            self.preview_exr = load_array_img(new_chunk_file)
         else:
             self.preview_exr = blend(
                 self.preview_exr,
-                load_img(new_chunk_file),
+                load_array_img(new_chunk_file),
                 1.0 / self.num_add
             )
 
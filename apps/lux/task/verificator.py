@@ -14,6 +14,14 @@ logger = logging.getLogger("apps.lux")
 
 
 class LuxRenderVerificator(RenderingVerificator):
+    # unbiased, progressive renders: reference images are noisier
+    METRIC_THRESHOLDS = {
+        'psnr': 25,
+        'ssim': 0.6,
+        'edges': 0.6,
+        'histogram': 0.4,
+    }
+
     def __init__(self, *args, **kwargs):
         super(LuxRenderVerificator, self).__init__(*args, **kwargs)
         self.test_flm = None
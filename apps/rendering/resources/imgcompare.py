@@ -1,6 +1,9 @@
 import logging
 import math
 
+import numpy
+
+from apps.rendering.resources.imgmetrics import compare_arrays
 from apps.rendering.resources.imgrepr import (EXRImgRepr, ImgRepr, load_img,
                                               PILImgRepr)
 
@@ -22,31 +25,62 @@ def calculate_psnr(mse, max_=255):
     return 20 * math.log10(max_) - 10 * math.log10(mse)
 
 
+def crop_array(img, start=(0, 0), box=None):
+    """ Return a box of the image as an array (see ImgRepr.to_array)
+    :param ImgRepr img: the image
+    :param start: (x, y) of the upper left corner of the box
+    :param box: (width, height) of the box; the whole image by default
+    :return numpy.ndarray: float32 array of shape (height, width, 3)
+    """
+    size = img.get_size()
+    if box is None:
+        box = size
+    (res_x, res_y) = box
+    if res_x <= 0 or res_y <= 0:
+        raise ValueError("Image or box resolution must be greater than 0")
+    if start[0] < 0 or start[1] < 0 or start[0] + res_x > size[0] \
+            or start[1] + res_y > size[1]:
+        raise ValueError("Box {} at {} exceeds image of size {}"
+                         .format(box, start, size))
+    return img.to_array()[start[1]:start[1] + res_y,
+                          start[0]:start[0] + res_x]
+
+
 def calculate_mse(img1, img2, start1=(0, 0), start2=(0, 0), box=None):
-    mse = 0
     if not isinstance(img1, ImgRepr) or not isinstance(img2, ImgRepr):
         raise TypeError("img1 and img2 must be ImgRepr")
 
     if box is None:
-        (res_x, res_y) = img1.get_size()
-    else:
-        (res_x, res_y) = box
-    for i in range(0, res_x):
-        for j in range(0, res_y):
-            [r1, g1, b1] = img1.get_pixel((start1[0] + i, start1[1] + j))
-            [r2, g2, b2] = img2.get_pixel((start2[0] + i, start2[1] + j))
-            mse += (r1 - r2) * (r1 - r2) + \
-                   (g1 - g2) * (g1 - g2) + \
-                   (b1 - b2) * (b1 - b2)
+        box = img1.get_size()
+    arr1 = crop_array(img1, start1, box)
+    arr2 = crop_array(img2, start2, box)
 
-    if res_x <= 0 or res_y <= 0:
-        raise ValueError("Image or box resolution must be greater than 0")
-    mse /= res_x * res_y * 3
-    return mse
+    # accumulated in float64, exact for 8-bit values
+    diff = arr1.astype(numpy.float64)
+    diff -= arr2
+    mse = numpy.einsum('ijk,ijk->', diff, diff)
+    count = arr1.size
+
+    if getattr(img1, 'type', None) == "PIL" and \
+            getattr(img2, 'type', None) == "PIL":
+        # integer division, like for the integer pixel values before
+        return int(mse) // count
+    return float(mse) / count
 
 
 def compare_imgs(img1, img2, max_col=255, start1=(0, 0),
-                 start2=(0, 0), box=None):
+                 start2=(0, 0), box=None, thresholds=None):
+    """ Check whether boxes of two images are similar enough
+    :param dict thresholds: metric name -> accepted value (see imgmetrics);
+                            PSNR of at least PSNR_ACCEPTABLE_MIN by default
+    """
+    if thresholds:
+        if box is None:
+            box = img1.get_size()
+        return compare_arrays(crop_array(img1, start1, box),
+                              crop_array(img2, start2, box), max_col,
+                              thresholds)
+
     mse = calculate_mse(img1, img2, start1, start2, box)
     logger.debug("MSE = {}".format(mse))
     if mse == 0:
@@ -83,7 +117,7 @@ def compare_exr_imgs(file1, file2):
 
 
 def advance_verify_img(file_, res_x, res_y, start_box, box_size, compare_file,
-                       cmp_start_box):
+                       cmp_start_box, thresholds=None):
     try:
         img = load_img(file_)
         cmp_img = load_img(compare_file)
@@ -104,10 +138,12 @@ def advance_verify_img(file_, res_x, res_y, start_box, box_size, compare_file,
 
         if isinstance(img, PILImgRepr) and isinstance(cmp_img, PILImgRepr):
             return compare_imgs(img, cmp_img, start1=start_box,
-                                start2=cmp_start_box, box=box_size)
+                                start2=cmp_start_box, box=box_size,
+                                thresholds=thresholds)
         else:
             return compare_imgs(img, cmp_img, max_col=1, start1=start_box,
-                                start2=cmp_start_box, box=box_size)
+                                start2=cmp_start_box, box=box_size,
+                                thresholds=thresholds)
     except Exception:
         logger.exception("Cannot verify images {} and {}".format(file_,
                                                                  compare_file))
@@ -0,0 +1,193 @@
+"""Metrics comparing a rendered image box with its reference render.
+
+Every metric is a function of two arrays of the same shape (see
+ImgRepr.to_array) and of the maximum color value. Metrics are computed over
+float64 copies of both boxes made once per comparison; thresholds decide
+which metrics are computed and what values are accepted. Structural metrics
+(SSIM, histogram and edges) are skipped for boxes smaller than
+STRUCTURAL_MIN_SIZE, where they measure mostly noise.
+"""
+import logging
+import math
+
+import numpy
+
+logger = logging.getLogger("apps.rendering")
+
+# luminance weights of RGB channels (ITU-R BT.601)
+LUMA = numpy.array([0.299, 0.587, 0.114])
+
+SSIM_WINDOW = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+HISTOGRAM_BINS = 32
+# size of the blur applied before computing gradients
+EDGE_BLUR = 3
+# minimal width and height of boxes compared with structural metrics
+STRUCTURAL_MIN_SIZE = 32
+
+# name -> (function, whether higher values are better, minimal box size)
+METRICS = {}
+
+
+def register_metric(name, func, higher_is_better=True, min_size=1):
+    """ Add a metric usable in thresholds
+    :param str name: name of the metric
+    :param func: func(arr1, arr2, max_val) -> float
+    :param bool higher_is_better: whether thresholds are minimal values
+                                  (otherwise maximal)
+    :param int min_size: minimal width and height of boxes the metric is
+                         computed for; it is skipped for smaller boxes
+    """
+    METRICS[name] = (func, higher_is_better, min_size)
+
+
+def psnr(arr1, arr2, max_val):
+    """ Peak signal-to-noise ratio of the whole box [dB] """
+    return _psnr(numpy.mean(numpy.square(arr1 - arr2)), max_val)
+
+
+def channel_psnr(arr1, arr2, max_val):
+    """ PSNR of the worst channel [dB] """
+    mse = numpy.mean(numpy.square(arr1 - arr2), axis=(0, 1))
+    return min(_psnr(m, max_val) for m in mse)
+
+
+def ssim(arr1, arr2, max_val, window=SSIM_WINDOW):
+    """ Mean structural similarity of all channels, over square windows
+    at every position in the box; 1.0 for equal boxes """
+    window = min(window, arr1.shape[0], arr1.shape[1])
+    c1 = (SSIM_K1 * max_val) ** 2
+    c2 = (SSIM_K2 * max_val) ** 2
+
+    mu1 = _box_mean(arr1, window)
+    mu2 = _box_mean(arr2, window)
+    var1 = _box_mean(arr1 * arr1, window) - mu1 * mu1
+    var2 = _box_mean(arr2 * arr2, window) - mu2 * mu2
+    cov = _box_mean(arr1 * arr2, window) - mu1 * mu2
+
+    ssim_map = (2 * mu1 * mu2 + c1) * (2 * cov + c2) / \
+        ((mu1 * mu1 + mu2 * mu2 + c1) * (var1 + var2 + c2))
+    return float(ssim_map.mean())
+
+
+def histogram_distance(arr1, arr2, max_val, bins=HISTOGRAM_BINS):
+    """ 1 - intersection of normalized color histograms, averaged over
+    channels; 0.0 for boxes with the same colors """
+    hist1 = _histograms(arr1, max_val, bins)
+    hist2 = _histograms(arr2, max_val, bins)
+    intersection = numpy.minimum(hist1, hist2).sum(axis=1)
+    return float(1.0 - intersection.mean() / (arr1.shape[0] * arr1.shape[1]))
+
+
+def edge_similarity(arr1, arr2, max_val):
+    """ Correlation of gradient magnitudes of luminance; noise and missing
+    details lower it. 1.0 for boxes with the same edges """
+    edges1 = _gradient_magnitude(arr1)
+    edges2 = _gradient_magnitude(arr2)
+    if edges1.size == 0:
+        return 1.0
+
+    edges1 -= edges1.mean()
+    edges2 -= edges2.mean()
+    norm = math.sqrt(float((edges1 * edges1).sum() *
+                           (edges2 * edges2).sum()))
+    if norm == 0:
+        # flat boxes
+        return 1.0 if numpy.allclose(edges1, edges2) else 0.0
+    return float((edges1 * edges2).sum() / norm)
+
+
+register_metric('psnr', psnr)
+register_metric('channel_psnr', channel_psnr)
+register_metric('ssim', ssim, min_size=STRUCTURAL_MIN_SIZE)
+register_metric('histogram', histogram_distance, higher_is_better=False,
+                min_size=STRUCTURAL_MIN_SIZE)
+register_metric('edges', edge_similarity, min_size=STRUCTURAL_MIN_SIZE)
+
+
+def compute_metrics(arr1, arr2, max_val, names):
+    """ Compute metrics of two boxes
+    :param numpy.ndarray arr1: array of shape (height, width, 3)
+    :param numpy.ndarray arr2: array of the same shape
+    :param max_val: maximum color value
+    :param names: names of registered metrics
+    :return dict: name -> value
+    """
+    if arr1.shape != arr2.shape:
+        raise ValueError("Boxes of different shapes: {} and {}"
+                         .format(arr1.shape, arr2.shape))
+    arr1 = numpy.asarray(arr1, dtype=numpy.float64)
+    arr2 = numpy.asarray(arr2, dtype=numpy.float64)
+    return {name: METRICS[name][0](arr1, arr2, max_val) for name in names}
+
+
+def check_metrics(values, thresholds):
+    """ Return names of metrics with values outside of thresholds
+    :param dict values: name -> value
+    :param dict thresholds: name -> minimal or maximal accepted value
+    :return list: names of failed metrics
+    """
+    failed = []
+    for name, threshold in thresholds.items():
+        higher_is_better = METRICS[name][1]
+        value = values[name]
+        if (value < threshold) if higher_is_better else (value > threshold):
+            failed.append(name)
+    return sorted(failed)
+
+
+def applicable_metrics(shape, names):
+    """ Return names of metrics that can be computed for boxes of a shape
+    :param tuple shape: shape of the boxes, (height, width, ...)
+    :param names: names of registered metrics
+    :return list: names of metrics with a minimal size not above the box
+    """
+    size = min(shape[:2])
+    return [name for name in names if METRICS[name][2] <= size]
+
+
+def compare_arrays(arr1, arr2, max_val, thresholds):
+    """ Check whether two boxes are similar enough; metrics not applicable
+    to boxes of this size are skipped
+    :param dict thresholds: metric name -> minimal or maximal accepted value
+    :return bool: whether all computed metrics are within thresholds
+    """
+    names = applicable_metrics(arr1.shape, thresholds.keys())
+    thresholds = {name: thresholds[name] for name in names}
+    values = compute_metrics(arr1, arr2, max_val, names)
+    failed = check_metrics(values, thresholds)
+    logger.debug("Image metrics: %r, failed: %r", values, failed)
+    return not failed
+
+
+def _psnr(mse, max_val):
+    if mse <= 0:
+        return float('inf')
+    return 20 * math.log10(max_val) - 10 * math.log10(mse)
+
+
+def _box_mean(arr, size):
+    """ Mean of every size x size window of arr, per channel """
+    sums = numpy.zeros((arr.shape[0] + 1, arr.shape[1] + 1) + arr.shape[2:])
+    sums[1:, 1:] = arr.cumsum(axis=0).cumsum(axis=1)
+    return (sums[size:, size:] - sums[:-size, size:] -
+            sums[size:, :-size] + sums[:-size, :-size]) / (size * size)
+
+
+def _histograms(arr, max_val, bins):
+    """ Histograms of channels in one bincount: shape (channels, bins) """
+    channels = arr.shape[2]
+    idx = numpy.clip(arr * (bins / float(max_val)), 0, bins - 1)
+    idx = idx.astype(numpy.intp) + numpy.arange(channels) * bins
+    counts = numpy.bincount(idx.ravel(), minlength=channels * bins)
+    return counts.reshape(channels, bins)
+
+
+def _gradient_magnitude(arr):
+    luma = arr.dot(LUMA)
+    if min(luma.shape) > EDGE_BLUR:
+        luma = _box_mean(luma, EDGE_BLUR)
+    grad_x = luma[:-1, 1:] - luma[:-1, :-1]
+    grad_y = luma[1:, :-1] - luma[:-1, :-1]
+    return numpy.sqrt(grad_x * grad_x + grad_y * grad_y)
@@ -4,6 +4,7 @@ import logging
 from copy import deepcopy
 import OpenEXR
 import Imath
+import numpy
 from PIL import Image
 
 logger = logging.getLogger("apps.rendering")
@@ -36,6 +37,21 @@ class ImgRepr(object):
     def to_pil(self):
         return
 
+    def to_array(self):
+        """ Return RGB values of the image as a float32 array of shape
+        (height, width, 3), indexed by [y, x] """
+        res_x, res_y = self.get_size()
+        return numpy.array([[self.get_pixel((x, y)) for x in range(res_x)]
+                            for y in range(res_y)], dtype=numpy.float32)
+
+    def set_array(self, array):
+        """ Set RGB values of the image from an array of shape
+        (height, width, 3), indexed by [y, x] """
+        res_x, res_y = self.get_size()
+        for y in range(res_y):
+            for x in range(res_x):
+                self.set_pixel((x, y), array[y, x])
+
 
 class PILImgRepr(ImgRepr):
     def __init__(self):
@@ -62,6 +78,13 @@ class PILImgRepr(ImgRepr):
     def to_pil(self):
         return self.img
 
+    def to_array(self):
+        return numpy.asarray(self.img, dtype=numpy.float32)
+
+    def set_array(self, array):
+        array = numpy.clip(array, 0, 255).astype(numpy.uint8)
+        self.img = Image.fromarray(array, 'RGB')
+
 
 class EXRImgRepr(ImgRepr):
     def __init__(self):
@@ -94,6 +117,18 @@ class EXRImgRepr(ImgRepr):
             self.rgb[c].putpixel((i, j), max(min(self.max, color[c]),
                                              self.min))
 
+    def to_array(self):
+        res_x, res_y = self.get_size()
+        array = numpy.empty((res_y, res_x, 3), dtype=numpy.float32)
+        for c, channel in enumerate(self.rgb):
+            array[:, :, c] = numpy.asarray(channel)
+        return array
+
+    def set_array(self, array):
+        array = numpy.clip(array, self.min, self.max).astype(numpy.float32)
+        self.rgb = [Image.fromarray(numpy.ascontiguousarray(array[:, :, c]))
+                    for c in range(len(self.rgb))]
+
     def get_rgbf_extrema(self):
         extrema = [im.getextrema() for im in self.rgb]
         darkest = min([lo for (lo, hi) in extrema])
@@ -107,15 +142,8 @@ class EXRImgRepr(ImgRepr):
             lightest = self.max
             darkest = self.min
 
-        if lightest == darkest:
-            lightest = 0.1 + darkest
-        scale = 255.0 / (lightest - darkest)
-
-        def normalize_0_255(v):
-            return v * scale
-
-        rgb8 = [im.point(normalize_0_255).convert("L") for im in self.rgb]
-        return Image.merge("RGB", rgb8)
+        return Image.fromarray(
+            to_8bit(self.to_array(), lightest, darkest), 'RGB')
 
     def to_l_image(self):
         img = self.to_pil()
@@ -123,14 +151,136 @@ class EXRImgRepr(ImgRepr):
 
     def copy(self):
         e = EXRImgRepr()
-        e.load_from_file(self.file_path)
+        e.img = self.img
+        e.file_path = self.file_path
         e.dw = deepcopy(self.dw)
-        e.rgb = deepcopy(self.rgb)
+        e.rgb = [c.copy() for c in self.rgb]
         e.min = self.min
         e.max = self.max
         return e
 
 
+class ArrayImgRepr(ImgRepr):
+    """ Image held in one contiguous float32 array of shape
+    (height, width, 3). Copies and crops share the array with the original
+    image; whichever of them is modified first copies it. Conversion to
+    PIL happens only in to_pil.
+    """
+
+    def __init__(self, array=None, min_val=0.0, max_val=1.0):
+        """
+        :param numpy.ndarray array: RGB values indexed by [y, x]
+        :param float min_val: minimal color value
+        :param float max_val: maximal color value
+        """
+        self.array = array
+        self.type = "ARRAY"
+        self.min = min_val
+        self.max = max_val
+
+    def load_from_file(self, file_):
+        _, ext = os.path.splitext(file_)
+        if ext.upper() == ".EXR":
+            exr = OpenEXR.InputFile(file_)
+            dw = exr.header()['dataWindow']
+            shape = (dw.max.y - dw.min.y + 1, dw.max.x - dw.min.x + 1)
+            pt = Imath.PixelType(Imath.PixelType.FLOAT)
+            self.array = numpy.empty(shape + (3,), dtype=numpy.float32)
+            for i, c in enumerate("RGB"):
+                self.array[:, :, i] = numpy.frombuffer(
+                    exr.channel(c, pt), dtype=numpy.float32).reshape(shape)
+            exr.close()
+            self.min, self.max = 0.0, 1.0
+        else:
+            img = Image.open(file_)
+            self.array = numpy.array(img.convert('RGB'), dtype=numpy.float32)
+            img.close()
+            self.min, self.max = 0.0, 255.0
+
+    def get_size(self):
+        return self.array.shape[1], self.array.shape[0]
+
+    def get_pixel(self, (i, j)):
+        return self.array[j, i].tolist()
+
+    def set_pixel(self, (i, j), color):
+        self._writable_array()[j, i] = numpy.clip(color, self.min, self.max)
+
+    def to_array(self):
+        """ Return the array itself, without copying; it must not be
+        modified """
+        return self.array
+
+    def set_array(self, array):
+        self.array = numpy.clip(array, self.min, self.max).astype(
+            numpy.float32)
+
+    def copy(self):
+        self.array.flags.writeable = False
+        return ArrayImgRepr(self.array, self.min, self.max)
+
+    def crop(self, (x, y), (width, height)):
+        """ Return the box of the given size starting at (x, y), sharing
+        the array with this image """
+        res_x, res_y = self.get_size()
+        if width <= 0 or height <= 0 or x < 0 or y < 0 or \
+                x + width > res_x or y + height > res_y:
+            raise ValueError("Box {} at {} does not fit image of size {}"
+                             .format((width, height), (x, y), (res_x, res_y)))
+        self.array.flags.writeable = False
+        return ArrayImgRepr(self.array[y:y + height, x:x + width],
+                            self.min, self.max)
+
+    def paste(self, img, (x, y)):
+        """ Put img with its top left corner at (x, y); like in
+        Image.paste, parts outside of this image are skipped
+        :param ImgRepr img: pasted image
+        """
+        src = img.to_array()
+        res_x, res_y = self.get_size()
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + src.shape[1], res_x)
+        y1 = min(y + src.shape[0], res_y)
+        if x0 >= x1 or y0 >= y1:
+            return
+        numpy.clip(src[y0 - y:y1 - y, x0 - x:x1 - x], self.min, self.max,
+                   out=self._writable_array()[y0:y1, x0:x1])
+
+    def blend(self, img, alpha):
+        """ Return a new image: this one mixed with img
+        :param ImgRepr img: image of the same size
+        :param float alpha: weight of img
+        """
+        array = _blend_arrays(self.array, img.to_array(), alpha)
+        numpy.clip(array, self.min, self.max, out=array)
+        return ArrayImgRepr(array, self.min, self.max)
+
+    def get_rgbf_extrema(self):
+        return float(self.array.max()), float(self.array.min())
+
+    def normalize(self, use_extremas=False):
+        """ Map colors to 0-255, scaling from [min, max] or from the
+        extrema of the image
+        :return numpy.ndarray: uint8 array of the same shape
+        """
+        if use_extremas:
+            lightest, darkest = self.get_rgbf_extrema()
+        else:
+            lightest, darkest = self.max, self.min
+        return to_8bit(self.array, lightest, darkest)
+
+    def to_pil(self, use_extremas=False):
+        return Image.fromarray(self.normalize(use_extremas), 'RGB')
+
+    def to_l_image(self):
+        return self.to_pil().convert('L')
+
+    def _writable_array(self):
+        if not self.array.flags.writeable:
+            self.array = self.array.copy()
+        return self.array
+
+
 def load_img(file_):
     """
     Load image from file path and return ImgRepr
@@ -151,14 +301,32 @@ def load_img(file_):
         return None
 
 
+def load_array_img(file_):
+    """
+    Load image from file path into an ArrayImgRepr
+    :param str file_: path to the file
+    :return ArrayImgRepr | None: None if there was an error
+    """
+    try:
+        img = ArrayImgRepr()
+        img.load_from_file(file_)
+        return img
+    except Exception as err:
+        logger.warning("Can't load img file {}:{}".format(file_, err))
+        return None
+
+
 def load_as_pil(file_):
     """ Load image from file path and retun PIL Image representation
      :param str file_: path to the file 
      :return Image.Image | None: return PIL Image represantion or None 
      if there was an error
     """
-
-    img = load_img(file_)
+    _, ext = os.path.splitext(file_)
+    if ext.upper() == ".EXR":
+        img = load_array_img(file_)
+    else:
+        img = load_img(file_)
     if img:
         return img.to_pil()
 
@@ -169,13 +337,28 @@ def blend(img1, img2, alpha):
         logger.error("Both images must have the same size.")
         return
 
+    if isinstance(img1, ArrayImgRepr):
+        return img1.blend(img2, alpha)
+
     img = img1.copy()
+    img.set_array(_blend_arrays(img1.to_array(), img2.to_array(), alpha))
+    return img
 
-    for x in range(0, res_x):
-        for y in range(0, res_y):
-            p1 = img1.get_pixel((x, y))
-            p2 = img2.get_pixel((x, y))
-            p = map(lambda c1, c2: c1 * (1 - alpha) + c2 * alpha, p1, p2)
-            img.set_pixel((x, y), p)
 
-    return img
+def to_8bit(array, lightest, darkest):
+    """ Scale colors by 255 / (lightest - darkest) into a uint8 array;
+    like Image.point followed by convert("L"), values are clipped to 0-255
+    and truncated and NaNs become 0 """
+    if lightest == darkest:
+        lightest = 0.1 + darkest
+    scaled = numpy.multiply(array, 255.0 / (lightest - darkest),
+                            dtype=numpy.float32)
+    numpy.nan_to_num(scaled, copy=False)
+    numpy.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(numpy.uint8)
+
+
+def _blend_arrays(arr1, arr2, alpha):
+    result = numpy.multiply(arr2, alpha, dtype=numpy.float32)
+    result += numpy.multiply(arr1, 1 - alpha, dtype=numpy.float32)
+    return result
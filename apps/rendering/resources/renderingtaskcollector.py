@@ -1,30 +1,79 @@
-
 import logging
-import math
 import os
+import tempfile
 
-from PIL import Image, ImageChops
+import Imath
+import numpy
+import OpenEXR
+from PIL import Image
 
-from apps.rendering.resources.imgrepr import EXRImgRepr, load_img
+from apps.rendering.resources.imgrepr import to_8bit
 
 logger = logging.getLogger("apps.rendering")
 
+# number of rows of a chunk converted and written at once
+STRIP_HEIGHT = 64
 
-class RenderingTaskCollector(object):
-    def __init__(self, paste=False, width=None, height=None):
+# channel of the output used for alpha
+ALPHA = 3
 
+
+class RenderingTaskCollector(object):
+    """ Connects results of subtasks into the final image.
+
+    The image is written to a memory-mapped RGBA buffer in a temporary file,
+    strip by strip, so only one chunk is held in memory at once. If width
+    and height are given, chunks are written as soon as they are added;
+    otherwise the size is computed from all chunks in finalize. With paste,
+    chunks are put one below another in the order they were added, or in
+    the order of their part numbers if they have them; otherwise they are
+    added together (colors clipped to 255).
+    """
+
+    def __init__(self, paste=False, width=None, height=None, tmp_dir=None):
+        """
+        :param bool paste: paste chunks instead of adding them
+        :param int width: width of the final image
+        :param int height: height of the final image
+        :param str tmp_dir: directory for the output buffer
+        """
         self.accepted_img_files = []
         self.accepted_alpha_files = []
+        # pairs of (part number, image filepath); parts are numbered from 1
+        self.chunks = {}
+        # last part number covered by a chunk that spans several parts
+        self.chunk_ends = {}
         self.paste = paste
         self.width = width
         self.height = height
-
-    def add_img_file(self, img_file):
+        self.tmp_dir = tmp_dir
+
+        self.fixed_size = bool(width and height)
+        self.output = None
+        self.has_alpha = False
+        self.offset = 0
+        self.collected_img = 0
+        self.collected_alpha = 0
+        # first rows of the parts that follow the pasted chunks; a chunk
+        # with a part number is written once all parts above it are
+        self.part_tops = {1: 0}
+        self.pending_parts = set()
+
+    def add_img_file(self, img_file, part=None, end_part=None):
         """
-        Add file path to the image with subtask result
+        Add file path to the image with subtask result. Adding a chunk for
+        a part that was already added replaces it.
         :param str img_file: path to the file
+        :param int part: number of the first part covered by the chunk
+        :param int end_part: number of the last part covered by the chunk
         """
-        self.accepted_img_files.append(img_file)
+        if part is None:
+            self.accepted_img_files.append(img_file)
+        else:
+            self.chunks[part] = img_file
+            self.chunk_ends[part] = end_part or part
+            self.pending_parts.add(part)
+        self._collect()
 
     def add_alpha_file(self, img_file):
         """
@@ -32,102 +81,166 @@ class RenderingTaskCollector(object):
         :param str img_file: path to the file
         """
         self.accepted_alpha_files.append(img_file)
+        self._collect()
 
     def finalize(self):
         """
-        Connect all collected files and return final image
+        Connect all collected files and return final image. Images with an
+        alpha channel share memory with the output buffer; PIL cannot share
+        memory of RGB images, so they are copied from it.
         :return Image.Image:
         """
-        if len(self.accepted_img_files) == 0:
+        if not self.accepted_img_files and not self.chunks:
             return None
 
-        img_repr = load_img(self.accepted_img_files[0])
-        if isinstance(img_repr, EXRImgRepr):
-            final_img = self.finalize_exr(img_repr)
-            self.finalize_alpha(final_img)
+        if not self.fixed_size:
+            self._compute_size()
+            self.output = None
+        if self.output is None:
+            self._open_output()
+        self._collect()
+
+        size = (self.width, self.height)
+        if self.has_alpha:
+            return Image.frombuffer('RGBA', size, self.output, 'raw', 'RGBA',
+                                    0, 1)
+        return Image.frombytes('RGB', size, self.output, 'raw', 'RGBX')
+
+    def _compute_size(self):
+        img_files = self.accepted_img_files + self.chunks.values()
+        sizes = [_get_size(img_file) for img_file in img_files]
+        self.width = sizes[0][0]
+        if self.paste:
+            self.height = sum(height for _, height in sizes)
         else:
-            final_img = self.finalize_pil()
-        return final_img
-
-    def finalize_alpha(self, final_img):
-        """
-        Load collected alpha files, add them as chops and put to final image as an alpha channel
-        :param Image.Image final_img: image hat should have alpha channel added
-        :return:
-        """
-        if len(self.accepted_alpha_files) == 0:
+            self.height = sizes[0][1]
+
+    def _open_output(self):
+        self.output = numpy.memmap(tempfile.TemporaryFile(dir=self.tmp_dir),
+                                   dtype=numpy.uint8, mode='w+',
+                                   shape=(self.height, self.width, 4))
+        self.has_alpha = False
+        self.offset = 0
+        self.collected_img = 0
+        self.collected_alpha = 0
+        self.part_tops = {1: 0}
+        self.pending_parts = set(self.chunks)
+
+    def _collect(self):
+        """ Write chunks added since the last call to the output """
+        if self.output is None:
+            if not self.fixed_size:
+                return
+            self._open_output()
+
+        for img_file in self.accepted_img_files[self.collected_img:]:
+            top = self.offset if self.paste else 0
+            self.offset += self._write_chunk(img_file, top)
+            self.collected_img += 1
+
+        for part in sorted(self.pending_parts):
+            top = self.part_tops.get(part) if self.paste else 0
+            if top is None:
+                continue
+            height = self._write_chunk(self.chunks[part], top)
+            self.part_tops[self.chunk_ends[part] + 1] = top + height
+            self.pending_parts.remove(part)
+
+        for img_file in self.accepted_alpha_files[self.collected_alpha:]:
+            for y, rows in _read_strips(img_file):
+                self._write(y, _luminance(rows)[:, :, None], add=True,
+                            channel=ALPHA)
+            self.collected_alpha += 1
+
+    def _write_chunk(self, img_file, top):
+        """ Write a chunk to the output starting at row top and return
+        its height """
+        height = 0
+        for y, rows in _read_strips(img_file):
+            self._write(top + y, rows, add=not self.paste)
+            height = y + rows.shape[0]
+        return height
+
+    def _write(self, top, rows, add, channel=0):
+        """ Write rows of a chunk to the output, starting at row top and
+        channel; parts outside of the output are skipped """
+        bottom = min(top + rows.shape[0], self.height)
+        width = min(rows.shape[1], self.width)
+        if bottom <= top:
             return
 
-        e = EXRImgRepr()
-        e.load_from_file(self.accepted_alpha_files[0])
-        final_alpha = e.to_l_image()
-
-        for img in self.accepted_alpha_files[1:]:
-            e = EXRImgRepr()
-            e.load_from_file(img)
-            l_im = e.to_l_image()
-            final_alpha = ImageChops.add(final_alpha, l_im)
-            l_im.close()
+        channels = rows.shape[2]
+        if channel + channels > ALPHA:
+            self.has_alpha = True
+
+        target = self.output[top:bottom, :width, channel:channel + channels]
+        rows = rows[:bottom - top, :width]
+        if add:
+            rows = numpy.minimum(numpy.add(target, rows, dtype=numpy.uint16),
+                                 255)
+        target[...] = rows
+
+
+def _get_size(img_file):
+    if _is_exr(img_file):
+        exr = OpenEXR.InputFile(img_file)
+        dw = exr.header()['dataWindow']
+        exr.close()
+        return dw.max.x - dw.min.x + 1, dw.max.y - dw.min.y + 1
+    img = Image.open(img_file)
+    size = img.size
+    img.close()
+    return size
+
+
+def _read_strips(img_file):
+    """ Yield (first row, uint8 array of shape (rows, width, 3 or 4)) for
+    consecutive strips of an image; EXR files are read strip by strip """
+    if _is_exr(img_file):
+        return _read_exr_strips(img_file)
+    return _read_pil_strips(img_file)
+
+
+def _read_exr_strips(img_file):
+    exr = OpenEXR.InputFile(img_file)
+    dw = exr.header()['dataWindow']
+    pt = Imath.PixelType(Imath.PixelType.FLOAT)
+    width = dw.max.x - dw.min.x + 1
+    height = dw.max.y - dw.min.y + 1
+    try:
+        for y in xrange(0, height, STRIP_HEIGHT):
+            rows = min(STRIP_HEIGHT, height - y)
+            strip = numpy.empty((rows, width, 3), dtype=numpy.float32)
+            for i, c in enumerate("RGB"):
+                data = exr.channel(c, pt, dw.min.y + y, dw.min.y + y + rows - 1)
+                strip[:, :, i] = numpy.frombuffer(
+                    data, dtype=numpy.float32).reshape(rows, width)
+            # same colors as EXRImgRepr.to_pil
+            yield y, to_8bit(strip, 1.0, 0.0)
+    finally:
+        exr.close()
+
+
+def _read_pil_strips(img_file):
+    img = Image.open(img_file)
+    try:
+        mode = 'RGBA' if 'A' in img.getbands() else 'RGB'
+        chunk = img.convert(mode)
+    finally:
+        img.close()
+    width, height = chunk.size
+    for y in xrange(0, height, STRIP_HEIGHT):
+        rows = min(STRIP_HEIGHT, height - y)
+        yield y, numpy.asarray(chunk.crop((0, y, width, y + rows)))
 
-        final_img.putalpha(final_alpha)
-        final_alpha.close()
 
-    def finalize_exr(self, exr_repr):
+def _luminance(rows):
+    """ Luminance of 8-bit RGB colors, computed like Image.convert('L') """
+    rows = rows.astype(numpy.uint32)
+    return ((rows[:, :, 0] * 299 + rows[:, :, 1] * 587 +
+             rows[:, :, 2] * 114) // 1000).astype(numpy.uint8)
 
-        final_img = exr_repr.to_pil()
 
-        if self.paste:
-            if not self.width or not self.height:
-                self.width, self.height = final_img.size
-                self.height *= len(self.accepted_img_files)
-            img = Image.new('RGB', (self.width, self.height))
-            final_img = self._paste_image(img, final_img, 0)
-            img.close()
-
-        for i, img_path in enumerate(self.accepted_img_files[1:], start=1):
-            img = load_img(img_path)
-            rgb8_im = img.to_pil()
-            if not self.paste:
-                final_img = ImageChops.add(final_img, rgb8_im)
-            else:
-                final_img = self._paste_image(final_img, rgb8_im, i)
-                
-            rgb8_im.close()
-
-        return final_img
-        
-    def finalize_pil(self):
-        res_x, res_y = 0, 0
-
-        for name in self.accepted_img_files:
-            img = Image.open(name)
-            res_x, img_y = img.size
-            res_y += img_y
-            img.close()
-        
-        self.width = res_x
-        self.height = res_y
-        img = Image.open(self.accepted_img_files[0])
-        bands = img.getbands()
-        img.close()
-        band = ""
-        for b in bands:
-            band += b
-        final_img = Image.new(band, (res_x, res_y))
-        offset = 0
-        for img_path in self.accepted_img_files:
-            img = Image.open(img_path)
-            if not self.paste:
-                final_img = ImageChops.add(final_img, img)
-            else:
-                final_img.paste(img, (0, offset))
-                _, img_y = img.size
-                offset += img_y
-                img.close()
-        return final_img
-
-    def _paste_image(self, final_img, new_part, num):
-        img_offset = Image.new("RGB", (self.width, self.height))
-        offset = int(math.floor(num * float(self.height) / float(len(self.accepted_img_files))))
-        img_offset.paste(new_part, (0, offset))
-        return ImageChops.add(final_img, img_offset)
+def _is_exr(img_file):
+    _, ext = os.path.splitext(img_file)
+    return ext.upper() == ".EXR"
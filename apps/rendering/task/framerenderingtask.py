@@ -11,12 +11,15 @@ from apps.core.task.coretask import CoreTask
 from apps.core.task.coretaskstate import Options
 from apps.rendering.resources.imgrepr import load_as_pil
 from apps.rendering.resources.renderingtaskcollector import RenderingTaskCollector
+from apps.rendering.task.partitioner import AdaptivePartitioner
 from apps.rendering.task.renderingtask import RenderingTask, RenderingTaskBuilder
 from apps.rendering.task.verificator import FrameRenderingVerificator
 
 logger = logging.getLogger("apps.rendering")
 
 DEFAULT_PADDING = 4
+# part of the subtask timeout that adaptively sized subtasks should take
+ADAPTIVE_TARGET_TIME_RATIO = 0.5
 
 
 class FrameRendererOptions(Options):
@@ -24,6 +27,7 @@ class FrameRendererOptions(Options):
         super(FrameRendererOptions, self).__init__()
         self.use_frames = False
         self.frames = range(1, 11)
+        self.adaptive_subtasks = False
 
 
 class FrameRenderingTask(RenderingTask):
@@ -45,6 +49,8 @@ class FrameRenderingTask(RenderingTask):
         for frame in self.frames:
             frame_key = unicode(frame)
             self.frames_given[frame_key] = {}
+        # collectors of the image (key None) or frames that are not finished yet
+        self.collectors = {}
 
         if self.use_frames:
             self.preview_file_path = [None] * len(self.frames)
@@ -53,9 +59,26 @@ class FrameRenderingTask(RenderingTask):
         self.verificator.use_frames = self.use_frames
         self.verificator.frames = self.frames
 
+        self.partitioner = None
+        adaptive = getattr(task_definition.options, 'adaptive_subtasks', False)
+        if adaptive and (not self.use_frames or self.__full_frames()):
+            target_time = task_definition.subtask_timeout * ADAPTIVE_TARGET_TIME_RATIO
+            self.partitioner = AdaptivePartitioner(self.total_tasks, target_time)
+
+    def __getstate__(self):
+        state = super(FrameRenderingTask, self).__getstate__()
+        state['collectors'] = {}
+        return state
+
+    def restart(self):
+        super(FrameRenderingTask, self).restart()
+        self.collectors = {}
+
     @CoreTask.handle_key_error
     def computation_failed(self, subtask_id):
         CoreTask.computation_failed(self, subtask_id)
+        if self.partitioner:
+            self.partitioner.subtask_failed(subtask_id)
         if self.use_frames:
             self._update_frame_task_preview()
         else:
@@ -75,10 +98,12 @@ class FrameRenderingTask(RenderingTask):
         parts = self.subtasks_given[subtask_id]['parts']
         num_end = self.subtasks_given[subtask_id]['end_task']
         frames = self.subtasks_given[subtask_id]['frames']
+        if self.partitioner:
+            self.partitioner.subtask_finished(subtask_id)
 
         for result_file in result_files:
             if not self.use_frames:
-                self._collect_image_part(num_start, result_file)
+                self._collect_image_part(num_start, result_file, num_end)
             elif self.total_tasks <= len(self.frames):
                 frames = self._collect_frames(num_start, result_file, frames)
             else:
@@ -175,11 +200,13 @@ class FrameRenderingTask(RenderingTask):
             for j in range(upper_y, lower_y):
                 img_task.putpixel((i, j), color)
 
-    def _choose_frames(self, frames, start_task, total_tasks):
+    def _choose_frames(self, frames, start_task, total_tasks, end_task=None):
+        if end_task is None:
+            end_task = start_task
         if total_tasks <= len(frames):
             subtasks_frames = int(math.ceil(len(frames) / total_tasks))
             start_frame = (start_task - 1) * subtasks_frames
-            end_frame = min(start_task * subtasks_frames, len(frames))
+            end_frame = min(end_task * subtasks_frames, len(frames))
             return frames[start_frame:end_frame], 1
         else:
             parts = int(total_tasks / len(frames))
@@ -189,10 +216,7 @@ class FrameRenderingTask(RenderingTask):
         output_file_name = self.output_file
         self.collected_file_names = OrderedDict(sorted(self.collected_file_names.items()))
         if not self._use_outer_task_collector():
-            collector = RenderingTaskCollector(paste=True, width=self.res_x, height=self.res_y)
-            for file in self.collected_file_names.values():
-                collector.add_img_file(file)
-            collector.finalize().save(output_file_name, self.output_format)
+            self._save_collected(None, output_file_name)
         else:
             self._put_collected_files_together(os.path.join(self.tmp_dir, output_file_name),
                                                self.collected_file_names.values(), "paste")
@@ -204,10 +228,7 @@ class FrameRenderingTask(RenderingTask):
         collected = self.frames_given[frame_key]
         collected = OrderedDict(sorted(collected.items()))
         if not self._use_outer_task_collector():
-            collector = RenderingTaskCollector(paste=True, width=self.res_x, height=self.res_y)
-            for file in collected.values():
-                collector.add_img_file(file)
-            collector.finalize().save(output_file_name, self.output_format)
+            self._save_collected(frame_key, output_file_name)
         else:
             self._put_collected_files_together(output_file_name, collected.values(), "paste")
 
@@ -215,9 +236,10 @@ class FrameRenderingTask(RenderingTask):
         self._update_frame_preview(output_file_name, frame_num, final=True)
         self._update_frame_task_preview()
 
-    def _collect_image_part(self, num_start, tr_file):
+    def _collect_image_part(self, num_start, tr_file, num_end=None):
         self.collected_file_names[num_start] = tr_file
-        self._update_preview(tr_file, num_start)
+        self._add_to_collector(None, tr_file, num_start, num_end)
+        self._update_preview(tr_file, num_start, num_end)
         self._update_task_preview()
 
     def _collect_frames(self, num_start, tr_file, frames_list):
@@ -232,6 +254,7 @@ class FrameRenderingTask(RenderingTask):
         frame_key = unicode(frame_num)
         part = self._count_part(num_start, parts)
         self.frames_given[frame_key][part] = tr_file
+        self._add_to_collector(frame_key, tr_file, part)
 
         self._update_frame_preview(tr_file, frame_num, part)
 
@@ -241,6 +264,47 @@ class FrameRenderingTask(RenderingTask):
     def _count_part(self, start_num, parts):
         return ((start_num - 1) % parts) + 1
 
+    def _add_to_collector(self, frame_key, tr_file, part, end_part=None):
+        """ Write a chunk of the image (frame_key None) or a frame as soon as it is accepted """
+        if self._use_outer_task_collector():
+            return
+        if frame_key in self.collectors:
+            self.collectors[frame_key].add_img_file(tr_file, part, end_part)
+        else:
+            self._get_collector(frame_key)
+
+    def _get_collector(self, frame_key):
+        """ Return the collector of the image (frame_key None) or a frame. A new collector,
+        e.g. after the task was restored, gets all chunks collected so far """
+        collector = self.collectors.get(frame_key)
+        if collector is None:
+            collector = RenderingTaskCollector(paste=True, width=self.res_x, height=self.res_y,
+                                               tmp_dir=self.tmp_dir)
+            for part, end_part, tr_file in self._get_collected_parts(frame_key):
+                collector.add_img_file(tr_file, part, end_part)
+            self.collectors[frame_key] = collector
+        return collector
+
+    def _get_collected_parts(self, frame_key):
+        if frame_key is None:
+            ends = {sub['start_task']: sub['end_task'] for sub in self.subtasks_given.values()
+                    if sub['status'] == SubtaskStatus.finished}
+            return [(num_start, ends.get(num_start), tr_file)
+                    for num_start, tr_file in self.collected_file_names.items()]
+        # whole frames are collected as part 0
+        return [(max(part, 1), None, tr_file)
+                for part, tr_file in self.frames_given[frame_key].items()]
+
+    def _save_collected(self, frame_key, output_file_name):
+        self._get_collector(frame_key).finalize().save(output_file_name, self.output_format)
+        del self.collectors[frame_key]
+
+    def _get_subtask_units(self, perf_index, node_id):
+        if not self.partitioner:
+            return 1
+        return self.partitioner.units_for(perf_index, node_id,
+                                          self.total_tasks - self.last_task)
+
     def __full_frames(self):
         return self.total_tasks <= len(self.frames)
 
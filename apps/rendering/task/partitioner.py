@@ -0,0 +1,77 @@
+from __future__ import division
+import logging
+import time
+
+logger = logging.getLogger("apps.rendering")
+
+
+class AdaptivePartitioner(object):
+    """ Chooses how many consecutive task units (image strips or frames)
+    should be given to a provider in a single subtask. The size is
+    proportional to the throughput measured for the provider in this task,
+    or - for providers that have not finished anything yet - to the throughput
+    of other providers scaled by the declared performance index.
+    """
+
+    # weight of the newest measurement in the moving average
+    SMOOTHING = 0.5
+
+    def __init__(self, total_units, target_time):
+        """
+        :param int total_units: number of units the task is divided into
+        :param float target_time: desired computation time of one subtask
+        [in seconds]
+        """
+        self.total_units = total_units
+        self.target_time = target_time
+        self.node_rates = {}
+        self.perf_rate = None
+        self.pending = {}
+
+    def units_for(self, perf_index, node_id, units_left):
+        """ Return number of units that should be given to the node.
+        :param float perf_index: performance declared by the node
+        :param node_id: id of the node that asks for a subtask
+        :param int units_left: number of units that have not been given yet
+        :return int: number of units, at least 1 and at most units_left
+        """
+        if units_left <= 1:
+            return max(units_left, 0)
+
+        rate = self.node_rates.get(node_id)
+        if rate is None and self.perf_rate is not None and perf_index > 0:
+            rate = self.perf_rate * perf_index
+        if rate is None or self.target_time <= 0:
+            return 1
+
+        units = int(rate * self.target_time)
+        # leave something for the other nodes so a single slow node
+        # does not hold the end of the task
+        return max(1, min(units, units_left // 2))
+
+    def subtask_started(self, subtask_id, node_id, units, perf_index):
+        self.pending[subtask_id] = (node_id, units, perf_index, time.time())
+
+    def subtask_finished(self, subtask_id):
+        if subtask_id not in self.pending:
+            return
+        node_id, units, perf_index, start = self.pending.pop(subtask_id)
+        duration = time.time() - start
+        if duration <= 0:
+            return
+
+        rate = units / duration
+        self.node_rates[node_id] = self._smooth(self.node_rates.get(node_id),
+                                                rate)
+        if perf_index > 0:
+            self.perf_rate = self._smooth(self.perf_rate, rate / perf_index)
+        logger.debug("Node %r computed %r units in %.1fs", node_id, units,
+                     duration)
+
+    def subtask_failed(self, subtask_id):
+        self.pending.pop(subtask_id, None)
+
+    def _smooth(self, old, new):
+        if old is None:
+            return new
+        return self.SMOOTHING * new + (1 - self.SMOOTHING) * old
@@ -87,6 +87,8 @@ class RenderingTask(CoreTask):
 
         self.total_tasks = total_tasks
         self.res_x, self.res_y = task_definition.resolution
+        # ask providers to send partial results while computing subtasks
+        self.stream_partial_results = getattr(task_definition, 'stream_partial_results', False)
 
         self.root_path = root_path
         self.preview_file_path = None
@@ -142,7 +144,7 @@ class RenderingTask(CoreTask):
     def get_preview_file_path(self):
         return self.preview_file_path
 
-    def _update_preview(self, new_chunk_file_path, num_start):
+    def _update_preview(self, new_chunk_file_path, num_start, num_end=None):
         img = load_as_pil(new_chunk_file_path)
 
         img_current = self._open_preview()
@@ -210,13 +212,15 @@ class RenderingTask(CoreTask):
         ctd.working_directory = working_directory
         ctd.docker_images = self.header.docker_images
         ctd.deadline = timeout_to_deadline(self.header.subtask_timeout)
+        ctd.stream_partial_results = self.stream_partial_results
         return ctd
 
-    def _get_next_task(self):
+    def _get_next_task(self, perf_index=0.0, node_id=None):
         if self.last_task != self.total_tasks:
-            self.last_task += 1
-            start_task = self.last_task
-            end_task = self.last_task
+            units = self._get_subtask_units(perf_index, node_id)
+            start_task = self.last_task + 1
+            end_task = min(self.last_task + units, self.total_tasks)
+            self.last_task = end_task
             return start_task, end_task
         else:
             for sub in self.subtasks_given.values():
@@ -226,8 +230,17 @@ class RenderingTask(CoreTask):
                     start_task = sub['start_task']
                     self.num_failed_subtasks -= 1
                     return start_task, end_task
+            subtask_id = self._get_speculative_subtask(perf_index, node_id)
+            if subtask_id is not None:
+                sub = self.subtasks_given[subtask_id]
+                logger.info("Duplicating subtask {} for node {}".format(subtask_id, node_id))
+                return sub['start_task'], sub['end_task']
         return None, None
 
+    def _get_subtask_units(self, perf_index, node_id):
+        """ Return how many consecutive units should be given in a new subtask """
+        return 1
+
     def _get_working_directory(self):
         common_path_prefix = os.path.commonprefix(self.task_resources)
         common_path_prefix = os.path.dirname(common_path_prefix)
@@ -19,8 +19,13 @@ logger = logging.getLogger("apps.rendering")
 
 
 class RenderingVerificator(CoreVerificator):
+    # metric name -> accepted value for advanced verification (see
+    # imgmetrics); None compares PSNR with PSNR_ACCEPTABLE_MIN
+    METRIC_THRESHOLDS = None
+
     def __init__(self, verification_options=None, advanced_verification=False):
         super(RenderingVerificator, self).__init__(verification_options, advanced_verification)
+        self.metric_thresholds = copy(self.METRIC_THRESHOLDS)
         self.tmp_dir = None
         self.res_x = 0
         self.res_y = 0
@@ -67,7 +72,8 @@ class RenderingVerificator(CoreVerificator):
 
         return advance_verify_img(img_file, res_x, res_y, start_box,
                                   self.verification_options.box_size, cmp_file,
-                                  cmp_start_box)
+                                  cmp_start_box,
+                                  thresholds=self.metric_thresholds)
 
     def _check_size(self, file_, res_x, res_y):
         return check_size(file_, res_x, res_y)
@@ -31,6 +31,7 @@ ESTIMATED_DEFAULT = 2220.0
 
 USE_IP6 = 0
 ACCEPT_TASKS = 1
+MAX_CONCURRENT_SUBTASKS = 1
 SEND_PINGS = 1
 
 PINGS_INTERVALS = 120
@@ -147,6 +148,7 @@ class AppConfig:
             opt_peer_num=OPTIMAL_PEER_NUM,
             # flags
             accept_tasks=ACCEPT_TASKS,
+            max_concurrent_subtasks=MAX_CONCURRENT_SUBTASKS,
             send_pings=SEND_PINGS,
             # hardware
             hardware_preset_name=CUSTOM_HARDWARE_PRESET_NAME,
@@ -42,6 +42,7 @@ from golem.ranking.ranking import Ranking
 from golem.resource.base.resourceserver import BaseResourceServer
 from golem.resource.client import AsyncRequest, async_run
 from golem.resource.dirmanager import DirManager, DirectoryType
+from golem.resource.hashcache import file_hash_cache
 # noqa
 from golem.resource.hyperdrive.resourcesmanager import HyperdriveResourceManager
 from golem.rpc.mapping.aliases import Task, Network, Environment, UI, Payments
@@ -115,6 +116,9 @@ class Client(HardwarePresetsMixin):
         HardwarePresets.update_config(self.config_desc.hardware_preset_name,
                                       self.config_desc)
 
+        # Hashes of task resources
+        file_hash_cache.initialize(self.datadir)
+
         self.keys_auth = EllipticalKeysAuth(self.datadir)
 
         # NETWORK
@@ -238,6 +242,9 @@ class Client(HardwarePresetsMixin):
         hyperdrive_ports = self.daemon_manager.start()
 
         resource_manager = HyperdriveResourceManager(dir_manager)
+        # resources of tasks whose directories were removed to free space
+        self.task_server.task_computer.dir_cache.add_eviction_listener(
+            resource_manager.remove_task)
         self.resource_server = BaseResourceServer(resource_manager, dir_manager,
                                                   self.keys_auth, self)
 
@@ -549,7 +556,10 @@ class Client(HardwarePresetsMixin):
             u'supported': self.get_supported_task_count(),
             u'subtasks_computed': self.get_computed_task_count(),
             u'subtasks_with_errors': self.get_error_task_count(),
-            u'subtasks_with_timeout': self.get_timeout_task_count()
+            u'subtasks_with_timeout': self.get_timeout_task_count(),
+            u'slots': self.task_server.task_computer.get_slot_stats(),
+            u'result_pipeline':
+                self.task_server.task_manager.result_pipeline.get_stats()
         }
 
     def get_supported_task_count(self):
@@ -698,11 +708,13 @@ class Client(HardwarePresetsMixin):
         if state:
             return DictSerializer.dump(state)
 
-    def pull_resources(self, task_id, resources, client_options=None):
+    def pull_resources(self, task_id, resources, client_options=None,
+                       deadline=None):
         self.resource_server.download_resources(
             resources,
             task_id,
-            client_options=client_options
+            client_options=client_options,
+            deadline=deadline
         )
 
     def add_resource_peer(self, node_name, addr, port, key_id, node_info):
@@ -56,6 +56,7 @@ class ClientConfigDescriptor(object):
         self.public_address = ""
 
         self.accept_tasks = 1
+        self.max_concurrent_subtasks = 1
 
     def init_from_app_config(self, app_config):
         """Initializes config parameters based on the specified AppConfig
@@ -82,7 +83,7 @@ class ConfigApprover(object):
                        'use_ipv6', 'eth_account', 'accept_tasks', 'node_name']
     to_int_opt = ['seed_port', 'num_cores', 'opt_peer_num', 'waiting_for_task_timeout', 'p2p_session_timeout',
                   'task_session_timeout', 'pings_interval', 'max_results_sending_delay',
-                  'min_price', 'max_price']
+                  'min_price', 'max_price', 'max_concurrent_subtasks']
     to_float_opt = ['estimated_performance', 'estimated_lux_performance', 'estimated_blender_performance',
                     'getting_peers_interval', 'getting_tasks_interval', 'computing_trust', 'requesting_trust']
 
@@ -0,0 +1,188 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import shutil
+import sys
+from collections import Counter
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY_FILE_RANGE = 'copy_file_range'
+COPY = 'copy'
+
+# _IOW(0x94, 9, int): clone the source file into the destination file
+FICLONE = 0x40049409
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# maximum size of a single copy_file_range call
+COPY_RANGE_SIZE = 1024 * 1024 * 1024
+
+# errors meaning that a strategy cannot be used for a pair of files
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM,
+                errno.EBADF, errno.ENOSYS, errno.EOPNOTSUPP,
+                getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+                errno.EMLINK}
+
+_lock = Lock()
+# strategies unavailable in the system
+_disabled = set()
+# (source device, destination device) pairs on which reflinks failed
+_no_reflink = set()
+
+
+def _load_copy_file_range():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        func = libc.copy_file_range
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                     ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+    func.restype = ctypes.c_ssize_t
+    return func
+
+
+_copy_file_range = _load_copy_file_range()
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def materialize(src, dst, link=False):
+    """ Put a file with the contents of src at dst, the cheapest possible
+    way. Tries in order: a reflink (a copy-on-write clone), a hardlink (if
+    allowed), copy_file_range (a copy made by the kernel) and a regular copy.
+    An existing dst is replaced. Copies get the metadata of src.
+    :param str src: source file
+    :param str dst: destination file
+    :param bool link: whether dst may be a hardlink to src; modifying
+                      a hardlinked file in place modifies src as well, so
+                      use it only for files that are never written
+    :return str: strategy used, one of REFLINK, HARDLINK, COPY_FILE_RANGE
+                 and COPY
+    """
+    if os.path.realpath(src) == os.path.realpath(dst):
+        raise ValueError("Cannot copy {} onto itself".format(src))
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if _reflink(src, dst):
+        strategy = REFLINK
+    elif link and _hardlink(src, dst):
+        return HARDLINK
+    elif _copy_range(src, dst):
+        strategy = COPY_FILE_RANGE
+    else:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+        strategy = COPY
+
+    shutil.copystat(src, dst)
+    return strategy
+
+
+def materialize_tree(src, dst, exclude=None, link=False):
+    """ Materialize files of the src directory in dst, keeping files
+    already in dst that are not in src
+    :param list|None exclude: extensions of files to skip
+    :return Counter: strategy -> number of files put with it
+    """
+    exclude = exclude or []
+    strategies = Counter()
+
+    for src_dir, _, files in os.walk(src):
+        dst_dir = os.path.join(dst, os.path.relpath(src_dir, src))
+        if not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+        for file_ in files:
+            if os.path.splitext(file_)[1] in exclude:
+                continue
+            strategy = materialize(os.path.join(src_dir, file_),
+                                   os.path.join(dst_dir, file_), link=link)
+            strategies[strategy] += 1
+    return strategies
+
+
+def _unsupported(exc):
+    return exc.errno in _UNSUPPORTED
+
+
+def _disable(strategy, exc):
+    with _lock:
+        if strategy not in _disabled:
+            logger.debug("Disabling %s: %s", strategy, exc)
+            _disabled.add(strategy)
+
+
+def _reflink(src, dst):
+    if fcntl is None or not sys.platform.startswith('linux') \
+            or REFLINK in _disabled:
+        return False
+
+    devices = (os.stat(src).st_dev,
+               os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+    if devices[0] != devices[1] or devices in _no_reflink:
+        return False
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except (IOError, OSError) as exc:
+            if not _unsupported(exc):
+                raise
+            # the file system does not support reflinks
+            with _lock:
+                _no_reflink.add(devices)
+    os.remove(dst)
+    return False
+
+
+def _hardlink(src, dst):
+    if not hasattr(os, 'link'):
+        return False
+    try:
+        os.link(src, dst)
+        return True
+    except OSError as exc:
+        if not _unsupported(exc):
+            raise
+        return False
+
+
+def _copy_range(src, dst):
+    if _copy_file_range is None or COPY_FILE_RANGE in _disabled:
+        return False
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copied = 0
+        while True:
+            result = _copy_file_range(fsrc.fileno(), None, fdst.fileno(),
+                                      None, COPY_RANGE_SIZE, 0)
+            if result == 0:
+                return True
+            if result > 0:
+                copied += result
+                continue
+
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            exc = OSError(err, os.strerror(err))
+            if copied or not _unsupported(exc):
+                raise exc
+            if err == errno.ENOSYS:
+                _disable(COPY_FILE_RANGE, exc)
+            break
+    os.remove(dst)
+    return False
@@ -1,7 +1,11 @@
 import abc
+import struct
 from hashlib import sha256
+from multiprocessing.pool import ThreadPool
 from Crypto.Cipher import AES
 from Crypto import Random
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import PBKDF2
 from Crypto.Random.random import StrongRandom
 from threading import Lock
 
@@ -56,17 +60,52 @@ class FileEncryptor(object):
 
 
 class AESFileEncryptor(FileEncryptor):
+    """ Encrypts files with AES-CBC. An encrypted file starts with a header
+    block holding the format version and the salt used to derive the key
+    and the initialization vector from a secret:
+    - version 0: 'salt_' + salt, written by older versions,
+    - version 1: 'ver_' + version byte + salt.
+    Both versions share the same ciphertext layout, so every version can
+    be decrypted.
+    """
 
     aes_mode = AES.MODE_CBC
     block_size = AES.block_size
+    # number of blocks encrypted or decrypted at once
     chunk_size = 1024
     salt_prefix = 'salt_'
     salt_prefix_len = len(salt_prefix)
+    version = 1
+    version_prefix = 'ver_'
+    version_prefix_len = len(version_prefix) + 1
 
     @classmethod
     def gen_salt(cls, length):
         return Random.new().read(length - cls.salt_prefix_len)
 
+    @classmethod
+    def gen_header(cls):
+        """ Return a header block of the current format version and its salt
+        """
+        salt = Random.new().read(cls.block_size - cls.version_prefix_len)
+        return cls.version_prefix + chr(cls.version) + salt, salt
+
+    @classmethod
+    def parse_header(cls, header):
+        """ Return the format version and the salt stored in a header block
+        :raise ValueError: when the format is not supported
+        """
+        if len(header) != cls.block_size:
+            raise ValueError("Invalid header length: {}".format(len(header)))
+        if header.startswith(cls.salt_prefix):
+            return 0, header[cls.salt_prefix_len:]
+        if header.startswith(cls.version_prefix):
+            version = ord(header[cls.version_prefix_len - 1])
+            if version <= cls.version:
+                return version, header[cls.version_prefix_len:]
+            raise ValueError("Unsupported format version: {}".format(version))
+        raise ValueError("Unknown encrypted file format")
+
     @classmethod
     def get_key_and_iv(cls, secret, salt, key_len, iv_len):
 
@@ -80,54 +119,470 @@ class AESFileEncryptor(FileEncryptor):
         return digest[:key_len], digest[key_len:total_len]
 
     @classmethod
-    def encrypt(cls, file_in, file_out, secret, key_len=32):
+    def encrypt(cls, file_in, file_out, secret, key_len=32, chunk_size=None):
 
-        block_size = cls.block_size
-        salt = cls.gen_salt(block_size)
-        key, iv = cls.get_key_and_iv(secret, salt, key_len, block_size)
-        cipher = AES.new(key, cls.aes_mode, iv)
+        chunk_bytes = (chunk_size or cls.chunk_size) * cls.block_size
 
         with FileHelper(file_in, 'rb') as src, FileHelper(file_out, 'wb') as dst:
+            writer = cls.writer(dst, secret, key_len, chunk_size)
+            while True:
+                chunk = src.read(chunk_bytes)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.close()
+
+    @classmethod
+    def decrypt(cls, file_in, file_out, secret, key_len=32, chunk_size=None):
+
+        chunk_bytes = (chunk_size or cls.chunk_size) * cls.block_size
 
-            dst.write(cls.salt_prefix + salt)
+        with FileHelper(file_in, 'rb') as src, FileHelper(file_out, 'wb') as dst:
+            reader = cls.reader(src, secret, key_len, chunk_size)
+            while True:
+                chunk = reader.read(chunk_bytes)
+                if not chunk:
+                    break
+                dst.write(chunk)
+
+    @classmethod
+    def writer(cls, dst, secret, key_len=32, chunk_size=None):
+        """ Return a file-like object encrypting data written to dst """
+        return AESEncryptingWriter(dst, secret, key_len,
+                                   chunk_size or cls.chunk_size)
+
+    @classmethod
+    def reader(cls, src, secret, key_len=32, chunk_size=None):
+        """ Return a seekable file-like object reading decrypted data
+        from src """
+        return AESDecryptingReader(src, secret, key_len,
+                                   chunk_size or cls.chunk_size)
+
+
+class AESEncryptingWriter(object):
+    """ Write-only file-like object that encrypts the data written to it
+    and writes the ciphertext to a file. Data is encrypted in chunks of
+    chunk_size blocks; the last block is padded when the writer is closed.
+    """
+
+    def __init__(self, dst, secret, key_len=32,
+                 chunk_size=AESFileEncryptor.chunk_size):
+        block_size = AESFileEncryptor.block_size
+        header, salt = AESFileEncryptor.gen_header()
+        key, iv = AESFileEncryptor.get_key_and_iv(secret, salt, key_len,
+                                                  block_size)
+        self._cipher = AES.new(key, AESFileEncryptor.aes_mode, iv)
+        self._dst = dst
+        self._chunk_bytes = chunk_size * block_size
+        self._buffer = []
+        self._buffered = 0
+        self._position = 0
+        self.closed = False
+
+        self._dst.write(header)
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._position += len(data)
+        if self._buffered >= self._chunk_bytes:
+            self._encrypt_buffer()
+
+    def tell(self):
+        """ Return the number of plaintext bytes written """
+        return self._position
+
+    def flush(self):
+        self._dst.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        block_size = AESFileEncryptor.block_size
+        pad_len = block_size - self._buffered % block_size
+        self._buffer.append(pad_len * chr(pad_len))
+        self._buffered += pad_len
+        self._encrypt_buffer()
+        self._dst.flush()
+        self.closed = True
+
+    def _encrypt_buffer(self):
+        data = ''.join(self._buffer)
+        length = len(data) - len(data) % AESFileEncryptor.block_size
+        self._dst.write(self._cipher.encrypt(data[:length]))
+        self._buffer = [data[length:]]
+        self._buffered = len(data) - length
+
+
+class AESDecryptingReader(object):
+    """ Read-only, seekable file-like object with the decrypted content of
+    a file encrypted by AESFileEncryptor. CBC blocks can be decrypted
+    independently, so only the blocks that are read are decrypted; at least
+    chunk_size blocks are decrypted at once.
+    """
+
+    def __init__(self, src, secret, key_len=32,
+                 chunk_size=AESFileEncryptor.chunk_size):
+        block_size = AESFileEncryptor.block_size
+        self._src = src
+        self._src.seek(0, 0)
+        self.version, salt = AESFileEncryptor.parse_header(
+            src.read(block_size))
+        self._key, self._iv = AESFileEncryptor.get_key_and_iv(
+            secret, salt, key_len, block_size)
+        self._chunk_size = chunk_size
+        self._position = 0
+        self._cache_start = 0
+        self._cache = ''
+
+        self._src.seek(0, 2)
+        encrypted_size = self._src.tell() - block_size
+        if encrypted_size <= 0 or encrypted_size % block_size:
+            raise ValueError("Invalid encrypted data size: {}"
+                             .format(encrypted_size))
+        self._num_blocks = encrypted_size // block_size
+        last_block = self._decrypt_blocks(self._num_blocks - 1, 1)
+        pad_len = ord(last_block[-1])
+        self.size = max(encrypted_size - pad_len, 0)
+        self.closed = False
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        remaining = self.size - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return ''
+
+        cache_end = self._cache_start + len(self._cache)
+        if self._position < self._cache_start or \
+                self._position + size > cache_end:
+            self._fill_cache(size)
+
+        start = self._position - self._cache_start
+        data = self._cache[start:start + size]
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError("Invalid seek position: {}".format(offset))
+        self._position = offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self.closed = True
+        self._cache = ''
+
+    def _fill_cache(self, size):
+        block_size = AESFileEncryptor.block_size
+        first = self._position // block_size
+        last = (self._position + size - 1) // block_size
+        count = max(last - first + 1, self._chunk_size)
+        count = min(count, self._num_blocks - first)
+        self._cache_start = first * block_size
+        self._cache = self._decrypt_blocks(first, count)
+
+    def _decrypt_blocks(self, first, count):
+        """ Decrypt count blocks starting with block number first """
+        block_size = AESFileEncryptor.block_size
+        if first == 0:
+            iv = self._iv
+            self._src.seek(block_size, 0)
+        else:
+            # the previous ciphertext block is the initialization vector
+            self._src.seek(first * block_size, 0)
+            iv = self._src.read(block_size)
+        cipher = AES.new(self._key, AESFileEncryptor.aes_mode, iv)
+        return cipher.decrypt(self._src.read(count * block_size))
+
+
+class AESGCMFileEncryptor(FileEncryptor):
+    """ Encrypts files with AES-GCM in independently authenticated chunks
+    (format version 2). The file starts with a header:
+    'ver_' + version byte + salt + chunk length (uint32), followed by
+    the chunks. Every chunk holds chunk length bytes of ciphertext (the last
+    one may be shorter) and a 16 byte tag. The nonce of a chunk is built
+    from its index and a flag marking the last chunk, so reordered, dropped
+    or truncated chunks fail verification. Chunks can be decrypted and
+    verified independently, in any order and in parallel.
+    """
+
+    version = 2
+    version_prefix = AESFileEncryptor.version_prefix
+    block_size = AES.block_size
+    # number of blocks in a chunk
+    chunk_size = 64 * 1024
+    salt_len = 16
+    tag_len = 16
+    kdf_iterations = 10000
+    header_len = len(version_prefix) + 1 + salt_len + 4
 
-            working = True
-            while working:
+    @classmethod
+    def derive_key(cls, secret, salt, key_len=32):
+        return PBKDF2(secret, salt, key_len, count=cls.kdf_iterations,
+                      hmac_hash_module=SHA256)
 
-                chunk = src.read(cls.chunk_size * block_size)
-                chunk_len = len(chunk)
-                chunk_len_mod = chunk_len % block_size
+    @classmethod
+    def gen_header(cls, chunk_size=None):
+        """ Return a header, the salt and the chunk length in bytes """
+        chunk_len = (chunk_size or cls.chunk_size) * cls.block_size
+        salt = Random.new().read(cls.salt_len)
+        header = cls.version_prefix + chr(cls.version) + salt + \
+            struct.pack('>I', chunk_len)
+        return header, salt, chunk_len
 
-                if chunk_len == 0 or chunk_len_mod != 0:
-                    pad_len = (block_size - chunk_len_mod) or block_size
-                    chunk += pad_len * chr(pad_len)
-                    working = False
+    @classmethod
+    def is_chunked(cls, prefix):
+        """ Check whether data starting with prefix is in this format """
+        return prefix[:len(cls.version_prefix) + 1] == \
+            cls.version_prefix + chr(cls.version)
 
-                dst.write(cipher.encrypt(chunk))
+    @classmethod
+    def parse_header(cls, header):
+        """ Return the salt and the chunk length stored in a header
+        :raise ValueError: when the header is not in this format
+        """
+        if len(header) != cls.header_len or not cls.is_chunked(header):
+            raise ValueError("Unknown encrypted file format")
+        salt = header[len(cls.version_prefix) + 1:-4]
+        chunk_len, = struct.unpack('>I', header[-4:])
+        if chunk_len == 0:
+            raise ValueError("Invalid chunk length")
+        return salt, chunk_len
 
     @classmethod
-    def decrypt(cls, file_in, file_out, secret, key_len=32):
+    def chunk_cipher(cls, key, index, last):
+        nonce = struct.pack('>QI', index, 1 if last else 0)
+        return AES.new(key, AES.MODE_GCM, nonce=nonce)
 
-        block_size = cls.block_size
+    @classmethod
+    def encrypt(cls, file_in, file_out, secret, key_len=32, chunk_size=None):
 
         with FileHelper(file_in, 'rb') as src, FileHelper(file_out, 'wb') as dst:
+            writer = cls.writer(dst, secret, key_len, chunk_size)
+            while True:
+                chunk = src.read(writer.chunk_len)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.close()
 
-            block = src.read(block_size)
-            salt = block[cls.salt_prefix_len:]
+    @classmethod
+    def decrypt(cls, file_in, file_out, secret, key_len=32, chunk_size=None,
+                workers=4):
+        """ Decrypt a file, decrypting up to workers chunks in parallel.
+        Files in the CBC formats are decrypted with AESFileEncryptor.
+        :raise ValueError: when a chunk fails verification
+        """
 
-            key, iv = cls.get_key_and_iv(secret, salt, key_len, block_size)
-            cipher = AES.new(key, cls.aes_mode, iv)
+        with FileHelper(file_in, 'rb') as src, FileHelper(file_out, 'wb') as dst:
+            reader = cls.reader(src, secret, key_len, chunk_size)
+            if not isinstance(reader, AESGCMDecryptingReader):
+                while True:
+                    chunk = reader.read(AESFileEncryptor.chunk_size *
+                                        AESFileEncryptor.block_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                return
+
+            pool = ThreadPool(workers)
+            try:
+                for first in xrange(0, reader.num_chunks, workers):
+                    indices = range(first,
+                                    min(first + workers, reader.num_chunks))
+                    encrypted = [reader.read_chunk(i) for i in indices]
+                    for chunk in pool.map(lambda args: reader.open_chunk(*args),
+                                          zip(indices, encrypted)):
+                        dst.write(chunk)
+            finally:
+                pool.close()
 
-            working = True
-            next_chunk = str()
-            while working:
+    @classmethod
+    def verify(cls, file_in, secret, key_len=32):
+        """ Return indices of chunks that fail verification, so they can be
+        fetched again
+        """
+        with FileHelper(file_in, 'rb') as src:
+            reader = AESGCMDecryptingReader(src, secret, key_len)
+            invalid = []
+            for index in xrange(reader.num_chunks):
+                try:
+                    reader.open_chunk(index, reader.read_chunk(index))
+                except ValueError:
+                    invalid.append(index)
+            return invalid
 
-                chunk = next_chunk
-                next_chunk = cipher.decrypt(src.read(cls.chunk_size *
-                                                     block_size))
-                if len(next_chunk) == 0:
-                    pad_len = ord(chunk[-1])
-                    chunk = chunk[:-pad_len]
-                    working = False
+    @classmethod
+    def writer(cls, dst, secret, key_len=32, chunk_size=None):
+        """ Return a file-like object encrypting data written to dst """
+        return AESGCMEncryptingWriter(dst, secret, key_len, chunk_size)
 
-                dst.write(chunk)
+    @classmethod
+    def reader(cls, src, secret, key_len=32, chunk_size=None):
+        """ Return a seekable file-like object reading decrypted data
+        from src. Files in the CBC formats are read with AESFileEncryptor;
+        chunk_size only applies to them, chunked files are read one chunk
+        at a time.
+        """
+        src.seek(0, 0)
+        prefix = src.read(len(cls.version_prefix) + 1)
+        if cls.is_chunked(prefix):
+            return AESGCMDecryptingReader(src, secret, key_len)
+        return AESFileEncryptor.reader(src, secret, key_len, chunk_size)
+
+
+class AESGCMEncryptingWriter(object):
+    """ Write-only file-like object writing data encrypted in the format
+    of AESGCMFileEncryptor. A chunk is encrypted as soon as it is complete
+    and data following it is written; the last chunk is written when
+    the writer is closed.
+    """
+
+    def __init__(self, dst, secret, key_len=32, chunk_size=None):
+        header, salt, self.chunk_len = \
+            AESGCMFileEncryptor.gen_header(chunk_size)
+        self._key = AESGCMFileEncryptor.derive_key(secret, salt, key_len)
+        self._dst = dst
+        self._buffer = []
+        self._buffered = 0
+        self._position = 0
+        self._index = 0
+        self.closed = False
+
+        self._dst.write(header)
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._position += len(data)
+        # the last chunk can only be written when the writer is closed
+        if self._buffered > self.chunk_len:
+            data = ''.join(self._buffer)
+            end = (len(data) - 1) // self.chunk_len * self.chunk_len
+            for start in xrange(0, end, self.chunk_len):
+                self._write_chunk(data[start:start + self.chunk_len], False)
+            self._buffer = [data[end:]]
+            self._buffered = len(data) - end
+
+    def tell(self):
+        """ Return the number of plaintext bytes written """
+        return self._position
+
+    def flush(self):
+        self._dst.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self._write_chunk(''.join(self._buffer), True)
+        self._buffer = []
+        self._dst.flush()
+        self.closed = True
+
+    def _write_chunk(self, chunk, last):
+        cipher = AESGCMFileEncryptor.chunk_cipher(self._key, self._index, last)
+        encrypted, tag = cipher.encrypt_and_digest(chunk)
+        self._dst.write(encrypted)
+        self._dst.write(tag)
+        self._index += 1
+
+
+class AESGCMDecryptingReader(object):
+    """ Read-only, seekable file-like object with the decrypted content of
+    a file encrypted by AESGCMFileEncryptor. Every chunk is verified when it
+    is decrypted; reading a corrupted chunk raises ValueError.
+    """
+
+    def __init__(self, src, secret, key_len=32):
+        tag_len = AESGCMFileEncryptor.tag_len
+        self._src = src
+        self._src.seek(0, 0)
+        salt, self.chunk_len = AESGCMFileEncryptor.parse_header(
+            src.read(AESGCMFileEncryptor.header_len))
+        self._key = AESGCMFileEncryptor.derive_key(secret, salt, key_len)
+        self._position = 0
+        self._cache_index = None
+        self._cache = ''
+
+        self._src.seek(0, 2)
+        encrypted_size = self._src.tell() - AESGCMFileEncryptor.header_len
+        stored_len = self.chunk_len + tag_len
+        if encrypted_size < tag_len:
+            raise ValueError("Invalid encrypted data size: {}"
+                             .format(encrypted_size))
+        self.num_chunks = (encrypted_size + stored_len - 1) // stored_len
+        last_len = encrypted_size - (self.num_chunks - 1) * stored_len
+        if last_len < tag_len:
+            raise ValueError("Truncated chunk {}".format(self.num_chunks - 1))
+        self.size = (self.num_chunks - 1) * self.chunk_len + last_len - \
+            tag_len
+        self.version = AESGCMFileEncryptor.version
+        self.closed = False
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        remaining = self.size - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+
+        result = []
+        while size > 0:
+            index, offset = divmod(self._position, self.chunk_len)
+            if index != self._cache_index:
+                self._cache = self.open_chunk(index, self.read_chunk(index))
+                self._cache_index = index
+            data = self._cache[offset:offset + size]
+            result.append(data)
+            self._position += len(data)
+            size -= len(data)
+        return ''.join(result)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError("Invalid seek position: {}".format(offset))
+        self._position = offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self.closed = True
+        self._cache = ''
+        self._cache_index = None
+
+    def read_chunk(self, index):
+        """ Return the encrypted chunk with its tag """
+        stored_len = self.chunk_len + AESGCMFileEncryptor.tag_len
+        self._src.seek(AESGCMFileEncryptor.header_len + index * stored_len, 0)
+        return self._src.read(stored_len)
+
+    def open_chunk(self, index, stored):
+        """ Decrypt and verify an encrypted chunk; thread-safe
+        :raise ValueError: when the chunk fails verification
+        """
+        tag_len = AESGCMFileEncryptor.tag_len
+        last = index == self.num_chunks - 1
+        cipher = AESGCMFileEncryptor.chunk_cipher(self._key, index, last)
+        try:
+            return cipher.decrypt_and_verify(stored[:-tag_len],
+                                             stored[-tag_len:])
+        except ValueError:
+            raise ValueError("Chunk {} failed verification".format(index))
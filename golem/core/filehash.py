@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import mmap
+import os
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+# files of at least this size are memory-mapped
+MMAP_SIZE = 4 * 1024 * 1024
+# size of data passed to a single update(); hashlib releases the GIL while
+# hashing blocks larger than 2 KiB, so threads hash files in parallel
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def iter_file(path, block_size=BLOCK_SIZE):
+    """ Yield consecutive blocks of a file: buffers of a memory map for large
+    files, strings read from the file otherwise. Buffers are only valid
+    until the next block is requested.
+    :param str path: path to the file
+    :param int block_size: maximum size of blocks
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        mapped = None
+        if size >= MMAP_SIZE:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError) as exc:
+                logger.debug("Cannot map %r: %r", path, exc)
+
+        if mapped is None:
+            for data in iter(lambda: f.read(block_size), ''):
+                yield data
+            return
+
+        with closing(mapped):
+            for offset in xrange(0, len(mapped), block_size):
+                yield buffer(mapped, offset, block_size)
+
+
+def file_digest(path, algorithm='sha1', block_size=BLOCK_SIZE):
+    """ Return the digest of file contents
+    :param str path: path to the file
+    :param str algorithm: name of a hashlib algorithm
+    :return str: binary digest
+    """
+    sha = hashlib.new(algorithm)
+    for data in iter_file(path, block_size):
+        sha.update(data)
+    return sha.digest()
+
+
+class FileHasher(object):
+    """ Hashes files in a pool of threads """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+
+    def hash_file(self, path, algorithm='sha1'):
+        return file_digest(path, algorithm)
+
+    def hash_files(self, paths, algorithm='sha1'):
+        """ Hash many files at once
+        :param list paths: paths to files
+        :param str algorithm: name of a hashlib algorithm
+        :return dict: path -> binary digest
+        """
+        return dict(zip(paths, self.map(lambda path: file_digest(
+            path, algorithm), paths)))
+
+    def map(self, func, paths):
+        """ Call func for every path, in parallel if there are many paths
+        :return list: results in the order of paths
+        """
+        paths = list(paths)
+        if len(paths) < 2 or self.workers < 2:
+            return [func(path) for path in paths]
+
+        pool = ThreadPool(min(self.workers, len(paths)))
+        try:
+            return pool.map(func, paths)
+        finally:
+            pool.close()
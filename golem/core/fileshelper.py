@@ -1,39 +1,48 @@
 import ctypes
 import os
-import shutil
+import uuid
+from contextlib import contextmanager
 
 import subprocess
 
 from golem.core.common import is_windows
+from golem.core.filecopy import materialize_tree
 
 from gui.controller import memoryhelper
 
 
-def copy_file_tree(src, dst, exclude=None):
+def copy_file_tree(src, dst, exclude=None, link=False):
     """Copy directory and it's content from src to dst. Doesn't copy files
        with extensions from excluded. Don't remove additional files from
-       destination directory.
+       destination directory. Files are reflinked when possible, or
+       hardlinked if allowed (see golem.core.filecopy.materialize).
     :param str src: source directory (copy this directory)
     :param str dst: destination directory (copy source directory here)
     :param list|None exclude: don't copy files with this extensions
+    :param bool link: whether files may be hardlinked; only for files
+                      that are never written
+    :return Counter: copy strategy -> number of files copied with it
     """
-    if exclude is None:
-        exclude = []
-    if not os.path.isdir(dst):
-        os.mkdir(dst)
-    for src_dir, dirs, files in os.walk(src):
-        dst_dir = src_dir.replace(src, dst)
-        if not os.path.exists(dst_dir):
-            os.mkdir(dst_dir)
-        for file_ in files:
-            _, ext = os.path.splitext(file_)
-            if ext in exclude:
-                continue
-            src_file = os.path.join(src_dir, file_)
-            dst_file = os.path.join(dst_dir, file_)
-            if os.path.exists(dst_file):
-                os.remove(dst_file)
-            shutil.copy2(src_file, dst_dir)
+    return materialize_tree(src, dst, exclude, link)
+
+
+@contextmanager
+def replacing_file(path):
+    """Open a temporary file for writing, which replaces path when it is
+       written without errors. Unlike opening path for writing, this does not
+       modify other hardlinks of the old file (e.g. chunk store objects).
+    :param str path: destination file
+    """
+    tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        if is_windows() and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def get_dir_size(dir_, report_error=lambda _: ()):
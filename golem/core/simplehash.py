@@ -1,6 +1,8 @@
 import hashlib
 import base64
 
+from golem.core.filehash import BLOCK_SIZE, file_digest
+
 
 class SimpleHash(object):
     """ Hash methods wrapper meta-class """
@@ -48,19 +50,11 @@ class SimpleHash(object):
         return cls.base64_encode(cls.hash(data))
 
     @classmethod
-    def hash_file_base64(cls, filename, block_size=2 ** 20):
+    def hash_file_base64(cls, filename, block_size=BLOCK_SIZE):
         """Return sha1 of data from given file encoded with base64
         :param str filename: name of a file that should be read
-        :param int block_size: *Default: 2**20* data will be read from file in chunks of this size
+        :param int block_size: *Default: 8 MiB* data will be hashed in chunks of this size;
+                               large files are memory-mapped (see filehash)
         :return str: base64 encoded sha1 of data from file <filename>
         """
-        with open(filename, "r") as f:
-            sha = hashlib.sha1()
-
-            while True:
-                data = f.read(block_size)
-                if not data:
-                    break
-                sha.update(data)
-
-            return cls.base64_encode(sha.digest())
+        return cls.base64_encode(file_digest(filename, 'sha1', block_size))
@@ -48,6 +48,38 @@ class DockerConfigManager(object):
 
         self.container_host_config.update(host_config)
 
+    def slot_host_config(self, slot_index, num_slots):
+        """Returns a copy of the container host config with the cpu set and
+           memory limit divided between concurrently running containers.
+           There are never more slots than cpu cores; cores that do not
+           divide evenly go to the first slots.
+        :param int slot_index: index of the computation slot
+        :param int num_slots: total number of computation slots
+        :return dict: host config for a container running in the given slot
+        """
+        host_config = dict(self.container_host_config)
+        num_slots = max(int(num_slots), 1)
+
+        cpu_set = host_config.get('cpuset')
+        cpu_cores = cpu_set.split(',') if cpu_set else []
+        if cpu_cores:
+            num_slots = min(num_slots, len(cpu_cores))
+        if num_slots == 1:
+            return host_config
+
+        slot_index %= num_slots
+        if cpu_cores:
+            per_slot, extra = divmod(len(cpu_cores), num_slots)
+            start = slot_index * per_slot + min(slot_index, extra)
+            end = start + per_slot + (1 if slot_index < extra else 0)
+            host_config['cpuset'] = ','.join(cpu_cores[start:end])
+
+        mem_limit = host_config.get('mem_limit')
+        if mem_limit:
+            host_config['mem_limit'] = int(mem_limit) // num_slots
+
+        return host_config
+
     @classmethod
     def install(cls, *args, **kwargs):
         if not DockerTaskThread.docker_manager:
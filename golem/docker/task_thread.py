@@ -1,8 +1,11 @@
 import logging
 import os
 
+import posixpath
+
 import requests
 from golem.docker.job import DockerJob
+from golem.task.partialresults import PartialResultsWatcher
 from golem.task.taskthread import TaskThread
 from golem.vm.memorychecker import MemoryChecker
 
@@ -20,11 +23,19 @@ class DockerTaskThread(TaskThread):
     STDOUT_FILE = "stdout.log"
     STDERR_FILE = "stderr.log"
 
+    # Partial results put by the task script in this dir (relative to
+    # the work dir) are sent to the requestor while the subtask is computed.
+    # Its path in the container is passed in the 'partial_results_dir'
+    # parameter.
+    PARTIAL_RESULTS_DIR = "partial"
+    partial_results_interval = 10.0
+
     docker_manager = None
 
     def __init__(self, task_computer, subtask_id, docker_images,
                  orig_script_dir, src_code, extra_data, short_desc,
-                 res_path, tmp_path, timeout, check_mem=False):
+                 res_path, tmp_path, timeout, check_mem=False,
+                 host_config=None, stream_partial_results=False):
 
         if not docker_images:
             raise AttributeError("docker images is None")
@@ -43,6 +54,14 @@ class DockerTaskThread(TaskThread):
         self.job = None
         self.mc = None
         self.check_mem = check_mem
+        self.host_config = host_config
+        self.stream_partial_results = stream_partial_results
+        self.partial_results_watcher = None
+        if stream_partial_results:
+            self.extra_data = dict(
+                extra_data,
+                partial_results_dir=posixpath.join(DockerJob.WORK_DIR,
+                                                   self.PARTIAL_RESULTS_DIR))
 
     def run(self):
         if not self.image:
@@ -59,8 +78,17 @@ class DockerTaskThread(TaskThread):
                 os.mkdir(work_dir)
             if not os.path.exists(output_dir):
                 os.mkdir(output_dir)
-
-            if self.docker_manager:
+            if self.stream_partial_results:
+                partial_dir = os.path.join(work_dir, self.PARTIAL_RESULTS_DIR)
+                if not os.path.exists(partial_dir):
+                    os.mkdir(partial_dir)
+                self.partial_results_watcher = PartialResultsWatcher(
+                    partial_dir, self._partial_results_computed,
+                    self.partial_results_interval)
+
+            if self.host_config is not None:
+                host_config = self.host_config
+            elif self.docker_manager:
                 host_config = self.docker_manager.container_host_config
             else:
                 host_config = None
@@ -73,7 +101,11 @@ class DockerTaskThread(TaskThread):
                     self.mc = MemoryChecker()
                     self.mc.start()
                 self.job.start()
+                if self.partial_results_watcher:
+                    self.partial_results_watcher.start()
                 exit_code = self.job.wait()
+                if self.partial_results_watcher:
+                    self.partial_results_watcher.stop()
                 # Get stdout and stderr
                 stdout_file = os.path.join(output_dir, self.STDOUT_FILE)
                 stderr_file = os.path.join(output_dir, self.STDERR_FILE)
@@ -120,6 +152,11 @@ class DockerTaskThread(TaskThread):
             if self.docker_manager:
                 self.docker_manager.recover_vm_connectivity(self.job.kill)
 
+    def _partial_results_computed(self, files):
+        self.task_computer.partial_results_computed(self, files)
+
     def _cleanup(self):
         if self.mc:
             self.mc.stop()
+        if self.partial_results_watcher:
+            self.partial_results_watcher.stop()
@@ -1,4 +1,5 @@
 import errno
+import heapq
 import logging
 import socket
 import time
@@ -18,6 +19,11 @@ IDLE_STREAM_TIMEOUT = 90
 
 
 class ChunkStream:
+    """ Reader of a chunked HTTP response. Received data is kept in a single
+    bytearray; separators are found with bytearray.find and the socket
+    receives into a preallocated buffer, so streaming large files does not
+    create an object per byte.
+    """
 
     # short separator: \r\n
     short_sep_list = ["\r", "\n"]
@@ -29,14 +35,15 @@ class ChunkStream:
     long_sep_list_len = len(long_sep_list)
     long_sep = "".join(long_sep_list)
 
-    # end of chunk: 0\r\n\r\n
-    _eoc_list = ["0"] + long_sep_list
-    _eoc_len = len(_eoc_list)
-    _eoc = "".join(_eoc_list)
+    # chunk size line extension: <size>;<name>=<value>
+    _ext_sep = ";"
 
     _conn_sleep = 0.1
     _read_sleep = 0.1
 
+    # consumed data is removed from the buffer once it is larger than this
+    _compact_size = 64 * 1024
+
     _retry_err_codes = [errno.EWOULDBLOCK, errno.EINTR]
     _stop_err_codes = [errno.EBADF]
 
@@ -60,8 +67,12 @@ class ChunkStream:
         self.url = url
 
         self.sock = None
-        self.buf = []
-        self.recv_size = 4096
+        # received data; data before pos has already been consumed
+        self.buf = bytearray()
+        self.pos = 0
+        self.recv_size = 64 * 1024
+        self._recv_buf = bytearray()
+        self._recv_view = memoryview(self._recv_buf)
 
         self.headers_read = False
         self.eof = False
@@ -107,6 +118,12 @@ class ChunkStream:
     def cancel(self):
         logger.debug("Stream cancelled")
         self.cancelled = True
+        # wake up a read waiting for data
+        if self.sock and not self.done:
+            try:
+                self.sock.shutdown(socket.SHUT_RD)
+            except socket.error:
+                pass
 
     def next(self):
         if not self.headers_read:
@@ -115,18 +132,21 @@ class ChunkStream:
         return self._read_chunk_line()
 
     def _read_headers(self):
+        start_idx = self.pos
+
         while self.working and not self.eof:
             try:
                 self._read_chunk()
             except StopIteration:
                 self.eof = True
 
-            sep_idx = self.sublist_index(self.buf, self.long_sep_list)
+            sep_idx = self.buf.find(self.long_sep, start_idx)
             if sep_idx != -1:
-                next_idx = sep_idx + self.long_sep_list_len
-                self._assert_headers(self.buf[:sep_idx])
-                self.buf = self.buf[next_idx:]
+                self._assert_headers(str(self.buf[self.pos:sep_idx]))
+                self._consume(sep_idx + self.long_sep_list_len)
                 break
+            # the separator may begin at the end of received data
+            start_idx = max(self.pos, len(self.buf) - self.long_sep_list_len)
 
     @classmethod
     def _assert_headers(cls, data):
@@ -183,11 +203,9 @@ class ChunkStream:
     def _read_chunk(self):
         if self.working and not self.eof:
             try:
-                chunk = self.__read()
-                if chunk:
-                    self.buf += chunk
-                    return len(chunk)
-                return 0
+                received = self._recv()
+                self.buf += self._recv_view[:received]
+                return received
             except StopIteration:
                 self.eof = True
         return -1
@@ -197,71 +215,70 @@ class ChunkStream:
 
             if self.content_size is None:
 
-                sep_idx = self.sublist_index(self.buf, self.short_sep_list)
+                sep_idx = self.buf.find(self.short_sep, self.pos)
                 if sep_idx == -1:
 
                     n = self._read_chunk()
-                    if n <= 0 or not self.buf:
+                    if n <= 0 or not self._buffered():
                         raise StopIteration()
                     continue
 
                 else:
 
-                    size_slice = self.buf[:sep_idx]
-                    next_idx = sep_idx + self.short_sep_len
-                    self.buf = self.buf[next_idx:]
+                    size_line = str(self.buf[self.pos:sep_idx])
+                    self.pos = sep_idx + self.short_sep_len
 
-                    if not size_slice:
+                    # the line ending chunk data
+                    if not size_line:
                         continue
 
                     try:
-                        self.content_size = int(''.join(size_slice), 16)
+                        size = size_line.split(self._ext_sep, 1)[0]
+                        self.content_size = int(size, 16)
                         self.content_read = self.content_sent = 0
                     except Exception as exc:
                         logger.error("Invalid size: {} : {}"
-                                     .format(size_slice[:8], exc))
+                                     .format(size_line[:8], exc))
                         raise
 
                 if self.content_size == 0:
                     raise StopIteration()
 
-            if self.buf:
-                n = len(self.buf)
-            else:
+            n = self._buffered()
+            if not n:
                 n = self._read_chunk()
-                if n <= 0 or not self.buf:
+                if n <= 0:
                     raise StopIteration()
 
             self.content_read = min(self.content_size, self.content_read + n)
 
-            if self.content_read >= self.content_size:
-
-                last_idx = self.content_size - self.content_sent
-                result = ''.join(self.buf[:last_idx])
+            count = min(n, self.content_size - self.content_sent)
+            result = self._consume(self.pos + count)
+            self.content_sent += count
 
-                self.buf = self.buf[last_idx:]
-                if self.sublist_index(self.buf, self._eoc_list) == 0:
-                    self.buf = self.buf[self._eoc_len:]
-
-                self.data_read += self.content_read
+            if self.content_sent >= self.content_size:
+                self.data_read += self.content_size
                 self.content_size = None
                 self.content_sent = 0
 
-            else:
+            return result
 
-                self.content_sent += len(self.buf)
-                result = ''.join(self.buf)
-                self.buf = []
+    def _buffered(self):
+        return len(self.buf) - self.pos
 
-            return result
+    def _consume(self, end_idx):
+        """ Return buffered data up to end_idx and mark it as consumed """
+        result = memoryview(self.buf)[self.pos:end_idx].tobytes()
+        self.pos = end_idx
 
-    @staticmethod
-    def sublist_index(buf, seq, start_idx=0):
-        l_seq = len(seq)
-        for i in xrange(start_idx, len(buf)):
-            if buf[i:i + l_seq] == seq:
-                return i
-        return -1
+        if self.pos == len(self.buf):
+            del self.buf[:]
+            self.pos = 0
+        elif self.pos >= self._compact_size:
+            del self.buf[:self.pos]
+            self.pos = 0
+
+        return result
 
     def __iter__(self):
         return self
@@ -316,7 +333,7 @@ class ChunkStream:
             self.sock.shutdown(socket.SHUT_WR)
             # read remaining data
             try:
-                self.__read(drain=True)
+                self._recv(drain=True)
             except StopIteration:
                 pass
             except socket.error:
@@ -333,18 +350,26 @@ class ChunkStream:
             logger.error("Error disconnecting socket: {}"
                          .format(exc))
 
-    def __read(self, drain=False):
+    def _recv(self, drain=False):
+        """ Receive data into the receive buffer
+        :return int: number of bytes received
+        """
+        if len(self._recv_buf) < self.recv_size:
+            self._recv_buf = bytearray(self.recv_size)
+            self._recv_view = memoryview(self._recv_buf)
+
         while self.working:
 
             if self.cancelled and not (drain or self.done):
                 self.disconnect()
 
             try:
-                chunk = self.sock.recv(self.recv_size)
+                received = self.sock.recv_into(self._recv_view,
+                                               self.recv_size)
             except socket.error, e:
                 err = e.args[0]
                 if err in self._retry_err_codes:
-                    time.sleep(self._read_sleep)
+                    self.__wait_readable()
                 elif err in self._stop_err_codes:
                     raise StopIteration()
                 else:
@@ -353,76 +378,126 @@ class ChunkStream:
                     raise
             else:
                 self.timestamp = time.time()
-                if chunk:
+                if received:
                     if drain:
                         continue
-                    return chunk
+                    return received
                 raise StopIteration()
 
+    def __wait_readable(self):
+        # cancel() shuts the socket down, which ends the wait immediately
+        try:
+            select.select([self.sock], [], [], self.timeouts[1])
+        except (select.error, socket.error, ValueError):
+            time.sleep(self._read_sleep)
+
 
 class StreamMonitor(object):
+    """ Cancels streams that received no data for stream_timeout seconds.
+    Deadlines of the streams are kept in a heap and a single thread sleeps
+    until the nearest one; a stream that received data in the meantime is
+    scheduled again at its new deadline. The thread is woken up before the
+    deadline only when a stream with an earlier one is added. Finished
+    streams are forgotten when their deadline passes.
+    """
     stream_timeout = IDLE_STREAM_TIMEOUT
 
     _thread = None
     _initialized = False
     _working = False
 
-    _sleep = 1.0
-    _sleep_short = 0.1
-
     _streams = {}
+    # heap of (deadline, stream id)
+    _deadlines = []
+    # deadline the thread sleeps until, None when there are no streams
+    _wait_deadline = None
+    _wake_socks = None
 
     __lock = Lock()
-    __streams_lock = Lock()
 
     @classmethod
     def monitor(cls, stream, sock=None):
+        unique_id = str(uuid.uuid4())
+        timeout = cls.stream_timeout
+        deadline = stream.timestamp + timeout
+
         with cls.__lock:
             if not cls._initialized:
                 cls._initialize()
 
-        unique_id = str(uuid.uuid4())
-        with cls.__streams_lock:
             cls._streams[unique_id] = dict(
                 stream=stream,
-                socket=sock
+                socket=sock,
+                timeout=timeout
             )
+            heapq.heappush(cls._deadlines, (deadline, unique_id))
+            wake = cls._wait_deadline is None or deadline < cls._wait_deadline
+
+        if wake:
+            cls._wake()
+        return unique_id
 
     @classmethod
     def _loop(cls):
         while cls._working:
-            now = time.time()
-            sleep = cls._sleep
+            expired = []
 
-            for unique_id in cls._streams.keys():
-                with cls.__streams_lock:
-                    if unique_id in cls._streams:
-                        data = cls._streams[unique_id]
-                    else:
+            with cls.__lock:
+                now = time.time()
+
+                while cls._deadlines and cls._deadlines[0][0] <= now:
+                    _, unique_id = heapq.heappop(cls._deadlines)
+                    data = cls._streams.get(unique_id)
+                    if not data:
                         continue
 
-                stream, sock = data['stream'], data['socket']
-                dt = now - stream.timestamp
-                timed_out = dt >= cls.stream_timeout
+                    stream = data['stream']
+                    deadline = stream.timestamp + data['timeout']
+                    if stream.done or deadline <= now:
+                        expired.append((unique_id, data))
+                    else:
+                        heapq.heappush(cls._deadlines, (deadline, unique_id))
+
+                if cls._deadlines:
+                    cls._wait_deadline = cls._deadlines[0][0]
+                    timeout = max(cls._wait_deadline - now, 0)
+                else:
+                    cls._wait_deadline = timeout = None
+
+            for unique_id, data in expired:
+                cls._close_stream(unique_id, data['stream'], data['socket'],
+                                  data['timeout'])
 
-                if timed_out or stream.done:
-                    cls._close_stream(unique_id, stream, sock)
-                    sleep = cls._sleep_short
-                    break
+            cls._wait(timeout)
 
-            time.sleep(sleep)
+    @classmethod
+    def _wait(cls, timeout):
+        reader = cls._wake_socks[0]
+        try:
+            readable, _, _ = select.select([reader], [], [], timeout)
+            if readable:
+                reader.recv(4096)
+        except (select.error, socket.error) as exc:
+            logger.debug("Stream monitor wait interrupted: {}".format(exc))
 
     @classmethod
-    def _close_stream(cls, unique_id, stream, sock):
+    def _wake(cls):
+        try:
+            cls._wake_socks[1].send('\0')
+        except socket.error as exc:
+            logger.debug("Cannot wake up stream monitor: {}".format(exc))
+
+    @classmethod
+    def _close_stream(cls, unique_id, stream, sock, timeout):
         if not stream.done:
             logger.debug("Closing stream {} (> {} s)"
-                         .format(unique_id, IDLE_STREAM_TIMEOUT))
+                         .format(unique_id, timeout))
             stream.cancel()
         cls._remove_stream(unique_id)
 
     @classmethod
     def _remove_stream(cls, unique_id):
-        with cls.__streams_lock:
+        with cls.__lock:
             cls._streams.pop(unique_id, None)
 
     @classmethod
@@ -436,12 +511,33 @@ class StreamMonitor(object):
 
     @classmethod
     def _initialize(cls):
+        cls._wake_socks = _socket_pair()
+        cls._wake_socks[0].setblocking(0)
+        cls._initialized = True
         cls._working = True
         cls._thread = Thread(target=cls._loop)
         cls._thread.daemon = True
         cls._thread.start()
 
 
+def _socket_pair():
+    """ Connected pair of sockets, used to wake up threads waiting in select
+    :return tuple: (reading socket, writing socket)
+    """
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        writer = socket.create_connection(listener.getsockname())
+        reader, _ = listener.accept()
+    finally:
+        listener.close()
+    return reader, writer
+
+
 class StreamFileObject:
 
     def __init__(self, source):
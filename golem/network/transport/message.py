@@ -639,6 +639,7 @@ class MessageWantToComputeTask(Message):
         'max_memory_size': u"MAX_MEM",
         'num_cores': u"NUM_CORES",
         'price': u"PRICE",
+        'max_subtasks': u"MAX_SUBTASKS",
     }
 
     def __init__(
@@ -650,6 +651,7 @@ class MessageWantToComputeTask(Message):
             max_resource_size=0,
             max_memory_size=0,
             num_cores=0,
+            max_subtasks=1,
             **kwargs):
         """
         Create message with information that node wants to compute given task
@@ -659,6 +661,8 @@ class MessageWantToComputeTask(Message):
         :param int max_resource_size: how much disk space can this node offer
         :param int max_memory_size: how much ram can this node offer
         :param int num_cores: how many cpu cores this node can offer
+        :param int max_subtasks: how many subtasks of this task the node
+                                 is willing to compute at once
         """
         self.node_name = node_name
         self.task_id = task_id
@@ -667,6 +671,7 @@ class MessageWantToComputeTask(Message):
         self.max_memory_size = max_memory_size
         self.num_cores = num_cores
         self.price = price
+        self.max_subtasks = max_subtasks
         super(MessageWantToComputeTask, self).__init__(**kwargs)
 
 
@@ -1085,6 +1090,39 @@ class MessageCannotComputeTask(Message):
         super(MessageCannotComputeTask, self).__init__(**kwargs)
 
 
+class MessagePartialTaskResultHash(Message):
+    TYPE = TASK_MSG_BASE + 27
+
+    MAPPING = {
+        'subtask_id': u"SUB_TASK_ID",
+        'multihash': u"MULTIHASH",
+        'secret': u"SECRET",
+        'options': u"OPTIONS",
+        'sequence': u"SEQUENCE",
+    }
+
+    def __init__(
+            self,
+            subtask_id=0,
+            multihash="",
+            secret="",
+            options=None,
+            sequence=0,
+            **kwargs):
+        """
+        Create message with a package of partial results of a subtask that
+        is still being computed
+        :param int sequence: number of the package, increasing with every
+                             package sent for the subtask
+        """
+        self.subtask_id = subtask_id
+        self.multihash = multihash
+        self.secret = secret
+        self.options = options
+        self.sequence = sequence
+        super(MessagePartialTaskResultHash, self).__init__(**kwargs)
+
+
 RESOURCE_MSG_BASE = 3000
 
 
@@ -1211,6 +1249,7 @@ def init_messages():
             MessageWantToComputeTask,
             MessageReportComputedTask,
             MessageTaskResultHash,
+            MessagePartialTaskResultHash,
             MessageTaskFailure,
             MessageGetTaskResult,
             MessageStartSessionResponse,
@@ -0,0 +1,249 @@
+import os
+import stat
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+
+class StreamZipFile(zipfile.ZipFile):
+    """ ZipFile writing files from disk without seeking back in the output
+    file. CRC and sizes of a file are stored in a data descriptor following
+    the file data, so the archive can be written to a write-only stream.
+    """
+
+    read_size = 64 * 1024
+
+    def write(self, filename, arcname=None, compress_type=None):
+
+        st = os.stat(filename)
+        if stat.S_ISDIR(st.st_mode):
+            # directories are written without seeking
+            return zipfile.ZipFile.write(self, filename, arcname,
+                                         compress_type)
+
+        if compress_type is None:
+            compress_type = self.compression
+        blocks = self._read_blocks(filename, compress_type)
+        self.write_blocks(filename, blocks, arcname, compress_type)
+
+    def write_blocks(self, filename, blocks, arcname=None,
+                     compress_type=None):
+        """ Write an entry with contents of a file already split into blocks
+        :param filename: path to the file, used for its metadata
+        :param blocks: iterable of (data, compressed data) pairs
+        """
+        if not self.fp:
+            raise RuntimeError(
+                "Attempt to write to ZIP archive that was already closed")
+
+        st = os.stat(filename)
+        if arcname is None:
+            arcname = filename
+        arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+        arcname = arcname.lstrip(os.sep + (os.altsep or ''))
+
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+        if compress_type is None:
+            compress_type = self.compression
+        zinfo.compress_type = compress_type
+        zinfo.file_size = st.st_size
+        zinfo.flag_bits = 0x08
+        zinfo.header_offset = self.fp.tell()
+
+        self._writecheck(zinfo)
+        self._didModify = True
+
+        zip64 = self._allowZip64 and \
+            zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        self.fp.write(zinfo.FileHeader(zip64))
+
+        crc = file_size = compress_size = 0
+        for data, compressed in blocks:
+            file_size += len(data)
+            crc = zlib.crc32(data, crc) & 0xffffffff
+            compress_size += len(compressed)
+            self.fp.write(compressed)
+
+        if not zip64 and max(file_size, compress_size) > zipfile.ZIP64_LIMIT:
+            raise RuntimeError('File size has increased during compressing')
+
+        zinfo.CRC = crc
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+
+        fmt = '<4sLQQ' if zip64 else '<4sLLL'
+        self.fp.write(struct.pack(fmt, 'PK\x07\x08', crc,
+                                  compress_size, file_size))
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
+
+    def _read_blocks(self, filename, compress_type):
+        if compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, -15)
+        else:
+            compressor = None
+
+        with open(filename, 'rb') as src:
+            while True:
+                buf = src.read(self.read_size)
+                if not buf:
+                    break
+                yield buf, compressor.compress(buf) if compressor else buf
+
+        if compressor:
+            yield '', compressor.flush()
+
+
+class _CountingWriter(object):
+    """ Write-only stream keeping track of the number of bytes written,
+    which is all ZipFile needs from a file it writes to """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+
+def _deflate_block(data, level, last):
+    # Every block is compressed independently and ends on a byte boundary,
+    # so the compressed blocks concatenated form a single deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    flush_mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(flush_mode)
+
+
+class ArchiveBuilder(object):
+    """ Builds zip archives of task resources. Files are read by absolute
+    paths and stored under explicit names, so the working directory of the
+    process is never changed. Files in already compressed formats are stored
+    as they are. Large files are split into blocks deflated in parallel
+    on a thread pool (zlib releases the GIL while compressing). The archive
+    is written without seeking, so it may be streamed to a socket
+    (e.g. through socket.makefile('wb')) as well as to a file.
+    """
+
+    # formats that do not get smaller when deflated
+    STORED_EXTENSIONS = frozenset([
+        '.exr', '.png', '.jpg', '.jpeg', '.webp', '.gif', '.mp4', '.avi',
+        '.mkv', '.webm', '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar',
+        '.zst'
+    ])
+    # beginnings of compressed files (e.g. gzip or zstd compressed .blend)
+    COMPRESSED_MAGIC = ('\x1f\x8b', '\x28\xb5\x2f\xfd', 'PK\x03\x04',
+                        '\x89PNG', '\xff\xd8\xff', '\x76\x2f\x31\x01')
+
+    # files larger than that are deflated in parallel blocks [B]
+    PARALLEL_SIZE = 8 * 1024 * 1024
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, workers=None, level=zlib.Z_DEFAULT_COMPRESSION):
+        self.workers = workers or cpu_count()
+        self.level = level
+        self.entries = []
+
+    def add(self, path, arcname):
+        """ Add a file to the archive
+        :param path: path to the file
+        :param arcname: name of the file in the archive
+        """
+        self.entries.append((os.path.abspath(path), arcname))
+
+    def add_header(self, root_path, header):
+        """ Add files listed in a TaskResourceHeader of directory root_path,
+        named by their paths relative to root_path """
+        for path, arcname in self._header_files(root_path, header):
+            self.add(path, arcname)
+
+    def write(self, stream):
+        """ Write the archive to a file-like object, which only needs
+        to support write """
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        zipf = StreamZipFile(_CountingWriter(stream), 'w',
+                             compression=zipfile.ZIP_DEFLATED,
+                             allowZip64=True)
+        try:
+            for path, arcname in self.entries:
+                self._write_entry(zipf, pool, path, arcname)
+            zipf.close()
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def write_file(self, output_path):
+        with open(output_path, 'wb') as f:
+            self.write(f)
+        return output_path
+
+    def compress_type(self, path):
+        """ Return ZIP_STORED for files in compressed formats and
+        ZIP_DEFLATED for the others """
+        ext = os.path.splitext(path)[1].lower()
+        if ext in self.STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+        if any(magic.startswith(m) for m in self.COMPRESSED_MAGIC):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _write_entry(self, zipf, pool, path, arcname):
+        compress_type = self.compress_type(path)
+        size = os.path.getsize(path)
+        if compress_type == zipfile.ZIP_STORED or size <= self.PARALLEL_SIZE \
+                or not pool:
+            zipf.write(path, arcname, compress_type)
+        else:
+            zipf.write_blocks(path, self._deflate_blocks(pool, path),
+                              arcname, compress_type)
+
+    def _deflate_blocks(self, pool, path):
+        # at most that many blocks are read ahead of the written one
+        window = 2 * self.workers
+        pending = deque()
+        with open(path, 'rb') as src:
+            data = src.read(self.BLOCK_SIZE)
+            while True:
+                next_data = src.read(self.BLOCK_SIZE)
+                last = not next_data
+                pending.append((data, pool.apply_async(
+                    _deflate_block, (data, self.level, last))))
+                if len(pending) >= window or last:
+                    block, result = pending.popleft()
+                    yield block, result.get()
+                if last:
+                    break
+                data = next_data
+        while pending:
+            block, result = pending.popleft()
+            yield block, result.get()
+
+    @classmethod
+    def _header_files(cls, root_path, header, arc_dir=''):
+        for sdh in header.sub_dir_headers:
+            for entry in cls._header_files(os.path.join(root_path,
+                                                        sdh.dir_name),
+                                           sdh,
+                                           os.path.join(arc_dir,
+                                                        sdh.dir_name)):
+                yield entry
+
+        for fdata in header.files_data:
+            yield (os.path.join(root_path, fdata[0]),
+                   os.path.join(arc_dir, fdata[0]))
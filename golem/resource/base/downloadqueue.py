@@ -0,0 +1,153 @@
+import time
+from threading import Lock
+
+
+class DownloadKind(object):
+    RESOURCE = 'resource'
+    RESULT = 'result'
+
+
+class QueuedDownload(object):
+
+    def __init__(self, kind, params, deadline=None, size=None):
+        self.kind = kind
+        self.params = params
+        self.deadline = deadline
+        self.size = size
+        self.queued = time.time()
+
+
+class KindStats(object):
+    """ Queue statistics of a single kind of downloads """
+
+    def __init__(self):
+        self.queued = 0
+        self.active = 0
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def average_wait(self):
+        if self.started == 0:
+            return 0.0
+        return self.total_wait / self.started
+
+    def to_dict(self):
+        return dict(queued=self.queued, active=self.active,
+                    started=self.started, average_wait=self.average_wait(),
+                    max_wait=self.max_wait)
+
+
+class DownloadQueue(object):
+    """ Downloads waiting for a free download slot. Every kind of downloads
+    (task resources, result packages) has its own number of slots. Waiting
+    downloads are started in the order of their rank, the lower the sooner:
+    - the time left to the deadline of the subtask (DEFAULT_SLACK when
+      unknown),
+    - plus the expected transfer time of the download, estimated from its
+      size (when known),
+    - plus a penalty of the kind, so that small result packages are not
+      stuck behind large resources,
+    - minus the time spent waiting multiplied by AGING_RATE, so that
+      downloads without a deadline are not starved.
+    """
+
+    DEFAULT_SLACK = 3600.0
+    # transfer rate used to estimate transfer time [B/s]
+    SIZE_RATE = 1024.0 * 1024.0
+    KIND_PENALTY = {
+        DownloadKind.RESULT: 0.0,
+        DownloadKind.RESOURCE: 60.0
+    }
+    AGING_RATE = 1.0
+
+    def __init__(self, budgets):
+        """
+        :param dict budgets: kind -> maximum number of concurrent downloads
+                             of that kind, unlimited if less than 1
+        """
+        self.budgets = dict(budgets)
+        self.stats = {kind: KindStats() for kind in budgets}
+        self._queue = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def rank(self, entry, now=None):
+        now = now or time.time()
+        if entry.deadline is None:
+            slack = self.DEFAULT_SLACK
+        else:
+            slack = entry.deadline - now
+        transfer_time = (entry.size or 0) / self.SIZE_RATE
+        waited = now - entry.queued
+        return slack + transfer_time + self.KIND_PENALTY.get(entry.kind, 0.0) \
+            - waited * self.AGING_RATE
+
+    def try_start(self, kind):
+        """ Take a slot for a download of a given kind if there is one
+        :return bool: True if the download can be started
+        """
+        with self._lock:
+            if not self._has_slot(kind):
+                return False
+            self._stats(kind).active += 1
+            return True
+
+    def start(self, kind):
+        """ Take a slot regardless of the budget """
+        with self._lock:
+            self._stats(kind).active += 1
+
+    def finish(self, kind):
+        """ Release a slot taken by try_start, start or pop """
+        with self._lock:
+            stats = self._stats(kind)
+            stats.active = max(stats.active - 1, 0)
+
+    def push(self, kind, params, deadline=None, size=None):
+        entry = QueuedDownload(kind, params, deadline, size)
+        with self._lock:
+            self._queue.append(entry)
+            self._stats(kind).queued += 1
+        return entry
+
+    def pop(self):
+        """ Remove the waiting download of the lowest rank among kinds that
+        have a free slot and take a slot for it
+        :return QueuedDownload: the download or None
+        """
+        now = time.time()
+        with self._lock:
+            ready = [e for e in self._queue if self._has_slot(e.kind)]
+            if not ready:
+                return None
+            entry = min(ready, key=lambda e: self.rank(e, now))
+            self._queue.remove(entry)
+
+            waited = now - entry.queued
+            stats = self._stats(entry.kind)
+            stats.queued -= 1
+            stats.active += 1
+            stats.started += 1
+            stats.total_wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+            return entry
+
+    def get_stats(self):
+        """ Return queue depth, active downloads and wait times of every kind
+        :return dict: kind -> dict of stats
+        """
+        with self._lock:
+            return {kind: stats.to_dict()
+                    for kind, stats in self.stats.items()}
+
+    def _has_slot(self, kind):
+        budget = self.budgets.get(kind, 0)
+        return budget < 1 or self._stats(kind).active < budget
+
+    def _stats(self, kind):
+        if kind not in self.stats:
+            self.stats[kind] = KindStats()
+        return self.stats[kind]
@@ -19,11 +19,13 @@ class TransferStatus(Enum):
 
 class PendingResource(object):
 
-    def __init__(self, resource, task_id, client_options, status):
+    def __init__(self, resource, task_id, client_options, status,
+                 deadline=None):
         self.resource = resource
         self.task_id = task_id
         self.client_options = client_options
         self.status = status
+        self.deadline = deadline
 
 
 class BaseResourceServer(object):
@@ -73,22 +75,25 @@ class BaseResourceServer(object):
     def remove_task(self, task_id, client_options=None):
         self.resource_manager.remove_task(task_id, client_options=client_options)
 
-    def download_resources(self, resources, task_id, client_options=None):
+    def download_resources(self, resources, task_id, client_options=None,
+                           deadline=None):
         with self._lock:
             for resource in resources:
-                self._add_pending_resource(resource, task_id, client_options)
+                self._add_pending_resource(resource, task_id, client_options,
+                                           deadline)
 
             collected = not self.pending_resources.get(task_id)
 
         if collected:
             self.client.task_resource_collected(task_id, unpack_delta=False)
 
-    def _add_pending_resource(self, resource, task_id, client_options):
+    def _add_pending_resource(self, resource, task_id, client_options,
+                              deadline=None):
         if task_id not in self.pending_resources:
             self.pending_resources[task_id] = []
 
         self.pending_resources[task_id].append(PendingResource(
-            resource, task_id, client_options, TransferStatus.idle
+            resource, task_id, client_options, TransferStatus.idle, deadline
         ))
 
     def _remove_pending_resource(self, resource, task_id):
@@ -115,7 +120,8 @@ class BaseResourceServer(object):
                                                         client_options=entry.client_options,
                                                         success=self._download_success,
                                                         error=self._download_error,
-                                                        async=async)
+                                                        async=async,
+                                                        deadline=entry.deadline)
 
     def _download_success(self, resource, task_id):
         if resource:
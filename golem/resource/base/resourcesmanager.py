@@ -3,11 +3,14 @@ import logging
 import os
 import re
 import shutil
-from collections import deque
+from collections import Counter
 from threading import Lock
 
 from golem.core.common import to_unicode
+from golem.core.filecopy import materialize
 from golem.core.fileshelper import copy_file_tree, common_dir
+from golem.resource.base.downloadqueue import DownloadKind, DownloadQueue
+from golem.resource.chunkstore import ChunkStore
 from golem.resource.client import IClientHandler, ClientCommands, ClientHandler, ClientConfig, TestClient, AsyncRequest, \
     async_run
 
@@ -193,10 +196,11 @@ class ResourceCache(object):
 
 class ResourceStorage(object):
 
-    def __init__(self, dir_manager, resource_dir_method):
+    def __init__(self, dir_manager, resource_dir_method, chunk_store=None):
         self.dir_manager = dir_manager
         self.resource_dir_method = resource_dir_method
         self.cache = ResourceCache()
+        self.chunk_store = chunk_store
 
     def list_dir(self, dir_name):
         return self.dir_manager.list_dir_names(dir_name)
@@ -243,7 +247,11 @@ class ResourceStorage(object):
             return True
 
     def copy(self, src_path, dst_relative_path, task_id):
-
+        """ Put a file or a directory into the resource directory of a task.
+        Files are reflinked when possible; they are not hardlinked, since
+        the source files may be modified in place later.
+        :return Counter: copy strategy -> number of files copied with it
+        """
         dst_relative_path = norm_path(dst_relative_path)
         dst_path = self.get_path(dst_relative_path, task_id)
         src_path = norm_path(src_path)
@@ -256,13 +264,79 @@ class ResourceStorage(object):
             shutil.rmtree(dst_path)
 
         if os.path.isfile(src_path):
-            shutil.copyfile(src_path, dst_path)
+            strategies = Counter([materialize(src_path, dst_path)])
         elif os.path.isdir(src_path):
-            copy_file_tree(src_path, dst_path)
+            strategies = copy_file_tree(src_path, dst_path)
         else:
             raise ValueError("Error reading source path: '{}'"
                              .format(src_path))
 
+        logger.debug("Resource manager: copied '{}' to task {}: {}"
+                     .format(src_path, task_id, dict(strategies)))
+        return strategies
+
+    def store(self, resource, relink=False):
+        """ Put files of a resource into the chunk store, so other tasks
+        can use them without downloading them again. Only resources placed
+        in the task directory are stored.
+        :param resource: resource with existing files
+        :param bool relink: replace files that were already stored with links
+                            to stored objects
+        """
+        if not self.chunk_store:
+            return
+
+        task_dir = self.get_dir(resource.task_id)
+        files = self._resource_files(resource)
+        if not files or not all(norm_path(p).startswith(task_dir + os.sep) and
+                                os.path.isfile(p) for p in files.itervalues()):
+            return
+
+        objects = dict()
+        with self.chunk_store.batch():
+            for name, path in files.iteritems():
+                objects[name] = self.chunk_store.add_file(path, resource.task_id,
+                                                          relink=relink)
+            if objects:
+                self.chunk_store.add_alias(resource.hash, objects)
+
+    def restore(self, resource):
+        """ Put files of a resource stored for other tasks in the task
+        directory
+        :return bool: True if all files were restored
+        """
+        if not self.chunk_store:
+            return False
+        objects = self.chunk_store.get_alias(resource.hash)
+        if not objects:
+            return False
+
+        if isinstance(resource, ResourceBundle):
+            paths = {name: os.path.join(resource.path, name)
+                     for name in objects}
+        elif len(objects) == 1:
+            paths = {name: resource.path for name in objects}
+        else:
+            return False
+
+        with self.chunk_store.batch():
+            for name, object_id in objects.iteritems():
+                if not self.chunk_store.materialize(object_id, paths[name],
+                                                    resource.task_id):
+                    return False
+        return True
+
+    def release(self, task_id):
+        if self.chunk_store:
+            self.chunk_store.release(task_id)
+
+    @staticmethod
+    def _resource_files(resource):
+        if isinstance(resource, ResourceBundle):
+            return {name: os.path.join(resource.path, name)
+                    for name in resource.files or []}
+        return {resource.file_name: resource.path}
+
     def clear_cache(self):
         self.cache.clear()
 
@@ -270,15 +344,16 @@ class ResourceStorage(object):
 class AbstractResourceManager(IClientHandler):
     __metaclass__ = abc.ABCMeta
 
-    lock = Lock()
-    queue_lock = Lock()
-
     def __init__(self, dir_manager, resource_dir_method=None):
 
-        self.download_queue = deque()
-        self.current_downloads = 0
+        # budgets are set from the client config when downloads start
+        self.download_queue = DownloadQueue({})
+        # only task resources are shared by tasks
+        chunk_store = None if resource_dir_method \
+            else ChunkStore(dir_manager.get_chunk_store_dir())
         self.storage = ResourceStorage(dir_manager, resource_dir_method
-                                       or dir_manager.get_task_resource_dir)
+                                       or dir_manager.get_task_resource_dir,
+                                       chunk_store=chunk_store)
         self.index_resources(self.storage.get_root())
 
         if not hasattr(self, 'commands'):
@@ -332,6 +407,7 @@ class AbstractResourceManager(IClientHandler):
                 self.unpin_resource(resource.hash,
                                     client=client,
                                     client_options=client_options)
+        self.storage.release(task_id)
 
     def add_task(self, files, task_id,
                  client=None, client_options=None):
@@ -406,18 +482,38 @@ class AbstractResourceManager(IClientHandler):
         AbstractResourceManager.__init__(self, self.storage.dir_manager,
                                          self.storage.resource_dir_method)
 
+    def get_download_stats(self):
+        """ Return depth of the download queue, number of active downloads
+        and times downloads waited in the queue, for every kind of downloads
+        :return dict: kind -> dict of stats
+        """
+        return self.download_queue.get_stats()
+
     def pull_resource(self, entry, task_id,
                       success, error,
-                      client=None, client_options=None, async=True, pin=True):
+                      client=None, client_options=None, async=True, pin=True,
+                      kind=DownloadKind.RESOURCE, deadline=None, size=None,
+                      reserved=False):
+        """ Download a resource, or put it into the download queue when all
+        download slots of its kind are taken
+        :param kind: kind of the download, one of DownloadKind
+        :param deadline: deadline of the subtask waiting for the resource
+        :param size: expected size of the resource [B]
+        :param bool reserved: a download slot was already taken for it
+        """
 
         resource = self._wrap_resource(entry, task_id)
+        queued = dict(kind=kind, deadline=deadline, size=size)
 
         if self.storage.has_resource(resource):
+            if reserved:
+                self.__finish_download(kind)
+                self.__process_queue()
             success(entry, task_id)
             return
 
         def success_wrapper(response, **_):
-            self.__dec_downloads()
+            self.__finish_download(kind)
             self._clear_retry(self.commands.get, resource.hash)
 
             if pin:
@@ -431,7 +527,7 @@ class AbstractResourceManager(IClientHandler):
             self.__process_queue()
 
         def error_wrapper(exception, **_):
-            self.__dec_downloads()
+            self.__finish_download(kind)
 
             if self._can_retry(exception, self.commands.get, resource.hash):
                 self.pull_resource(entry, task_id,
@@ -439,7 +535,8 @@ class AbstractResourceManager(IClientHandler):
                                    success=success,
                                    error=error,
                                    async=async,
-                                   pin=pin)
+                                   pin=pin,
+                                   **queued)
             else:
                 logger.error("Resource manager: error downloading {} ({}): {}"
                              .format(resource.path, resource.hash, exception))
@@ -450,9 +547,16 @@ class AbstractResourceManager(IClientHandler):
         make_path_dirs(self.storage.get_path(resource.path, task_id))
         local = self.storage.cache.get_by_hash(resource.hash)
 
-        if local:
+        if self.__restore(resource):
+
+            if not reserved:
+                self.download_queue.start(kind)
+            success_wrapper(entry)
+
+        elif local:
 
-            self.__inc_downloads()
+            if not reserved:
+                self.download_queue.start(kind)
             try:
                 self.storage.copy(local.path, resource.path, task_id)
             except Exception as exc:
@@ -462,8 +566,7 @@ class AbstractResourceManager(IClientHandler):
 
         else:
 
-            if self.__can_download():
-                self.__inc_downloads()
+            if reserved or self.__try_start_download(kind):
                 self.__pull(resource, task_id,
                             success=success_wrapper,
                             error=error_wrapper,
@@ -471,9 +574,10 @@ class AbstractResourceManager(IClientHandler):
                             client_options=client_options,
                             async=async)
             else:
-                self.__push_to_queue(entry, task_id,
-                                     success, error,
-                                     client, client_options, async, pin)
+                self.download_queue.push(kind,
+                                         (entry, task_id, success, error,
+                                          client, client_options, async, pin),
+                                         deadline=deadline, size=size)
 
     def command_failed(self, exc, cmd, obj_id, **kwargs):
         logger.error("Resource manager: Error executing command '{}': {}"
@@ -501,6 +605,7 @@ class AbstractResourceManager(IClientHandler):
             res_hash = to_unicode(response.get('Hash'))
             resource = self._wrap_resource((res_path, res_hash), task_id)
             self._cache_resource(resource)
+            self._store_resource(resource)
 
     def _cache_resource(self, resource):
         """
@@ -517,6 +622,24 @@ class AbstractResourceManager(IClientHandler):
             logger.warn("Resource does not exist: {}"
                         .format(resource.path))
 
+    def _store_resource(self, resource, relink=False):
+        """ Put a resource into the chunk store. Failures are not fatal,
+        the resource is then only not shared with other tasks.
+        """
+        try:
+            self.storage.store(resource, relink=relink)
+        except Exception as exc:
+            logger.warning("Resource manager: cannot store {}: {}"
+                           .format(resource, exc))
+
+    def __restore(self, resource):
+        try:
+            return self.storage.restore(resource)
+        except Exception as exc:
+            logger.warning("Resource manager: cannot restore {}: {}"
+                           .format(resource, exc))
+            return False
+
     def __pull(self, resource, task_id,
                success, error,
                client=None, client_options=None, async=True):
@@ -532,43 +655,46 @@ class AbstractResourceManager(IClientHandler):
             client_options=client_options
         )
 
+        def get_file(**kw):
+            data = client.get_file(**kw)
+            # downloaded files are stored in the download thread
+            self._store_resource(resource, relink=True)
+            return data
+
         if async:
-            self._async_call(client.get_file,
+            self._async_call(get_file,
                              success, error,
                              **kwargs)
         else:
             try:
-                data = client.get_file(**kwargs)
+                data = get_file(**kwargs)
                 success(data)
             except Exception as e:
                 error(e)
 
-    def __can_download(self):
-        max_dl = self.config.max_concurrent_downloads
-        with self.lock:
-            return max_dl < 1 or self.current_downloads < max_dl
+    def __update_budgets(self):
+        self.download_queue.budgets = {
+            DownloadKind.RESOURCE: self.config.max_concurrent_downloads,
+            DownloadKind.RESULT: self.config.max_concurrent_result_downloads
+        }
 
-    def __inc_downloads(self):
-        with self.lock:
-            self.current_downloads += 1
+    def __try_start_download(self, kind):
+        self.__update_budgets()
+        return self.download_queue.try_start(kind)
 
-    def __dec_downloads(self):
-        with self.lock:
-            self.current_downloads -= 1
-
-    def __push_to_queue(self, *params):
-        with self.queue_lock:
-            self.download_queue.append(params)
+    def __finish_download(self, kind):
+        self.download_queue.finish(kind)
 
     def __process_queue(self):
-        params = None
-
-        with self.queue_lock:
-            if self.download_queue:
-                params = self.download_queue.popleft()
-
-        if params:
-            self.pull_resource(*params)
+        self.__update_budgets()
+        queued = self.download_queue.pop()
+
+        if queued:
+            self.pull_resource(*queued.params,
+                               kind=queued.kind,
+                               deadline=queued.deadline,
+                               size=queued.size,
+                               reserved=True)
 
 
 class TestResourceManager(AbstractResourceManager, ClientHandler):
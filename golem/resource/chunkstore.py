@@ -0,0 +1,466 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import uuid
+from contextlib import contextmanager
+from threading import RLock
+
+import numpy
+
+from golem.core.filecopy import materialize
+
+logger = logging.getLogger(__name__)
+
+CHUNK_WINDOW = 48
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+# a chunk ends where the low bits of the window hash are zero,
+# on average every 2 ** CHUNK_BITS bytes after the minimal size
+CHUNK_BITS = 18
+READ_SIZE = 4 * 1024 * 1024
+
+# random values for every byte, the same on every node
+_GEAR = numpy.array([struct.unpack('<I', hashlib.sha256(chr(i)).digest()[:4])
+                     [0] for i in range(256)], dtype=numpy.uint32)
+
+
+def chunk_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _cut_points(data, final):
+    """ Find content-defined chunk boundaries in data that starts at
+    a chunk boundary. A chunk ends after a position where the sum of random
+    values of the last CHUNK_WINDOW bytes has CHUNK_BITS low bits set to zero,
+    so an insertion or removal changes only the chunks around it.
+    :param str data: data to split
+    :param bool final: whether data ends at the end of the file
+    :return list: end offsets of the complete chunks found in data
+    """
+    size = len(data)
+    if size == 0:
+        return []
+
+    values = _GEAR[numpy.frombuffer(data, dtype=numpy.uint8)]
+    sums = numpy.cumsum(values, dtype=numpy.uint32)
+    if size >= CHUNK_WINDOW:
+        window = sums[CHUNK_WINDOW - 1:].copy()
+        window[1:] -= sums[:size - CHUNK_WINDOW]
+    else:
+        window = numpy.empty(0, dtype=numpy.uint32)
+    mask = numpy.uint32((1 << CHUNK_BITS) - 1)
+    # offsets just after the windows with a matching hash
+    candidates = numpy.flatnonzero((window & mask) == 0) + CHUNK_WINDOW
+
+    cuts = []
+    start = 0
+    while start < size:
+        idx = numpy.searchsorted(candidates, start + MIN_CHUNK_SIZE,
+                                 side='right')
+        limit = start + MAX_CHUNK_SIZE
+        if idx < len(candidates) and candidates[idx] <= limit:
+            end = int(candidates[idx])
+        elif limit <= size:
+            end = limit
+        elif final:
+            end = size
+        else:
+            break
+        cuts.append(end)
+        start = end
+    return cuts
+
+
+def iter_chunks(file_obj, read_size=READ_SIZE):
+    """ Split file contents into content-defined chunks
+    :param file file_obj: file opened for reading in binary mode
+    :return: generator of chunk contents
+    """
+    pending = ''
+    while True:
+        data = file_obj.read(read_size)
+        final = not data
+        pending += data
+        start = 0
+        for end in _cut_points(pending, final):
+            yield pending[start:end]
+            start = end
+        pending = pending[start:]
+        if final:
+            break
+
+
+class FileManifest(object):
+    """ Description of file contents: a hash of the whole file and a list of
+    its chunks """
+
+    def __init__(self, file_hash, size, chunks):
+        """
+        :param str file_hash: SHA-1 of file contents
+        :param int size: file size
+        :param list chunks: list of [chunk hash, chunk size] pairs
+        """
+        self.hash = file_hash
+        self.size = size
+        self.chunks = chunks
+
+    def __eq__(self, other):
+        return isinstance(other, FileManifest) and \
+            self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<FileManifest {} ({} B, {} chunks)>'.format(
+            self.hash, self.size, len(self.chunks))
+
+    @classmethod
+    def build(cls, path):
+        sha = hashlib.sha1()
+        size = 0
+        chunks = []
+        with open(path, 'rb') as f:
+            for data in iter_chunks(f):
+                sha.update(data)
+                size += len(data)
+                chunks.append([chunk_hash(data), len(data)])
+        return cls(sha.hexdigest(), size, chunks)
+
+    def to_dict(self):
+        return dict(hash=self.hash, size=self.size,
+                    chunks=[list(c) for c in self.chunks])
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        return cls(dictionary['hash'], dictionary['size'],
+                   [list(c) for c in dictionary['chunks']])
+
+
+class ChunkStore(object):
+    """ Content-addressed store of resource files shared by tasks.
+
+    Every distinct file is kept once, as an object named after the hash of
+    its contents, and task resource directories get hardlinks to objects
+    (or copies, where linking is not possible). Objects are split into
+    content-defined chunks; the index maps every chunk to an object holding
+    it, so a file that differs from a stored one only in some of its chunks
+    can be assembled by fetching just the missing chunks. Objects are
+    referenced by tasks and removed when the last task using them is
+    released. A resource hash used by the network (an alias) can be mapped
+    to the objects it consists of, so a resource that is already stored is
+    not downloaded again. An object that was modified through one of its
+    links is detected by its size and modification time and dropped.
+    """
+
+    INDEX_FILE = 'index.json'
+    OBJECTS_DIR = 'objects'
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self._lock = RLock()
+        self._objects = None
+        self._chunks = None
+        self._aliases = None
+        self._batch = 0
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root_dir, self.INDEX_FILE)
+
+    def object_path(self, object_id):
+        return os.path.join(self.root_dir, self.OBJECTS_DIR,
+                            object_id[:2], object_id)
+
+    @contextmanager
+    def batch(self):
+        """ Save the index once, after all changes made in the block """
+        with self._lock:
+            self._batch += 1
+            try:
+                yield self
+            finally:
+                self._batch -= 1
+                if self._batch == 0 and self._objects is not None:
+                    self._save()
+
+    def add_file(self, path, task_id, relink=False):
+        """ Store a file for the task
+        :param str path: path to the file
+        :param task_id: task using the file
+        :param bool relink: replace the file with a link to the stored object
+                            when the same contents were already stored
+        :return str: object id
+        """
+        manifest = FileManifest.build(path)
+        with self._lock:
+            self._load()
+            object_id = manifest.hash
+
+            if not self._valid(object_id):
+                _link_or_copy(path, self.object_path(object_id))
+                self._add_object(manifest)
+            elif relink and not self._same_file(path, object_id):
+                _link_or_copy(self.object_path(object_id), path)
+
+            self._objects[object_id]['tasks'][task_id] = True
+            self._save()
+            return object_id
+
+    def add_alias(self, alias, objects):
+        """ Map a resource hash to stored objects
+        :param str alias: resource hash
+        :param dict objects: relative file path -> object id
+        """
+        with self._lock:
+            self._load()
+            self._aliases[alias] = dict(objects)
+            self._save()
+
+    def get_alias(self, alias):
+        """ Return objects of a resource if all of them are stored
+        :param str alias: resource hash
+        :return dict|None: relative file path -> object id
+        """
+        with self._lock:
+            self._load()
+            objects = self._aliases.get(alias)
+            if objects is None:
+                return None
+            if not all(self._valid(o) for o in objects.itervalues()):
+                self._aliases.pop(alias, None)
+                self._save()
+                return None
+            return dict(objects)
+
+    def has_object(self, object_id):
+        with self._lock:
+            self._load()
+            return self._valid(object_id)
+
+    def materialize(self, object_id, dst_path, task_id):
+        """ Put a stored object at dst_path for the task
+        :return bool: False if the object is not stored
+        """
+        with self._lock:
+            self._load()
+            if not self._valid(object_id):
+                return False
+            _link_or_copy(self.object_path(object_id), dst_path)
+            self._objects[object_id]['tasks'][task_id] = True
+            self._save()
+            return True
+
+    def get_manifest(self, object_id):
+        with self._lock:
+            self._load()
+            if not self._valid(object_id):
+                return None
+            return FileManifest.from_dict(self._objects[object_id])
+
+    def has_chunk(self, digest):
+        return self._locate(digest) is not None
+
+    def missing_chunks(self, digests):
+        """ Return hashes of chunks that are not stored """
+        return [d for d in digests if not self.has_chunk(d)]
+
+    def read_chunk(self, digest):
+        """ Read a stored chunk
+        :return str|None: chunk contents or None if the chunk is not stored
+        """
+        location = self._locate(digest)
+        if location is None:
+            return None
+        object_id, offset, size = location
+        with open(self.object_path(object_id), 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+        if chunk_hash(data) != digest:
+            return None
+        return data
+
+    def assemble(self, manifest, dst_path, fetch_chunk, task_id):
+        """ Write a file described by the manifest, reading stored chunks
+        and fetching only the missing ones, and store it for the task
+        :param FileManifest manifest: contents of the file
+        :param str dst_path: where to put the file
+        :param fetch_chunk: function returning contents of a chunk
+                            with a given hash
+        :return int: number of fetched chunks
+        """
+        if self.materialize(manifest.hash, dst_path, task_id):
+            return 0
+
+        fetched = 0
+        sha = hashlib.sha1()
+        dst_dir = os.path.dirname(dst_path)
+        if dst_dir and not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+        tmp_path = '{}.{}.part'.format(dst_path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for digest, size in manifest.chunks:
+                    data = self.read_chunk(digest)
+                    if data is None:
+                        data = fetch_chunk(digest)
+                        fetched += 1
+                        if len(data) != size or chunk_hash(data) != digest:
+                            raise ValueError("Invalid chunk {}"
+                                             .format(digest))
+                    sha.update(data)
+                    f.write(data)
+            if sha.hexdigest() != manifest.hash:
+                raise ValueError("Invalid contents of {}".format(dst_path))
+            _replace(tmp_path, dst_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.add_file(dst_path, task_id)
+        return fetched
+
+    def release(self, task_id):
+        """ Drop references of the task and remove objects that are not
+        used by any task
+        :return list: ids of removed objects
+        """
+        with self._lock:
+            self._load()
+            removed = []
+            for object_id, entry in self._objects.items():
+                entry['tasks'].pop(task_id, None)
+                if not entry['tasks']:
+                    self._remove_object(object_id)
+                    removed.append(object_id)
+            if removed:
+                logger.debug("Chunk store: removed %r objects of task %r",
+                             len(removed), task_id)
+            self._save()
+            return removed
+
+    def get_task_objects(self, task_id):
+        with self._lock:
+            self._load()
+            return sorted(o for o, entry in self._objects.iteritems()
+                          if task_id in entry['tasks'])
+
+    def _locate(self, digest):
+        with self._lock:
+            self._load()
+            location = self._chunks.get(digest)
+            if location is None or not self._valid(location[0]):
+                return None
+            return location
+
+    def _add_object(self, manifest):
+        object_id = manifest.hash
+        st = os.stat(self.object_path(object_id))
+        entry = manifest.to_dict()
+        entry.update(mtime=st.st_mtime, tasks={})
+        self._objects[object_id] = entry
+
+        offset = 0
+        for digest, size in manifest.chunks:
+            self._chunks.setdefault(digest, [object_id, offset, size])
+            offset += size
+
+    def _remove_object(self, object_id):
+        entry = self._objects.pop(object_id, None)
+        path = self.object_path(object_id)
+        if os.path.exists(path):
+            os.remove(path)
+        if entry is None:
+            return
+
+        for digest, _ in entry['chunks']:
+            location = self._chunks.get(digest)
+            if location and location[0] == object_id:
+                del self._chunks[digest]
+                self._relocate_chunk(digest)
+        for alias, objects in self._aliases.items():
+            if object_id in objects.itervalues():
+                del self._aliases[alias]
+
+    def _relocate_chunk(self, digest):
+        for object_id, entry in self._objects.iteritems():
+            offset = 0
+            for chunk, size in entry['chunks']:
+                if chunk == digest:
+                    self._chunks[digest] = [object_id, offset, size]
+                    return
+                offset += size
+
+    def _valid(self, object_id):
+        entry = self._objects.get(object_id)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(self.object_path(object_id))
+        except OSError:
+            st = None
+        if st is None or st.st_size != entry['size'] or \
+                st.st_mtime != entry['mtime']:
+            logger.warning("Chunk store: object %r was modified or removed",
+                           object_id)
+            self._remove_object(object_id)
+            return False
+        return True
+
+    def _same_file(self, path, object_id):
+        try:
+            return os.path.samefile(path, self.object_path(object_id))
+        except OSError:
+            return False
+
+    def _load(self):
+        if self._objects is not None:
+            return
+        self._objects, self._chunks, self._aliases = {}, {}, {}
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self._objects = index['objects']
+            self._chunks = index['chunks']
+            self._aliases = index['aliases']
+        except (IOError, ValueError, KeyError) as exc:
+            logger.warning("Chunk store: cannot read index %r: %s",
+                           self.index_path, exc)
+            self._objects, self._chunks, self._aliases = {}, {}, {}
+
+    def _save(self):
+        if self._batch:
+            return
+        if not os.path.isdir(self.root_dir):
+            os.makedirs(self.root_dir)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(objects=self._objects, chunks=self._chunks,
+                           aliases=self._aliases), f)
+        _replace(tmp_path, self.index_path)
+
+
+def _replace(src, dst):
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def _link_or_copy(src, dst):
+    """ Put a hardlink to src at dst, or a copy if linking is not
+    possible """
+    dst_dir = os.path.dirname(dst)
+    if dst_dir and not os.path.isdir(dst_dir):
+        os.makedirs(dst_dir)
+
+    tmp_path = '{}.{}.tmp'.format(dst, uuid.uuid4().hex)
+    try:
+        os.link(src, tmp_path)
+    except (OSError, AttributeError):
+        # different file systems or no hardlinks
+        materialize(src, tmp_path, link=False)
+    _replace(tmp_path, dst)
@@ -1,5 +1,4 @@
 import abc
-import hashlib
 import logging
 import os
 import shutil
@@ -18,23 +17,13 @@ from requests.packages.urllib3.exceptions import MaxRetryError, TimeoutError, Re
     ConnectTimeoutError, ConnectionError
 from twisted.internet import threads
 
-log = logging.getLogger(__name__)
-
+from golem.core.filehash import file_digest
 
-SHA1_BLOCK_SIZE = 64
+log = logging.getLogger(__name__)
 
 
 def file_sha_256(file_path):
-    sha = hashlib.sha256()
-
-    with open(file_path, 'rb') as f:
-        buf = f.read(SHA1_BLOCK_SIZE)
-
-        while len(buf) > 0:
-            sha.update(buf)
-            buf = f.read(SHA1_BLOCK_SIZE)
-
-    return sha.hexdigest()
+    return file_digest(file_path, 'sha256').encode('hex')
 
 
 def file_multihash(file_path):
@@ -107,9 +96,12 @@ class ClientConfig(object):
     """
     Initial configuration for classes implementing the IClient interface
     """
-    def __init__(self, max_concurrent_downloads=3, max_retries=8, timeout=None):
+    def __init__(self, max_concurrent_downloads=3, max_retries=8, timeout=None,
+                 max_concurrent_result_downloads=2):
 
+        # limits of concurrent downloads of task resources and of results
         self.max_concurrent_downloads = max_concurrent_downloads
+        self.max_concurrent_result_downloads = max_concurrent_result_downloads
         self.max_retries = max_retries
         self.client = dict(
             timeout=timeout or (12000, 12000)
@@ -0,0 +1,232 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import defaultdict
+from threading import Lock
+
+from golem.core.fileshelper import free_partition_space
+
+logger = logging.getLogger(__name__)
+
+
+class TaskDirCache(object):
+    """ Keeps the total size of task directories managed by a DirManager
+    under a quota, removing directories of the least recently used tasks.
+    Directories of pinned tasks (e.g. tasks being computed) are never
+    removed. Removal starts when the directories take more than the quota
+    and stops once they take less than low_watermark of it, so tasks are not
+    removed one by one with every new download. The quota is also lowered to
+    keep at least min_free bytes free on the partition; a quota of 0 means
+    that only the free space is taken into account.
+    """
+
+    EVICTED_PREFIX = '.evicted-'
+
+    def __init__(self, dir_manager, quota, low_watermark=0.8, min_free=0):
+        """
+        :param DirManager dir_manager: manager of the task directories
+        :param int quota: maximum size of the task directories [B]
+        :param float low_watermark: fraction of the quota to free space to
+        :param int min_free: space to keep free on the partition [B]
+        """
+        self.dir_manager = dir_manager
+        self.quota = quota
+        self.low_watermark = low_watermark
+        self.min_free = min_free
+
+        self._pins = defaultdict(int)
+        self._last_use = {}
+        self._listeners = []
+        self._lock = Lock()
+        self._enforce_lock = Lock()
+
+    def add_eviction_listener(self, callback):
+        """ Call callback with the id of every removed task. Callbacks are
+        called in the reactor thread, since enforce may run in a worker
+        thread.
+        """
+        self._listeners.append(callback)
+
+    def touch(self, task_id):
+        with self._lock:
+            self._last_use[task_id] = time.time()
+
+    def pin(self, task_id):
+        """ Protect directories of a task from being removed. Every call
+        has to be paired with a call to unpin.
+        """
+        with self._lock:
+            self._pins[task_id] += 1
+            self._last_use[task_id] = time.time()
+
+    def unpin(self, task_id):
+        with self._lock:
+            if self._pins.get(task_id, 0) <= 1:
+                self._pins.pop(task_id, None)
+            else:
+                self._pins[task_id] -= 1
+            self._last_use[task_id] = time.time()
+
+    def is_pinned(self, task_id):
+        with self._lock:
+            return task_id in self._pins
+
+    def get_limit(self, used):
+        """ Return the maximum size of the task directories, given that they
+        currently take used bytes """
+        limit = self.quota if self.quota > 0 else float('inf')
+        if self.min_free:
+            root = self.dir_manager.get_node_dir()
+            free = free_partition_space(root) * 1024
+            limit = min(limit, used + free - self.min_free)
+        return max(limit, 0)
+
+    def get_usage(self):
+        """ Return sizes of the task directories
+        :return dict: task id -> size of its directories [B]
+        """
+        return {task_id: sum(size for size in files.itervalues())
+                for task_id, files in self._scan().iteritems()}
+
+    def enforce(self):
+        """ Remove directories of the least recently used tasks if the task
+        directories take more space than allowed
+        :return list: ids of the removed tasks
+        """
+        if not self._enforce_lock.acquire(False):
+            return []
+        try:
+            return self._enforce()
+        finally:
+            self._enforce_lock.release()
+
+    def _enforce(self):
+        task_files = self._scan()
+        # files linked in several task directories are counted once and are
+        # freed with the last of them
+        owners = defaultdict(set)
+        sizes = {}
+        for task_id, files in task_files.iteritems():
+            for inode, size in files.iteritems():
+                owners[inode].add(task_id)
+                sizes[inode] = size
+
+        used = sum(sizes.itervalues())
+        limit = self.get_limit(used)
+        if used <= limit:
+            return []
+
+        target = limit * self.low_watermark
+        logger.info("Task directories take %r B, over the limit of %r B",
+                    used, limit)
+
+        evicted = []
+        for task_id in self._eviction_order(task_files):
+            if used <= target:
+                break
+            if not self._remove(task_id):
+                continue
+            evicted.append(task_id)
+            for inode in task_files[task_id]:
+                owners[inode].discard(task_id)
+                if not owners[inode]:
+                    used -= sizes[inode]
+
+        if used > target:
+            logger.warning("Cannot free enough space in task directories: "
+                           "%r B used, %r B allowed", used, limit)
+
+        from twisted.internet import reactor
+        for task_id in evicted:
+            reactor.callFromThread(self._task_evicted, task_id)
+        return evicted
+
+    def _task_evicted(self, task_id):
+        for listener in self._listeners:
+            try:
+                listener(task_id)
+            except Exception as exc:
+                logger.error("Task directory eviction listener failed: %r",
+                             exc)
+
+    def _eviction_order(self, task_files):
+        with self._lock:
+            last_use = dict(self._last_use)
+        dirs_last_use = {
+            task_id: last_use.get(task_id) or self._dir_last_use(task_id)
+            for task_id in task_files
+        }
+        return sorted(task_files, key=dirs_last_use.get)
+
+    def _remove(self, task_id):
+        task_dir = self._task_dir(task_id)
+        removed_dir = os.path.join(self.dir_manager.get_node_dir(),
+                                   self.EVICTED_PREFIX + str(uuid.uuid4()))
+        with self._lock:
+            if task_id in self._pins:
+                return False
+            # the directory is moved away while the task cannot be pinned
+            try:
+                os.rename(task_dir, removed_dir)
+            except OSError as exc:
+                logger.warning("Cannot remove directory of task %r: %s",
+                               task_id, exc)
+                return False
+            self._last_use.pop(task_id, None)
+
+        logger.info("Removing directory of task %r", task_id)
+        shutil.rmtree(removed_dir, ignore_errors=True)
+        return True
+
+    def _scan(self):
+        """ Return files of every task directory
+        :return dict: task id -> dict of (device, inode) -> file size
+        """
+        root = self.dir_manager.get_node_dir()
+        result = {}
+
+        for name in self.dir_manager.list_dir_names(root):
+            if name.startswith(self.EVICTED_PREFIX):
+                # left by an interrupted removal
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            elif self._is_task_dir(name):
+                result[name] = self._dir_files(self._task_dir(name))
+        return result
+
+    def _is_task_dir(self, name):
+        dm = self.dir_manager
+        if name == dm.global_resource:
+            return False
+        task_dir = self._task_dir(name)
+        return any(os.path.isdir(os.path.join(task_dir, sub_dir))
+                   for sub_dir in (dm.res, dm.tmp, dm.output))
+
+    def _task_dir(self, task_id):
+        return os.path.join(self.dir_manager.get_node_dir(), task_id)
+
+    def _dir_last_use(self, task_id):
+        """ Time of the latest modification in the task directory, used for
+        tasks not used since the cache was created """
+        latest = 0.0
+        for dir_path, dir_names, file_names in os.walk(self._task_dir(task_id)):
+            for name in dir_names + file_names:
+                try:
+                    mtime = os.lstat(os.path.join(dir_path, name)).st_mtime
+                except OSError:
+                    continue
+                latest = max(latest, mtime)
+        return latest
+
+    @staticmethod
+    def _dir_files(path):
+        files = {}
+        for dir_path, _, file_names in os.walk(path):
+            for name in file_names:
+                try:
+                    st = os.lstat(os.path.join(dir_path, name))
+                except OSError:
+                    continue
+                files[(st.st_dev, st.st_ino)] = st.st_size
+        return files
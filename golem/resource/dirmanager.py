@@ -42,19 +42,23 @@ def get_tmp_path(task_id, root_path):
 
 class DirManager(object):
     """ Manage working directories for application. Return paths, create them if it's needed """
-    def __init__(self, root_path, tmp="tmp", res="resources", output="output", global_resource="golemres"):
+    def __init__(self, root_path, tmp="tmp", res="resources", output="output", global_resource="golemres",
+                 chunk_store="chunks"):
         """ Creates new dir manager instance
         :param str root_path: path to the main directory where all other working directories are placed
         :param str tmp: temporary directory name
         :param res: resource directory name
         :param output: output directory name
         :param global_resource: global resources directory name
+        :param chunk_store: name of the directory of resource files shared by tasks, placed in the global resources
+                            directory
         """
         self.root_path = root_path
         self.tmp = tmp
         self.res = res
         self.output = output
         self.global_resource = global_resource
+        self.chunk_store = chunk_store
 
     def clear_dir(self, d, undeletable=None):
         """ Remove everything but undeletable from given directory
@@ -118,6 +122,14 @@ class DirManager(object):
         full_path = self.__get_global_resource_path()
         return self.get_dir(full_path, create, "resource dir does not exist")
 
+    def get_chunk_store_dir(self, create=True):
+        """ Get directory of the content-addressed store of resource files shared by tasks
+        :param bool create: *Default: True* should directory be created if it doesn't exist
+        :return str: path to directory
+        """
+        full_path = self.__get_chunk_store_path()
+        return self.get_dir(full_path, create, "chunk store dir does not exist")
+
     def get_task_temporary_dir(self, task_id, create=True):
         """ Get temporary directory
         :param task_id:
@@ -191,6 +203,9 @@ class DirManager(object):
     def __get_global_resource_path(self):
         return os.path.join(self.root_path, self.global_resource)
 
+    def __get_chunk_store_path(self):
+        return os.path.join(self.root_path, self.global_resource, self.chunk_store)
+
 
 class DirectoryType(object):
 
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from golem.core.filehash import FileHasher
+from golem.core.simplehash import SimpleHash
+
+logger = logging.getLogger(__name__)
+
+
+def _file_key(path):
+    st = os.stat(path)
+    mtime_ns = int(round(st.st_mtime * 10 ** 9))
+    return [st.st_size, mtime_ns, st.st_ino]
+
+
+class FileHashCache(object):
+    """ Cache of SimpleHash.hash_file_base64 results. An entry is valid as
+    long as the size, modification time and inode of the file are the same
+    as when it was hashed. Files modified shortly before they were hashed are
+    not cached, since a later modification may not change their mtime. The
+    cache is kept in memory and, once initialized with a node's data
+    directory, in a sidecar index file there.
+    """
+
+    INDEX_FILE = 'filehashes.json'
+    # files modified less than that before hashing are not cached [s]
+    MIN_AGE = 2.0
+
+    def __init__(self, workers=4):
+        self.hasher = FileHasher(workers)
+        self.index_path = None
+        self._entries = {}
+        self._lock = Lock()
+        self._dirty = False
+
+    def initialize(self, datadir):
+        """ Load the index kept in datadir and save it there from now on """
+        with self._lock:
+            self.index_path = os.path.join(datadir, self.INDEX_FILE)
+            self._entries = {}
+            self._dirty = False
+            if not os.path.exists(self.index_path):
+                return
+            try:
+                with open(self.index_path) as f:
+                    self._entries = json.load(f)
+            except (IOError, ValueError) as exc:
+                logger.warning("Cannot read file hash cache %r: %s",
+                               self.index_path, exc)
+
+    def get_hash(self, path):
+        """ Return base64 encoded SHA-1 of file contents, hashing the file
+        only if it changed since it was hashed last time
+        """
+        return self.scan([path])[path]
+
+    def scan(self, paths):
+        """ Return hashes of many files, hashing changed files in parallel
+        :param list paths: paths to files
+        :return dict: path -> base64 encoded SHA-1 of file contents
+        """
+        result = {}
+        changed = []
+        for path in paths:
+            cached = self._lookup(path)
+            if cached is None:
+                changed.append(path)
+            else:
+                result[path] = cached
+
+        hashes = self.hasher.map(self._hash, changed)
+        result.update(zip(changed, hashes))
+        if changed:
+            self.save()
+        return result
+
+    def invalidate(self, path=None):
+        """ Remove a file from the cache, or clear the whole cache if path
+        is not given """
+        with self._lock:
+            if path is None:
+                self._entries = {}
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+            self._dirty = True
+        self.save()
+
+    def prune(self):
+        """ Remove entries of files that were modified or removed """
+        with self._lock:
+            for path, entry in self._entries.items():
+                try:
+                    valid = _file_key(path) == entry['key']
+                except OSError:
+                    valid = False
+                if not valid:
+                    del self._entries[path]
+                    self._dirty = True
+        self.save()
+
+    def save(self):
+        with self._lock:
+            if not self.index_path or not self._dirty:
+                return
+            tmp_path = self.index_path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._entries, f)
+                if os.name == 'nt' and os.path.exists(self.index_path):
+                    os.remove(self.index_path)
+                os.rename(tmp_path, self.index_path)
+                self._dirty = False
+            except (IOError, OSError) as exc:
+                logger.warning("Cannot save file hash cache %r: %s",
+                               self.index_path, exc)
+
+    def _lookup(self, path):
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(abs_path)
+        if entry is None:
+            return None
+        try:
+            if _file_key(abs_path) == entry['key']:
+                # loaded from the index as unicode
+                return str(entry['hash'])
+        except OSError:
+            pass
+        with self._lock:
+            self._entries.pop(abs_path, None)
+            self._dirty = True
+        return None
+
+    def _hash(self, path):
+        started = time.time()
+        try:
+            key = _file_key(path)
+        except OSError:
+            key = None
+        file_hash = SimpleHash.hash_file_base64(path)
+        # the file could be modified while it was hashed
+        if key and key == _file_key(path) and \
+                started - key[1] / 10.0 ** 9 >= self.MIN_AGE:
+            with self._lock:
+                self._entries[os.path.abspath(path)] = dict(key=key,
+                                                            hash=file_hash)
+                self._dirty = True
+        return file_hash
+
+
+file_hash_cache = FileHashCache()
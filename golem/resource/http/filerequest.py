@@ -1,9 +1,20 @@
-import requests
+import logging
 import os
+import re
+
+import requests
+
+from golem.resource.chunkstore import chunk_hash
+from golem.resource.multisource import HTTPRangeSource, MultiSourceDownloader
 
 __all__ = ['DownloadFileRequest', 'DownloadFilesRequest'
                                   'UploadFileRequest', 'UploadFilesRequest']
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+
 
 class Request(object):
     def run(self, url, headers=None, **kwargs):
@@ -20,22 +31,188 @@ class FileRequest(Request):
 
 
 class DownloadFileRequest(FileRequest):
-    def __init__(self, file_hash, file_path, stream=True, **kwargs):
+    """ Downloads a file, writing it to a partial file next to file_path.
+    A broken download is continued with a Range request from the data
+    already on disk, also when the request is run again after a failure.
+    Parts of the file may be verified with their hashes; data that does not
+    match is downloaded again. Large files can be fetched in parallel ranges.
+    """
+
+    PART_EXT = '.part'
+
+    _content_range_re = re.compile(r'bytes\s+(?:\d+-\d+|\*)/(\d+)')
+
+    def __init__(self, file_hash, file_path, stream=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_resumes=5, ranges=None,
+                 parallel_size=None, range_size=DEFAULT_RANGE_SIZE,
+                 workers=4, timeout=None, **kwargs):
+        """
+        :param int chunk_size: size of data written at once
+        :param int max_resumes: number of times a download is continued
+                                without receiving any data before it fails
+        :param list ranges: [hash, size] pairs of consecutive parts of
+                            the file (see FileManifest.chunks), verified with
+                            chunk_hash
+        :param int parallel_size: files of at least this size are fetched
+                                  in parallel ranges; None disables it
+        :param int range_size: size of ranges fetched in parallel
+        :param int workers: number of ranges fetched at the same time
+        :param timeout: timeout of requests, passed to requests
+        """
         super(DownloadFileRequest, self).__init__(file_path)
         self.file_hash = file_hash
         self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_resumes = max_resumes
+        self.ranges = ranges
+        self.parallel_size = parallel_size
+        self.range_size = range_size
+        self.workers = workers
+        self.timeout = timeout
+
+    @property
+    def part_path(self):
+        return self.file_path + self.PART_EXT
 
     def run(self, url, headers=None, **kwargs):
-        r = requests.get(url + '/' + str(self.file_hash),
-                         headers=headers,
-                         stream=self.stream)
+        url = url + '/' + str(self.file_hash)
+
+        if self.parallel_size is not None \
+                and not os.path.exists(self.part_path):
+            try:
+                if self._run_parallel(url, headers):
+                    return self.file_path
+            except Exception as exc:
+                logger.warning("Cannot download %r in parallel: %r",
+                               self.file_hash, exc)
+
+        failures = 0
+        offset = self._valid_size()
+
+        while True:
+            try:
+                complete = self._fetch(url, headers, offset)
+            except requests.exceptions.HTTPError:
+                raise
+            except IOError as exc:
+                complete = False
+                logger.debug("Download of %r broken at %r B: %r",
+                             self.file_hash, self._part_size(), exc)
+
+            valid_size = self._valid_size()
+            if complete and valid_size == self._part_size():
+                break
+
+            # failures are counted until any valid data is received
+            failures = failures + 1 if valid_size <= offset else 1
+            if failures > self.max_resumes:
+                raise IOError("Cannot download {}: no progress after {} "
+                              "attempts".format(self.file_hash, failures))
+            offset = valid_size
+
+        self._finish()
+        return self.file_path
+
+    def _fetch(self, url, headers, offset):
+        """ Download the file from offset to the end
+        :return bool: whether the whole file was received
+        """
+        headers = dict(headers or {})
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+
+        r = requests.get(url, headers=headers, stream=self.stream,
+                         timeout=self.timeout)
+
+        if offset and r.status_code == \
+                requests.codes.requested_range_not_satisfiable:
+            r.close()
+            if self._total_size(r) == offset:
+                return True
+            # the partial file is larger than the file
+            offset = 0
+            headers.pop('Range')
+            r = requests.get(url, headers=headers, stream=self.stream,
+                             timeout=self.timeout)
+
         r.raise_for_status()
+        if r.status_code != requests.codes.partial_content:
+            # the range was ignored
+            offset = 0
+        total_size = self._total_size(r)
 
-        with open(self.file_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
+        mode = 'r+b' if offset else 'wb'
+        with open(self.part_path, mode) as f:
+            f.seek(offset)
+            f.truncate()
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
                 if chunk:
                     f.write(chunk)
-        return self.file_path
+
+        return total_size is None or self._part_size() == total_size
+
+    def _run_parallel(self, url, headers):
+        """ Download the file in parallel ranges if it is large enough
+        :return bool: whether the file was downloaded
+        """
+        source = HTTPRangeSource(url, headers=headers, timeout=self.timeout)
+        size = source.get_size()
+        if size < self.parallel_size:
+            return False
+
+        downloader = MultiSourceDownloader(
+            [source], workers=self.workers, per_source=self.workers,
+            max_errors=self.max_resumes + 1, piece_size=self.range_size)
+        verify = self._verify_file if self.ranges else None
+        downloader.download_ranges(size, self.file_path, verify=verify)
+        return True
+
+    def _valid_size(self):
+        """ Return the size of data in the partial file that can be kept:
+        its size, or the end of the last valid range when ranges are known
+        """
+        size = self._part_size()
+        if not self.ranges or not size:
+            return size
+        return self._valid_prefix(self.part_path, size)
+
+    def _valid_prefix(self, path, size):
+        valid = 0
+        with open(path, 'rb') as f:
+            for digest, range_size in self.ranges:
+                if valid + range_size > size:
+                    break
+                if chunk_hash(f.read(range_size)) != digest:
+                    logger.debug("Invalid range of %r at %r B",
+                                 self.file_hash, valid)
+                    break
+                valid += range_size
+        return valid
+
+    def _verify_file(self, path):
+        size = os.path.getsize(path)
+        return self._valid_prefix(path, size) == size
+
+    def _part_size(self):
+        try:
+            return os.path.getsize(self.part_path)
+        except OSError:
+            return 0
+
+    def _finish(self):
+        if os.name == 'nt' and os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        os.rename(self.part_path, self.file_path)
+
+    def _total_size(self, response):
+        content_range = response.headers.get('Content-Range')
+        if content_range:
+            match = self._content_range_re.match(content_range)
+            return int(match.group(1)) if match else None
+        if response.status_code == requests.codes.ok:
+            content_length = response.headers.get('Content-Length')
+            return int(content_length) if content_length else None
+        return None
 
 
 class UploadFileRequest(FileRequest):
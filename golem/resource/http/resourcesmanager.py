@@ -1,9 +1,13 @@
+import logging
 import os
 import random
 
 from golem.resource.base.resourcesmanager import AbstractResourceManager
 from golem.resource.client import ClientHandler, IClient, ClientCommands, ClientConfig, ClientOptions, file_multihash
 from golem.resource.http.filerequest import UploadFileRequest, DownloadFileRequest
+from golem.resource.multisource import HTTPRangeSource, MultiSourceDownloader
+
+logger = logging.getLogger(__name__)
 
 SERVERS = [
     'http://94.23.17.170:8888'
@@ -16,6 +20,10 @@ class HTTPResourceManagerClient(IClient):
     VERSION = 1.0
 
     OPTION_SERVER = 'server'
+    OPTION_SERVERS = 'servers'
+
+    # files of at least this size are downloaded in parallel ranges
+    PARALLEL_DOWNLOAD_SIZE = 64 * 1024 * 1024
 
     def __init__(self,
                  host=None,
@@ -37,8 +45,11 @@ class HTTPResourceManagerClient(IClient):
         for i in node_id:
             c += ord(i)
 
+        idx = c % len(SERVERS)
         options = dict()
-        options[cls.OPTION_SERVER] = SERVERS[c % len(SERVERS)]
+        options[cls.OPTION_SERVER] = SERVERS[idx]
+        # files are downloaded from all servers at once
+        options[cls.OPTION_SERVERS] = SERVERS[idx:] + SERVERS[:idx]
 
         return ClientOptions(cls.CLIENT_ID, cls.VERSION, options)
 
@@ -66,7 +77,17 @@ class HTTPResourceManagerClient(IClient):
         file_path = kwargs.pop('filepath')
         file_name = kwargs.pop('filename')
         dst_path = os.path.join(file_path, file_name)
-        self._download(multihash, dst_path, **kwargs)
+
+        servers = self._servers_from_kwargs(kwargs)
+        if len(servers) > 1:
+            try:
+                self._download_multi(multihash, dst_path, servers)
+            except Exception as exc:
+                logger.warning("Cannot download %r from many servers: %r",
+                               multihash, exc)
+                self._download(multihash, dst_path, **kwargs)
+        else:
+            self._download(multihash, dst_path, **kwargs)
 
         return dict(Name=file_name, Hash=multihash)
 
@@ -75,12 +96,41 @@ class HTTPResourceManagerClient(IClient):
 
     def _download(self, multihash, dst_path, **kwargs):
         url = self._server_from_kwargs(kwargs)
+        kwargs.setdefault('parallel_size', self.PARALLEL_DOWNLOAD_SIZE)
+        kwargs.setdefault('timeout', self._timeout())
         return DownloadFileRequest(multihash, dst_path, **kwargs).run(url)
 
+    def _download_multi(self, multihash, dst_path, servers):
+        sources = [HTTPRangeSource(server + '/' + str(multihash),
+                                   timeout=self._timeout())
+                   for server in servers]
+        size = sources[0].get_size()
+
+        def verify(path):
+            return file_multihash(path) == multihash
+
+        downloader = MultiSourceDownloader(sources)
+        return downloader.download_ranges(size, dst_path, verify=verify)
+
     def _upload(self, f, multihash, client_options=None, **kwargs):
         url = self._server_from_kwargs(kwargs)
         return UploadFileRequest(f, multihash, **kwargs).run(url)
 
+    def _timeout(self):
+        """ Connect and read timeouts [s] for requests """
+        timeout = self.defaults.get('timeout')
+        if timeout:
+            return tuple(t / 1000.0 for t in timeout)
+        return None
+
+    def _servers_from_kwargs(self, kwargs):
+        options = ClientOptions.from_kwargs(kwargs)
+        if options:
+            servers = options.get(self.CLIENT_ID, self.VERSION, self.OPTION_SERVERS)
+            if servers:
+                return servers
+        return [self._server_from_kwargs(kwargs)]
+
     def _server_from_kwargs(self, kwargs):
         server = None
         options = ClientOptions.from_kwargs(kwargs)
@@ -85,3 +85,4 @@ class HyperdriveResourceManager(ClientHandler, AbstractResourceManager):
     def _cache_response(self, resources, resource_hash, task_id):
         res = self._wrap_resource((resource_hash, resources), task_id)
         self._cache_resource(res)
+        self._store_resource(res)
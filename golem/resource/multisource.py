@@ -0,0 +1,306 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import requests
+
+from golem.resource.chunkstore import chunk_hash
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkSource(object):
+    """ A source of parts of a single file, e.g. a peer holding it """
+
+    def __init__(self, name):
+        self.name = name
+
+    def fetch(self, offset, size):
+        """ Return size bytes of the file starting at offset """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.name)
+
+
+class HTTPRangeSource(ChunkSource):
+    """ File served over HTTP, fetched with range requests """
+
+    def __init__(self, url, headers=None, timeout=None):
+        super(HTTPRangeSource, self).__init__(url)
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+
+    def get_size(self):
+        response = requests.head(self.url, headers=self.headers,
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        return int(response.headers['Content-Length'])
+
+    def fetch(self, offset, size):
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes={}-{}'.format(offset, offset + size - 1)
+        response = requests.get(self.url, headers=headers,
+                                timeout=self.timeout)
+        response.raise_for_status()
+        if response.status_code != requests.codes.partial_content:
+            raise IOError("Range requests not supported by {}"
+                          .format(self.url))
+        return response.content
+
+
+class _Piece(object):
+
+    def __init__(self, offset, size, digest=None):
+        self.offset = offset
+        self.size = size
+        self.digest = digest
+        # sources that failed to deliver the piece
+        self.failed = set()
+
+
+class _SourceState(object):
+
+    def __init__(self, source):
+        self.source = source
+        self.active = 0
+        self.completed = 0
+        self.errors = 0
+        self.rate = None
+        self.dropped = False
+
+
+class _Transfer(object):
+
+    def __init__(self, pieces, sources):
+        self.pending = deque(pieces)
+        self.sources = [_SourceState(s) for s in sources]
+        self.in_flight = 0
+        self.error = None
+        self.cond = threading.Condition()
+
+
+class MultiSourceDownloader(object):
+    """ Downloads a file from several sources at once. The file is split
+    into pieces (chunks of a FileManifest or fixed byte ranges) fetched in
+    parallel worker threads; every worker takes the next piece and the
+    fastest source that is not busy. Pieces are verified when they arrive;
+    a piece that failed is fetched again, from another source if there is
+    one. Sources that fail max_errors times, or whose throughput falls below
+    slow_ratio of the fastest source, are dropped.
+    """
+
+    # weight of the last measurement in the throughput of a source
+    RATE_WEIGHT = 0.5
+
+    def __init__(self, sources, workers=4, per_source=2, max_errors=3,
+                 slow_ratio=0.2, min_samples=2, piece_size=4 * 1024 * 1024):
+        """
+        :param list sources: ChunkSource instances serving the same file
+        :param int workers: number of pieces fetched at the same time
+        :param int per_source: number of pieces fetched from a single source
+                               at the same time
+        :param int max_errors: failures after which a source is dropped
+        :param float slow_ratio: fraction of the throughput of the fastest
+                                 source below which a source is dropped
+        :param int min_samples: pieces a source has to deliver before
+                                it is compared with the others
+        :param int piece_size: size of byte ranges, when there is no manifest
+        """
+        if not sources:
+            raise ValueError("No sources to download from")
+        self.sources = sources
+        self.workers = workers
+        self.per_source = per_source
+        self.max_errors = max_errors
+        self.slow_ratio = slow_ratio
+        self.min_samples = min_samples
+        self.piece_size = piece_size
+
+    def download_manifest(self, manifest, dst_path, chunk_store=None,
+                          task_id=None):
+        """ Download a file described by the manifest, verifying every chunk.
+        Chunks present in the chunk store are not downloaded and the file is
+        put into the store for the task.
+        :return dict: source name -> number of chunks fetched from it
+        """
+        pieces = []
+        offset = 0
+        for digest, size in manifest.chunks:
+            pieces.append(_Piece(offset, size, digest))
+            offset += size
+
+        def prefill(f):
+            missing = []
+            for piece in pieces:
+                data = chunk_store.read_chunk(piece.digest) \
+                    if chunk_store else None
+                if data is None:
+                    missing.append(piece)
+                else:
+                    f.seek(piece.offset)
+                    f.write(data)
+            return missing
+
+        def verify(path):
+            return _file_sha1(path) == manifest.hash
+
+        fetched = self._download(dst_path, manifest.size, prefill, verify)
+        if chunk_store:
+            chunk_store.add_file(dst_path, task_id)
+        return fetched
+
+    def download_ranges(self, size, dst_path, verify=None):
+        """ Download a file of a known size in byte ranges
+        :param verify: function checking the downloaded file by its path
+        :return dict: source name -> number of ranges fetched from it
+        """
+        pieces = [_Piece(offset, min(self.piece_size, size - offset))
+                  for offset in xrange(0, size, self.piece_size)]
+        return self._download(dst_path, size, lambda _: pieces, verify)
+
+    def _download(self, dst_path, size, prefill, verify):
+        dst_dir = os.path.dirname(dst_path)
+        if dst_dir and not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+        tmp_path = '{}.{}.part'.format(dst_path, uuid.uuid4().hex)
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.truncate(size)
+                pieces = prefill(f)
+
+            transfer = _Transfer(pieces, self.sources)
+            workers = [threading.Thread(target=self._work,
+                                        args=(transfer, tmp_path))
+                       for _ in xrange(min(self.workers, len(pieces)))]
+            for worker in workers:
+                worker.daemon = True
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+            if transfer.error:
+                raise transfer.error
+            if verify and not verify(tmp_path):
+                raise ValueError("Invalid contents of {}".format(dst_path))
+            if os.name == 'nt' and os.path.exists(dst_path):
+                os.remove(dst_path)
+            os.rename(tmp_path, dst_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return {s.source.name: s.completed for s in transfer.sources}
+
+    def _work(self, transfer, path):
+        with open(path, 'r+b') as f:
+            while True:
+                job = self._next(transfer)
+                if not job:
+                    return
+                piece, state = job
+                started = time.time()
+                try:
+                    data = state.source.fetch(piece.offset, piece.size)
+                    if len(data) != piece.size or \
+                            piece.digest and chunk_hash(data) != piece.digest:
+                        raise ValueError("Invalid piece at {} from {}"
+                                         .format(piece.offset, state.source))
+                    f.seek(piece.offset)
+                    f.write(data)
+                except Exception as exc:
+                    self._failed(transfer, piece, state, exc)
+                else:
+                    self._done(transfer, piece, state, time.time() - started)
+
+    def _next(self, transfer):
+        with transfer.cond:
+            while True:
+                if transfer.error:
+                    return None
+                if not transfer.pending:
+                    if not transfer.in_flight:
+                        return None
+                    # a piece in flight may fail and return to the queue
+                    transfer.cond.wait()
+                    continue
+
+                piece = transfer.pending[0]
+                alive = [s for s in transfer.sources if not s.dropped]
+                if not alive:
+                    transfer.error = IOError("No sources left to download "
+                                             "the piece at {}"
+                                             .format(piece.offset))
+                    transfer.cond.notify_all()
+                    return None
+                # sources that failed to deliver the piece are used again
+                # only if there are no others
+                usable = [s for s in alive
+                          if s.source not in piece.failed] or alive
+
+                free = [s for s in usable if s.active < self.per_source]
+                if not free:
+                    transfer.cond.wait()
+                    continue
+
+                # sources not measured yet are tried first
+                state = max(free, key=lambda s: (s.rate is None, s.rate,
+                                                 -s.active))
+                transfer.pending.popleft()
+                state.active += 1
+                transfer.in_flight += 1
+                return piece, state
+
+    def _done(self, transfer, piece, state, elapsed):
+        rate = piece.size / max(elapsed, 1e-6)
+        with transfer.cond:
+            state.active -= 1
+            state.completed += 1
+            transfer.in_flight -= 1
+            if state.rate is None:
+                state.rate = rate
+            else:
+                state.rate += self.RATE_WEIGHT * (rate - state.rate)
+            self._drop_slow(transfer)
+            transfer.cond.notify_all()
+
+    def _failed(self, transfer, piece, state, exc):
+        logger.debug("Cannot fetch piece at %r from %r: %r",
+                     piece.offset, state.source, exc)
+        with transfer.cond:
+            state.active -= 1
+            state.errors += 1
+            transfer.in_flight -= 1
+            piece.failed.add(state.source)
+            transfer.pending.appendleft(piece)
+            if state.errors >= self.max_errors and not state.dropped:
+                logger.info("Dropping source %r after %r errors",
+                            state.source, state.errors)
+                state.dropped = True
+            transfer.cond.notify_all()
+
+    def _drop_slow(self, transfer):
+        measured = [s for s in transfer.sources
+                    if not s.dropped and s.completed >= self.min_samples]
+        if len(measured) < 2:
+            return
+        best = max(s.rate for s in measured)
+        for state in measured:
+            if state.rate < best * self.slow_ratio:
+                logger.info("Dropping slow source %r (%.0f B/s, best "
+                            "%.0f B/s)", state.source, state.rate, best)
+                state.dropped = True
+
+
+def _file_sha1(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for buf in iter(lambda: f.read(1024 * 1024), ''):
+            sha.update(buf)
+    return sha.hexdigest()
@@ -4,8 +4,14 @@ import string
 import unicodedata
 import zipfile
 
+from twisted.internet import threads
+
+from golem.core.fileshelper import replacing_file
 from golem.core.simplehash import SimpleHash
+from golem.resource.archive import ArchiveBuilder
 from golem.resource.dirmanager import split_path
+from golem.resource.hashcache import file_hash_cache
+from golem.resource.rsyncdelta import build_delta, build_signature
 
 
 logger = logging.getLogger(__name__)
@@ -32,12 +38,31 @@ class TaskResourceHeader(object):
         return True
 
     @classmethod
-    def build(cls, relative_root, absolute_root):
-        return cls.__build(relative_root, absolute_root)
+    def build(cls, relative_root, absolute_root, signatures=False):
+        """ Build a header of all files in absolute_root
+        :param bool signatures: add block signatures of large files, letting
+                                the other node send deltas of these files
+                                (see rsyncdelta)
+        """
+        files = [os.path.join(root, f)
+                 for root, _, names in os.walk(absolute_root) for f in names]
+        # hash changed files in parallel, before walking the tree
+        hashes = file_hash_cache.scan(files)
+        return cls.__build(relative_root, absolute_root, hashes=hashes,
+                           signatures=signatures)
+
+    @classmethod
+    def build_async(cls, relative_root, absolute_root, signatures=False):
+        """ Build a header in a thread, without blocking the reactor
+        :return Deferred: fired with the header
+        """
+        return threads.deferToThread(cls.build, relative_root, absolute_root,
+                                     signatures)
 
     @classmethod
     def build_from_chosen(cls, dir_name, absolute_root, chosen_files=None):
         cur_th = TaskResourceHeader(dir_name)
+        hashes = file_hash_cache.scan(chosen_files)
 
         abs_dirs = split_path(absolute_root)
 
@@ -57,13 +82,13 @@ class TaskResourceHeader(object):
                     last_header.sub_dir_headers.append(child_sub_dir_header)
                     last_header = child_sub_dir_header
 
-            hsh = SimpleHash.hash_file_base64(f)
+            hsh = hashes[f]
             last_header.files_data.append((file_name, hsh))
 
         return cur_th
 
     @classmethod
-    def __build(cls, dir_name, absolute_root, chosen_files=None):
+    def __build(cls, dir_name, absolute_root, chosen_files=None, hashes=None, signatures=False):
         cur_th = TaskResourceHeader(dir_name)
 
         dirs = [name for name in os.listdir(absolute_root) if os.path.isdir(os.path.join(absolute_root, name))]
@@ -71,11 +96,19 @@ class TaskResourceHeader(object):
 
         files_data = []
         for f in files:
-            if chosen_files and os.path.join(absolute_root, f) not in chosen_files:
+            file_path = os.path.join(absolute_root, f)
+            if chosen_files and file_path not in chosen_files:
                 continue
-            hsh = SimpleHash.hash_file_base64(os.path.join(absolute_root, f))
+            if hashes and file_path in hashes:
+                hsh = hashes[file_path]
+            else:
+                hsh = file_hash_cache.get_hash(file_path)
 
-            files_data.append((f, hsh))
+            signature = build_signature(file_path) if signatures else None
+            if signature:
+                files_data.append((f, hsh, signature))
+            else:
+                files_data.append((f, hsh))
 
         # print "{}, {}, {}".format(relative_root, absolute_root, files_data)
 
@@ -83,7 +116,7 @@ class TaskResourceHeader(object):
 
         sub_dir_headers = []
         for d in dirs:
-            child_sub_dir_header = cls.__build(d, os.path.join(absolute_root, d), chosen_files)
+            child_sub_dir_header = cls.__build(d, os.path.join(absolute_root, d), chosen_files, hashes, signatures)
             sub_dir_headers.append(child_sub_dir_header)
 
         cur_th.sub_dir_headers = sub_dir_headers
@@ -98,6 +131,7 @@ class TaskResourceHeader(object):
         cur_th = TaskResourceHeader(header.dir_name)
 
         abs_dirs = split_path(absolute_root)
+        hashes = file_hash_cache.scan(chosen_files)
 
         for file_ in chosen_files:
 
@@ -109,7 +143,7 @@ class TaskResourceHeader(object):
 
             last_header, last_ref_header, ref_header_found = cls.__resolve_dirs(dirs, last_header, last_ref_header)
 
-            hsh = SimpleHash.hash_file_base64(file_)
+            hsh = hashes[file_]
             if ref_header_found:
                 if last_ref_header.__has_file(file_name):
                     if hsh == last_ref_header.__get_file_hash(file_name):
@@ -120,11 +154,18 @@ class TaskResourceHeader(object):
 
     @classmethod
     def build_parts_header_delta_from_chosen(cls, header, absolute_root, res_parts):
+        """ Build a header of files that differ from the ones in header.
+        Files with a signature in header are sent as deltas against the old
+        version, as (name, hash, [], delta) entries, if a delta is small
+        enough; other files as (name, hash, parts) entries.
+        :return (TaskResourceHeader, list): the header and parts to send
+        """
         if not isinstance(header, TaskResourceHeader):
             raise TypeError("Incorrect header type: {}. Should be TaskResourceHeader".format(type(header)))
         cur_th = TaskResourceHeader(header.dir_name)
         abs_dirs = split_path(absolute_root)
         delta_parts = []
+        hashes = file_hash_cache.scan(res_parts.keys())
 
         for file_, parts in res_parts.iteritems():
             dir_, file_name = os.path.split(file_)
@@ -135,11 +176,18 @@ class TaskResourceHeader(object):
 
             last_header, last_ref_header, ref_header_found = cls.__resolve_dirs(dirs, last_header, last_ref_header)
 
-            hsh = SimpleHash.hash_file_base64(file_)
+            hsh = hashes[file_]
+            signature = None
             if ref_header_found:
                 if last_ref_header.__has_file(file_name):
                     if hsh == last_ref_header.__get_file_hash(file_name):
                         continue
+                    signature = last_ref_header.__get_file_signature(file_name)
+
+            delta = build_delta(signature, file_) if signature else None
+            if delta:
+                last_header.files_data.append((file_name, hsh, [], delta.to_dict()))
+                continue
             last_header.files_data.append((file_name, hsh, parts))
             delta_parts += parts
 
@@ -170,13 +218,13 @@ class TaskResourceHeader(object):
 
             file_hash = 0
             if header.__has_file(f):
-                file_hash = SimpleHash.hash_file_base64(os.path.join(absolute_root, f))
+                file_hash = file_hash_cache.get_hash(os.path.join(absolute_root, f))
 
                 if file_hash == header.__get_file_hash(f):
                     continue
 
             if not file_hash:
-                file_hash = SimpleHash.hash_file_base64(os.path.join(absolute_root, f))
+                file_hash = file_hash_cache.get_hash(os.path.join(absolute_root, f))
 
             cur_tr.files_data.append((f, file_hash))
 
@@ -213,7 +261,7 @@ class TaskResourceHeader(object):
         if len(self.files_data) > 0:
             out += u"FILES \n"
             for f in self.files_data:
-                if len(f) > 2:
+                if len(f) > 2 and isinstance(f[2], list):
                     out += u"    {} {} {}".format(f[0], f[1], f[2])
                 else:
                     out += u"    {} {}".format(f[0], f[1])
@@ -243,6 +291,13 @@ class TaskResourceHeader(object):
         idx = [f[0] for f in self.files_data].index(file_)
         return self.files_data[idx][1]
 
+    def __get_file_signature(self, file_):
+        idx = [f[0] for f in self.files_data].index(file_)
+        file_data = self.files_data[idx]
+        if len(file_data) > 2 and isinstance(file_data[2], dict):
+            return file_data[2]
+        return None
+
 
 class TaskResource(object):
     @classmethod
@@ -286,8 +341,9 @@ class TaskResource(object):
     @classmethod
     def write_file(cls, file_name, data):
         try:
-            f = open(file_name, "wb")
-            f.write(data)
+            # file_name may be a hardlink to a stored object, do not truncate it
+            with replacing_file(file_name) as f:
+                f.write(data)
         except Exception as ex:
             logger.error(str(ex))
 
@@ -367,7 +423,7 @@ class TaskResource(object):
         for f in files:
             if f in [file_[0] for file_ in header.files_data]:
                 idx = [file_[0] for file_ in header.files_data].index(f)
-                if SimpleHash.hash_file_base64(os.path.join(absolute_root, f)) == header.files_data[idx][1]:
+                if file_hash_cache.get_hash(os.path.join(absolute_root, f)) == header.files_data[idx][1]:
                     continue
 
             fdata = cls.read_file(os.path.join(absolute_root, f))
@@ -387,7 +443,7 @@ class TaskResource(object):
             dir_.extract(os.path.join(to_path, dir_.dir_name))
 
         for f in self.files_data:
-            if not os.path.exists(os.path.join(to_path, f[0])) or SimpleHash.hash_file_base64(
+            if not os.path.exists(os.path.join(to_path, f[0])) or file_hash_cache.get_hash(
                     os.path.join(to_path, f[0])) != f[1]:
                 self.write_file(os.path.join(to_path, f[0]), f[2])
 
@@ -428,40 +484,26 @@ def remove_disallowed_filename_chars(filename):
 
 def compress_dir(root_path, header, output_dir):
     output_file = remove_disallowed_filename_chars(header.hash().strip().decode('unicode-escape') + ".zip")
-
     output_file = os.path.join(output_dir, output_file)
 
-    zipf = zipfile.ZipFile(output_file, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
-
-    cur_working_dir = os.getcwd()
-    os.chdir(root_path)
-    logger.debug("Working directory {}".format(os.getcwd()))
-
-    try:
-        compress_dir_impl("", header, zipf)
-
-        zipf.close()
-    finally:
-        os.chdir(cur_working_dir)
-        logger.debug("Return to prev working directory {}".format(os.getcwd()))
-
-    return output_file
+    builder = ArchiveBuilder()
+    builder.add_header(root_path, header)
+    return builder.write_file(output_file)
 
 
 def decompress_dir(root_path, zip_file):
     zipf = zipfile.ZipFile(zip_file, 'r', allowZip64=True)
 
+    # unlink existing files, which may be hardlinks to stored objects,
+    # instead of overwriting them
+    root = os.path.abspath(root_path)
+    for name in zipf.namelist():
+        path = os.path.abspath(os.path.join(root, name))
+        if path.startswith(root + os.sep) and os.path.isfile(path):
+            os.remove(path)
     zipf.extractall(root_path)
 
 
-def compress_dir_impl(root_path, header, zipf):
-    for sdh in header.sub_dir_headers:
-        compress_dir_impl(os.path.join(root_path, sdh.dir_name), sdh, zipf)
-
-    for fdata in header.files_data:
-        zipf.write(os.path.join(root_path, fdata[0]))
-
-
 def prepare_delta_zip(root_dir, header, output_dir, chosen_files=None):
     # delta_header = TaskResourceHeader.build_header_delta_from_header(header, root_dir, chosen_files)
     delta_header = TaskResourceHeader.build_header_delta_from_chosen(header, root_dir, chosen_files)
@@ -2,30 +2,29 @@ import os
 import hashlib
 import base64
 
+from golem.core.filehash import file_digest, iter_file
+from golem.core.fileshelper import replacing_file
+
 
 class ResourceHash:
     def __init__(self, resource_dir):
         self.resource_dir = resource_dir
 
     def split_file(self, filename, block_size=2 ** 20):
-        with open(filename, "rb") as f:
-            file_list = []
-            while True:
-                data = f.read(block_size)
-                if not data:
-                    break
-
-                filehash = os.path.join(self.resource_dir, self.__count_hash(data))
-                filehash = os.path.normpath(filehash)
+        file_list = []
+        for data in iter_file(filename, block_size):
+            filehash = os.path.join(self.resource_dir, self.__count_hash(data))
+            filehash = os.path.normpath(filehash)
 
-                with open(filehash, "wb") as fwb:
-                    fwb.write(data)
+            with open(filehash, "wb") as fwb:
+                fwb.write(data)
 
-                file_list.append(filehash)
+            file_list.append(filehash)
         return file_list
 
     def connect_files(self, file_list, res_file):
-        with open(res_file, 'wb') as f:
+        # res_file may be a hardlink to a stored object, do not truncate it
+        with replacing_file(res_file) as f:
             for file_hash in file_list:
                 with open(file_hash, "rb") as fh:
                     while True:
@@ -35,10 +34,7 @@ class ResourceHash:
                         f.write(data)
 
     def get_file_hash(self, filename):
-        with open(filename, "rb") as f:
-            data = f.read()
-            hash_ = self.__count_hash(data)
-        return hash_
+        return base64.urlsafe_b64encode(file_digest(filename, 'sha1'))
 
     def set_resource_dir(self, resource_dir):
         self.resource_dir = resource_dir
@@ -3,12 +3,14 @@ import random
 import os
 import time
 
+from golem.core.simplehash import SimpleHash
 from golem.network.transport.network import ProtocolFactory, SessionFactory
 from golem.network.transport.tcpserver import PendingConnectionsServer
 from golem.network.transport.tcpnetwork import SocketAddress, TCPNetwork, FilesProtocol, DecryptFileConsumer
 from golem.resource.dirmanager import DirManager
 from golem.resource.resourcesmanager import DistributedResourceManager
 from golem.resource.resourcesession import ResourceSession
+from golem.resource.rsyncdelta import FileDelta
 from golem.ranking.helper.trust import Trust
 
 logger = logging.getLogger(__name__)
@@ -213,13 +215,47 @@ class ResourceServer(PendingConnectionsServer):
         self.__free_peer(addr, port)
 
     def unpack_delta(self, dest_dir, delta, task_id):
+        """ Put files described in delta into dest_dir
+        :return bool: False if a file could not be rebuilt from its delta;
+                      resources in dest_dir are not up to date then
+        """
         if not os.path.isdir(dest_dir):
             os.mkdir(dest_dir)
+        success = True
         for dir_header in delta.sub_dir_headers:
-            self.unpack_delta(os.path.join(dest_dir, dir_header.dir_name), dir_header, task_id)
+            if not self.unpack_delta(os.path.join(dest_dir, dir_header.dir_name), dir_header, task_id):
+                success = False
 
         for files_data in delta.files_data:
-            self.resource_manager.connect_file(files_data[2], os.path.join(dest_dir, files_data[0]))
+            file_path = os.path.join(dest_dir, files_data[0])
+            if len(files_data) > 3 and files_data[3]:
+                if not self.__patch_file(file_path, files_data[1], files_data[3]):
+                    success = False
+            else:
+                self.resource_manager.connect_file(files_data[2], file_path)
+        return success
+
+    @staticmethod
+    def __patch_file(file_path, file_hash, delta):
+        """ Rebuild a new version of the file from its delta against
+        the version already in file_path. If that fails, the stale version
+        is removed, so the next request for resources fetches the whole file """
+        tmp_path = file_path + '.delta'
+        try:
+            FileDelta.from_dict(delta).apply(file_path, tmp_path)
+            if SimpleHash.hash_file_base64(tmp_path) != file_hash:
+                raise ValueError("hash mismatch")
+        except (EnvironmentError, KeyError, ValueError) as exc:
+            logger.error("Cannot apply delta of {}: {}".format(file_path, exc))
+            for path in [tmp_path, file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            return False
+
+        if os.name == 'nt':
+            os.remove(file_path)
+        os.rename(tmp_path, file_path)
+        return True
 
     def remove_session(self, session):
         if session in self.sessions:
@@ -3,6 +3,8 @@ from resource import TaskResource, TaskResourceHeader, prepare_delta_zip
 import os
 import logging
 
+from twisted.internet.defer import succeed
+
 from golem.core.databuffer import DataBuffer
 from golem.core.fileshelper import copy_file_tree
 from golem.resource.resourcehash import ResourceHash
@@ -18,7 +20,8 @@ class DistributedResourceManager:
         self.add_resources()
 
     def copy_resources(self, new_resource_dir):
-        copy_file_tree(self.resource_dir, new_resource_dir)
+        # files are moved, the originals are removed below
+        copy_file_tree(self.resource_dir, new_resource_dir, link=True)
         filenames = next(os.walk(self.resource_dir))[2]
         for f in filenames:
             os.remove(os.path.join(self.resource_dir, f))
@@ -66,12 +69,23 @@ class ResourcesManager:
         dir_name = self.get_resource_dir(task_id)
 
         if os.path.exists(dir_name):
-            task_res_header = TaskResourceHeader.build("resources", dir_name)
+            # signatures let the requestor send deltas of changed files
+            task_res_header = TaskResourceHeader.build("resources", dir_name, signatures=True)
         else:
             task_res_header = TaskResourceHeader("resources")
 
         return task_res_header
 
+    def get_resource_header_async(self, task_id):
+        """ Build the header (see get_resource_header) in a thread
+        :return Deferred: fired with the header
+        """
+        dir_name = self.get_resource_dir(task_id)
+
+        if os.path.exists(dir_name):
+            return TaskResourceHeader.build_async("resources", dir_name, signatures=True)
+        return succeed(TaskResourceHeader("resources"))
+
     def get_resource_delta(self, task_id, resource_header):
 
         dir_name = self.get_resource_dir(task_id)
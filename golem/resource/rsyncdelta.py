@@ -0,0 +1,283 @@
+import hashlib
+import logging
+import math
+import os
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+# bytes of SHA-1 kept as the strong checksum of a block
+STRONG_SIZE = 8
+# size of file parts scanned for matching blocks at once
+SEGMENT_SIZE = 2 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+# bits of weak checksums in the table filtering candidate blocks
+FILTER_BITS = 20
+
+# files smaller than this are always sent whole
+MIN_FILE_SIZE = 256 * 1024
+# deltas with more literal data than this are not worth sending
+MAX_LITERAL_RATIO = 0.5
+MAX_LITERAL_SIZE = 16 * 1024 * 1024
+
+
+def block_size_for(file_size):
+    """ Block size of a signature: about the square root of the file size,
+    like in rsync, rounded down to whole KiB """
+    size = int(math.sqrt(file_size)) & ~1023
+    return min(max(size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def strong_checksum(data):
+    return hashlib.sha1(data).digest()[:STRONG_SIZE]
+
+
+def rolling_checksums(data, block_size):
+    """ Compute the rsync weak checksum of every window of block_size bytes
+    in data: the sum of the bytes and the sum of the bytes weighted by their
+    distance from the end of the window, both modulo 2 ** 16.
+    :return numpy.ndarray: checksum of the window starting at every offset
+    """
+    # only the low 16 bits are needed: sums may wrap around in uint32
+    x = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.uint32)
+    count = len(x) - block_size + 1
+    if count <= 0:
+        return numpy.empty(0, dtype=numpy.uint32)
+
+    sums = numpy.zeros(len(x) + 1, dtype=numpy.uint32)
+    numpy.cumsum(x, out=sums[1:])
+    x *= numpy.arange(len(x), dtype=numpy.uint32)
+    weighted = numpy.zeros(len(x) + 1, dtype=numpy.uint32)
+    numpy.cumsum(x, out=weighted[1:])
+
+    a = sums[block_size:] - sums[:count]
+    b = a * numpy.arange(block_size, len(x) + 1, dtype=numpy.uint32)
+    b -= weighted[block_size:] - weighted[:count]
+    return (a & 0xffff) | (b << 16)
+
+
+def _block_checksums(data, block_size):
+    """ Weak checksums of consecutive whole blocks of data """
+    count = len(data) // block_size
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=count *
+                              block_size).reshape(count, block_size)
+    weights = numpy.arange(block_size, 0, -1, dtype=numpy.int64)
+    a = blocks.sum(axis=1, dtype=numpy.int64)
+    b = blocks.dot(weights)
+    return ((a & 0xffff) | ((b & 0xffff) << 16)).astype(numpy.uint32)
+
+
+class FileSignature(object):
+    """ Checksums of consecutive blocks of a file, sent by a node that has
+    an old version of the file to the owner of the new one """
+
+    def __init__(self, block_size, size, weak, strong):
+        """
+        :param int block_size: size of blocks
+        :param int size: file size
+        :param list weak: rolling checksums of whole blocks
+        :param str strong: STRONG_SIZE bytes of SHA-1 of every whole block
+        """
+        self.block_size = block_size
+        self.size = size
+        self.weak = weak
+        self.strong = strong
+
+    @classmethod
+    def build(cls, path, block_size=None):
+        size = os.path.getsize(path)
+        block_size = block_size or block_size_for(size)
+        # segments of whole blocks
+        segment_size = max(SEGMENT_SIZE // block_size, 1) * block_size
+
+        weak, strong = [], []
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(segment_size), ''):
+                weak.extend(_block_checksums(data, block_size).tolist())
+                for offset in xrange(0, len(data) - block_size + 1,
+                                     block_size):
+                    strong.append(strong_checksum(
+                        data[offset:offset + block_size]))
+
+        return cls(block_size, size, weak, ''.join(strong))
+
+    def get_strong(self, index):
+        return self.strong[index * STRONG_SIZE:(index + 1) * STRONG_SIZE]
+
+    def to_dict(self):
+        return dict(block_size=self.block_size, size=self.size,
+                    weak=list(self.weak), strong=self.strong)
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        signature = cls(dictionary['block_size'], dictionary['size'],
+                        list(dictionary['weak']), dictionary['strong'])
+        if len(signature.strong) != len(signature.weak) * STRONG_SIZE:
+            raise ValueError("Invalid file signature")
+        return signature
+
+
+class FileDelta(object):
+    """ Instructions building a new version of a file from blocks of the old
+    one: ranges of old blocks to copy and literal data """
+
+    COPY = 0
+    DATA = 1
+
+    def __init__(self, block_size, size, ops):
+        """
+        :param int block_size: block size of the signature of the old file
+        :param int size: size of the new file
+        :param list ops: [COPY, first block, number of blocks] and
+                         [DATA, literal data] lists
+        """
+        self.block_size = block_size
+        self.size = size
+        self.ops = ops
+
+    @property
+    def literal_size(self):
+        return sum(len(op[1]) for op in self.ops if op[0] == self.DATA)
+
+    @classmethod
+    def build(cls, signature, path):
+        """ Compute the delta of the file at path against the old version
+        described by the signature """
+        block_size = signature.block_size
+        blocks = {}
+        for index, weak in enumerate(signature.weak):
+            blocks.setdefault(weak, []).append(index)
+        # windows whose checksums are not in the filter match no block
+        mask = (1 << FILTER_BITS) - 1
+        table = numpy.zeros(mask + 1, dtype=numpy.bool_)
+        table[numpy.array(signature.weak, dtype=numpy.uint32) & mask] = True
+
+        size = os.path.getsize(path)
+        # (offset in the new file, block of the old file) pairs
+        matches = []
+        pos = 0
+
+        with open(path, 'rb') as f:
+            for start in xrange(0, size, SEGMENT_SIZE):
+                if not blocks or start + block_size > size:
+                    break
+                f.seek(start)
+                data = f.read(SEGMENT_SIZE + block_size - 1)
+                checksums = rolling_checksums(data, block_size)[:SEGMENT_SIZE]
+                candidates = numpy.nonzero(table[checksums & mask])[0]
+
+                for offset in candidates.tolist():
+                    if start + offset < pos or \
+                            int(checksums[offset]) not in blocks:
+                        continue
+                    window = data[offset:offset + block_size]
+                    index = cls._find_block(signature, blocks,
+                                            checksums[offset], window,
+                                            matches)
+                    if index is not None:
+                        matches.append((start + offset, index))
+                        pos = start + offset + block_size
+
+            ops = cls._build_ops(f, matches, block_size, size)
+        return cls(block_size, size, ops)
+
+    @staticmethod
+    def _find_block(signature, blocks, weak, window, matches):
+        indices = blocks[int(weak)]
+        strong = strong_checksum(window)
+        # the block following the last copied one makes a longer copy
+        if matches:
+            following = matches[-1][1] + 1
+            if following in indices and \
+                    signature.get_strong(following) == strong:
+                return following
+        for index in indices:
+            if signature.get_strong(index) == strong:
+                return index
+        return None
+
+    @classmethod
+    def _build_ops(cls, f, matches, block_size, size):
+        ops = []
+        pos = 0
+
+        def add_data(end):
+            if end > pos:
+                f.seek(pos)
+                ops.append([cls.DATA, f.read(end - pos)])
+
+        for offset, index in matches:
+            add_data(offset)
+            last = ops[-1] if ops else None
+            if offset == pos and last and last[0] == cls.COPY \
+                    and last[1] + last[2] == index:
+                last[2] += 1
+            else:
+                ops.append([cls.COPY, index, 1])
+            pos = offset + block_size
+
+        add_data(size)
+        return ops
+
+    def apply(self, basis_path, dst_path):
+        """ Write the new version of a file to dst_path, reading blocks of
+        the old version from basis_path """
+        with open(basis_path, 'rb') as basis, open(dst_path, 'wb') as out:
+            for op in self.ops:
+                if op[0] == self.DATA:
+                    out.write(op[1])
+                    continue
+
+                basis.seek(op[1] * self.block_size)
+                left = op[2] * self.block_size
+                while left > 0:
+                    data = basis.read(min(left, COPY_BUFFER_SIZE))
+                    if not data:
+                        raise ValueError("Blocks missing in {}"
+                                         .format(basis_path))
+                    out.write(data)
+                    left -= len(data)
+
+        if os.path.getsize(dst_path) != self.size:
+            raise ValueError("Invalid size of {} built from delta"
+                             .format(dst_path))
+
+    def to_dict(self):
+        return dict(block_size=self.block_size, size=self.size,
+                    ops=[list(op) for op in self.ops])
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        return cls(dictionary['block_size'], dictionary['size'],
+                   [list(op) for op in dictionary['ops']])
+
+
+def build_signature(path):
+    """ Return a signature of a file large enough to be sent as a delta
+    :return dict|None: FileSignature as a dict
+    """
+    if os.path.getsize(path) < MIN_FILE_SIZE:
+        return None
+    return FileSignature.build(path).to_dict()
+
+
+def build_delta(signature, path):
+    """ Return a delta of the file against the old version, if it is
+    considerably smaller than the file
+    :param dict signature: FileSignature of the old version as a dict
+    :return FileDelta|None: the delta
+    """
+    try:
+        delta = FileDelta.build(FileSignature.from_dict(signature), path)
+    except (KeyError, TypeError, ValueError) as exc:
+        logger.warning("Cannot build delta of %r: %r", path, exc)
+        return None
+
+    literal_size = delta.literal_size
+    if literal_size > min(delta.size * MAX_LITERAL_RATIO, MAX_LITERAL_SIZE):
+        return None
+    logger.debug("Delta of %r: %r B of %r B", path, literal_size, delta.size)
+    return delta
@@ -4,6 +4,7 @@ import shutil
 from threading import Lock
 import time
 
+from golem.core.filecopy import materialize
 from golem.docker.task_thread import DockerTaskThread
 from golem.resource.dirmanager import get_test_task_path, get_test_task_tmp_path
 from golem.resource.resource import TaskResourceHeader, decompress_dir
@@ -116,7 +117,8 @@ class LocalComputer(object):
             if res_file:
                 decompress_dir(self.test_task_res_path, res_file)
         for res in self.additional_resources:
-            shutil.copy(res, self.test_task_res_path)
+            dst = os.path.join(self.test_task_res_path, os.path.basename(res))
+            materialize(res, dst)
 
         return True
 
@@ -0,0 +1,67 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PartialResultsWatcher(object):
+    """ Watches a directory where a task script puts partial results of
+    a subtask (finished tiles or frames, periodic snapshots) and reports
+    new and updated files. Scripts should write a file under a name starting
+    with a dot and rename it when it is complete; such files are skipped.
+    """
+
+    def __init__(self, directory, callback, interval=10.0):
+        """
+        :param str directory: watched directory
+        :param callback: called with a list of paths of new or updated files
+        :param float interval: time between checks [in seconds]
+        """
+        self.directory = directory
+        self.callback = callback
+        self.interval = interval
+        self._known = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name="PartialResultsWatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def check(self):
+        """ Return paths of files that are new or changed since the last
+        check
+        """
+        changed = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                version = (st.st_mtime, st.st_size)
+                if self._known.get(path) != version:
+                    self._known[path] = version
+                    changed.append(path)
+        return sorted(changed)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                changed = self.check()
+                if changed:
+                    self.callback(changed)
+            except Exception:
+                logger.exception("Error checking partial results in %r",
+                                 self.directory)
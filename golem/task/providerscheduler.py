@@ -0,0 +1,127 @@
+import logging
+import time
+
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulingVerdict(Enum):
+    ASSIGN = 0
+    DEFER = 1
+    DECLINE = 2
+
+
+class ProviderStats(object):
+    """ Results of the subtasks computed by a single provider """
+
+    def __init__(self):
+        self.computed = 0
+        self.failed = 0
+        # task id -> smoothed time of computing a single subtask [in seconds]
+        self.durations = {}
+        # task id -> time of the last request for a subtask
+        self.last_seen = {}
+
+    def failure_ratio(self):
+        total = self.computed + self.failed
+        if total == 0:
+            return 0.0
+        return float(self.failed) / total
+
+
+class ProviderScheduler(object):
+    """ Decides on the requestor side whether a provider asking for a subtask
+    should get it now. Providers that often fail are declined and providers
+    that are slower than the others are deferred when the faster ones are
+    able to finish the remaining subtasks earlier, so the last subtasks of
+    a task go to the best performers.
+    """
+
+    # weight of the newest measurement in the moving average
+    SMOOTHING = 0.5
+    # number of results needed before the failure ratio is taken into account
+    MIN_RESULTS = 3
+    MAX_FAILURE_RATIO = 0.5
+    # provider that asked for a subtask within this time [in seconds]
+    # is treated as available for the task
+    ACTIVE_TIMEOUT = 120.0
+
+    def __init__(self):
+        self.providers = {}
+
+    def verdict(self, task_id, node_id, subtasks_left=None):
+        """ Decide what to do with a node's request for a subtask
+        :param str task_id: task the node wants to compute
+        :param str node_id: id of the node asking for a subtask
+        :param int|None subtasks_left: number of subtasks that were not
+                                       assigned yet, None if unknown
+        :return SchedulingVerdict:
+        """
+        now = time.time()
+        stats = self._get_stats(node_id)
+        stats.last_seen[task_id] = now
+
+        others = [s for n, s in self.providers.items()
+                  if n != node_id and not self._is_failing(s) and
+                  now - s.last_seen.get(task_id, 0) <= self.ACTIVE_TIMEOUT]
+
+        if self._is_failing(stats):
+            if others:
+                logger.info("Declining failing provider %r", node_id)
+                return SchedulingVerdict.DECLINE
+            return SchedulingVerdict.ASSIGN
+
+        if subtasks_left is None or subtasks_left <= 0:
+            # nothing left to reserve: only speculative copies of parts
+            # that are still computed are given away
+            return SchedulingVerdict.ASSIGN
+
+        known = [s.durations[task_id] for s in others
+                 if task_id in s.durations]
+        duration = stats.durations.get(task_id)
+        if duration is None:
+            # keep the last subtasks for providers with known performance
+            if subtasks_left <= len(known):
+                return SchedulingVerdict.DEFER
+            return SchedulingVerdict.ASSIGN
+
+        # number of subtasks that faster providers compute in the time
+        # this one needs for a single subtask
+        capacity = sum(duration / d for d in known if 0 < d < duration)
+        if subtasks_left <= capacity:
+            logger.debug("Deferring provider %r, %r subtasks left",
+                         node_id, subtasks_left)
+            return SchedulingVerdict.DEFER
+        return SchedulingVerdict.ASSIGN
+
+    def subtask_finished(self, task_id, node_id, duration):
+        """ Record a subtask successfully computed by the node
+        :param float duration: time from assigning the subtask to receiving
+                               its result [in seconds]
+        """
+        stats = self._get_stats(node_id)
+        stats.computed += 1
+        old = stats.durations.get(task_id)
+        if old is None:
+            stats.durations[task_id] = duration
+        else:
+            stats.durations[task_id] = self.SMOOTHING * duration + \
+                (1 - self.SMOOTHING) * old
+
+    def subtask_failed(self, node_id):
+        self._get_stats(node_id).failed += 1
+
+    def task_removed(self, task_id):
+        for stats in self.providers.values():
+            stats.durations.pop(task_id, None)
+            stats.last_seen.pop(task_id, None)
+
+    def _get_stats(self, node_id):
+        if node_id not in self.providers:
+            self.providers[node_id] = ProviderStats()
+        return self.providers[node_id]
+
+    def _is_failing(self, stats):
+        return stats.computed + stats.failed >= self.MIN_RESULTS and \
+            stats.failure_ratio() > self.MAX_FAILURE_RATIO
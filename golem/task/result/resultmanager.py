@@ -3,6 +3,7 @@ import logging
 import os
 
 from golem.core.fileencrypt import FileEncryptor
+from golem.resource.base.downloadqueue import DownloadKind
 from golem.resource.client import async_run
 from golem.resource.client import AsyncRequest
 from .resultpackage import EncryptingTaskResultPackager
@@ -40,9 +41,10 @@ class EncryptedResultPackageManager(TaskResultPackageManager):
 
     # Using a temp path
     def pull_package(self, multihash, task_id, subtask_id, key_or_secret,
-                     success, error, async=True, client_options=None, output_dir=None):
+                     success, error, async=True, client_options=None, output_dir=None,
+                     package_name=None, deadline=None):
 
-        file_name = task_id + "." + subtask_id
+        file_name = package_name or task_id + "." + subtask_id
         file_path = self.resource_manager.storage.get_path(file_name, task_id)
         output_dir = os.path.join(output_dir or os.path.dirname(file_path), subtask_id)
 
@@ -65,14 +67,17 @@ class EncryptedResultPackageManager(TaskResultPackageManager):
                                             success=package_downloaded,
                                             error=error,
                                             async=async,
-                                            pin=False)
+                                            pin=False,
+                                            kind=DownloadKind.RESULT,
+                                            deadline=deadline)
 
-    def create(self, node, task_result, client_options=None, key_or_secret=None):
+    def create(self, node, task_result, client_options=None, key_or_secret=None,
+               package_name=None):
         if not key_or_secret:
             raise ValueError("Empty key / secret")
 
         task_id = task_result.task_id
-        file_name = task_id + "." + task_result.subtask_id
+        file_name = package_name or task_id + "." + task_result.subtask_id
         file_path = self.resource_manager.storage.get_path(file_name, task_id)
 
         if os.path.exists(file_path):
@@ -1,10 +1,11 @@
 import abc
 import os
-import uuid
 import zipfile
+from contextlib import contextmanager
 
-from golem.core.fileencrypt import AESFileEncryptor
+from golem.core.fileencrypt import AESGCMFileEncryptor
 from golem.core.simpleserializer import CBORSerializer
+from golem.resource.archive import StreamZipFile
 from golem.task.taskbase import result_types
 
 
@@ -48,22 +49,34 @@ class Packager(object):
 
 class ZipPackager(Packager):
 
+    zip_class = StreamZipFile
+
     def extract(self, input_path, output_dir=None, **kwargs):
 
         if not output_dir:
             output_dir = os.path.dirname(input_path)
 
+        with open(input_path, 'rb') as src:
+            return self.extract_stream(src, output_dir)
+
+    def extract_stream(self, src, output_dir):
+        """ Extract an archive from a seekable file-like object """
+
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        with zipfile.ZipFile(input_path, 'r') as zf:
+        with zipfile.ZipFile(src, 'r') as zf:
             zf.extractall(output_dir)
             extracted = zf.namelist()
 
         return extracted, output_dir
 
     def generator(self, output_path):
-        return zipfile.ZipFile(output_path, mode='w')
+        return self.zip_class(output_path, mode='w')
+
+    def stream_generator(self, dst):
+        """ Return an archive writing to a write-only file-like object """
+        return self.zip_class(dst, mode='w')
 
     def write_disk_file(self, obj, file_path, file_name):
         obj.write(file_path, file_name)
@@ -73,44 +86,40 @@ class ZipPackager(Packager):
 
 
 class EncryptingPackager(Packager):
+    """ Zips files straight into an encrypting writer and extracts packages
+    through a decrypting reader, so no intermediate files are created.
+    Packages are encrypted in authenticated chunks, chunk_size is
+    the number of cipher blocks in a chunk. Packages encrypted in the older
+    formats can still be extracted.
+    """
 
     creator_class = ZipPackager
-    encryptor_class = AESFileEncryptor
+    encryptor_class = AESGCMFileEncryptor
 
-    def __init__(self, key_or_secret):
+    def __init__(self, key_or_secret, chunk_size=None):
 
         self._creator = self.creator_class()
         self.key_or_secret = key_or_secret
-
-    def create(self, output_path, disk_files=None, cbor_files=None, **kwargs):
-
-        output_dir = os.path.dirname(output_path)
-        pkg_file_path = os.path.join(output_dir, str(uuid.uuid4()) + ".pkg")
-        out_file_path = super(EncryptingPackager, self).create(pkg_file_path,
-                                                               disk_files=disk_files,
-                                                               cbor_files=cbor_files)
-
-        self.encryptor_class.encrypt(out_file_path,
-                                     output_path,
-                                     self.key_or_secret)
-        return output_path
+        self.chunk_size = chunk_size
 
     def extract(self, input_path, output_dir=None, **kwargs):
 
-        input_dir = os.path.dirname(input_path)
-        tmp_file_path = os.path.join(input_dir, str(uuid.uuid4()) + ".dec")
-
-        self.encryptor_class.decrypt(input_path,
-                                     tmp_file_path,
-                                     self.key_or_secret)
-
-        os.remove(input_path)
-        os.rename(tmp_file_path, input_path)
+        if not output_dir:
+            output_dir = os.path.dirname(input_path)
 
-        return self._creator.extract(input_path, output_dir=output_dir)
+        with open(input_path, 'rb') as src:
+            reader = self.encryptor_class.reader(src, self.key_or_secret,
+                                                 chunk_size=self.chunk_size)
+            return self._creator.extract_stream(reader, output_dir)
 
+    @contextmanager
     def generator(self, output_path):
-        return self._creator.generator(output_path)
+        with open(output_path, 'wb') as dst:
+            writer = self.encryptor_class.writer(dst, self.key_or_secret,
+                                                 chunk_size=self.chunk_size)
+            with self._creator.stream_generator(writer) as zf:
+                yield zf
+            writer.close()
 
     def write_disk_file(self, obj, file_path, file_name):
         self._creator.write_disk_file(obj, file_path, file_name)
@@ -137,9 +146,9 @@ class EncryptingTaskResultPackager(EncryptingPackager):
     descriptor_file_name = '.package_desc'
     result_file_name = '.result_cbor'
 
-    def __init__(self, key_or_secret):
+    def __init__(self, key_or_secret, chunk_size=None):
         self.parent = super(EncryptingTaskResultPackager, self)
-        self.parent.__init__(key_or_secret)
+        self.parent.__init__(key_or_secret, chunk_size=chunk_size)
 
     def create(self, output_path,
                disk_files=None, cbor_files=None,
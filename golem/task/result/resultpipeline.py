@@ -0,0 +1,132 @@
+import logging
+import time
+
+from twisted.internet import threads
+from twisted.internet.defer import DeferredLock, DeferredSemaphore
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats(object):
+    """ Latency statistics of a single stage of the result pipeline """
+
+    def __init__(self):
+        self.pending = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def started(self):
+        self.pending += 1
+
+    def finished(self, elapsed, success=True):
+        self.pending -= 1
+        if success:
+            self.processed += 1
+        else:
+            self.failed += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def average_time(self):
+        done = self.processed + self.failed
+        if done == 0:
+            return 0.0
+        return self.total_time / done
+
+    def to_dict(self):
+        return dict(pending=self.pending, processed=self.processed,
+                    failed=self.failed, average_time=self.average_time(),
+                    max_time=self.max_time)
+
+
+class ResultPipeline(object):
+    """ Processes results received by the requestor without blocking the
+    reactor thread. Every result goes through the stages:
+    - download: fetching and extracting the result package (done in
+      the resource manager threads),
+    - verify: interpreting and verifying the result in a worker thread.
+    At most max_workers results are verified at the same time and results
+    of a single task are verified one after another. At most max_pending
+    results are in the pipeline; when verification falls behind, new
+    downloads wait until there is room for them.
+    """
+
+    DOWNLOAD = 'download'
+    VERIFY = 'verify'
+    STAGES = (DOWNLOAD, VERIFY)
+
+    def __init__(self, max_workers=2, max_pending=16):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.stats = {stage: StageStats() for stage in self.STAGES}
+        self._pending = DeferredSemaphore(max_pending)
+        self._workers = DeferredSemaphore(max_workers)
+        self._task_locks = {}
+
+    def submit(self, job, *args, **kwargs):
+        """ Run a job processing a single result once there is room for it
+        in the pipeline
+        :param job: function returning a Deferred that fires when
+                    the result leaves the pipeline
+        :return Deferred: fires with the result of the job
+        """
+        if self.is_congested():
+            logger.debug("Result pipeline full, %r results waiting",
+                         len(self._pending.waiting) + 1)
+        return self._pending.run(job, *args, **kwargs)
+
+    def is_congested(self):
+        return self._pending.tokens == 0
+
+    def stage_started(self, stage):
+        """ Record that a result entered stage
+        :return float: start time to pass to stage_finished
+        """
+        self.stats[stage].started()
+        return time.time()
+
+    def stage_finished(self, stage, start, success=True):
+        self.stats[stage].finished(time.time() - start, success)
+
+    def measure(self, stage, deferred):
+        """ Measure time until the deferred fires as a latency of stage """
+        start = self.stage_started(stage)
+
+        def finished(result, success):
+            self.stage_finished(stage, start, success)
+            return result
+
+        deferred.addCallbacks(finished, finished,
+                              callbackArgs=(True,), errbackArgs=(False,))
+        return deferred
+
+    def verify(self, task_id, method, *args, **kwargs):
+        """ Call method in a worker thread, after the previous results of
+        the same task were verified
+        :return Deferred: fires with the value returned by method
+        """
+        deferred = self.run(task_id, method, *args, **kwargs)
+        return self.measure(self.VERIFY, deferred)
+
+    def run(self, task_id, method, *args, **kwargs):
+        """ Call method in a worker thread, after the previous jobs of
+        the same task are done, without measuring it as a stage
+        :return Deferred: fires with the value returned by method
+        """
+        lock = self._task_locks.get(task_id)
+        if lock is None:
+            lock = self._task_locks[task_id] = DeferredLock()
+        return lock.run(self._workers.run, threads.deferToThread,
+                        method, *args, **kwargs)
+
+    def task_removed(self, task_id):
+        self._task_locks.pop(task_id, None)
+
+    def get_stats(self):
+        """ Return latency statistics of every stage
+        :return dict: stage name -> dict of stats
+        """
+        return {stage: stats.to_dict()
+                for stage, stats in self.stats.items()}
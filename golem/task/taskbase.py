@@ -106,6 +106,9 @@ class ComputeTaskDef(object):
         self.performance = 0.0
         self.environment = ""
         self.docker_images = None
+        # the task script may put partial results into a watched directory
+        # while the subtask is computed
+        self.stream_partial_results = False
 
 
 class TaskEventListener(object):
@@ -180,6 +183,14 @@ class Task(object):
         """
         return  # Implement in derived class
 
+    def query_extra_data_batch(self, perf_index, num_cores=1, node_id=None, node_name=None, max_subtasks=1):
+        """ Called when a node asks for up to max_subtasks subtasks to compute at once. Parameters are the same
+        as in query_extra_data.
+        :param int max_subtasks: maximum number of subtasks that should be assigned to the node
+        :return list: list of ExtraData, the first one may ask the node to wait
+        """
+        return [self.query_extra_data(perf_index, num_cores, node_id, node_name)]
+
     @abc.abstractmethod
     def short_extra_data_repr(self, perf_index=None):
         """ Should return a short string with general task description that may be used for logging or stats gathering.
@@ -211,6 +222,24 @@ class Task(object):
         """
         return  # Implement in derived class
 
+    def verify_results(self, subtask_id, task_result, result_type=0):
+        """ Verify results of a finished subtask. Called in a worker thread, so it must not change
+        the state of the task, that is done by results_verified on the reactor thread
+        :param subtask_id: finished subtask id
+        :param task_result: task result, can be binary data or list of files
+        :param result_type: result_types representation
+        :return: outcome of the verification passed to results_verified
+        """
+        return task_result, result_type
+
+    def results_verified(self, subtask_id, verification):
+        """ Update the task with the outcome of verify_results
+        :param subtask_id: finished subtask id
+        :param verification: value returned by verify_results
+        """
+        task_result, result_type = verification
+        self.computation_finished(subtask_id, task_result, result_type)
+
     @abc.abstractmethod
     def computation_failed(self, subtask_id):
         """ Inform that computation of a task with given id has failed
@@ -340,12 +369,30 @@ class Task(object):
         """
         pass
 
+    def partial_results_received(self, subtask_id, files):
+        """ Informs about partial results of a subtask that is still being
+        computed. They are neither verified nor paid for, the subtask
+        still has to send its final result.
+        :param subtask_id:
+        :param list files: paths of the received files
+        :return bool: whether the partial results were used
+        """
+        return False
+
     def get_output_names(self):
         """ Return list of files containing final import task results
         :return list:
         """
         return []
 
+    def get_duplicated_subtasks(self, subtask_id):
+        """ Return ids of other subtasks that were given the same part of the task as subtask_id
+        and are still being computed or were cancelled because subtask_id was computed first
+        :param subtask_id:
+        :return list:
+        """
+        return []
+
 
 result_types = {'data': 0, 'files': 1}
 resource_types = {'zip': 0, 'parts': 1, 'hashes': 2}
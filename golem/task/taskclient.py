@@ -46,6 +46,15 @@ class TaskClient(object):
         with self._lock:
             self._finishing += 1
 
+    def cancel(self, finishing=False):
+        """ Forget a started computation without accepting or rejecting it
+        :param bool finishing: whether the results were already incoming
+        """
+        with self._lock:
+            self._started -= 1
+            if finishing:
+                self._finishing -= 1
+
     def accepted(self):
         with self._lock:
             return self._accepted
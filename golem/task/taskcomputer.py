@@ -12,11 +12,14 @@ from apps.core.benchmark.benchmarkrunner import BenchmarkRunner
 from apps.core.task.coretaskstate import TaskDesc
 from apps.lux.benchmark.benchmark import LuxBenchmark
 from apps.lux.task.luxrendertask import LuxRenderTaskBuilder
+from golem.appconfig import MIN_DISK_SPACE
 from golem.core.common import deadline_to_timeout
 from golem.core.statskeeper import IntStatsKeeper
 from golem.docker.manager import DockerManager
 from golem.docker.task_thread import DockerTaskThread
 from golem.manager.nodestatesnapshot import TaskChunkStateSnapshot
+from golem.resource.client import AsyncRequest, async_run
+from golem.resource.dircache import TaskDirCache
 from golem.resource.dirmanager import DirManager
 from golem.resource.resourcesmanager import ResourcesManager
 from golem.task.taskbase import Task
@@ -35,6 +38,33 @@ class CompStats(object):
         self.tasks_requested = 0
 
 
+class ComputationSlot(object):
+    """ A place for a single subtask computation. TaskComputer runs as many
+    subtasks concurrently as it has slots; each slot gets its own share of
+    the cpu cores and memory assigned to docker containers. Python (non-docker)
+    computations change the working directory and run one at a time.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.task_id = None
+        self.subtask_id = None
+        self.task_thread = None
+        self.stats = CompStats()
+
+    def is_free(self):
+        return self.subtask_id is None
+
+    def reserve(self, task_id, subtask_id):
+        self.task_id = task_id
+        self.subtask_id = subtask_id
+
+    def release(self):
+        self.task_id = None
+        self.subtask_id = None
+        self.task_thread = None
+
+
 class TaskComputer(object):
     """ TaskComputer is responsible for task computations that take place in Golem application. Tasks are started
     in separate threads.
@@ -42,6 +72,8 @@ class TaskComputer(object):
 
     lock = Lock()
     dir_lock = Lock()
+    # how often the size of task directories is checked [s]
+    dir_cache_check_interval = 60.0
 
     def __init__(self, node_name, task_server, use_docker_machine_manager=True):
         """ Create new task computer instance
@@ -57,6 +89,8 @@ class TaskComputer(object):
         self.runnable = True
         self.listeners = []
         self.current_computations = []
+        self.slots = []
+        self.max_concurrent_subtasks = 1
         self.last_task_request = time.time()
 
         self.waiting_ttl = 0
@@ -64,6 +98,8 @@ class TaskComputer(object):
 
         self.dir_manager = None
         self.resource_manager = None
+        self.dir_cache = None
+        self.last_dir_cache_check = time.time()
         self.task_request_frequency = None
         self.use_waiting_ttl = None
         self.waiting_for_task_timeout = None
@@ -94,7 +130,8 @@ class TaskComputer(object):
 
         self.assigned_subtasks = {}
         self.task_to_subtask_mapping = {}
-        self.max_assigned_tasks = 1
+        # task id -> ids of the subtasks waiting for task resources
+        self.subtasks_waiting_for_resources = {}
 
         self.delta = None
         self.last_task_timeout_checking = None
@@ -106,21 +143,26 @@ class TaskComputer(object):
             self.wait(ttl=self.waiting_for_task_timeout)
             self.assigned_subtasks[ctd.subtask_id] = ctd
             self.task_to_subtask_mapping[ctd.task_id] = ctd.subtask_id
-            self.__request_resource(ctd.task_id, self.resource_manager.get_resource_header(ctd.task_id),
-                                    ctd.return_address, ctd.return_port, ctd.key_id, ctd.task_owner)
+            self.dir_cache.pin(ctd.task_id)
+            waiting = self.subtasks_waiting_for_resources.setdefault(ctd.task_id, [])
+            waiting.append(ctd.subtask_id)
+            # subtasks assigned in a single batch share the resources
+            if len(waiting) == 1:
+                self.__request_resource_for(ctd)
             return True
         else:
             return False
 
     def resource_given(self, task_id):
         if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping[task_id]
-            if subtask_id in self.assigned_subtasks:
-                subtask = self.assigned_subtasks[subtask_id]
-                timeout = deadline_to_timeout(subtask.deadline)
-                self.__compute_task(subtask_id, subtask.docker_images,
-                                    subtask.src_code, subtask.extra_data,
-                                    subtask.short_description, timeout)
+            subtask_ids = self.__pop_waiting_subtasks(task_id)
+            if subtask_ids:
+                for subtask_id in subtask_ids:
+                    subtask = self.assigned_subtasks[subtask_id]
+                    timeout = deadline_to_timeout(subtask.deadline)
+                    self.__compute_task(subtask_id, subtask.docker_images,
+                                        subtask.src_code, subtask.extra_data,
+                                        subtask.short_description, timeout)
                 self.waiting_for_task = None
                 return True
             else:
@@ -128,23 +170,29 @@ class TaskComputer(object):
 
     def task_resource_collected(self, task_id, unpack_delta=True):
         if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping[task_id]
-            if subtask_id in self.assigned_subtasks:
-                subtask = self.assigned_subtasks[subtask_id]
-                if unpack_delta:
-                    self.task_server.unpack_delta(self.dir_manager.get_task_resource_dir(task_id), self.delta, task_id)
-                self.delta = None
+            subtask_ids = self.__pop_waiting_subtasks(task_id)
+            if subtask_ids:
+                delta, self.delta = self.delta, None
+                if unpack_delta and not self.task_server.unpack_delta(self.dir_manager.get_task_resource_dir(task_id),
+                                                                      delta, task_id):
+                    # do not compute with stale resources
+                    self.subtasks_waiting_for_resources[task_id] = subtask_ids
+                    self.task_resource_failure(task_id, "Cannot apply resource deltas")
+                    return False
                 self.last_task_timeout_checking = time.time()
-                self.__compute_task(subtask_id, subtask.docker_images, subtask.src_code, subtask.extra_data,
-                                    subtask.short_description, deadline_to_timeout(subtask.deadline))
+                for subtask_id in subtask_ids:
+                    subtask = self.assigned_subtasks[subtask_id]
+                    self.__compute_task(subtask_id, subtask.docker_images, subtask.src_code, subtask.extra_data,
+                                        subtask.short_description, deadline_to_timeout(subtask.deadline))
                 return True
             return False
 
     def task_resource_failure(self, task_id, reason):
         if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping.pop(task_id)
-            if subtask_id in self.assigned_subtasks:
-                subtask = self.assigned_subtasks.pop(subtask_id)
+            subtask_ids = self.__pop_waiting_subtasks(task_id)
+            self.task_to_subtask_mapping.pop(task_id)
+            for subtask_id in subtask_ids:
+                subtask = self.__pop_subtask(subtask_id)
                 self.task_server.send_task_failed(subtask_id, subtask.task_id,
                                                   'Error downloading resources: {}'.format(reason),
                                                   subtask.return_address, subtask.return_port, subtask.key_id,
@@ -157,71 +205,102 @@ class TaskComputer(object):
             if subtask_id in self.assigned_subtasks:
                 self.delta = delta
 
+    def get_task_deadline(self, task_id):
+        """ Return the earliest deadline of subtasks of a task assigned to this node, or None """
+        deadlines = [s.deadline for s in self.assigned_subtasks.values() if s.task_id == task_id]
+        return min(deadlines) if deadlines else None
+
     def task_request_rejected(self, task_id, reason):
         logger.warning("Task {} request rejected: {}".format(task_id, reason))
 
     def resource_request_rejected(self, subtask_id, reason):
         logger.warning("Task {} resource request rejected: {}".format(subtask_id, reason))
-        self.assigned_subtasks.pop(subtask_id, None)
+        self.__pop_subtask(subtask_id)
         self.reset()
 
     def task_computed(self, task_thread):
         if task_thread.end_time is None:
             task_thread.end_time = time.time()
 
+        time_ = task_thread.end_time - task_thread.start_time
+        subtask_id = task_thread.subtask_id
+
         with self.lock:
             try:
                 self.current_computations.remove(task_thread)
             except ValueError: # not in list
                 pass
+            slot = self.__release_slot(subtask_id)
+            # directories of the task are kept until the results are sent
+            subtask = self.__pop_subtask(subtask_id, unpin=False)
 
-        time_ = task_thread.end_time - task_thread.start_time
-        subtask_id = task_thread.subtask_id
-        try:
-            subtask = self.assigned_subtasks.pop(subtask_id)
-        except KeyError:
+        if subtask is None:
             logger.error("No subtask with id %r", subtask_id)
             return
 
         if task_thread.error or task_thread.error_msg:
             if "Task timed out" in task_thread.error_msg:
-                self.stats.increase_stat('tasks_with_timeout')
+                self.__increase_stat(slot, 'tasks_with_timeout')
             else:
-                self.stats.increase_stat('tasks_with_errors')
+                self.__increase_stat(slot, 'tasks_with_errors')
+            self.dir_cache.unpin(subtask.task_id)
             self.task_server.send_task_failed(subtask_id, subtask.task_id, task_thread.error_msg,
                                               subtask.return_address, subtask.return_port, subtask.key_id,
                                               subtask.task_owner, self.node_name)
             dispatcher.send(signal='golem.monitor', event='computation_time_spent', success=False, value=time_)
         elif task_thread.result and 'data' in task_thread.result and 'result_type' in task_thread.result:
             logger.info("Task %r computed", subtask_id)
-            self.stats.increase_stat('computed_tasks')
+            self.__increase_stat(slot, 'computed_tasks')
             self.task_server.send_results(subtask_id, subtask.task_id, task_thread.result, time_,
                                           subtask.return_address, subtask.return_port, subtask.key_id,
                                           subtask.task_owner, self.node_name)
             dispatcher.send(signal='golem.monitor', event='computation_time_spent', success=True, value=time_)
         else:
-            self.stats.increase_stat('tasks_with_errors')
+            self.__increase_stat(slot, 'tasks_with_errors')
+            self.dir_cache.unpin(subtask.task_id)
             self.task_server.send_task_failed(subtask_id, subtask.task_id, "Wrong result format",
                                               subtask.return_address, subtask.return_port, subtask.key_id,
                                               subtask.task_owner, self.node_name)
             dispatcher.send(signal='golem.monitor', event='computation_time_spent', success=False, value=time_)
-        self.counting_task = None
+        self.counting_task = self.__computing_task_id() or None
+
+    def task_result_sent(self, task_id):
+        """ Results of a subtask of the task were sent to its owner, so the task directories may be removed """
+        self.dir_cache.unpin(task_id)
+
+    def partial_results_computed(self, task_thread, files):
+        """ Send partial results of a subtask that is still being computed. Called from the thread watching
+        partial results, the results are queued in the reactor thread. """
+        from twisted.internet import reactor
+        reactor.callFromThread(self.__send_partial_results, task_thread.subtask_id, files)
+
+    def __send_partial_results(self, subtask_id, files):
+        subtask = self.assigned_subtasks.get(subtask_id)
+        if subtask is None:
+            return
+        logger.debug("Partial results of subtask %r: %r", subtask_id, files)
+        self.task_server.send_partial_results(subtask_id, subtask.task_id, files,
+                                              subtask.return_address, subtask.return_port, subtask.key_id,
+                                              subtask.task_owner, self.node_name)
 
     def run(self):
         if self.counting_task:
-            for task_thread in self.current_computations:
+            for task_thread in list(self.current_computations):
                 task_thread.check_timeout()
-        elif self.compute_tasks and self.runnable:
+        if self.compute_tasks and self.runnable and self.has_free_slot():
             if not self.waiting_for_task:
                 if time.time() - self.last_task_request > self.task_request_frequency:
-                    if len(self.current_computations) == 0:
-                        self.__request_task()
+                    self.__request_task()
             elif self.use_waiting_ttl:
                 time_ = time.time()
                 self.waiting_ttl -= time_ - self.last_checking
                 self.last_checking = time_
                 if self.waiting_ttl < 0:
+                    self.__drop_waiting_subtasks()
                     self.reset()
+        if time.time() - self.last_dir_cache_check > self.dir_cache_check_interval:
+            self.last_dir_cache_check = time.time()
+            async_run(AsyncRequest(self.dir_cache.enforce))
 
     def get_progresses(self):
         ret = {}
@@ -232,15 +311,77 @@ class TaskComputer(object):
 
         return ret
 
+    def get_slot_stats(self):
+        """ Return the subtask computed in every slot, its progress and
+        computation statistics gathered in the slot during this session
+        :return list: dict for every slot, ordered by slot index
+        """
+        ret = []
+        for slot in list(self.slots):
+            tt = slot.task_thread
+            stats = dict(vars(slot.stats))
+            stats.update(index=slot.index, subtask_id=slot.subtask_id,
+                         progress=tt.get_progress() if tt else 0.0)
+            ret.append(stats)
+        return ret
+
+    def has_free_slot(self):
+        return len(self.current_computations) < self.max_concurrent_subtasks \
+            and self.__free_slot() is not None
+
+    def free_slots(self):
+        """ Return number of subtasks that may be assigned to this node
+        with the next task request
+        """
+        with self.lock:
+            waiting = sum(len(s) for s in self.subtasks_waiting_for_resources.values())
+            free = len([s for s in self.slots[:self.max_concurrent_subtasks] if s.is_free()])
+        return max(free - waiting, 1)
+
     def change_config(self, config_desc, in_background=True, run_benchmarks=False):
         self.dir_manager = DirManager(self.task_server.get_task_computer_root())
         self.resource_manager = ResourcesManager(self.dir_manager, self)
+        self.change_dir_cache_config(config_desc)
         self.task_request_frequency = config_desc.task_request_interval
         self.waiting_for_task_timeout = config_desc.waiting_for_task_timeout
         self.waiting_for_task_session_timeout = config_desc.waiting_for_task_session_timeout
         self.compute_tasks = config_desc.accept_tasks
+        self.change_slots_config(config_desc)
         self.change_docker_config(config_desc, run_benchmarks, in_background)
+
+    def change_slots_config(self, config_desc):
+        try:
+            num_slots = max(int(config_desc.max_concurrent_subtasks), 1)
+        except (AttributeError, TypeError, ValueError):
+            num_slots = 1
+        try:
+            num_cores = int(config_desc.num_cores)
+        except (AttributeError, TypeError, ValueError):
+            num_cores = 0
+        # each slot needs at least one cpu core
+        if num_cores > 0:
+            num_slots = min(num_slots, num_cores)
+
+        with self.lock:
+            self.max_concurrent_subtasks = num_slots
+            while len(self.slots) < num_slots:
+                self.slots.append(ComputationSlot(len(self.slots)))
+            # slots above the limit are removed as soon as they become free
+            self.slots = self.slots[:num_slots] + \
+                [s for s in self.slots[num_slots:] if not s.is_free()]
     
+    def change_dir_cache_config(self, config_desc):
+        try:
+            quota = int(config_desc.max_resource_size) * 1024
+        except (AttributeError, TypeError, ValueError):
+            quota = 0
+        if self.dir_cache is None:
+            # pins of tasks are kept when the config changes
+            self.dir_cache = TaskDirCache(self.dir_manager, quota, min_free=MIN_DISK_SPACE * 1024)
+        else:
+            self.dir_cache.dir_manager = self.dir_manager
+            self.dir_cache.quota = quota
+
     def _validate_task_state(self, task_state):
         td = task_state.definition
         if not os.path.exists(td.main_program_file):
@@ -349,7 +490,7 @@ class TaskComputer(object):
         self.session_closed()
 
     def session_closed(self):
-        if not self.counting_task:
+        if not self.counting_task or self.has_free_slot():
             self.reset()
 
     def wait(self, wait=True, ttl=None):
@@ -360,7 +501,7 @@ class TaskComputer(object):
             self.waiting_ttl = ttl
 
     def reset(self, computing_task=False):
-        self.counting_task = computing_task
+        self.counting_task = computing_task or self.__computing_task_id()
         self.use_waiting_ttl = False
         self.task_requested = False
         self.waiting_for_task = None
@@ -368,7 +509,7 @@ class TaskComputer(object):
 
     def __request_task(self):
         with self.lock:
-            perform_request = not self.waiting_for_task and not self.counting_task
+            perform_request = not self.waiting_for_task and self.has_free_slot()
 
         if not perform_request:
             return
@@ -381,6 +522,22 @@ class TaskComputer(object):
         if self.waiting_for_task is not None:
             self.stats.increase_stat('tasks_requested')
 
+    def __request_resource_for(self, ctd):
+        """ Build a header of resources of the task that this node already has
+        (with signatures of large files) in a thread and request the rest """
+        def request(resource_header):
+            # subtasks may have been dropped in the meantime
+            if ctd.task_id in self.subtasks_waiting_for_resources:
+                self.__request_resource(ctd.task_id, resource_header, ctd.return_address, ctd.return_port,
+                                        ctd.key_id, ctd.task_owner)
+
+        def error(failure):
+            logger.error("Cannot build resource header of task {}: {}".format(ctd.task_id, failure.getErrorMessage()))
+            self.task_resource_failure(ctd.task_id, failure.getErrorMessage())
+
+        deferred = self.resource_manager.get_resource_header_async(ctd.task_id)
+        deferred.addCallbacks(request, error)
+
     def __request_resource(self, task_id, resource_header, return_address, return_port, key_id, task_owner):
         self.last_checking = time.time()
         self.wait(ttl=self.waiting_for_task_timeout)
@@ -388,13 +545,43 @@ class TaskComputer(object):
                                                                   key_id,
                                                                   task_owner)
 
+    def __pop_waiting_subtasks(self, task_id):
+        subtask_ids = self.subtasks_waiting_for_resources.pop(task_id, None)
+        if subtask_ids is None:
+            subtask_ids = [self.task_to_subtask_mapping[task_id]]
+        return [s for s in subtask_ids if s in self.assigned_subtasks]
+
+    def __drop_waiting_subtasks(self):
+        """ Forget subtasks which did not receive their resources in time """
+        for task_id, subtask_ids in self.subtasks_waiting_for_resources.items():
+            for subtask_id in subtask_ids:
+                self.__pop_subtask(subtask_id)
+            if not any(s.task_id == task_id for s in self.assigned_subtasks.values()):
+                self.task_to_subtask_mapping.pop(task_id, None)
+        self.subtasks_waiting_for_resources.clear()
+
     def __compute_task(self, subtask_id, docker_images,
                        src_code, extra_data, short_desc, task_timeout):
 
         task_id = self.assigned_subtasks[subtask_id].task_id
         working_dir = self.assigned_subtasks[subtask_id].working_directory
+        stream_partial_results = getattr(self.assigned_subtasks[subtask_id],
+                                         'stream_partial_results', False)
         unique_str = str(uuid.uuid4())
 
+        with self.lock:
+            slot = self.__free_slot()
+            if slot is not None:
+                slot.reserve(task_id, subtask_id)
+
+        if slot is None:
+            logger.error("No free computation slot for subtask %r", subtask_id)
+            subtask = self.__pop_subtask(subtask_id)
+            self.task_server.send_task_failed(subtask_id, subtask.task_id, "No free computation slot",
+                                              subtask.return_address, subtask.return_port, subtask.key_id,
+                                              subtask.task_owner, self.node_name)
+            return
+
         self.reset(computing_task=task_id)
 
         with self.dir_lock:
@@ -406,29 +593,67 @@ class TaskComputer(object):
                 os.makedirs(temp_dir)
 
         if docker_images:
+            host_config = self.docker_manager.slot_host_config(
+                slot.index, self.max_concurrent_subtasks)
             tt = DockerTaskThread(self, subtask_id, docker_images, working_dir,
                                   src_code, extra_data, short_desc,
-                                  resource_dir, temp_dir, task_timeout)
+                                  resource_dir, temp_dir, task_timeout,
+                                  host_config=host_config,
+                                  stream_partial_results=stream_partial_results)
         elif self.support_direct_computation:
             tt = PyTaskThread(self, subtask_id, working_dir, src_code,
                               extra_data, short_desc, resource_dir, temp_dir,
                               task_timeout)
         else:
             logger.error("Cannot run PyTaskThread in this version")
-            subtask = self.assigned_subtasks.pop(subtask_id)
+            with self.lock:
+                self.__release_slot(subtask_id)
+            subtask = self.__pop_subtask(subtask_id)
             self.task_server.send_task_failed(subtask_id, subtask.task_id, "Host direct task not supported",
                                               subtask.return_address, subtask.return_port, subtask.key_id,
                                               subtask.task_owner, self.node_name)
-            self.counting_task = None
+            self.counting_task = self.__computing_task_id() or None
             return
 
-        self.current_computations.append(tt)
+        with self.lock:
+            slot.task_thread = tt
+            self.current_computations.append(tt)
         tt.start()
 
     def quit(self):
         for t in self.current_computations:
             t.end_comp()
 
+    def __pop_subtask(self, subtask_id, unpin=True):
+        subtask = self.assigned_subtasks.pop(subtask_id, None)
+        if subtask is not None and unpin:
+            self.dir_cache.unpin(subtask.task_id)
+        return subtask
+
+    def __free_slot(self):
+        for slot in self.slots[:self.max_concurrent_subtasks]:
+            if slot.is_free():
+                return slot
+
+    def __release_slot(self, subtask_id):
+        for slot in self.slots:
+            if slot.subtask_id == subtask_id:
+                slot.release()
+                if slot.index >= self.max_concurrent_subtasks:
+                    self.slots.remove(slot)
+                return slot
+
+    def __computing_task_id(self):
+        for slot in self.slots:
+            if not slot.is_free():
+                return slot.task_id
+        return False
+
+    def __increase_stat(self, slot, stat_name):
+        self.stats.increase_stat(stat_name)
+        if slot is not None:
+            setattr(slot.stats, stat_name, getattr(slot.stats, stat_name) + 1)
+
 
 class AssignedSubTask(object):
     def __init__(self, src_code, extra_data, short_desc, owner_address, owner_port):
@@ -21,10 +21,10 @@ def compute_subtask_value(price, computation_time):
 
 
 class CompTaskInfo(object):
-    def __init__(self, header, price):
+    def __init__(self, header, price, requests=1):
         self.header = header
         self.price = price
-        self.requests = 1
+        self.requests = requests
         self.subtasks = {}
 
     def __repr__(self):
@@ -97,7 +97,10 @@ class CompTaskKeeper(object):
         self.active_tasks.update(active_tasks)
         self.subtask_to_task.update(subtask_to_task)
 
-    def add_request(self, theader, price):
+    def add_request(self, theader, price, num_subtasks=1):
+        """ Remember that we asked for num_subtasks subtasks of a given task
+        and should accept that many task definitions from its owner
+        """
         logger.debug('CT.add_request()')
         if not type(price) in (int, long):
             raise TypeError(
@@ -108,9 +111,10 @@ class CompTaskKeeper(object):
             raise ValueError("Price should be greater or equal zero")
         task_id = theader.task_id
         if task_id in self.active_tasks:
-            self.active_tasks[task_id].requests += 1
+            self.active_tasks[task_id].requests += num_subtasks
         else:
-            self.active_tasks[task_id] = CompTaskInfo(theader, price)
+            self.active_tasks[task_id] = CompTaskInfo(theader, price,
+                                                      num_subtasks)
         self.dump()
 
     @handle_key_error
@@ -153,11 +157,22 @@ class CompTaskKeeper(object):
         return compute_subtask_value(price, computing_time)
 
     @handle_key_error
-    def request_failure(self, task_id):
-        logger.debug('CT.request_failure(%r)', task_id)
-        self.active_tasks[task_id].requests -= 1
+    def request_failure(self, task_id, num_subtasks=1):
+        logger.debug('CT.request_failure(%r, %r)', task_id, num_subtasks)
+        self.active_tasks[task_id].requests -= num_subtasks
         self.dump()
 
+    @handle_key_error
+    def release_requests(self, task_id):
+        """ Forget the subtasks of a task that were requested but not
+        assigned, once the owner has answered the request
+        """
+        logger.debug('CT.release_requests(%r)', task_id)
+        task = self.active_tasks[task_id]
+        if task.requests > 0:
+            task.requests = 0
+            self.dump()
+
 
 class TaskHeaderKeeper(object):
     """Keeps information about tasks living in Golem Network. Node may
@@ -4,7 +4,7 @@ import pickle
 from pydispatch import dispatcher
 import time
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed
 
 from golem.core.common import HandleKeyError, get_timestamp_utc, \
     timeout_to_deadline, to_unicode
@@ -14,7 +14,9 @@ from golem.network.transport.tcpnetwork import SocketAddress
 from golem.resource.client import AsyncRequest, async_run
 from golem.resource.dirmanager import DirManager
 from golem.resource.hyperdrive.resourcesmanager import HyperdriveResourceManager
+from golem.task.providerscheduler import ProviderScheduler, SchedulingVerdict
 from golem.task.result.resultmanager import EncryptedResultPackageManager
+from golem.task.result.resultpipeline import ResultPipeline
 from golem.task.taskbase import ComputeTaskDef, TaskEventListener
 from golem.task.taskkeeper import CompTaskKeeper, compute_subtask_value
 from golem.task.taskstate import TaskState, TaskStatus, SubtaskStatus, SubtaskState
@@ -35,6 +37,9 @@ def log_task_key_error(*args, **kwargs):
 class TaskManager(TaskEventListener):
     """ Keeps and manages information about requested tasks
     """
+    # maximum number of subtasks assigned to a node in a single request
+    MAX_SUBTASKS_PER_REQUEST = 8
+
     handle_task_key_error = HandleKeyError(log_task_key_error)
     handle_subtask_key_error = HandleKeyError(log_subtask_key_error)
 
@@ -68,11 +73,13 @@ class TaskManager(TaskEventListener):
         resource_manager = HyperdriveResourceManager(self.dir_manager,
                                                      resource_dir_method=self.dir_manager.get_task_temporary_dir)
         self.task_result_manager = EncryptedResultPackageManager(resource_manager)
+        self.result_pipeline = ResultPipeline()
 
         self.activeStatus = [TaskStatus.computing, TaskStatus.starting, TaskStatus.waiting]
         self.use_distributed_resources = use_distributed_resources
 
         self.comp_task_keeper = CompTaskKeeper(self.tasks_dir, persist=self.task_persistence)
+        self.provider_scheduler = ProviderScheduler()
         if self.task_persistence:
             self.restore_tasks()
 
@@ -184,15 +191,28 @@ class TaskManager(TaskEventListener):
         False (regardless new subtask was assigned or not). The third element describes whether we're waiting for
         client's other task results.
         """
-        logger.debug('get_next_subtask(%r, %r, %r, %r, %r, %r, %r, %r, %r)', node_id, node_name, task_id, estimated_performance, price, max_resource_size, max_memory_size, num_cores, address)
+        ctds, wrong_task, wait = self.get_next_subtasks(node_id, node_name, task_id, estimated_performance, price,
+                                                        max_resource_size, max_memory_size, num_cores, address)
+        return (ctds[0] if ctds else None), wrong_task, wait
+
+    def get_next_subtasks(self, node_id, node_name, task_id, estimated_performance, price, max_resource_size,
+                          max_memory_size, num_cores=0, address="", max_subtasks=1):
+        """ Assign up to <max_subtasks> next subtasks from task <task_id> to node with given id <node_id> and name.
+        Subtasks are assigned at once, so the node may compute them concurrently and download task resources only
+        once. Parameters are the same as in get_next_subtask.
+        :param int max_subtasks: maximum number of subtasks that the node wants to compute
+        :return (list, bool, bool): Function returns a triplet. First element is a list of ComputeTaskDefs that
+        describe assigned subtasks (may be empty). Second and third elements are the same as in get_next_subtask.
+        """
+        logger.debug('get_next_subtasks(%r, %r, %r, %r, %r, %r, %r, %r, %r, %r)', node_id, node_name, task_id, estimated_performance, price, max_resource_size, max_memory_size, num_cores, address, max_subtasks)
         if task_id not in self.tasks:
             logger.info("Cannot find task {} in my tasks".format(task_id))
-            return None, True, False
+            return [], True, False
 
         task = self.tasks[task_id]
 
         if task.header.max_price < price:
-            return None, False, False
+            return [], False, False
 
         def has_subtasks():
             if self.tasks_states[task_id].status not in self.activeStatus:
@@ -210,15 +230,26 @@ class TaskManager(TaskEventListener):
             return True
         if not has_subtasks():
             logger.info("Cannot get next task for estimated performance {}".format(estimated_performance))
-            return None, False, False
-
-        extra_data = task.query_extra_data(estimated_performance, num_cores, node_id, node_name)
-        if extra_data.should_wait:
-            return None, False, True
-
-        ctd = extra_data.ctd
+            return [], False, False
+
+        verdict = self.provider_scheduler.verdict(task_id, node_id, task.get_tasks_left())
+        if verdict == SchedulingVerdict.DEFER:
+            return [], False, True
+        if verdict == SchedulingVerdict.DECLINE:
+            return [], False, False
+
+        max_subtasks = self.__limit_subtasks(max_subtasks)
+        if max_subtasks > 1:
+            extra_data_list = task.query_extra_data_batch(estimated_performance, num_cores, node_id, node_name,
+                                                          max_subtasks)
+        else:
+            extra_data_list = [task.query_extra_data(estimated_performance, num_cores, node_id, node_name)]
+        if not extra_data_list:
+            return [], False, False
+        if extra_data_list[0].should_wait:
+            return [], False, True
 
-        def check_compute_task_def():
+        def check_compute_task_def(ctd):
             if not isinstance(ctd, ComputeTaskDef) or not ctd.subtask_id:
                 logger.debug('check ctd: ctd not instance or not subtask_id')
                 return False
@@ -229,18 +260,43 @@ class TaskManager(TaskEventListener):
                 logger.debug('check ctd: subtask_states')
                 return False
             return True
-        if not check_compute_task_def():
-            return None, False, False
 
-        ctd.key_id = task.header.task_owner_key_id
-        ctd.return_address = task.header.task_owner_address
-        ctd.return_port = task.header.task_owner_port
-        ctd.task_owner = task.header.task_owner
+        ctds, rejected = [], []
+        for extra_data in extra_data_list:
+            ctd = extra_data.ctd
+            if check_compute_task_def(ctd) and ctd.subtask_id not in [c.subtask_id for c in ctds]:
+                ctds.append(ctd)
+            else:
+                rejected.append(ctd)
+
+        # the task has already given these parts away, return them so they are not lost
+        for ctd in rejected:
+            subtask_id = getattr(ctd, 'subtask_id', None)
+            if subtask_id and subtask_id not in self.subtask2task_mapping \
+                    and subtask_id not in self.tasks_states[task_id].subtask_states \
+                    and subtask_id not in [c.subtask_id for c in ctds]:
+                logger.warning("Incorrect subtask {} returned to task {}".format(subtask_id, task_id))
+                task.computation_failed(subtask_id)
+
+        for ctd in ctds:
+            ctd.key_id = task.header.task_owner_key_id
+            ctd.return_address = task.header.task_owner_address
+            ctd.return_port = task.header.task_owner_port
+            ctd.task_owner = task.header.task_owner
+
+            self.subtask2task_mapping[ctd.subtask_id] = task_id
+            self.__add_subtask_to_tasks_states(node_name, node_id, price, ctd, address)
+
+        if ctds:
+            self.notice_task_updated(task_id)
+        return ctds, False, False
 
-        self.subtask2task_mapping[ctd.subtask_id] = task_id
-        self.__add_subtask_to_tasks_states(node_name, node_id, price, ctd, address)
-        self.notice_task_updated(task_id)
-        return ctd, False, extra_data.should_wait
+    def __limit_subtasks(self, max_subtasks):
+        """ Clamp the number of subtasks requested by a node to [1, MAX_SUBTASKS_PER_REQUEST] """
+        if isinstance(max_subtasks, bool) or not isinstance(max_subtasks, (int, long)):
+            logger.warning("Invalid number of requested subtasks: %r", max_subtasks)
+            return 1
+        return max(1, min(max_subtasks, self.MAX_SUBTASKS_PER_REQUEST))
 
     def get_tasks_headers(self):
         ret = []
@@ -301,8 +357,51 @@ class TaskManager(TaskEventListener):
         task_id = self.subtask2task_mapping[subtask_id]
         return self.tasks_states[task_id].subtask_states[subtask_id].value
 
+    @handle_subtask_key_error
+    def is_subtask_paid(self, subtask_id):
+        """ Return True if a payment for a given subtask has been added """
+        task_id = self.subtask2task_mapping[subtask_id]
+        subtask_state = self.tasks_states[task_id].subtask_states[subtask_id]
+        # states saved before the flag was introduced do not have it
+        return getattr(subtask_state, 'paid', False)
+
+    @handle_subtask_key_error
+    def set_subtask_paid(self, subtask_id):
+        task_id = self.subtask2task_mapping[subtask_id]
+        self.tasks_states[task_id].subtask_states[subtask_id].paid = True
+
     @handle_subtask_key_error
     def computed_task_received(self, subtask_id, result, result_type):
+        if not self.__result_expected(subtask_id):
+            return False
+
+        task_id = self.subtask2task_mapping[subtask_id]
+        self.tasks[task_id].computation_finished(subtask_id, result, result_type)
+        return self.__result_verified(subtask_id)
+
+    def verify_computed_task(self, subtask_id, result, result_type):
+        """ Same as computed_task_received, but the result is interpreted and verified by the task in
+        a worker thread of the result pipeline. The task and subtask states are updated afterwards
+        on the reactor thread.
+        :return Deferred: fires with True if the result was accepted, False otherwise
+        """
+        if not self.__result_expected(subtask_id):
+            return succeed(False)
+
+        task_id = self.subtask2task_mapping[subtask_id]
+        task = self.tasks[task_id]
+
+        def verified(verification):
+            task.results_verified(subtask_id, verification)
+            return bool(self.__result_verified(subtask_id))
+
+        deferred = self.result_pipeline.verify(task_id, task.verify_results,
+                                               subtask_id, result, result_type)
+        deferred.addCallback(verified)
+        return deferred
+
+    @handle_subtask_key_error
+    def __result_expected(self, subtask_id):
         task_id = self.subtask2task_mapping[subtask_id]
 
         subtask_state = self.tasks_states[task_id].subtask_states[subtask_id]
@@ -313,8 +412,11 @@ class TaskManager(TaskEventListener):
                            .format(subtask_id, subtask_status))
             self.notice_task_updated(task_id)
             return False
+        return True
 
-        self.tasks[task_id].computation_finished(subtask_id, result, result_type)
+    @handle_subtask_key_error
+    def __result_verified(self, subtask_id):
+        task_id = self.subtask2task_mapping[subtask_id]
         ss = self.tasks_states[task_id].subtask_states[subtask_id]
         ss.subtask_progress = 1.0
         ss.subtask_rem_time = 0.0
@@ -326,9 +428,14 @@ class TaskManager(TaskEventListener):
         if not self.tasks[task_id].verify_subtask(subtask_id):
             logger.debug("Subtask {} not accepted\n".format(subtask_id))
             ss.subtask_status = SubtaskStatus.failure
+            self.provider_scheduler.subtask_failed(ss.computer.node_id)
             self.notice_task_updated(task_id)
             return False
 
+        self.provider_scheduler.subtask_finished(task_id, ss.computer.node_id,
+                                                 max(time.time() - ss.time_started, 0.0))
+        self.__cancel_duplicated_subtasks(task_id, subtask_id)
+
         if self.tasks_states[task_id].status in self.activeStatus:
             if not self.tasks[task_id].finished_computation():
                 self.tasks_states[task_id].status = TaskStatus.computing
@@ -360,10 +467,24 @@ class TaskManager(TaskEventListener):
         ss.subtask_rem_time = 0.0
         ss.subtask_status = SubtaskStatus.failure
         ss.stderr = str(err)
+        self.provider_scheduler.subtask_failed(ss.computer.node_id)
 
         self.notice_task_updated(task_id)
         return True
 
+    def get_subtask_status(self, subtask_id):
+        """ Return status of a given subtask or None if it is not my subtask
+        :param str subtask_id:
+        :return str|None:
+        """
+        task_id = self.subtask2task_mapping.get(subtask_id)
+        if task_id is None:
+            return None
+        subtask_state = self.tasks_states[task_id].subtask_states.get(subtask_id)
+        if subtask_state is None:
+            return None
+        return subtask_state.subtask_status
+
     def task_result_incoming(self, subtask_id):
         node_id = self.get_node_id_for_subtask(subtask_id)
 
@@ -403,6 +524,7 @@ class TaskManager(TaskEventListener):
                         logger.info("Subtask {} dies".format(s.subtask_id))
                         s.subtask_status = SubtaskStatus.failure
                         nodes_with_timeouts.append(s.computer.node_id)
+                        self.provider_scheduler.subtask_failed(s.computer.node_id)
                         t.computation_failed(s.subtask_id)
                         s.stderr = "[GOLEM] Timeout"
                         self.notice_task_updated(th.task_id)
@@ -484,6 +606,8 @@ class TaskManager(TaskEventListener):
         self.tasks[task_id].unregister_listener(self)
         del self.tasks[task_id]
         del self.tasks_states[task_id]
+        self.provider_scheduler.task_removed(task_id)
+        self.result_pipeline.task_removed(task_id)
 
         self.dir_manager.clear_temporary(task_id)
 
@@ -593,12 +717,15 @@ class TaskManager(TaskEventListener):
         """
         task_id = self.subtask2task_mapping[subtask_id]
         ss = self.tasks_states[task_id].subtask_states[subtask_id]
+        if ss.subtask_status == SubtaskStatus.cancelled:
+            # the node is not paid for the time after cancellation
+            computation_time = min(computation_time, ss.computation_time)
         ss.computation_time = computation_time
         ss.value = compute_subtask_value(ss.computer.price, computation_time)
 
-    def add_comp_task_request(self, theader, price):
+    def add_comp_task_request(self, theader, price, num_subtasks=1):
         """ Add a header of a task which this node may try to compute """
-        self.comp_task_keeper.add_request(theader, price)
+        self.comp_task_keeper.add_request(theader, price, num_subtasks)
 
     @handle_task_key_error
     def get_payment_for_task_id(self, task_id):
@@ -632,10 +759,57 @@ class TaskManager(TaskEventListener):
 
         self.tasks_states[ctd.task_id].subtask_states[ctd.subtask_id] = ss
 
+    def __cancel_duplicated_subtasks(self, task_id, subtask_id):
+        """ Mark subtasks computing the same part as subtask_id as cancelled.
+        A cancelled node is paid for the time it spent on the computation
+        until the part was computed by another node.
+        """
+        subtask_states = self.tasks_states[task_id].subtask_states
+        for duplicate_id in self.tasks[task_id].get_duplicated_subtasks(subtask_id):
+            ss = subtask_states.get(duplicate_id)
+            if ss is None or not SubtaskStatus.is_computed(ss.subtask_status):
+                continue
+            logger.info("Subtask {} cancelled, subtask {} was computed first"
+                        .format(duplicate_id, subtask_id))
+            ss.subtask_status = SubtaskStatus.cancelled
+            ss.subtask_rem_time = 0.0
+            ss.stderr = "[GOLEM] Cancelled"
+            computation_time = max(time.time() - ss.time_started, 0.0)
+            if ss.computation_time:
+                # the node has already reported its computation time
+                computation_time = min(computation_time, ss.computation_time)
+            ss.computation_time = computation_time
+            ss.value = compute_subtask_value(ss.computer.price, ss.computation_time)
+
     def notify_update_task(self, task_id):
         self.notice_task_updated(task_id)
 
     @handle_task_key_error
+    def partial_results_received(self, subtask_id, files):
+        """ Pass partial results of a subtask that is still being computed
+        to its task, in a worker thread
+        :return Deferred: fires with True if the task used the results
+        """
+        task_id = self.subtask2task_mapping.get(subtask_id)
+        task = self.tasks.get(task_id)
+        if task is None:
+            return succeed(False)
+
+        def received(used):
+            if used:
+                self.notice_task_updated(task_id)
+            return used
+
+        def failed(failure):
+            logger.error("Cannot use partial results of subtask %r: %s",
+                         subtask_id, failure.getErrorMessage())
+            return False
+
+        deferred = self.result_pipeline.run(task_id,
+                                            task.partial_results_received,
+                                            subtask_id, files)
+        return deferred.addCallbacks(received, failed)
+
     def notice_task_updated(self, task_id):
         # self.save_state()
         if self.task_persistence:
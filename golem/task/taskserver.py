@@ -9,7 +9,7 @@ from golem.network.transport.tcpnetwork import TCPNetwork, TCPConnectInfo, Socke
 from golem.network.transport.tcpserver import PendingConnectionsServer, PenConnStatus
 from golem.ranking.helper.trust import Trust
 from golem.task.deny import get_deny_set
-from golem.task.taskbase import TaskHeader
+from golem.task.taskbase import TaskHeader, result_types
 from golem.task.taskconnectionshelper import TaskConnectionsHelper
 from taskcomputer import TaskComputer
 from taskkeeper import TaskHeaderKeeper
@@ -51,6 +51,9 @@ class TaskServer(PendingConnectionsServer):
 
         self.results_to_send = {}
         self.failures_to_send = {}
+        self.partial_results_to_send = {}
+        # subtask id -> number of partial result packages sent
+        self.partial_results_sent = {}
 
         self.use_ipv6 = use_ipv6
 
@@ -94,7 +97,8 @@ class TaskServer(PendingConnectionsServer):
             else:
                 performance = 0.0
             if self.should_accept_requestor(theader.task_owner_key_id):
-                self.task_manager.add_comp_task_request(theader, self.config_desc.min_price)
+                max_subtasks = self.task_computer.free_slots()
+                self.task_manager.add_comp_task_request(theader, self.config_desc.min_price, max_subtasks)
                 args = {
                     'node_name': self.config_desc.node_name,
                     'key_id': theader.task_owner_key_id,
@@ -103,7 +107,8 @@ class TaskServer(PendingConnectionsServer):
                     'price': self.config_desc.min_price,
                     'max_resource_size': self.config_desc.max_resource_size,
                     'max_memory_size': self.config_desc.max_memory_size,
-                    'num_cores': self.config_desc.num_cores
+                    'num_cores': self.config_desc.num_cores,
+                    'max_subtasks': max_subtasks
                 }
                 self._add_pending_request(TASK_CONN_TYPES['task_request'], theader.task_owner, theader.task_owner_port, theader.task_owner_key_id, args)
 
@@ -120,8 +125,8 @@ class TaskServer(PendingConnectionsServer):
             logger.error("Cannot map subtask_id {} to session".format(subtask_id))
         return subtask_id
 
-    def pull_resources(self, task_id, resources, client_options=None):
-        self.client.pull_resources(task_id, resources, client_options=client_options)
+    def pull_resources(self, task_id, resources, client_options=None, deadline=None):
+        self.client.pull_resources(task_id, resources, client_options=client_options, deadline=deadline)
 
     def send_results(self, subtask_id, task_id, result, computing_time, owner_address, owner_port, owner_key_id, owner,
                      node_name):
@@ -131,6 +136,9 @@ class TaskServer(PendingConnectionsServer):
 
         Trust.REQUESTED.increase(owner_key_id)
 
+        # the final result supersedes partial results that were not sent yet
+        self.partial_results_to_send.pop(subtask_id, None)
+
         if subtask_id not in self.results_to_send:
             value = self.task_manager.comp_task_keeper.get_value(task_id, computing_time)
             if self.client.transaction_system:
@@ -148,6 +156,20 @@ class TaskServer(PendingConnectionsServer):
 
         return True
 
+    def send_partial_results(self, subtask_id, task_id, files, owner_address, owner_port, owner_key_id, owner,
+                             node_name):
+        """ Queue partial results of a subtask that is still being computed. Partial results are sent on
+        a best-effort basis, files that were not sent yet are sent together with the newer ones.
+        """
+        if subtask_id in self.results_to_send:
+            return
+
+        wpr = self.partial_results_to_send.get(subtask_id)
+        if wpr is None:
+            wpr = WaitingPartialResult(task_id, subtask_id, owner_address, owner_port, owner_key_id, owner)
+            self.partial_results_to_send[subtask_id] = wpr
+        wpr.add_files(files)
+
     def send_task_failed(self, subtask_id, task_id, err_msg, owner_address, owner_port, owner_key_id, owner, node_name):
         Trust.REQUESTED.decrease(owner_key_id)
         if subtask_id not in self.failures_to_send:
@@ -248,7 +270,16 @@ class TaskServer(PendingConnectionsServer):
         self.client.add_resource_peer(node_name, addr, port, key_id, node_info)
 
     def task_result_sent(self, subtask_id):
-        return self.results_to_send.pop(subtask_id, None)
+        self.partial_results_sent.pop(subtask_id, None)
+        wtr = self.results_to_send.pop(subtask_id, None)
+        if wtr is not None:
+            self.task_computer.task_result_sent(wtr.task_id)
+        return wtr
+
+    def next_partial_result_sequence(self, subtask_id):
+        sequence = self.partial_results_sent.get(subtask_id, 0) + 1
+        self.partial_results_sent[subtask_id] = sequence
+        return sequence
 
     def retry_sending_task_result(self, subtask_id):
         wtr = self.results_to_send.get(subtask_id, None)
@@ -306,8 +337,18 @@ class TaskServer(PendingConnectionsServer):
     def accept_result(self, subtask_id, account_info):
         mod = min(max(self.task_manager.get_trust_mod(subtask_id), self.min_trust), self.max_trust)
         Trust.COMPUTED.increase(account_info.key_id, mod)
+        self.pay_for_subtask(subtask_id, account_info)
 
+    def pay_for_subtask(self, subtask_id, account_info):
+        """ Add payment for a computed subtask without changing the trust
+        of the node that computed it
+        """
         task_id = self.task_manager.get_task_id(subtask_id)
+        if self.task_manager.is_subtask_paid(subtask_id):
+            # result or report of the subtask received again
+            logger.info(u"Subtask %r has already been paid for", subtask_id)
+            return
+
         value = self.task_manager.get_value(subtask_id)
         if not value:
             logger.info(u"Invaluable subtask: %r value: %r", subtask_id, value)
@@ -322,6 +363,7 @@ class TaskServer(PendingConnectionsServer):
             return
 
         payment = self.client.transaction_system.add_payment_info(task_id, subtask_id, value, account_info)
+        self.task_manager.set_subtask_paid(subtask_id)
         logger.debug(u'Result accepted for subtask: %s Created payment: %r', subtask_id, payment)
 
     def increase_trust_payment(self, task_id):
@@ -348,7 +390,7 @@ class TaskServer(PendingConnectionsServer):
         Trust.WRONG_COMPUTED.decrease(account_info.key_id, mod)
 
     def unpack_delta(self, dest_dir, delta, task_id):
-        self.client.resource_server.unpack_delta(dest_dir, delta, task_id)
+        return self.client.resource_server.unpack_delta(dest_dir, delta, task_id)
 
     def get_computing_trust(self, node_id):
         return self.client.get_computing_trust(node_id)
@@ -509,7 +551,7 @@ class TaskServer(PendingConnectionsServer):
     #############################
     def __connection_for_task_request_established(self, session, conn_id, node_name, key_id, task_id,
                                                   estimated_performance, price, max_resource_size, max_memory_size,
-                                                  num_cores):
+                                                  num_cores, max_subtasks=1):
         self.remove_forwarded_session_request(key_id)
         session.task_id = task_id
         session.key_id = key_id
@@ -517,15 +559,16 @@ class TaskServer(PendingConnectionsServer):
         self._mark_connected(conn_id, session.address, session.port)
         self.task_sessions[task_id] = session
         session.send_hello()
-        session.request_task(node_name, task_id, estimated_performance, price, max_resource_size, max_memory_size, num_cores)
+        session.request_task(node_name, task_id, estimated_performance, price, max_resource_size, max_memory_size, num_cores,
+                             max_subtasks)
 
     def __connection_for_task_request_failure(self, conn_id, node_name, key_id, task_id, estimated_performance, price,
-                                              max_resource_size, max_memory_size, num_cores, *args):
+                                              max_resource_size, max_memory_size, num_cores, max_subtasks=1, *args):
 
         response = lambda session: self.__connection_for_task_request_established(session, conn_id, node_name, key_id,
                                                                                   task_id, estimated_performance, price,
                                                                                   max_resource_size, max_memory_size,
-                                                                                  num_cores)
+                                                                                  num_cores, max_subtasks)
         if key_id in self.response_list:
             self.response_list[conn_id].append(response)
         else:
@@ -569,6 +612,20 @@ class TaskServer(PendingConnectionsServer):
             pc.status = PenConnStatus.WaitingAlt
             pc.time = time.time()
 
+    def __connection_for_partial_result_established(self, session, conn_id, waiting_partial_result):
+        session.key_id = waiting_partial_result.owner_key_id
+        session.conn_id = conn_id
+        self._mark_connected(conn_id, session.address, session.port)
+        session.send_hello()
+        session.send_partial_result_hash(waiting_partial_result,
+                                         disconnect=True)
+
+    def __connection_for_partial_result_failure(self, conn_id, waiting_partial_result):
+        # partial results are not worth a forwarded connection
+        logger.debug("Cannot send partial results of subtask %r", waiting_partial_result.subtask_id)
+        self.remove_pending_conn(conn_id)
+        self.remove_responses(conn_id)
+
     def __connection_for_task_failure_established(self, session, conn_id, key_id, subtask_id, err_msg):
         self.remove_forwarded_session_request(key_id)
         session.key_id = key_id
@@ -730,13 +787,14 @@ class TaskServer(PendingConnectionsServer):
         open_session.open_session = session
 
     def __connection_for_task_request_final_failure(self, conn_id, node_name, key_id, task_id, estimated_performance,
-                                                    price, max_resource_size, max_memory_size, num_cores, *args):
+                                                    price, max_resource_size, max_memory_size, num_cores,
+                                                    max_subtasks=1, *args):
         logger.warning("Cannot connect to task {} owner".format(task_id))
         logger.warning("Removing task {} from task list".format(task_id))
 
         self.task_computer.task_request_rejected(task_id, "Connection failed")
         self.task_keeper.request_failure(task_id)
-        self.task_manager.comp_task_keeper.request_failure(task_id)
+        self.task_manager.comp_task_keeper.request_failure(task_id, max_subtasks)
         self.remove_pending_conn(conn_id)
         self.remove_responses(conn_id)
 
@@ -839,6 +897,20 @@ class TaskServer(PendingConnectionsServer):
 
         self.failures_to_send.clear()
 
+        # partial results are queued by computing threads
+        for subtask_id in self.partial_results_to_send.keys():
+            wpr = self.partial_results_to_send.pop(subtask_id, None)
+            session = self.task_sessions.get(subtask_id, None)
+            if wpr is None:
+                continue
+            elif session:
+                session.send_partial_result_hash(wpr)
+            else:
+                args = {'waiting_partial_result': wpr}
+                self._add_pending_request(TASK_CONN_TYPES['partial_result'],
+                                          wpr.owner, wpr.owner_port,
+                                          wpr.owner_key_id, args)
+
     # CONFIGURATION METHODS
     #############################
     @staticmethod
@@ -855,6 +927,7 @@ class TaskServer(PendingConnectionsServer):
             TASK_CONN_TYPES['start_session']: self.__connection_for_start_session_established,
             TASK_CONN_TYPES['middleman']: self.__connection_for_middleman_established,
             TASK_CONN_TYPES['nat_punch']: self.__connection_for_nat_punch_established,
+            TASK_CONN_TYPES['partial_result']: self.__connection_for_partial_result_established,
         })
 
     def _set_conn_failure(self):
@@ -867,6 +940,7 @@ class TaskServer(PendingConnectionsServer):
             TASK_CONN_TYPES['start_session']: self.__connection_for_start_session_failure,
             TASK_CONN_TYPES['middleman']: self.__connection_for_middleman_failure,
             TASK_CONN_TYPES['nat_punch']: self.__connection_for_nat_punch_failure,
+            TASK_CONN_TYPES['partial_result']: self.__connection_for_partial_result_failure,
         })
 
     def _set_conn_final_failure(self):
@@ -879,6 +953,7 @@ class TaskServer(PendingConnectionsServer):
             TASK_CONN_TYPES['start_session']: self.__connection_for_start_session_final_failure,
             TASK_CONN_TYPES['middleman']: self.noop,
             TASK_CONN_TYPES['nat_punch']: self.noop,
+            TASK_CONN_TYPES['partial_result']: self.__connection_for_partial_result_failure,
         })
 
     def _set_listen_established(self):
@@ -909,6 +984,23 @@ class WaitingTaskResult(object):
         self.already_sending = False
 
 
+class WaitingPartialResult(object):
+    def __init__(self, task_id, subtask_id, owner_address, owner_port, owner_key_id, owner):
+        self.task_id = task_id
+        self.subtask_id = subtask_id
+        self.result = []
+        self.result_type = result_types['files']
+        self.owner_address = owner_address
+        self.owner_port = owner_port
+        self.owner_key_id = owner_key_id
+        self.owner = owner
+
+    def add_files(self, files):
+        for file_path in files:
+            if file_path not in self.result:
+                self.result.append(file_path)
+
+
 class WaitingTaskFailure(object):
     def __init__(self, task_id, subtask_id, err_msg, owner_address, owner_port, owner_key_id, owner):
         self.task_id = task_id
@@ -931,6 +1023,7 @@ TASK_CONN_TYPES = {
     'start_session': 7,
     'middleman': 8,
     'nat_punch': 9,
+    'partial_result': 10,
 }
 
 
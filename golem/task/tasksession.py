@@ -1,9 +1,10 @@
 import logging
-import functools
 import os
 import struct
 import time
 
+from twisted.internet.defer import Deferred, maybeDeferred
+
 from golem.core.common import HandleAttributeError
 from golem.core.simpleserializer import CBORSerializer
 from golem.docker.environment import DockerEnvironment
@@ -13,12 +14,13 @@ from golem.network.transport import tcpnetwork
 from golem.resource.client import AsyncRequest, async_run
 from golem.resource.resource import decompress_dir
 from golem.task.taskbase import ComputeTaskDef, result_types, resource_types
+from golem.task.taskstate import SubtaskStatus
 from golem.transactions.ethereum.ethereumpaymentskeeper import EthAccountInfo
 
 logger = logging.getLogger(__name__)
 
 
-TASK_PROTOCOL_ID = 14
+TASK_PROTOCOL_ID = 16
 
 
 def drop_after_attr_error(*args, **kwargs):
@@ -32,17 +34,6 @@ def call_task_computer_and_drop_after_attr_error(*args, **kwargs):
     args[0].dropped()
 
 
-def dropped_after():
-    def inner(f):
-        @functools.wraps(f)
-        def curry(self, *args, **kwargs):
-            result = f(self, *args, **kwargs)
-            self.dropped()
-            return result
-        return curry
-    return inner
-
-
 class TaskSession(MiddlemanSafeSession):
     """ Session for Golem task network """
 
@@ -222,14 +213,33 @@ class TaskSession(MiddlemanSafeSession):
         self.conn.producer = None
         self.dropped()
 
-    @dropped_after()
     def result_received(self, extra_data, decrypt=True):
-        """ Inform server about received result
+        """ Inform server about received result. The result is verified
+        in the result pipeline and the session is dropped when the result
+        is accepted or rejected.
         :param dict extra_data: dictionary with information about
                                 received result
         :param bool decrypt: tells whether result decryption should
                              be performed
+        :return Deferred: fires when the result is accepted or rejected
         """
+        subtask_id = extra_data.get("subtask_id")
+
+        def on_error(failure):
+            logger.error("Cannot verify result of subtask %r: %s",
+                         subtask_id, failure.getErrorMessage())
+            self.task_manager.task_computation_failure(
+                subtask_id,
+                'Error verifying task result'
+            )
+            self._reject_subtask_result(subtask_id)
+
+        deferred = maybeDeferred(self._process_result, extra_data, decrypt)
+        deferred.addErrback(on_error)
+        deferred.addBoth(lambda _: self.dropped())
+        return deferred
+
+    def _process_result(self, extra_data, decrypt):
         result = extra_data.get('result')
         result_type = extra_data.get("result_type")
         subtask_id = extra_data.get("subtask_id")
@@ -238,6 +248,11 @@ class TaskSession(MiddlemanSafeSession):
             logger.error("No task_id value in extra_data for received data ")
             return
 
+        if self.task_manager.get_subtask_status(subtask_id) == \
+                SubtaskStatus.cancelled:
+            self._accept_cancelled_subtask(subtask_id, self.result_owner)
+            return
+
         if result_type is None:
             logger.error("No information about result_type for received data ")
             self._reject_subtask_result(subtask_id)
@@ -253,18 +268,30 @@ class TaskSession(MiddlemanSafeSession):
                 self._reject_subtask_result(subtask_id)
                 return
 
-        self.task_manager.computed_task_received(
+        deferred = self.task_manager.verify_computed_task(
             subtask_id,
             result,
             result_type
         )
-        if not self.task_manager.verify_subtask(subtask_id):
+        deferred.addCallback(self._result_verified, subtask_id)
+        return deferred
+
+    def _result_verified(self, accepted, subtask_id):
+        if not accepted:
             self._reject_subtask_result(subtask_id)
             return
 
         self.task_server.accept_result(subtask_id, self.result_owner)
         self.send(message.MessageSubtaskResultAccepted(subtask_id=subtask_id))
 
+    def _accept_cancelled_subtask(self, subtask_id, account_info):
+        """ The same part was computed by another node and the result is not
+        needed. Node is paid for the time before the subtask was cancelled.
+        """
+        logger.info("Result of cancelled subtask %r is not needed", subtask_id)
+        self.task_server.pay_for_subtask(subtask_id, account_info)
+        self.send(message.MessageSubtaskResultAccepted(subtask_id=subtask_id))
+
     def _reject_subtask_result(self, subtask_id):
         self.task_server.reject_result(subtask_id, self.result_owner)
         self.send_result_rejected(subtask_id)
@@ -277,7 +304,8 @@ class TaskSession(MiddlemanSafeSession):
             price,
             max_resource_size,
             max_memory_size,
-            num_cores
+            num_cores,
+            max_subtasks=1
             ):
         """ Inform that node wants to compute given task
         :param str node_name: name of that node
@@ -287,6 +315,8 @@ class TaskSession(MiddlemanSafeSession):
         :param int max_resource_size: how much disk space can this node offer
         :param int max_memory_size: how much ram can this node offer
         :param int num_cores: how many cpu cores this node can offer
+        :param int max_subtasks: how many subtasks this node can compute
+                                 at once
         :return:
         """
         self.send(
@@ -297,7 +327,8 @@ class TaskSession(MiddlemanSafeSession):
                 price=price,
                 max_resource_size=max_resource_size,
                 max_memory_size=max_memory_size,
-                num_cores=num_cores
+                num_cores=num_cores,
+                max_subtasks=max_subtasks
             )
         )
 
@@ -360,6 +391,55 @@ class TaskSession(MiddlemanSafeSession):
             eth_account=eth_account,
             extra_data=extra_data))
 
+    def send_partial_result_hash(self, partial_result, disconnect=False):
+        """ Package partial results of a subtask that is still being
+        computed and send the package hash to the task owner
+        :param WaitingPartialResult partial_result: files to send
+        :param bool disconnect: close the session after sending
+        """
+        task_result_manager = self.task_manager.task_result_manager
+        resource_manager = task_result_manager.resource_manager
+        client_options = resource_manager.build_client_options(
+            self.task_server.get_key_id()
+        )
+
+        subtask_id = partial_result.subtask_id
+        sequence = self.task_server.next_partial_result_sequence(subtask_id)
+        package_name = "{}.{}.partial{}".format(partial_result.task_id,
+                                                subtask_id, sequence)
+        secret = task_result_manager.gen_secret()
+
+        def success(result):
+            _, result_hash = result
+            self.send(
+                message.MessagePartialTaskResultHash(
+                    subtask_id=subtask_id,
+                    multihash=result_hash,
+                    secret=secret,
+                    options=client_options,
+                    sequence=sequence
+                )
+            )
+            if disconnect:
+                self.dropped()
+
+        def error(exc):
+            logger.warning(
+                "Couldn't create a partial result package for subtask %r: %r",
+                subtask_id,
+                exc
+            )
+            if disconnect:
+                self.dropped()
+
+        request = AsyncRequest(task_result_manager.create,
+                               self.task_server.node, partial_result,
+                               client_options=client_options,
+                               key_or_secret=secret,
+                               package_name=package_name)
+
+        return async_run(request, success=success, error=error)
+
     def send_task_failure(self, subtask_id, err_msg):
         """ Inform task owner that an error occurred during task computation
         :param str subtask_id:
@@ -456,12 +536,12 @@ class TaskSession(MiddlemanSafeSession):
 
     def _react_to_want_to_compute_task(self, msg):
         if self.task_server.should_accept_provider(self.key_id):
-            ctd, wrong_task, wait = self.task_manager.get_next_subtask(
+            ctds, wrong_task, wait = self.task_manager.get_next_subtasks(
                 self.key_id, msg.node_name, msg.task_id, msg.perf_index,
                 msg.price, msg.max_resource_size, msg.max_memory_size,
-                msg.num_cores, self.address)
+                msg.num_cores, self.address, msg.max_subtasks)
         else:
-            ctd, wrong_task, wait = None, False, False
+            ctds, wrong_task, wait = [], False, False
 
         if wrong_task:
             self.send(
@@ -471,8 +551,11 @@ class TaskSession(MiddlemanSafeSession):
                 )
             )
             self.dropped()
-        elif ctd:
-            self.send(message.MessageTaskToCompute(compute_task_def=ctd))
+        elif ctds:
+            # all subtasks of a batch share the task resources, the provider
+            # asks for them once
+            for ctd in ctds:
+                self.send(message.MessageTaskToCompute(compute_task_def=ctd))
         elif wait:
             self.send(message.MessageWaitingForResults())
         else:
@@ -504,6 +587,7 @@ class TaskSession(MiddlemanSafeSession):
             self.dropped()
 
     def _react_to_waiting_for_results(self, _):
+        self.task_manager.comp_task_keeper.release_requests(self.task_id)
         self.task_computer.session_closed()
         if not self.msgs_to_send:
             self.disconnect(self.DCRNoMoreMessages)
@@ -517,13 +601,38 @@ class TaskSession(MiddlemanSafeSession):
         self.dropped()
 
     def _react_to_cannot_assign_task(self, msg):
+        self.task_manager.comp_task_keeper.release_requests(msg.task_id)
         self.task_computer.task_request_rejected(msg.task_id, msg.reason)
         self.task_server.remove_task_header(msg.task_id)
         self.task_computer.session_closed()
         self.dropped()
 
     def _react_to_report_computed_task(self, msg):
-        if msg.subtask_id in self.task_manager.subtask2task_mapping:
+        if self.task_manager.get_subtask_status(msg.subtask_id) == \
+                SubtaskStatus.cancelled:
+            if self.task_manager.get_node_id_for_subtask(msg.subtask_id) != \
+                    self.key_id:
+                logger.warning("Report of subtask %r from a node that did "
+                               "not compute it", msg.subtask_id)
+                self.dropped()
+                return
+            self.task_server.receive_subtask_computation_time(
+                msg.subtask_id,
+                msg.computation_time
+            )
+            self._accept_cancelled_subtask(
+                msg.subtask_id,
+                EthAccountInfo(
+                    msg.key_id,
+                    msg.port,
+                    msg.address,
+                    msg.node_name,
+                    msg.node_info,
+                    msg.eth_account
+                )
+            )
+            self.dropped()
+        elif msg.subtask_id in self.task_manager.subtask2task_mapping:
             self.task_server.receive_subtask_computation_time(
                 msg.subtask_id,
                 msg.computation_time
@@ -573,33 +682,102 @@ class TaskSession(MiddlemanSafeSession):
             client_options
         )
 
-        def on_success(extracted_pkg, *args, **kwargs):
-            extra_data = extracted_pkg.to_extra_data()
-            logger.debug("Task result extracted {}"
-                         .format(extracted_pkg.__dict__))
-            self.result_received(extra_data, decrypt=False)
+        pipeline = self.task_manager.result_pipeline
+
+        def pull_package():
+            # fires when the result leaves the pipeline
+            done = Deferred()
+            start = pipeline.stage_started(pipeline.DOWNLOAD)
+
+            def on_success(extracted_pkg, *args, **kwargs):
+                pipeline.stage_finished(pipeline.DOWNLOAD, start)
+                extra_data = extracted_pkg.to_extra_data()
+                logger.debug("Task result extracted {}"
+                             .format(extracted_pkg.__dict__))
+                self.result_received(extra_data, decrypt=False)\
+                    .chainDeferred(done)
+
+            def on_error(exc, *args, **kwargs):
+                pipeline.stage_finished(pipeline.DOWNLOAD, start, False)
+                logger.error("Task result error: {} ({})"
+                             .format(subtask_id, exc or "unspecified"))
+                self.send_result_rejected(subtask_id)
+                self.task_server.reject_result(subtask_id, self.result_owner)
+                self.task_manager.task_computation_failure(
+                    subtask_id,
+                    'Error downloading task result'
+                )
+                self.dropped()
+                done.callback(None)
 
-        def on_error(exc, *args, **kwargs):
-            logger.error("Task result error: {} ({})"
-                         .format(subtask_id, exc or "unspecified"))
-            self.send_result_rejected(subtask_id)
-            self.task_server.reject_result(subtask_id, self.result_owner)
-            self.task_manager.task_computation_failure(
+            self.task_manager.task_result_manager.pull_package(
+                multihash,
+                task_id,
                 subtask_id,
-                'Error downloading task result'
+                secret,
+                success=on_success,
+                error=on_error,
+                client_options=client_options,
+                output_dir=output_dir,
+                deadline=task.header.deadline
             )
-            self.dropped()
+            return done
+
+        def on_pipeline_error(failure):
+            logger.error("Task result processing error: %r (%s)",
+                         subtask_id, failure.getErrorMessage())
 
         self.task_manager.task_result_incoming(subtask_id)
+        # waits while the pipeline is full of results to verify
+        pipeline.submit(pull_package).addErrback(on_pipeline_error)
+
+    def _react_to_partial_task_result_hash(self, msg):
+        subtask_id = msg.subtask_id
+        # the sequence number is a part of the output path
+        if not isinstance(msg.sequence, (int, long)) or \
+                isinstance(msg.sequence, bool) or msg.sequence < 0:
+            logger.warning("Invalid sequence number of partial results of "
+                           "subtask %r: %r", subtask_id, msg.sequence)
+            return
+
+        if self.task_manager.get_node_id_for_subtask(subtask_id) != \
+                self.key_id:
+            logger.warning("Partial results of subtask %r from a node that "
+                           "does not compute it", subtask_id)
+            return
+
+        task_id = self.task_manager.subtask2task_mapping.get(subtask_id)
+        task = self.task_manager.tasks.get(task_id)
+        # final results are more important than the partial ones
+        if task is None or self.task_manager.result_pipeline.is_congested():
+            logger.debug("Skipping partial results of subtask %r",
+                         subtask_id)
+            return
+
+        tmp_dir = getattr(task, 'tmp_dir', None)
+        output_dir = os.path.join(tmp_dir, 'partial', str(msg.sequence)) \
+            if tmp_dir else None
+        package_name = "{}.{}.partial{}".format(task_id, subtask_id,
+                                                msg.sequence)
+
+        def on_success(extracted_pkg, *args, **kwargs):
+            files = extracted_pkg.to_extra_data().get('result') or []
+            self.task_manager.partial_results_received(subtask_id, files)
+
+        def on_error(exc, *args, **kwargs):
+            logger.warning("Cannot download partial results of subtask "
+                           "%r: %r", subtask_id, exc)
+
         self.task_manager.task_result_manager.pull_package(
-            multihash,
+            msg.multihash,
             task_id,
             subtask_id,
-            secret,
+            msg.secret,
             success=on_success,
             error=on_error,
-            client_options=client_options,
-            output_dir=output_dir
+            client_options=msg.options,
+            output_dir=output_dir,
+            package_name=package_name
         )
 
     def _react_to_get_resource(self, msg):
@@ -630,8 +808,15 @@ class TaskSession(MiddlemanSafeSession):
         self.dropped()
 
     def _react_to_delta_parts(self, msg):
+        self.__batch_received()
         self.task_computer.wait_for_resources(self.task_id, msg.delta_header)
-        self.task_server.pull_resources(self.task_id, msg.parts)
+        if not msg.parts:
+            # changed files were sent as deltas in the header
+            self.task_computer.task_resource_collected(self.task_id)
+            return
+        deadline = self.task_computer.get_task_deadline(self.task_id)
+        self.task_server.pull_resources(self.task_id, msg.parts,
+                                        deadline=deadline)
         self.task_server.add_resource_peer(
             msg.node_name,
             msg.address,
@@ -641,13 +826,16 @@ class TaskSession(MiddlemanSafeSession):
         )
 
     def _react_to_resource_list(self, msg):
+        self.__batch_received()
         resource_manager = self.task_server.client.resource_server.resource_manager  # noqa
         resources = resource_manager.from_wire(msg.resources)
         client_options = msg.options
 
         self.task_computer.wait_for_resources(self.task_id, resources)
+        deadline = self.task_computer.get_task_deadline(self.task_id)
         self.task_server.pull_resources(self.task_id, resources,
-                                        client_options=client_options)
+                                        client_options=client_options,
+                                        deadline=deadline)
 
     def _react_to_hello(self, msg):
         send_hello = False
@@ -806,6 +994,11 @@ class TaskSession(MiddlemanSafeSession):
         self.err_msg = "Wrong docker images {}".format(ctd.docker_images)
         return False
 
+    def __batch_received(self):
+        # the owner sends all subtasks assigned for a request before
+        # it answers the resource request of the first one
+        self.task_manager.comp_task_keeper.release_requests(self.task_id)
+
     def __send_delta_resource(self, msg):
         res_file_path = self.task_manager.get_resources(
             msg.task_id,
@@ -825,11 +1018,14 @@ class TaskSession(MiddlemanSafeSession):
         )
 
     def __send_resource_parts_list(self, msg):
-        res = self.task_manager.get_resources(
-            msg.task_id,
-            CBORSerializer.loads(msg.resource_header),
-            resource_types["parts"]
-        )
+        # deltas of changed files are built in a thread
+        async_run(AsyncRequest(self.task_manager.get_resources,
+                               msg.task_id,
+                               CBORSerializer.loads(msg.resource_header),
+                               resource_types["parts"]),
+                  self.__send_delta_parts)
+
+    def __send_delta_parts(self, res):
         if res is None:
             return
         delta_header, parts_list = res
@@ -946,6 +1142,7 @@ class TaskSession(MiddlemanSafeSession):
             message.MessageReportComputedTask.TYPE: self._react_to_report_computed_task,  # noqa
             message.MessageGetTaskResult.TYPE: self._react_to_get_task_result,
             message.MessageTaskResultHash.TYPE: self._react_to_task_result_hash,  # noqa
+            message.MessagePartialTaskResultHash.TYPE: self._react_to_partial_task_result_hash,  # noqa
             message.MessageGetResource.TYPE: self._react_to_get_resource,
             message.MessageResourceList.TYPE: self._react_to_resource_list,
             message.MessageSubtaskResultAccepted.TYPE: self._react_to_subtask_result_accepted,  # noqa
@@ -40,6 +40,8 @@ class SubtaskState(object):
         self.subtask_rem_time = 0
         self.subtask_status = ""
         self.value = 0
+        # whether a payment for this subtask has been added
+        self.paid = False
         self.stdout = ""
         self.stderr = ""
         self.results = []
@@ -67,6 +69,7 @@ class SubtaskStatus(object):
     finished = u"Finished"
     failure = u"Failure"
     restarted = u"Restart"
+    cancelled = u"Cancelled"
 
     @classmethod
     def is_computed(cls, status):
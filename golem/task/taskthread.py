@@ -10,6 +10,13 @@ logger = logging.getLogger("golem.task.taskthread")
 
 
 class TaskThread(Thread):
+    # working directory is shared by all threads of the process, computations
+    # that change it cannot run concurrently. Source code of python tasks may
+    # rely on relative paths, so python computations in separate slots run one
+    # at a time; only docker computations (DockerTaskThread, which does not
+    # change the working directory) run concurrently
+    working_directory_lock = Lock()
+
     def __init__(self, task_computer, subtask_id, working_directory, src_code,
                  extra_data, short_desc, res_path, tmp_path, timeout=0):
         super(TaskThread, self).__init__()
@@ -90,13 +97,14 @@ class TaskThread(Thread):
         abs_res_path = os.path.abspath(os.path.normpath(self.res_path))
         abs_tmp_path = os.path.abspath(os.path.normpath(self.tmp_path))
 
-        self.prev_working_directory = os.getcwd()
-        os.chdir(os.path.join(abs_res_path,
-                              os.path.normpath(self.working_directory)))
-        try:
-            extra_data["resourcePath"] = abs_res_path
-            extra_data["tmp_path"] = abs_tmp_path
-            self.result, self.error_msg = self.vm.run_task(self.src_code, extra_data)
-        finally:
-            self.end_time = time.time()
-            os.chdir(self.prev_working_directory)
+        with self.working_directory_lock:
+            self.prev_working_directory = os.getcwd()
+            os.chdir(os.path.join(abs_res_path,
+                                  os.path.normpath(self.working_directory)))
+            try:
+                extra_data["resourcePath"] = abs_res_path
+                extra_data["tmp_path"] = abs_tmp_path
+                self.result, self.error_msg = self.vm.run_task(self.src_code, extra_data)
+            finally:
+                self.end_time = time.time()
+                os.chdir(self.prev_working_directory)
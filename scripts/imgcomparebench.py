@@ -0,0 +1,95 @@
+"""Measure apps.rendering.resources.imgcompare.calculate_mse.
+
+Random PNG and EXR images are compared with the current, vectorized
+calculate_mse and with the previous implementation, which read every pixel
+of both images with get_pixel. The previous one is measured on smaller
+images and the result is scaled to the number of pixels; results of both
+are checked to be equal.
+
+    python scripts/imgcomparebench.py --size 2048 --legacy-size 256
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import click
+import numpy
+import OpenEXR
+from PIL import Image
+
+from apps.rendering.resources.imgcompare import calculate_mse
+from apps.rendering.resources.imgrepr import load_img
+
+
+def legacy_mse(img1, img2, start1=(0, 0), start2=(0, 0), box=None):
+    mse = 0
+    (res_x, res_y) = box or img1.get_size()
+    for i in range(0, res_x):
+        for j in range(0, res_y):
+            [r1, g1, b1] = img1.get_pixel((start1[0] + i, start1[1] + j))
+            [r2, g2, b2] = img2.get_pixel((start2[0] + i, start2[1] + j))
+            mse += (r1 - r2) * (r1 - r2) + \
+                (g1 - g2) * (g1 - g2) + \
+                (b1 - b2) * (b1 - b2)
+    return mse / (res_x * res_y * 3)
+
+
+def write_png(path, size, seed):
+    data = numpy.random.RandomState(seed).randint(0, 256, (size, size, 3))
+    Image.fromarray(data.astype(numpy.uint8)).save(path)
+
+
+def write_exr(path, size, seed):
+    data = numpy.random.RandomState(seed).random_sample((3, size, size))
+    exr = OpenEXR.OutputFile(path, OpenEXR.Header(size, size))
+    exr.writePixels({c: data[i].astype(numpy.float32).tostring()
+                     for i, c in enumerate('RGB')})
+    exr.close()
+
+
+def measure(func, img1, img2):
+    started = time.time()
+    result = func(img1, img2)
+    return result, time.time() - started
+
+
+def run(tmp_dir, ext, writer, size, legacy_size):
+    paths = {}
+    for name, res in [('large', size), ('small', legacy_size)]:
+        paths[name] = [os.path.join(tmp_dir, '{}{}{}'.format(name, i, ext))
+                       for i in range(2)]
+        for i, path in enumerate(paths[name]):
+            writer(path, res, i)
+
+    small = [load_img(path) for path in paths['small']]
+    large = [load_img(path) for path in paths['large']]
+
+    expected, legacy_time = measure(legacy_mse, *small)
+    result, _ = measure(calculate_mse, *small)
+    assert abs(result - expected) <= abs(expected) * 1e-9, (result, expected)
+
+    _, current_time = measure(calculate_mse, *large)
+    scale = float(size * size) / (legacy_size * legacy_size)
+    click.echo("{} {}x{}: vectorized {:.3f} s, per pixel {:.3f} s "
+               "(estimated from {}x{}), {:.0f}x faster".format(
+                   ext, size, size, current_time, legacy_time * scale,
+                   legacy_size, legacy_size,
+                   legacy_time * scale / current_time))
+
+
+@click.command()
+@click.option('--size', default=2048, help='Width and height of images')
+@click.option('--legacy-size', default=256,
+              help='Width and height of images for the previous version')
+def main(size, legacy_size):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        run(tmp_dir, '.png', write_png, size, legacy_size)
+        run(tmp_dir, '.exr', write_exr, size, legacy_size)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
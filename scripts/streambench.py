@@ -0,0 +1,188 @@
+"""Measure the throughput of golem.http.stream.ChunkStream.
+
+A local HTTP server streams random data with chunked transfer encoding;
+the data is read with the current bytearray based ChunkStream and with
+the previous parser, which kept received data as a list of characters.
+
+    python scripts/streambench.py --size 32 --legacy-size 4
+"""
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+
+import click
+import numpy
+
+from golem.http.stream import ChunkStream
+
+
+class ListChunkStream(ChunkStream):
+    """ The previous parser: received data as a list of characters,
+    separators searched element by element """
+
+    def __init__(self, *args, **kwargs):
+        ChunkStream.__init__(self, *args, **kwargs)
+        self.buf = []
+
+    def _read_headers(self):
+        while self.working and not self.eof:
+            try:
+                self._read_chunk()
+            except StopIteration:
+                self.eof = True
+
+            sep_idx = self.sublist_index(self.buf, self.long_sep_list)
+            if sep_idx != -1:
+                next_idx = sep_idx + self.long_sep_list_len
+                self._assert_headers(self.buf[:sep_idx])
+                self.buf = self.buf[next_idx:]
+                break
+
+    def _read_chunk(self):
+        if self.working and not self.eof:
+            try:
+                received = self._recv()
+                self.buf += self._recv_view[:received].tobytes()
+                return received
+            except StopIteration:
+                self.eof = True
+        return -1
+
+    def _read_chunk_line(self):
+        while self.working:
+
+            if self.content_size is None:
+                sep_idx = self.sublist_index(self.buf, self.short_sep_list)
+                if sep_idx == -1:
+                    n = self._read_chunk()
+                    if n <= 0 or not self.buf:
+                        raise StopIteration()
+                    continue
+
+                size_slice = self.buf[:sep_idx]
+                self.buf = self.buf[sep_idx + self.short_sep_len:]
+                if not size_slice:
+                    continue
+
+                self.content_size = int(''.join(size_slice), 16)
+                self.content_read = self.content_sent = 0
+                if self.content_size == 0:
+                    raise StopIteration()
+
+            if self.buf:
+                n = len(self.buf)
+            else:
+                n = self._read_chunk()
+                if n <= 0 or not self.buf:
+                    raise StopIteration()
+
+            self.content_read = min(self.content_size, self.content_read + n)
+
+            if self.content_read >= self.content_size:
+                last_idx = self.content_size - self.content_sent
+                result = ''.join(self.buf[:last_idx])
+                self.buf = self.buf[last_idx:]
+                self.data_read += self.content_read
+                self.content_size = None
+                self.content_sent = 0
+            else:
+                self.content_sent += len(self.buf)
+                result = ''.join(self.buf)
+                self.buf = []
+
+            return result
+
+    @staticmethod
+    def sublist_index(buf, seq, start_idx=0):
+        l_seq = len(seq)
+        for i in xrange(start_idx, len(buf)):
+            if buf[i:i + l_seq] == seq:
+                return i
+        return -1
+
+
+class ChunkedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = ''
+    chunk_size = 1024 * 1024
+
+    def do_GET(self):
+        size = int(self.path.strip('/'))
+        self.send_response(200)
+        self.send_header('Content-type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        sent = 0
+        while sent < size:
+            chunk = self.data[:min(self.chunk_size, size - sent)]
+            self.wfile.write('{:x}\r\n'.format(len(chunk)))
+            self.wfile.write(chunk)
+            self.wfile.write('\r\n')
+            sent += len(chunk)
+        self.wfile.write('0\r\n\r\n')
+
+    def log_message(self, *_):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def measure(stream_class, addr, size, read_size):
+    stream = stream_class(addr, '/{}'.format(size), timeouts=(10000, 10000))
+    received = 0
+    start = time.time()
+
+    stream.connect()
+    try:
+        while True:
+            data = stream.read(read_size)
+            if data is None:
+                break
+            received += len(data)
+    finally:
+        stream.disconnect()
+
+    elapsed = time.time() - start
+    if received != size:
+        raise ValueError("Received {} B instead of {} B"
+                         .format(received, size))
+    return size / elapsed / 1024 / 1024
+
+
+@click.command()
+@click.option("--size", default=32, help="Size of the stream [MB]")
+@click.option("--legacy-size", default=4,
+              help="Size of the stream read with the list parser [MB]")
+@click.option("--read-size", default=64 * 1024, help="Size of reads [B]")
+@click.option("--chunk-size", default=1024 * 1024,
+              help="Size of HTTP chunks [B]")
+@click.option("--repeat", default=3)
+def run(size, legacy_size, read_size, chunk_size, repeat):
+    ChunkedHandler.chunk_size = chunk_size
+    ChunkedHandler.data = numpy.random.RandomState(0).bytes(chunk_size)
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ChunkedHandler)
+    thread = Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    addr = httpd.server_address
+
+    try:
+        for name, stream_class, mb in [('bytearray', ChunkStream, size),
+                                       ('list', ListChunkStream,
+                                        legacy_size)]:
+            rates = [measure(stream_class, addr, mb * 1024 * 1024, read_size)
+                     for _ in xrange(repeat)]
+            print "{:>10}: {:8.2f} MB/s (best of {}, {} MB)".format(
+                name, max(rates), repeat, mb)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    run()
@@ -5,6 +5,7 @@ import unittest
 from os import path
 from random import randrange, shuffle
 
+from mock import Mock, patch
 from PIL import Image
 
 from apps.blender.benchmark.benchmark import BlenderBenchmark
@@ -17,6 +18,7 @@ from apps.blender.task.blenderrendertask import (BlenderDefaults,
                                                  PreviewUpdater,
                                                  logger)
 from apps.rendering.resources.imgrepr import load_img
+from apps.rendering.task.partitioner import AdaptivePartitioner
 from apps.rendering.task.renderingtaskstate import (AdvanceRenderingVerificationOptions,
                                                     RenderingTaskDefinition)
 
@@ -249,6 +251,55 @@ class TestBlenderTask(TempDirFixture, LogTestCase):
         self.bt.subtasks_given[1] = {'status': SubtaskStatus.finished}
         assert self.bt.query_extra_data(1000, 2, "ABC", "abc").ctd is None
 
+    def test_adaptive_subtasks(self):
+        bt = self.build_bt(2, 300, 30)
+        assert bt.partitioner is None
+        bt.task_definition.options.adaptive_subtasks = True
+        bt = BlenderRenderTask(node_name="example-node-name",
+                               task_definition=bt.task_definition,
+                               total_tasks=30,
+                               root_path=self.tempdir)
+        bt.initialize(DirManager(self.tempdir))
+        assert bt.partitioner is not None
+
+        # without any history single parts are given
+        ctd = bt.query_extra_data(1000, 2, "XYZ", "xyz").ctd
+        assert (ctd.extra_data['start_task'], ctd.extra_data['end_task']) == (1, 1)
+        assert ctd.subtask_id in bt.partitioner.pending
+
+        bt.partitioner.node_rates["ABC"] = 0.1
+        bt.partitioner.target_time = 50
+        ctd = bt.query_extra_data(1000, 2, "ABC", "abc").ctd
+        assert (ctd.extra_data['start_task'], ctd.extra_data['end_task']) == (2, 6)
+        assert bt.last_task == 6
+        assert "border_max_y = {:.3f}".format(bt._get_min_max_y(2)[1]) \
+            in ctd.extra_data['script_src']
+        assert "border_min_y = {:.3f}".format(bt._get_min_max_y(6)[0]) \
+            in ctd.extra_data['script_src']
+        assert bt.verificator._get_part_size(ctd.extra_data) == (2, 50)
+
+        bt.computation_failed(ctd.subtask_id)
+        assert ctd.subtask_id not in bt.partitioner.pending
+        ctd = bt.query_extra_data(1000, 2, "DEF", "def").ctd
+        assert (ctd.extra_data['start_task'], ctd.extra_data['end_task']) == (7, 7)
+
+    def test_adaptive_subtasks_frames(self):
+        bt = self.build_bt(2, 300, 4, frames=range(1, 9))
+        bt.partitioner = AdaptivePartitioner(4, 100)
+        bt.partitioner.node_rates["ABC"] = 0.02
+        ctd = bt.query_extra_data(1000, 2, "ABC", "abc").ctd
+        assert (ctd.extra_data['start_task'], ctd.extra_data['end_task']) == (1, 2)
+        assert ctd.extra_data['frames'] == [1, 2, 3, 4]
+
+    def test_get_min_max_y_range(self):
+        for tasks in [3, 7, 20]:
+            self.bt.total_tasks = tasks
+            for start in range(1, tasks + 1):
+                for end in range(start, tasks + 1):
+                    min_y, max_y = self.bt._get_min_max_y(start, end)
+                    assert max_y == self.bt._get_min_max_y(start)[1]
+                    assert min_y == self.bt._get_min_max_y(end)[0]
+
     def test_get_min_max_y(self):
         self.assertEquals(self.bt.res_x, 2)
         self.assertEquals(self.bt.res_y, 300)
@@ -467,6 +518,44 @@ class TestBlenderTask(TempDirFixture, LogTestCase):
         img.save(preview, "PNG")
         bt._update_preview(preview, 3)
 
+    def test_partial_results_received(self):
+        bt = self.build_bt(300, 200, 10)
+        dm = DirManager(self.tempdir)
+        bt.initialize(dm)
+        bt.preview_updater = Mock()
+        bt.subtasks_given["sub1"] = {'status': SubtaskStatus.starting, 'start_task': 2, 'end_task': 3}
+        partial = os.path.join(self.tempdir, "tile." + bt.output_format.lower())
+
+        assert bt.partial_results_received("sub1", [partial, "/tmp/progress.log"])
+        bt.preview_updater.update_partial_preview.assert_called_once_with(partial, 2, 3)
+        assert bt.get_partial_results("sub1") == sorted([partial, "/tmp/progress.log"])
+
+        bt.subtasks_given["sub1"]['status'] = SubtaskStatus.finished
+        assert not bt.partial_results_received("sub1", [partial])
+        assert bt.preview_updater.update_partial_preview.call_count == 1
+
+    def test_partial_frames(self):
+        # a subtask renders at most one frame
+        assert not self.build_bt(300, 200, 3, frames=[1, 2, 3]).stream_partial_results
+        assert not self.build_bt(300, 200, 6, frames=[1, 2, 3]).stream_partial_results
+
+        bt = self.build_bt(30, 20, 2, frames=[1, 2, 3, 4])
+        assert bt.stream_partial_results
+        ed = bt.query_extra_data(1000, 2, "ABC", "abc")
+        assert ed.ctd.stream_partial_results
+        subtask = bt.subtasks_given[ed.ctd.subtask_id]
+        assert subtask['frames'] == [1, 2]
+
+        # finished frames are named after their numbers
+        partial = os.path.join(self.tempdir, "1.png")
+        Image.new("RGB", (30, 20), (255, 0, 0)).save(partial)
+        other = os.path.join(self.tempdir, "3.png")
+        Image.new("RGB", (30, 20)).save(other)
+        with patch.object(bt, '_update_frame_preview') as update:
+            assert bt.partial_results_received(ed.ctd.subtask_id, [partial, other])
+            update.assert_called_once_with(partial, 1, final=True)
+        assert BlenderRenderTask._get_partial_frame_num("/tmp/tile.png") is None
+
 
 class TestPreviewUpdater(TempDirFixture, LogTestCase):
     def test_update_preview(self):
@@ -504,6 +593,47 @@ class TestPreviewUpdater(TempDirFixture, LogTestCase):
                 self.assertAlmostEqual(pu.perfect_match_area_y, res_y * scale_factor)
             self.assertTrue(pu.perfectly_placed_subtasks == chunks)
 
+    def test_update_preview_range(self):
+        preview_file = self.temp_file_name('sample_img.png')
+        expected_offsets = generate_expected_offsets(6, 200, 60)
+        pu = PreviewUpdater(preview_file, 200, expected_offsets[-1], expected_offsets)
+        for start, end in [(3, 5), (6, 6), (1, 2)]:
+            img = Image.new("RGB", (200, 10 * (end - start + 1)))
+            file1 = self.temp_file_name('chunk{}.png'.format(start))
+            img.save(file1)
+            pu.update_preview(file1, start, end)
+        assert pu.perfectly_placed_subtasks == 6
+        assert pu.perfect_match_area_y == 60
+        assert pu.chunk_ends == {1: 2, 3: 5, 6: 6}
+
+    def test_update_partial_preview(self):
+        preview_file = self.temp_file_name('sample_img.bmp')
+        expected_offsets = generate_expected_offsets(6, 200, 60)
+        pu = PreviewUpdater(preview_file, 200, expected_offsets[-1], expected_offsets)
+
+        partial = self.temp_file_name('partial.png')
+        Image.new("RGB", (200, 20), (255, 255, 255)).save(partial)
+        pu.update_partial_preview(partial, 1, 2)
+        # partial results are not registered as computed chunks
+        assert pu.chunks == {}
+        assert pu.perfectly_placed_subtasks == 0
+        img = Image.open(preview_file)
+        assert img.getpixel((0, 0)) == (255, 255, 255)
+        assert img.getpixel((0, expected_offsets[3])) == (0, 0, 0)
+        img.close()
+
+        final = self.temp_file_name('chunk3.png')
+        Image.new("RGB", (200, 10), (0, 0, 255)).save(final)
+        pu.update_preview(final, 3)
+        img = Image.open(preview_file)
+        # the partial result is kept until the final one arrives
+        assert img.getpixel((0, 0)) == (255, 255, 255)
+        assert img.getpixel((0, expected_offsets[3])) == (0, 0, 255)
+        img.close()
+
+        with self.assertLogs(logger, level="WARNING"):
+            pu.update_partial_preview("Not existing", 4)
+
     def test_error_in_preview_update(self):
         pu = PreviewUpdater(None, 300, 200, {})
         with self.assertLogs(logger, level="WARNING"):
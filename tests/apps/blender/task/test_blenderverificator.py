@@ -22,6 +22,7 @@ class TestBlenderVerificator(TestCase):
         bv.res_y = 600
         bv.total_tasks = 20
         assert bv._get_part_size({"start_task": 3}) == (800, 30)
+        assert bv._get_part_size({"start_task": 3, "end_task": 5}) == (800, 90)
         bv.use_frames = True
         bv.frames = range(40)
         assert bv._get_part_size({"start_task": 3}) == (800, 600)
@@ -15,6 +15,7 @@ from golem.resource.dirmanager import DirManager
 from golem.resource.resource import TaskResourceHeader
 from golem.resource.resourcesmanager import DistributedResourceManager
 from golem.task.taskbase import result_types, TaskEventListener
+from golem.task.taskclient import TaskClient
 from golem.task.taskstate import SubtaskStatus
 from golem.tools.assertlogs import LogTestCase
 from golem.tools.testdirfixture import TestDirFixture
@@ -22,6 +23,7 @@ from golem.tools.testdirfixture import TestDirFixture
 from apps.core.task.coretask import (CoreTask, logger, log_key_error, TaskTypeInfo,
                                      CoreTaskBuilder, AcceptClientVerdict)
 from apps.core.task.coretaskstate import TaskDefinition
+from apps.core.task.verificator import SubtaskVerificationState
 
 
 class TestCoreTask(LogTestCase, TestDirFixture):
@@ -245,7 +247,8 @@ class TestCoreTask(LogTestCase, TestDirFixture):
         task.restart()
         assert task.num_tasks_received == 0
         assert task.last_task == 8
-        assert task.num_failed_subtasks == 5
+        # "def" and "jkl" compute the same part, it is resent only once
+        assert task.num_failed_subtasks == 4
         assert task.subtasks_given["xyz"]["status"] == SubtaskStatus.restarted
         assert task.subtasks_given["abc"]["status"] == SubtaskStatus.failure
         assert task.subtasks_given["def"]["status"] == SubtaskStatus.restarted
@@ -293,6 +296,96 @@ class TestCoreTask(LogTestCase, TestDirFixture):
         c.num_failed_subtasks = 0
         assert not c.needs_computation()
 
+    def test_speculative_subtasks(self):
+        c = self._get_core_task()
+        c.total_tasks = 3
+        c.last_task = 3
+        c.subtasks_given["a"] = {'status': SubtaskStatus.finished, 'start_task': 1,
+                                 'end_task': 1, 'node_id': 'A', 'perf': 10}
+        c.subtasks_given["b"] = {'status': SubtaskStatus.starting, 'start_task': 2,
+                                 'end_task': 2, 'node_id': 'B', 'perf': 5}
+        c.subtasks_given["c"] = {'status': SubtaskStatus.starting, 'start_task': 3,
+                                 'end_task': 3, 'node_id': 'C', 'perf': 20}
+        assert c.needs_computation()
+        # slowest node's part first, not for the same or slower node
+        assert c._get_speculative_subtask(30, 'D') == "b"
+        assert c._get_speculative_subtask(30, 'B') == "c"
+        assert c._get_speculative_subtask(10, 'D') == "b"
+        assert c._get_speculative_subtask(5, 'D') is None
+
+        c.speculative_threshold = 1
+        assert not c.needs_computation()
+        assert c._get_speculative_subtask(30, 'D') is None
+        c.speculative_threshold = 2
+
+        c.subtasks_given["d"] = {'status': SubtaskStatus.starting, 'start_task': 2,
+                                 'end_task': 2, 'node_id': 'D', 'perf': 30}
+        for node in ['A', 'B', 'C', 'D']:
+            c.counting_nodes[node] = TaskClient(node)
+            c.counting_nodes[node].start()
+        # part 2 is already duplicated
+        assert c._get_speculative_subtask(30, 'E') == "c"
+        assert c.get_duplicated_subtasks("b") == ["d"]
+
+        c.accept_results("d", [])
+        assert c.subtasks_given["d"]['status'] == SubtaskStatus.finished
+        assert c.subtasks_given["b"]['status'] == SubtaskStatus.cancelled
+        assert c.counting_nodes['B'].started() == 0
+        assert c.get_duplicated_subtasks("d") == ["b"]
+
+        # failure of a duplicated part does not cause a resend
+        c.subtasks_given["e"] = {'status': SubtaskStatus.starting, 'start_task': 3,
+                                 'end_task': 3, 'node_id': 'E', 'perf': 30}
+        c.counting_nodes['E'] = TaskClient('E')
+        c.computation_failed("e")
+        assert c.subtasks_given["e"]['status'] == SubtaskStatus.resent
+        assert c.num_failed_subtasks == 0
+        c.computation_failed("c")
+        assert c.subtasks_given["c"]['status'] == SubtaskStatus.failure
+        assert c.num_failed_subtasks == 1
+        assert c._get_speculative_subtask(30, 'F') is None
+
+    def test_query_extra_data_batch(self):
+        c = self._get_core_task()
+        c.total_tasks = 5
+
+        def _query_extra_data(perf_index, num_cores=0, node_id=None, node_name=None):
+            if c.last_task == c.total_tasks:
+                c._release_client(node_id)
+                return c.ExtraData()
+            c.last_task += 1
+            return c.ExtraData(ctd="ctd{}".format(c.last_task))
+
+        def query_extra_data(perf_index, num_cores=0, node_id=None, node_name=None):
+            verdict = c._accept_client(node_id)
+            if verdict != AcceptClientVerdict.ACCEPTED:
+                return c.ExtraData(should_wait=verdict == AcceptClientVerdict.SHOULD_WAIT)
+            return _query_extra_data(perf_index, num_cores, node_id, node_name)
+
+        c.query_extra_data = query_extra_data
+        c._query_extra_data = _query_extra_data
+
+        batch = c.query_extra_data_batch(1000, 1, "A", "A", 3)
+        assert [e.ctd for e in batch] == ["ctd1", "ctd2", "ctd3"]
+        assert c.counting_nodes["A"].started() == 3
+        assert c.max_pending_client_results == 1
+
+        # node waits for results of the previous batch
+        batch = c.query_extra_data_batch(1000, 1, "A", "A", 3)
+        assert len(batch) == 1
+        assert batch[0].should_wait
+        assert c.counting_nodes["A"].started() == 3
+
+        # batch ends with the last part of the task
+        batch = c.query_extra_data_batch(1000, 1, "B", "B", 3)
+        assert [e.ctd for e in batch] == ["ctd4", "ctd5"]
+        assert c.counting_nodes["B"].started() == 2
+
+        batch = c.query_extra_data_batch(1000, 1, "C", "C", 3)
+        assert len(batch) == 1
+        assert batch[0].ctd is None
+        assert c.counting_nodes["C"].started() == 0
+
     def test_get_active_tasks(self):
         c = self._get_core_task()
         assert c.get_active_tasks() == 0
@@ -394,6 +487,50 @@ class TestCoreTask(LogTestCase, TestDirFixture):
         c._mark_subtask_failed("subtask1")
         assert c._accept_client("Node 1") == AcceptClientVerdict.REJECTED
 
+    def test_partial_results_received(self):
+        c = self._get_core_task()
+        assert not c.partial_results_received("unknown", ["/tmp/a/tile.png"])
+        c.subtasks_given["subtask1"] = {"status": SubtaskStatus.starting}
+
+        assert c.partial_results_received("subtask1", ["/tmp/1/tile.png", "/tmp/1/log.txt"])
+        # newer snapshots replace the previous ones
+        assert c.partial_results_received("subtask1", ["/tmp/2/tile.png"])
+        assert c.get_partial_results("subtask1") == ["/tmp/1/log.txt", "/tmp/2/tile.png"]
+
+        c.computation_failed("subtask1")
+        assert c.get_partial_results("subtask1") == []
+
+        c.subtasks_given["subtask1"]["status"] = SubtaskStatus.finished
+        assert not c.partial_results_received("subtask1", ["/tmp/3/tile.png"])
+        assert c.get_partial_results("subtask1") == []
+
+    def test_verify_results(self):
+        c = self._get_core_task()
+        c.subtasks_given["subtask1"] = {"status": SubtaskStatus.starting, "node_id": "Node 1"}
+        c._accept_client("Node 1")
+        files = self.additional_dir_content([1])
+        c.partial_results_received("subtask1", ["/tmp/1/tile.png"])
+        c.subtasks_given["subtask1"]["status"] = SubtaskStatus.downloading
+
+        ver_state = c.verify_results("subtask1", files, result_types['files'])
+        assert ver_state == SubtaskVerificationState.VERIFIED
+        # the state of the task is changed only in results_verified
+        assert c.subtasks_given["subtask1"]["status"] == SubtaskStatus.downloading
+        assert c.get_partial_results("subtask1") == ["/tmp/1/tile.png"]
+
+        c.results_verified("subtask1", ver_state)
+        assert c.subtasks_given["subtask1"]["status"] == SubtaskStatus.finished
+        assert c.get_partial_results("subtask1") == []
+
+        # results are not accepted twice
+        assert c.verify_results("subtask1", files, result_types['files']) is None
+        c.results_verified("subtask1", SubtaskVerificationState.WRONG_ANSWER)
+        assert c.subtasks_given["subtask1"]["status"] == SubtaskStatus.finished
+
+        c.subtasks_given["subtask2"] = {"status": SubtaskStatus.downloading, "node_id": "Node 1"}
+        c.results_verified("subtask2", SubtaskVerificationState.WRONG_ANSWER)
+        assert c.subtasks_given["subtask2"]["status"] == SubtaskStatus.failure
+
     def test_create_path_in_load_task_result(self):
         c = self._get_core_task()
         assert not os.path.isdir(os.path.join(c.tmp_dir, "subtask1"))
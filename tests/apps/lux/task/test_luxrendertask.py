@@ -20,6 +20,7 @@ from apps.lux.task.luxrendertask import (
     LuxRenderTaskBuilder,
     LuxRenderTaskTypeInfo
 )
+from apps.rendering.resources.imgrepr import ArrayImgRepr
 from apps.rendering.task.renderingtaskstate import RenderingTaskDefinition
 
 
@@ -224,6 +225,8 @@ class TestLuxRenderTask(TempDirFixture, LogTestCase, PEP8MixIn):
         luxtask._update_preview(str(p), 1)
         # Run update again (should blend)
         luxtask._update_preview(str(p), 2)
+        assert isinstance(luxtask.preview_exr, ArrayImgRepr)
+        assert luxtask.preview_exr.get_size() == (10, 10)
 
     def test_errors(self):
         luxtask = self.get_test_lux_task()
@@ -1,5 +1,6 @@
 import os
 
+import numpy
 from PIL import Image
 
 
@@ -8,7 +9,8 @@ from apps.rendering.resources.imgcompare import (advance_verify_img,
                                                  compare_imgs,
                                                  compare_pil_imgs,
                                                  calculate_mse,
-                                                 calculate_psnr, logger)
+                                                 calculate_psnr, crop_array,
+                                                 logger)
 from apps.rendering.resources.imgrepr import load_img, PILImgRepr
 
 from golem.testutils import TempDirFixture
@@ -224,3 +226,70 @@ class TestCompareImgFunctions(TempDirFixture, LogTestCase):
                                       img_path, (0, 0))
         assert not advance_verify_img(img_path, 10, 10, (0, 0), (2, 2),
                                       exr_path, (0, 0))
+
+    def test_crop_array(self):
+        img = get_pil_img_repr(self.temp_file_name("img.png"))
+        img.set_pixel((3, 2), [1, 2, 3])
+
+        array = crop_array(img)
+        assert array.shape == (10, 10, 3)
+        array = crop_array(img, start=(3, 2), box=(4, 5))
+        assert array.shape == (5, 4, 3)
+        assert array.dtype == numpy.float32
+        assert list(array[0, 0]) == [1, 2, 3]
+        assert list(array[1, 0]) == [255, 0, 0]
+
+        for start, box in [((0, 0), (11, 10)), ((0, 0), (10, 11)),
+                           ((5, 0), (6, 1)), ((-1, 0), (2, 2)),
+                           ((0, 0), (0, 2))]:
+            with self.assertRaises(ValueError):
+                crop_array(img, start, box)
+
+
+def _reference_mse(img1, img2, start1=(0, 0), start2=(0, 0), box=None):
+    """ The previous, per pixel implementation of calculate_mse """
+    mse = 0
+    (res_x, res_y) = box or img1.get_size()
+    for i in range(0, res_x):
+        for j in range(0, res_y):
+            [r1, g1, b1] = img1.get_pixel((start1[0] + i, start1[1] + j))
+            [r2, g2, b2] = img2.get_pixel((start2[0] + i, start2[1] + j))
+            mse += (r1 - r2) * (r1 - r2) + \
+                (g1 - g2) * (g1 - g2) + \
+                (b1 - b2) * (b1 - b2)
+    return mse / (res_x * res_y * 3)
+
+
+class TestVectorizedMse(TempDirFixture):
+
+    def _random_pil(self, name, seed):
+        path = self.temp_file_name(name)
+        data = numpy.random.RandomState(seed).randint(0, 256, (30, 40, 3))
+        Image.fromarray(data.astype(numpy.uint8)).save(path)
+        return load_img(path)
+
+    def test_pil(self):
+        img1 = self._random_pil("img1.png", 0)
+        img2 = self._random_pil("img2.png", 1)
+
+        for args in [dict(), dict(start1=(3, 4), start2=(10, 2),
+                                  box=(20, 17))]:
+            expected = _reference_mse(img1, img2, **args)
+            assert calculate_mse(img1, img2, **args) == expected
+            assert isinstance(calculate_mse(img1, img2, **args), int)
+
+    def test_exr(self):
+        img1 = get_exr_img_repr()
+        img2 = get_exr_img_repr(alt=True)
+
+        for args in [dict(), dict(start1=(1, 2), start2=(4, 3),
+                                  box=(5, 6))]:
+            expected = _reference_mse(img1, img2, **args)
+            assert abs(calculate_mse(img1, img2, **args) - expected) < \
+                expected * 1e-9
+
+        # mixed image types
+        img3 = self._random_pil("img3.png", 2)
+        expected = _reference_mse(img1, img3, box=(10, 10))
+        assert abs(calculate_mse(img1, img3, box=(10, 10)) - expected) < \
+            expected * 1e-9
@@ -0,0 +1,225 @@
+import unittest
+
+import numpy
+from PIL import Image
+
+from apps.blender.task.verificator import BlenderVerificator
+from apps.lux.task.verificator import LuxRenderVerificator
+from apps.rendering.resources import imgmetrics
+from apps.rendering.resources.imgcompare import advance_verify_img, \
+    compare_imgs
+from apps.rendering.resources.imgmetrics import (applicable_metrics,
+                                                 check_metrics,
+                                                 compare_arrays,
+                                                 compute_metrics,
+                                                 edge_similarity, METRICS,
+                                                 register_metric, ssim)
+from apps.rendering.resources.imgrepr import load_img
+
+from golem.testutils import TempDirFixture
+
+from imghelper import get_exr_img_repr, get_test_exr
+
+
+def make_scene(size=48):
+    y, x = numpy.mgrid[0:size, 0:size]
+    scene = numpy.dstack([128 + 100 * numpy.sin(x / 7.0),
+                          128 + 100 * numpy.cos(y / 9.0),
+                          128 + 50 * numpy.sin((x + y) / 5.0)])
+    scene[10:30, 15:35] = 30
+    return scene
+
+
+def add_noise(scene, deviation, seed=0):
+    noise = numpy.random.RandomState(seed).normal(0, deviation, scene.shape)
+    return numpy.clip(scene + noise, 0, 255)
+
+
+def reference_ssim(arr1, arr2, max_val, window):
+    """ SSIM computed window by window """
+    c1 = (0.01 * max_val) ** 2
+    c2 = (0.03 * max_val) ** 2
+    values = []
+    for y in range(arr1.shape[0] - window + 1):
+        for x in range(arr1.shape[1] - window + 1):
+            for c in range(arr1.shape[2]):
+                w1 = arr1[y:y + window, x:x + window, c]
+                w2 = arr2[y:y + window, x:x + window, c]
+                mu1, mu2 = w1.mean(), w2.mean()
+                cov = ((w1 - mu1) * (w2 - mu2)).mean()
+                values.append((2 * mu1 * mu2 + c1) * (2 * cov + c2) /
+                              ((mu1 ** 2 + mu2 ** 2 + c1) *
+                               (w1.var() + w2.var() + c2)))
+    return numpy.mean(values)
+
+
+class TestImgMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = make_scene()
+
+    def test_equal(self):
+        values = compute_metrics(self.scene, self.scene, 255, METRICS.keys())
+        assert values == {'psnr': float('inf'),
+                          'channel_psnr': float('inf'),
+                          'ssim': 1.0,
+                          'edges': 1.0,
+                          'histogram': 0.0}
+
+    def test_noise(self):
+        names = METRICS.keys()
+        slight = compute_metrics(self.scene, add_noise(self.scene, 3), 255,
+                                 names)
+        strong = compute_metrics(self.scene, add_noise(self.scene, 25), 255,
+                                 names)
+        for name in ['psnr', 'channel_psnr', 'ssim', 'edges']:
+            assert slight[name] > strong[name]
+        assert slight['histogram'] < strong['histogram']
+        assert strong['ssim'] < 0.6
+
+    def test_ssim(self):
+        noisy = add_noise(self.scene[:16, :16], 10)
+        for window in [3, 7]:
+            expected = reference_ssim(self.scene[:16, :16], noisy, 255,
+                                      window)
+            assert abs(ssim(self.scene[:16, :16], noisy, 255, window) -
+                       expected) < 1e-9
+
+        # windows larger than the box
+        small = self.scene[:2, :4]
+        assert abs(ssim(small, small * 0.5, 255) -
+                   reference_ssim(small, small * 0.5, 255, 2)) < 1e-9
+
+    def test_channel_psnr(self):
+        other = self.scene.copy()
+        other[:, :, 2] += 10
+        values = compute_metrics(self.scene, other, 255,
+                                 ['psnr', 'channel_psnr'])
+        assert values['channel_psnr'] < values['psnr']
+        assert abs(values['channel_psnr'] - 20 * numpy.log10(25.5)) < 1e-9
+
+    def test_histogram(self):
+        black = numpy.zeros((4, 4, 3))
+        white = numpy.ones((4, 4, 3)) * 255
+        half = black.copy()
+        half[:2] = 255
+
+        def distance(arr1, arr2):
+            return compute_metrics(arr1, arr2, 255, ['histogram'])['histogram']
+
+        assert distance(black, white) == 1.0
+        assert distance(black, half) == 0.5
+        # histograms do not depend on positions of pixels
+        assert distance(half, half[::-1]) == 0.0
+
+    def test_edges(self):
+        flat = numpy.ones((8, 8, 3)) * 100
+
+        def edges(arr1, arr2):
+            return compute_metrics(arr1, arr2, 255, ['edges'])['edges']
+
+        assert edges(flat, flat * 0.5) == 1.0
+        assert edges(flat, self.scene[:8, :8]) == 0.0
+        assert edges(flat[:1, :1], flat[:1, :1]) == 1.0
+        # shifted edges
+        shifted = numpy.roll(self.scene, 4, axis=1)
+        assert edges(self.scene, shifted) < 0.7
+
+    def test_check_metrics(self):
+        values = {'psnr': 31.0, 'ssim': 0.7, 'histogram': 0.2}
+        assert check_metrics(values, {'psnr': 30, 'histogram': 0.3}) == []
+        assert check_metrics(values, {'psnr': 32, 'ssim': 0.8,
+                                      'histogram': 0.1}) == \
+            ['histogram', 'psnr', 'ssim']
+
+    def test_compare_arrays(self):
+        thresholds = {'psnr': 30, 'ssim': 0.8}
+        assert compare_arrays(self.scene, add_noise(self.scene, 3), 255,
+                              thresholds)
+        assert not compare_arrays(self.scene, add_noise(self.scene, 25), 255,
+                                  thresholds)
+        with self.assertRaises(ValueError):
+            compare_arrays(self.scene, self.scene[1:], 255, thresholds)
+        with self.assertRaises(KeyError):
+            compare_arrays(self.scene, self.scene, 255, {'unknown': 1})
+
+    def test_applicable_metrics(self):
+        names = ['psnr', 'ssim', 'histogram', 'edges']
+        assert sorted(applicable_metrics((5, 5, 3), names)) == ['psnr']
+        assert sorted(applicable_metrics((31, 64, 3), names)) == ['psnr']
+        assert sorted(applicable_metrics((32, 32, 3), names)) == sorted(names)
+
+    def test_small_noisy_box(self):
+        # flat box with +-1 noise: structural metrics would reject it
+        flat = numpy.full((5, 5, 3), 128.0)
+        noise = numpy.random.RandomState(0).randint(-1, 2, flat.shape)
+        assert edge_similarity(flat, flat + noise, 255) < 0.8
+        for thresholds in [BlenderVerificator.METRIC_THRESHOLDS,
+                           LuxRenderVerificator.METRIC_THRESHOLDS]:
+            assert compare_arrays(flat, flat + noise, 255, thresholds)
+            assert not compare_arrays(flat, flat + 40 * noise, 255,
+                                      thresholds)
+
+    def test_register_metric(self):
+        register_metric('max_diff', lambda a, b, _: abs(a - b).max(),
+                        higher_is_better=False)
+        try:
+            other = self.scene.copy()
+            other[0, 0, 0] += 5
+            assert compare_arrays(self.scene, other, 255, {'max_diff': 5})
+            assert not compare_arrays(self.scene, other, 255,
+                                      {'max_diff': 4})
+        finally:
+            del imgmetrics.METRICS['max_diff']
+
+
+class TestCompareWithThresholds(TempDirFixture):
+
+    def _save(self, name, array):
+        path = self.temp_file_name(name)
+        Image.fromarray(array.astype(numpy.uint8)).save(path)
+        return path
+
+    def test_compare_imgs(self):
+        scene = make_scene()
+        img = load_img(self._save('scene.png', scene))
+        noisy_path = self._save('noisy.png', add_noise(scene, 12))
+        noisy = load_img(noisy_path)
+        thresholds = {'psnr': 25}
+
+        # PSNR alone accepts strong noise; SSIM does not
+        assert compare_imgs(img, noisy, thresholds=thresholds)
+        thresholds['ssim'] = 0.9
+        assert not compare_imgs(img, noisy, thresholds=thresholds)
+        assert compare_imgs(img, img, thresholds=thresholds)
+        assert compare_imgs(img, img, start1=(15, 10), start2=(15, 10),
+                            box=(20, 20), thresholds=thresholds)
+        assert not compare_imgs(img, img, start1=(0, 0), start2=(15, 10),
+                                box=(20, 20), thresholds=thresholds)
+
+        path = self._save('other.png', scene)
+        assert advance_verify_img(path, 48, 48, (0, 0), (10, 10),
+                                  path, (0, 0), thresholds=thresholds)
+        assert not advance_verify_img(path, 48, 48, (0, 0), (48, 48),
+                                      noisy_path, (0, 0),
+                                      thresholds=thresholds)
+
+    def test_small_noisy_box(self):
+        flat = numpy.full((10, 10, 3), 128.0)
+        noise = numpy.random.RandomState(1).randint(-1, 2, flat.shape)
+        path = self._save('flat.png', flat)
+        noisy_path = self._save('flat_noisy.png', flat + noise)
+        # default verification box
+        assert advance_verify_img(path, 10, 10, (2, 3), (5, 5), noisy_path,
+                                  (2, 3), thresholds=BlenderVerificator.
+                                  METRIC_THRESHOLDS)
+
+    def test_exr(self):
+        thresholds = {'psnr': 30, 'ssim': 0.9, 'edges': 0.9}
+        exr1 = get_exr_img_repr()
+        exr2 = get_exr_img_repr(alt=True)
+        assert compare_imgs(exr1, exr1, max_col=1, thresholds=thresholds)
+        assert not compare_imgs(exr1, exr2, max_col=1, thresholds=thresholds)
+        assert advance_verify_img(get_test_exr(), 10, 10, (0, 0), (5, 5),
+                                  get_test_exr(), (0, 0),
+                                  thresholds=thresholds)
@@ -2,14 +2,16 @@ import os
 import unittest
 
 import Imath
+import numpy
 from PIL import Image
 
 from golem.testutils import TempDirFixture
 from golem.tools.assertlogs import LogTestCase
 
-from apps.rendering.resources.imgrepr import (blend, EXRImgRepr, ImgRepr,
-                                              load_as_pil, load_img, logger,
-                                              PILImgRepr)
+from apps.rendering.resources.imgrepr import (ArrayImgRepr, blend,
+                                              EXRImgRepr, ImgRepr,
+                                              load_array_img, load_as_pil,
+                                              load_img, logger, PILImgRepr)
 
 from imghelper import (get_exr_img_repr, get_pil_img_repr, get_test_exr,
                        make_test_img)
@@ -86,6 +88,24 @@ class TestPILImgRepr(TempDirFixture):
         assert p_copy.get_pixel((5, 3)) == [200, 210, 220]
         assert p.get_pixel((5, 3)) == [255, 0, 0]
 
+    def test_to_array(self):
+        p = get_pil_img_repr(self.temp_file_name('img.png'), (10, 8))
+        p.set_pixel((3, 5), [10, 11, 12])
+        array = p.to_array()
+        assert array.shape == (8, 10, 3)
+        assert array.dtype == numpy.float32
+        assert list(array[5, 3]) == [10, 11, 12]
+        assert (ImgRepr.to_array(p) == array).all()
+
+    def test_set_array(self):
+        p = get_pil_img_repr(self.temp_file_name('img.png'), (10, 8))
+        array = numpy.zeros((8, 10, 3))
+        array[5, 3] = [10.7, -3, 300]
+        p.set_array(array)
+        assert p.img.mode == 'RGB'
+        assert p.get_pixel((3, 5)) == [10, 0, 255]
+        assert p.get_pixel((0, 0)) == [0, 0, 0]
+
 
 def almost_equal(v1, v2):
     assert abs(v1 - v2) < 0.001
@@ -166,7 +186,46 @@ class TestExrImgRepr(TempDirFixture):
         assert e_copy.min == 0.0
         assert e_copy.max == 1.0
 
+    def test_copy(self):
+        e = get_exr_img_repr()
+        e.set_pixel((1, 1), [0.1, 0.2, 0.3])
+        e_copy = e.copy()
+        assert e_copy.img is e.img
+        assert e_copy.file_path == e.file_path
+        assert (e_copy.to_array() == e.to_array()).all()
+        e_copy.set_pixel((1, 1), [0.4, 0.5, 0.6])
+        almost_equal_pixels(e.get_pixel((1, 1)), [0.1, 0.2, 0.3])
+
+    def test_set_array(self):
+        e = get_exr_img_repr()
+        e.max = 0.8
+        array = e.to_array()
+        array[2, 4] = [0.25, 1.5, -1]
+        e.set_array(array)
+        assert [c.mode for c in e.rgb] == ['F', 'F', 'F']
+        assert e.get_pixel((4, 2)) == [0.25, 0.800000011920929, 0.0]
+        assert e.get_pixel((9, 9)) == get_exr_img_repr().get_pixel((9, 9))
+
+        # the previous implementation of set_pixel
+        e = get_exr_img_repr()
+        ImgRepr.set_array(e, array)
+        assert (e.to_array() == numpy.clip(array, 0, 1)).all()
+
     def test_to_pil(self):
+        def point_to_pil(exr, lightest, darkest):
+            scale = 255.0 / (lightest - darkest)
+            return Image.merge("RGB", [im.point(lambda v: v * scale)
+                                       .convert("L") for im in exr.rgb])
+
+        for alt in [False, True]:
+            e = get_exr_img_repr(alt)
+            lightest, darkest = e.get_rgbf_extrema()
+            assert e.to_pil().tobytes() == \
+                point_to_pil(e, 1.0, 0.0).tobytes()
+            assert e.to_pil(use_extremas=True).tobytes() == \
+                point_to_pil(e, lightest if lightest != darkest else 0.1,
+                             darkest).tobytes()
+
         e = get_exr_img_repr()
 
         img = e.to_pil()
@@ -182,6 +241,16 @@ class TestExrImgRepr(TempDirFixture):
         img3 = img_alt.to_pil(use_extremas=True)
         assert isinstance(img3, Image.Image)
 
+    def test_to_array(self):
+        e = get_exr_img_repr()
+        e.set_pixel((4, 2), [0.25, 0.5, 0.75])
+        array = e.to_array()
+        assert array.shape == (10, 10, 3)
+        assert array.dtype == numpy.float32
+        assert list(array[2, 4]) == [0.25, 0.5, 0.75]
+        assert list(array[9, 9]) == e.get_pixel((9, 9))
+        assert (ImgRepr.to_array(e) == array).all()
+
     def test_to_l_image(self):
         e = get_exr_img_repr()
         img = e.to_l_image()
@@ -195,6 +264,137 @@ class TestExrImgRepr(TempDirFixture):
         assert e.get_rgbf_extrema() == (3.71875, 0.10687255859375)
 
 
+class TestArrayImgRepr(TempDirFixture):
+
+    def test_init(self):
+        img = ArrayImgRepr()
+        assert isinstance(img, ImgRepr)
+        assert img.array is None
+        assert img.type == "ARRAY"
+        assert (img.min, img.max) == (0.0, 1.0)
+
+    def test_load(self):
+        img = ArrayImgRepr()
+        img.load_from_file(get_test_exr())
+        exr = get_exr_img_repr()
+        assert img.array.dtype == numpy.float32
+        assert img.array.flags.c_contiguous
+        assert img.get_size() == (10, 10)
+        assert (img.to_array() == exr.to_array()).all()
+        assert img.get_pixel((5, 5)) == exr.get_pixel((5, 5))
+        assert (img.min, img.max) == (0.0, 1.0)
+        assert img.get_rgbf_extrema() == exr.get_rgbf_extrema()
+
+        img_path = self.temp_file_name('img.png')
+        pil = get_pil_img_repr(img_path, (10, 8), (1, 2, 3))
+        img.load_from_file(img_path)
+        assert img.get_size() == (10, 8)
+        assert (img.to_array() == pil.to_array()).all()
+        assert (img.min, img.max) == (0.0, 255.0)
+
+        with self.assertRaises(Exception):
+            img.load_from_file("unknown file.exr")
+
+    def test_set_pixel(self):
+        img = load_array_img(get_test_exr())
+        img.set_pixel((3, 1), [0.25, 2, -1])
+        assert img.get_pixel((3, 1)) == [0.25, 1.0, 0.0]
+        img.set_array(numpy.ones((2, 3, 3)) * 3)
+        assert img.get_size() == (3, 2)
+        assert img.array.dtype == numpy.float32
+        assert img.get_pixel((2, 1)) == [1.0, 1.0, 1.0]
+
+    def test_copy(self):
+        img = load_array_img(get_test_exr())
+        pixel = img.get_pixel((3, 1))
+        img_copy = img.copy()
+        assert img_copy.array is img.array
+
+        img_copy.set_pixel((3, 1), [0.25, 0.5, 0.75])
+        assert img_copy.get_pixel((3, 1)) == [0.25, 0.5, 0.75]
+        assert img.get_pixel((3, 1)) == pixel
+
+        img_copy = img.copy()
+        img.set_pixel((3, 1), [0.25, 0.5, 0.75])
+        assert img_copy.get_pixel((3, 1)) == pixel
+
+    def test_crop(self):
+        img = load_array_img(get_test_exr())
+        box = img.crop((2, 3), (4, 5))
+        assert box.get_size() == (4, 5)
+        assert numpy.may_share_memory(box.array, img.array)
+        assert box.get_pixel((0, 0)) == img.get_pixel((2, 3))
+        assert box.get_pixel((3, 4)) == img.get_pixel((5, 7))
+
+        pixel = img.get_pixel((2, 3))
+        box.set_pixel((0, 0), [0, 0, 0])
+        assert img.get_pixel((2, 3)) == pixel
+        img.set_pixel((5, 7), [0, 0, 0])
+        assert box.get_pixel((3, 4)) != [0, 0, 0]
+
+        for start, size in [((0, 0), (0, 5)), ((-1, 0), (2, 2)),
+                            ((8, 0), (3, 2)), ((0, 9), (2, 2))]:
+            with self.assertRaises(ValueError):
+                img.crop(start, size)
+
+    def test_paste(self):
+        img = ArrayImgRepr(numpy.zeros((4, 5, 3), dtype=numpy.float32))
+        part = ArrayImgRepr(numpy.ones((2, 2, 3), dtype=numpy.float32) * 2)
+        img.paste(part, (1, 2))
+        assert img.array[:, :, 0].tolist() == [[0, 0, 0, 0, 0],
+                                               [0, 0, 0, 0, 0],
+                                               [0, 1, 1, 0, 0],
+                                               [0, 1, 1, 0, 0]]
+        # parts outside of the image are skipped
+        img.paste(part, (4, -1))
+        assert img.array[:, 4, 1].tolist() == [1, 0, 0, 0]
+        img.paste(part, (6, 0))
+        assert img.array.sum() == 15
+
+        # other representations can be pasted
+        pil = get_pil_img_repr(self.temp_file_name('img.png'), (2, 1))
+        img.max = 255
+        img.paste(pil, (0, 0))
+        assert img.get_pixel((1, 0)) == [255, 0, 0]
+
+    def test_blend(self):
+        exr1 = load_array_img(get_test_exr())
+        exr2 = load_array_img(get_test_exr(alt=True))
+        for alpha in [0, 0.1, 0.5, 1]:
+            expected = blend(get_exr_img_repr(), get_exr_img_repr(alt=True),
+                             alpha)
+            result = blend(exr1, exr2, alpha)
+            assert isinstance(result, ArrayImgRepr)
+            assert numpy.allclose(result.array, expected.to_array())
+        assert exr1.get_pixel((3, 2)) == get_exr_img_repr().get_pixel((3, 2))
+
+        # colors are clipped like in set_pixel
+        exr1.max = 0.5
+        assert exr1.blend(exr1, 0.5).array.max() == 0.5
+
+    def test_to_pil(self):
+        img = load_array_img(get_test_exr())
+        exr = get_exr_img_repr()
+        for use_extremas in [False, True]:
+            normalized = img.normalize(use_extremas)
+            assert normalized.dtype == numpy.uint8
+            assert normalized.shape == (10, 10, 3)
+            pil = img.to_pil(use_extremas)
+            assert pil.mode == "RGB"
+            assert pil.tobytes() == exr.to_pil(use_extremas).tobytes()
+            assert pil.tobytes() == normalized.tobytes()
+        assert img.to_l_image().tobytes() == exr.to_l_image().tobytes()
+
+        # images loaded from 8-bit files keep their colors
+        img_path = self.temp_file_name('img.png')
+        get_pil_img_repr(img_path, color=(1, 128, 255))
+        img = load_array_img(img_path)
+        assert img.to_pil().getpixel((4, 4)) == (1, 128, 255)
+
+        img.set_pixel((0, 0), [float('nan'), 0, 0])
+        assert img.normalize()[0, 0].tolist() == [0, 0, 0]
+
+
 class TestImgFunctions(TempDirFixture, LogTestCase):
 
     def test_load_img(self):
@@ -209,6 +409,13 @@ class TestImgFunctions(TempDirFixture, LogTestCase):
 
         assert load_img("notexisting") is None
 
+    def test_load_array_img(self):
+        img = load_array_img(get_test_exr())
+        assert isinstance(img, ArrayImgRepr)
+        assert img.get_size() == (10, 10)
+        with self.assertLogs(logger, "WARNING"):
+            assert load_array_img("notexisting") is None
+
     def test_blend_pil(self):
         img_path1 = self.temp_file_name("img1.png")
         img_path2 = self.temp_file_name("img2.png")
@@ -1,14 +1,17 @@
 import os
 
-from PIL import Image
+import numpy
+from mock import patch
+from PIL import Image, ImageChops
 
 from golem.tools.testdirfixture import TestDirFixture
 
 
+from apps.rendering.resources import renderingtaskcollector
 from apps.rendering.resources.renderingtaskcollector import RenderingTaskCollector
 from apps.rendering.resources.imgcompare import (advance_verify_img,
                                                  compare_pil_imgs)
-from apps.rendering.resources.imgrepr import load_img
+from apps.rendering.resources.imgrepr import EXRImgRepr, load_img
 
 
 def make_test_img(img_path, size=(10, 10), color=(255, 0, 0)):
@@ -82,20 +85,34 @@ class TestRenderingTaskCollector(TestDirFixture):
 
         collector.add_alpha_file(_get_test_exr())
         collector.add_alpha_file(_get_test_exr(alt=True))
+        collector.add_alpha_file(_get_test_exr())
+        collector.add_img_file(_get_test_exr())
 
-        img_path = self.temp_file_name("img1.png")
-        make_test_img(img_path)
-        img_repr = load_img(img_path)
-
-        collector.finalize_alpha(img_repr.img)
+        img = collector.finalize()
+        assert img.mode == "RGBA"
+        # the image shares memory with the output buffer
+        assert img.readonly
+
+        expected = _load_exr(_get_test_exr())
+        alpha = _load_exr(_get_test_exr()).to_l_image()
+        for alpha_file in [_get_test_exr(alt=True), _get_test_exr()]:
+            alpha = ImageChops.add(alpha, _load_exr(alpha_file).to_l_image())
+        expected = expected.to_pil()
+        expected.putalpha(alpha)
+        assert img.tobytes() == expected.tobytes()
 
     def test_finalize_exr(self):
+        exr1 = _load_exr(_get_test_exr()).to_pil()
+        exr2 = _load_exr(_get_test_exr(alt=True)).to_pil()
+
         collector = RenderingTaskCollector()
         collector.add_img_file(_get_test_exr())
         collector.add_img_file(_get_test_exr(alt=True))
         img = collector.finalize()
         assert isinstance(img, Image.Image)
+        assert img.mode == "RGB"
         assert img.size == (10, 10)
+        assert img.tobytes() == ImageChops.add(exr1, exr2).tobytes()
 
         collector = RenderingTaskCollector(paste=True)
         collector.add_img_file(_get_test_exr())
@@ -103,3 +120,104 @@ class TestRenderingTaskCollector(TestDirFixture):
         img = collector.finalize()
         assert isinstance(img, Image.Image)
         assert img.size == (10, 20)
+        assert img.crop((0, 0, 10, 10)).tobytes() == exr1.tobytes()
+        assert img.crop((0, 10, 10, 20)).tobytes() == exr2.tobytes()
+
+    @patch.object(renderingtaskcollector, 'STRIP_HEIGHT', 3)
+    def test_streaming(self):
+        paths = []
+        for i, (height, color) in enumerate([(4, (10, 20, 30)),
+                                             (7, (40, 50, 60)),
+                                             (5, (70, 80, 90))]):
+            paths.append(self.temp_file_name("chunk{}.png".format(i)))
+            make_test_img(paths[-1], (6, height), color)
+
+        collector = RenderingTaskCollector(paste=True, width=6, height=14,
+                                           tmp_dir=self.path)
+        collector.add_img_file(paths[0])
+        # chunks are written as soon as they are added
+        assert collector.collected_img == 1
+        assert collector.output[3, 5, :3].tolist() == [10, 20, 30]
+        assert collector.output[4, 0, :3].tolist() == [0, 0, 0]
+
+        collector.add_img_file(paths[1])
+        collector.add_img_file(paths[2])
+        img = collector.finalize()
+        assert img.size == (6, 14)
+        # chunks are put one below another; rows below height are skipped
+        assert [img.getpixel((2, y)) for y in [0, 3, 4, 10, 11, 13]] == \
+            [(10, 20, 30)] * 2 + [(40, 50, 60)] * 2 + [(70, 80, 90)] * 2
+
+        # chunks added after finalize are collected as well
+        collector = RenderingTaskCollector(width=6, height=4)
+        collector.add_img_file(paths[0])
+        assert collector.finalize().getpixel((0, 0)) == (10, 20, 30)
+        collector.add_img_file(paths[0])
+        assert collector.finalize().getpixel((0, 0)) == (20, 40, 60)
+
+    def test_parts(self):
+        paths = []
+        for i, (height, color) in enumerate([(4, (10, 20, 30)),
+                                             (7, (40, 50, 60)),
+                                             (3, (70, 80, 90))]):
+            paths.append(self.temp_file_name("chunk{}.png".format(i)))
+            make_test_img(paths[-1], (6, height), color)
+
+        collector = RenderingTaskCollector(paste=True, width=6, height=14,
+                                           tmp_dir=self.path)
+        # the first chunk covers parts 1 and 2; part 4 waits for part 3
+        collector.add_img_file(paths[2], 4)
+        assert collector.pending_parts == {4}
+        assert collector.output[13, 0, :3].tolist() == [0, 0, 0]
+        collector.add_img_file(paths[0], 1, 2)
+        assert collector.pending_parts == {4}
+        assert collector.output[3, 0, :3].tolist() == [10, 20, 30]
+        collector.add_img_file(paths[1], 3)
+        assert collector.pending_parts == set()
+        assert [collector.output[y, 0, :3].tolist() for y in [4, 10, 11]] \
+            == [[40, 50, 60]] * 2 + [[70, 80, 90]]
+
+        # a chunk added again replaces the part
+        collector.add_img_file(paths[2], 1, 2)
+        img = collector.finalize()
+        assert img.getpixel((0, 0)) == (70, 80, 90)
+        assert img.getpixel((0, 3)) == (10, 20, 30)
+
+        collector = RenderingTaskCollector(paste=True)
+        collector.add_img_file(paths[1], 2)
+        collector.add_img_file(paths[0], 1)
+        img = collector.finalize()
+        assert img.size == (6, 11)
+        assert img.getpixel((0, 4)) == (40, 50, 60)
+
+    def test_rgba(self):
+        img_path = self.temp_file_name("img.png")
+        Image.new('RGBA', (4, 2), (1, 2, 3, 100)).save(img_path)
+        img_path2 = self.temp_file_name("img2.png")
+        Image.new('RGBA', (4, 2), (100, 100, 100, 200)).save(img_path2)
+
+        collector = RenderingTaskCollector(paste=True)
+        collector.add_img_file(img_path)
+        collector.add_img_file(img_path2)
+        img = collector.finalize()
+        assert img.mode == "RGBA"
+        assert img.getpixel((0, 0)) == (1, 2, 3, 100)
+        assert img.getpixel((0, 3)) == (100, 100, 100, 200)
+
+        collector = RenderingTaskCollector()
+        collector.add_img_file(img_path)
+        collector.add_img_file(img_path2)
+        assert collector.finalize().getpixel((0, 0)) == (101, 102, 103, 255)
+
+    def test_luminance(self):
+        rows = numpy.random.RandomState(0).randint(0, 256, (16, 16, 3))
+        rows = rows.astype(numpy.uint8)
+        expected = Image.fromarray(rows, 'RGB').convert('L')
+        assert renderingtaskcollector._luminance(rows).tobytes() == \
+            expected.tobytes()
+
+
+def _load_exr(path):
+    img = EXRImgRepr()
+    img.load_from_file(path)
+    return img
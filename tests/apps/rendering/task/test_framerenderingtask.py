@@ -90,12 +90,22 @@ class TestFrameRenderingTask(TestDirFixture, LogTestCase):
         task.subtasks_given["SUBTASK3"] = {"start_task": 1, "node_id": "NODE 1", "parts": 1,
                                            "end_task": 1, "frames": [1],
                                            "status": SubtaskStatus.starting}
+        # the chunk is written to the collector when it is accepted
+        assert task.collectors[None].chunks == {3: img_file}
+        img_file2 = os.path.join(self.path, "img2.png")
+        Image.new("RGB", (800, 200), "#ff0000").save(img_file2)
         task.accept_results("SUBTASK2", [img_file])
-        task.accept_results("SUBTASK3", [img_file])
+        task.accept_results("SUBTASK3", [img_file2])
         assert task.num_tasks_received == 3
         assert task.total_tasks == 3
         output_file = task.output_file
         assert os.path.isfile(output_file)
+        assert task.collectors == {}
+        output_img = Image.open(output_file)
+        assert output_img.getpixel((0, 0)) == (255, 0, 0)
+        assert output_img.getpixel((0, 199)) == (255, 0, 0)
+        assert output_img.getpixel((0, 200)) == (0, 0, 255)
+        output_img.close()
 
         task = self._get_frame_task()
         task.tmp_dir = self.path
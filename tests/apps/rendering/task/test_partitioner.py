@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from mock import patch
+
+from apps.rendering.task.partitioner import AdaptivePartitioner
+
+
+class TestAdaptivePartitioner(TestCase):
+
+    @patch('apps.rendering.task.partitioner.time')
+    def _finish(self, partitioner, subtask_id, node_id, units, perf, duration,
+                time_mock):
+        time_mock.time.return_value = 100.0
+        partitioner.subtask_started(subtask_id, node_id, units, perf)
+        time_mock.time.return_value = 100.0 + duration
+        partitioner.subtask_finished(subtask_id)
+
+    def test_no_history(self):
+        p = AdaptivePartitioner(total_units=100, target_time=60)
+        assert p.units_for(1000, "node", 100) == 1
+        assert p.units_for(1000, "node", 1) == 1
+        assert p.units_for(1000, "node", 0) == 0
+
+    def test_node_rate(self):
+        p = AdaptivePartitioner(total_units=100, target_time=60)
+        # 2 units in 10s -> 0.2 units/s -> 12 units in 60s
+        self._finish(p, "s1", "node", 2, 1000, 10)
+        assert p.units_for(1000, "node", 98) == 12
+        # never more than half of what is left
+        assert p.units_for(1000, "node", 10) == 5
+        assert p.units_for(1000, "node", 1) == 1
+
+    def test_perf_scaled_rate(self):
+        p = AdaptivePartitioner(total_units=100, target_time=60)
+        self._finish(p, "s1", "node", 2, 1000, 10)
+        # unknown node twice as fast gets twice as much work
+        assert p.units_for(2000, "other", 98) == 24
+        # unknown node without performance index gets single unit
+        assert p.units_for(0, "other", 98) == 1
+
+    def test_smoothing_and_failure(self):
+        p = AdaptivePartitioner(total_units=100, target_time=60)
+        self._finish(p, "s1", "node", 2, 1000, 10)
+        self._finish(p, "s2", "node", 6, 1000, 10)
+        # average of 0.2 and 0.6 units/s
+        assert p.units_for(1000, "node", 98) == 24
+
+        p.subtask_started("s3", "node", 10, 1000)
+        p.subtask_failed("s3")
+        assert "s3" not in p.pending
+        p.subtask_finished("s3")
+        assert p.units_for(1000, "node", 98) == 24
@@ -0,0 +1,134 @@
+import ctypes
+import errno
+import os
+
+from mock import Mock, patch
+
+from golem.core import filecopy
+from golem.core.filecopy import COPY, COPY_FILE_RANGE, HARDLINK, REFLINK, \
+    materialize, materialize_tree
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class TestMaterialize(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/core/filecopy.py']
+
+    def setUp(self):
+        super(TestMaterialize, self).setUp()
+        filecopy._disabled.clear()
+        filecopy._no_reflink.clear()
+
+        self.src = os.path.join(self.tempdir, 'scene.blend')
+        self.dst = os.path.join(self.tempdir, 'task', 'scene.blend')
+        self.data = os.urandom(100000)
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+        os.utime(self.src, (1000000000, 1000000000))
+        os.makedirs(os.path.dirname(self.dst))
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _check_copy(self):
+        assert self._read(self.dst) == self.data
+        assert not os.path.samefile(self.src, self.dst)
+        assert os.path.getmtime(self.dst) == 1000000000
+
+    def test_link(self):
+        strategy = materialize(self.src, self.dst, link=True)
+        assert strategy in (REFLINK, HARDLINK)
+        assert self._read(self.dst) == self.data
+        if strategy == HARDLINK:
+            assert os.path.samefile(self.src, self.dst)
+
+    def test_no_link(self):
+        strategy = materialize(self.src, self.dst, link=False)
+        assert strategy in (REFLINK, COPY_FILE_RANGE, COPY)
+        self._check_copy()
+
+    def test_no_link_by_default(self):
+        strategy = materialize(self.src, self.dst)
+        assert strategy in (REFLINK, COPY_FILE_RANGE, COPY)
+        self._check_copy()
+
+    def test_replace(self):
+        with open(self.dst, 'wb') as f:
+            f.write('old')
+        materialize(self.src, self.dst, link=False)
+        self._check_copy()
+
+        with self.assertRaises(ValueError):
+            materialize(self.src, self.src)
+        assert self._read(self.src) == self.data
+
+    @patch('golem.core.filecopy.fcntl')
+    def test_reflink(self, fcntl):
+        assert materialize(self.src, self.dst) == REFLINK
+        args = fcntl.ioctl.call_args[0]
+        assert args[1] == filecopy.FICLONE
+
+    @patch('golem.core.filecopy.fcntl')
+    def test_reflink_unsupported(self, fcntl):
+        fcntl.ioctl.side_effect = IOError(errno.EOPNOTSUPP, 'unsupported')
+        assert materialize(self.src, self.dst, link=True) == HARDLINK
+
+        # not tried again on the same file system
+        os.remove(self.dst)
+        assert materialize(self.src, self.dst, link=True) == HARDLINK
+        assert fcntl.ioctl.call_count == 1
+
+    @patch('golem.core.filecopy.os.link',
+           side_effect=OSError(errno.EXDEV, 'cross-device link'))
+    @patch('golem.core.filecopy.fcntl', None)
+    def test_hardlink_unsupported(self, _):
+        strategy = materialize(self.src, self.dst, link=True)
+        assert strategy in (COPY_FILE_RANGE, COPY)
+        self._check_copy()
+
+    @patch('golem.core.filecopy.os.link',
+           side_effect=OSError(errno.EACCES, 'permission denied'))
+    @patch('golem.core.filecopy.fcntl', None)
+    def test_error(self, _):
+        with self.assertRaises(OSError):
+            materialize(self.src, self.dst, link=True)
+
+    @patch('golem.core.filecopy.fcntl', None)
+    def test_copy_file_range(self):
+        if filecopy._copy_file_range is None:
+            self.skipTest("copy_file_range is not available")
+        assert materialize(self.src, self.dst, link=False) == COPY_FILE_RANGE
+        self._check_copy()
+
+    @patch('golem.core.filecopy.fcntl', None)
+    def test_copy_file_range_unsupported(self):
+        def copy_file_range(*_):
+            ctypes.set_errno(errno.ENOSYS)
+            return -1
+
+        copy_range = Mock(side_effect=copy_file_range)
+        with patch('golem.core.filecopy._copy_file_range', copy_range):
+            assert materialize(self.src, self.dst, link=False) == COPY
+            self._check_copy()
+            assert materialize(self.src, self.dst, link=False) == COPY
+        # disabled after the first failure
+        assert copy_range.call_count == 1
+
+    def test_tree(self):
+        src_dir = os.path.join(self.tempdir, 'src')
+        dst_dir = os.path.join(self.tempdir, 'dst')
+        os.makedirs(os.path.join(src_dir, 'textures'))
+        os.makedirs(dst_dir)
+        for name in ['scene.blend', 'scene.log',
+                     os.path.join('textures', 'wood.png')]:
+            with open(os.path.join(src_dir, name), 'wb') as f:
+                f.write(name)
+        with open(os.path.join(dst_dir, 'other'), 'wb') as f:
+            f.write('other')
+
+        strategies = materialize_tree(src_dir, dst_dir, exclude=['.log'])
+        assert sum(strategies.values()) == 2
+        assert sorted(os.listdir(dst_dir)) == ['other', 'scene.blend',
+                                               'textures']
+        assert self._read(os.path.join(dst_dir, 'textures', 'wood.png')) == \
+            os.path.join('textures', 'wood.png')
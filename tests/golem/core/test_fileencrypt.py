@@ -1,7 +1,10 @@
 import os
 import random
 
-from golem.core.fileencrypt import FileHelper, FileEncryptor, AESFileEncryptor
+from Crypto.Cipher import AES
+
+from golem.core.fileencrypt import FileHelper, FileEncryptor, AESFileEncryptor, \
+    AESGCMFileEncryptor
 from golem.resource.dirmanager import DirManager
 from golem.tools.testdirfixture import TestDirFixture
 
@@ -109,6 +112,77 @@ class TestAESFileEncryptor(TestDirFixture):
         self.assertEqual(len(key), key_len)
         self.assertEqual(len(iv), iv_len)
 
+    def test_header(self):
+        header, salt = AESFileEncryptor.gen_header()
+        self.assertEqual(len(header), AESFileEncryptor.block_size)
+        self.assertEqual(AESFileEncryptor.parse_header(header),
+                         (AESFileEncryptor.version, salt))
+
+        legacy_salt = AESFileEncryptor.gen_salt(AESFileEncryptor.block_size)
+        legacy = AESFileEncryptor.salt_prefix + legacy_salt
+        self.assertEqual(AESFileEncryptor.parse_header(legacy),
+                         (0, legacy_salt))
+
+        with self.assertRaises(ValueError):
+            AESFileEncryptor.parse_header(
+                AESFileEncryptor.version_prefix + chr(255) + salt)
+        with self.assertRaises(ValueError):
+            AESFileEncryptor.parse_header('x' * AESFileEncryptor.block_size)
+        with self.assertRaises(ValueError):
+            AESFileEncryptor.parse_header(header[:-1])
+
+    def test_streaming(self):
+        secret = FileEncryptor.gen_secret(10, 20)
+        with open(self.test_file_path, 'rb') as f:
+            data = f.read() + 'tail'
+
+        for chunk_size in [1, 3, 1024]:
+            with open(self.enc_file_path, 'wb') as dst:
+                writer = AESFileEncryptor.writer(dst, secret,
+                                                 chunk_size=chunk_size)
+                for i in xrange(0, len(data), 100):
+                    writer.write(data[i:i + 100])
+                self.assertEqual(writer.tell(), len(data))
+                writer.close()
+
+            with open(self.enc_file_path, 'rb') as src:
+                reader = AESFileEncryptor.reader(src, secret,
+                                                 chunk_size=chunk_size)
+                self.assertEqual(reader.version, AESFileEncryptor.version)
+                self.assertEqual(reader.size, len(data))
+                self.assertEqual(reader.read(), data)
+                self.assertEqual(reader.read(10), '')
+
+                # random access
+                reader.seek(1000)
+                self.assertEqual(reader.read(50), data[1000:1050])
+                reader.seek(-10, 2)
+                self.assertEqual(reader.read(), data[-10:])
+                reader.seek(5)
+                reader.seek(7, 1)
+                self.assertEqual(reader.tell(), 12)
+                self.assertEqual(reader.read(3), data[12:15])
+
+    def test_decrypt_legacy(self):
+        """ Files written with the salt prefix can still be decrypted """
+        secret = FileEncryptor.gen_secret(10, 20)
+        decrypted_path = self.test_file_path + ".dec"
+        with open(self.test_file_path, 'rb') as f:
+            data = f.read()
+
+        block_size = AESFileEncryptor.block_size
+        salt = AESFileEncryptor.gen_salt(block_size)
+        key, iv = AESFileEncryptor.get_key_and_iv(secret, salt, 32,
+                                                  block_size)
+        cipher = AES.new(key, AESFileEncryptor.aes_mode, iv)
+        with open(self.enc_file_path, 'wb') as f:
+            f.write(AESFileEncryptor.salt_prefix + salt)
+            f.write(cipher.encrypt(data + block_size * chr(block_size)))
+
+        AESFileEncryptor.decrypt(self.enc_file_path, decrypted_path, secret)
+        with open(decrypted_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
 
 class TestFileHelper(TestDirFixture):
     """ Tests for FileHelper class """
@@ -133,3 +207,125 @@ class TestFileHelper(TestDirFixture):
             with FileHelper(file_, mode) as f:
                 self.assertIsInstance(f, file)
                 self.assertEqual(f.mode, mode)
+
+
+class TestAESGCMFileEncryptor(TestDirFixture):
+
+    def setUp(self):
+        TestDirFixture.setUp(self)
+
+        self.secret = FileEncryptor.gen_secret(10, 20)
+        self.test_file_path = os.path.join(self.path, 'test_file')
+        self.enc_file_path = os.path.join(self.path, 'test_file.enc')
+        self.dec_file_path = os.path.join(self.path, 'test_file.dec')
+        self.data = str(bytearray(random.getrandbits(8)
+                                  for _ in xrange(1000)))
+        with open(self.test_file_path, 'wb') as f:
+            f.write(self.data)
+
+    def _encrypt(self, data, chunk_size=4):
+        with open(self.enc_file_path, 'wb') as dst:
+            writer = AESGCMFileEncryptor.writer(dst, self.secret,
+                                                chunk_size=chunk_size)
+            writer.write(data)
+            writer.close()
+
+    def _corrupt(self, offset):
+        with open(self.enc_file_path, 'r+b') as f:
+            f.seek(offset)
+            byte = f.read(1)
+            f.seek(offset)
+            f.write(chr(ord(byte) ^ 1))
+
+    def test_encrypt_decrypt(self):
+        for chunk_size in [1, 4, 1024]:
+            AESGCMFileEncryptor.encrypt(self.test_file_path,
+                                        self.enc_file_path,
+                                        self.secret, chunk_size=chunk_size)
+            AESGCMFileEncryptor.decrypt(self.enc_file_path,
+                                        self.dec_file_path,
+                                        self.secret, workers=3)
+            with open(self.dec_file_path, 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+            self.assertEqual(AESGCMFileEncryptor.verify(self.enc_file_path,
+                                                        self.secret), [])
+
+    def test_chunk_boundaries(self):
+        chunk_len = 4 * AESGCMFileEncryptor.block_size
+        for size in [0, 1, chunk_len, 2 * chunk_len, 2 * chunk_len + 1]:
+            self._encrypt(self.data[:size])
+            with open(self.enc_file_path, 'rb') as src:
+                reader = AESGCMFileEncryptor.reader(src, self.secret)
+                self.assertEqual(reader.num_chunks,
+                                 max(size - 1, 0) // chunk_len + 1)
+                self.assertEqual(reader.size, size)
+                self.assertEqual(reader.read(), self.data[:size])
+
+    def test_random_access(self):
+        self._encrypt(self.data)
+        with open(self.enc_file_path, 'rb') as src:
+            reader = AESGCMFileEncryptor.reader(src, self.secret)
+            reader.seek(500)
+            self.assertEqual(reader.read(100), self.data[500:600])
+            reader.seek(-30, 2)
+            self.assertEqual(reader.read(100), self.data[-30:])
+            reader.seek(10)
+            self.assertEqual(reader.read(1), self.data[10])
+
+    def test_corrupted_chunk(self):
+        self._encrypt(self.data)
+        chunk_len = 4 * AESGCMFileEncryptor.block_size
+        stored_len = chunk_len + AESGCMFileEncryptor.tag_len
+        self._corrupt(AESGCMFileEncryptor.header_len + 2 * stored_len + 5)
+
+        self.assertEqual(AESGCMFileEncryptor.verify(self.enc_file_path,
+                                                    self.secret), [2])
+        with open(self.enc_file_path, 'rb') as src:
+            reader = AESGCMFileEncryptor.reader(src, self.secret)
+            # other chunks can still be read
+            self.assertEqual(reader.read(chunk_len), self.data[:chunk_len])
+            with self.assertRaises(ValueError):
+                reader.read()
+
+        with self.assertRaises(ValueError):
+            AESGCMFileEncryptor.decrypt(self.enc_file_path,
+                                        self.dec_file_path, self.secret)
+
+    def test_truncated(self):
+        self._encrypt(self.data)
+        stored_len = 4 * AESGCMFileEncryptor.block_size + \
+            AESGCMFileEncryptor.tag_len
+        with open(self.enc_file_path, 'r+b') as f:
+            f.truncate(AESGCMFileEncryptor.header_len + 3 * stored_len)
+
+        # the new last chunk was not encrypted as the last one
+        self.assertEqual(AESGCMFileEncryptor.verify(self.enc_file_path,
+                                                    self.secret), [2])
+
+    def test_wrong_secret(self):
+        self._encrypt(self.data)
+        with self.assertRaises(ValueError):
+            AESGCMFileEncryptor.decrypt(self.enc_file_path,
+                                        self.dec_file_path,
+                                        self.secret + "0")
+
+    def test_read_cbc(self):
+        """ Files in the CBC formats are still readable """
+        AESFileEncryptor.encrypt(self.test_file_path, self.enc_file_path,
+                                 self.secret)
+        AESGCMFileEncryptor.decrypt(self.enc_file_path, self.dec_file_path,
+                                    self.secret)
+        with open(self.dec_file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_parse_header(self):
+        header, salt, chunk_len = AESGCMFileEncryptor.gen_header(2)
+        self.assertEqual(len(header), AESGCMFileEncryptor.header_len)
+        self.assertEqual(AESGCMFileEncryptor.parse_header(header),
+                         (salt, chunk_len))
+        self.assertEqual(chunk_len, 2 * AESGCMFileEncryptor.block_size)
+
+        with self.assertRaises(ValueError):
+            AESGCMFileEncryptor.parse_header(header[:-1])
+        with self.assertRaises(ValueError):
+            AESGCMFileEncryptor.parse_header(header[:-4] + '\0' * 4)
@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+from mock import patch
+
+from golem.core.filehash import FileHasher, file_digest, iter_file
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class TestFileHash(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/core/filehash.py']
+
+    def setUp(self):
+        super(TestFileHash, self).setUp()
+        self.paths = []
+        for i, size in enumerate([0, 1000, 100000]):
+            path = os.path.join(self.tempdir, 'file{}'.format(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            self.paths.append(path)
+
+    def _sha1(self, path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).digest()
+
+    def test_iter_file(self):
+        path = self.paths[2]
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        blocks = [str(b) for b in iter_file(path, block_size=30000)]
+        assert map(len, blocks) == [30000, 30000, 30000, 10000]
+        assert ''.join(blocks) == data
+
+        # large files are memory-mapped
+        blocks = []
+        with patch('golem.core.filehash.MMAP_SIZE', 1000):
+            for block in iter_file(path, block_size=30000):
+                assert isinstance(block, buffer)
+                blocks.append(str(block))
+        assert ''.join(blocks) == data
+
+        assert list(iter_file(self.paths[0])) == []
+        with patch('golem.core.filehash.MMAP_SIZE', 0):
+            assert list(iter_file(self.paths[0])) == []
+
+    def test_file_digest(self):
+        for path in self.paths:
+            assert file_digest(path) == self._sha1(path)
+            with patch('golem.core.filehash.MMAP_SIZE', 1000):
+                assert file_digest(path, block_size=4096) == self._sha1(path)
+
+        with open(self.paths[1], 'rb') as f:
+            expected = hashlib.sha256(f.read()).digest()
+        assert file_digest(self.paths[1], 'sha256') == expected
+
+        with self.assertRaises(IOError):
+            file_digest(os.path.join(self.tempdir, 'missing'))
+
+    def test_hash_files(self):
+        file_hasher = FileHasher()
+        expected = {path: self._sha1(path) for path in self.paths}
+        assert file_hasher.hash_files(self.paths) == expected
+        assert FileHasher(workers=1).hash_files(self.paths) == expected
+        assert file_hasher.hash_files([]) == {}
+        assert file_hasher.hash_files(self.paths, 'md5')[self.paths[2]] == \
+            hashlib.md5(open(self.paths[2], 'rb').read()).digest()
+
+        with patch('golem.core.filehash.ThreadPool') as pool:
+            FileHasher(workers=1).map(len, self.paths)
+            file_hasher.map(len, self.paths[:1])
+            assert not pool.called
+            file_hasher.map(len, self.paths)
+            pool.assert_called_once_with(3)
@@ -8,7 +8,8 @@ import shutil
 
 from golem.core.common import get_golem_path, is_windows
 from golem.core.fileshelper import (common_dir, copy_file_tree, du, find_file_with_ext,
-                                    get_dir_size, has_ext, inner_dir_path, outer_dir_path)
+                                    get_dir_size, has_ext, inner_dir_path, outer_dir_path,
+                                    replacing_file)
 from golem.tools.testdirfixture import TestDirFixture
 
 
@@ -319,6 +320,31 @@ class TestFindAndCopy(TestDirFixture):
         self.assertEqual(dcmp.left_list, dcmp.right_list)
 
 
+class TestReplacingFile(TestDirFixture):
+    def test_replacing_file(self):
+        path = os.path.join(self.path, "file")
+        link = os.path.join(self.path, "link")
+        with open(path, 'wb') as f:
+            f.write("old")
+        os.link(path, link)
+
+        with replacing_file(path) as f:
+            f.write("new")
+        with open(path, 'rb') as f:
+            assert f.read() == "new"
+        # other hardlinks of the old file are not modified
+        with open(link, 'rb') as f:
+            assert f.read() == "old"
+
+        with self.assertRaises(ValueError):
+            with replacing_file(path) as f:
+                f.write("partial")
+                raise ValueError()
+        with open(path, 'rb') as f:
+            assert f.read() == "new"
+        assert sorted(os.listdir(self.path)) == ["file", "link"]
+
+
 class TestHasExt(TestDirFixture):
     def test_has_ext(self):
         file_names = ["file.ext", "file.dde", "file.abc", "file.ABC", "file.Abc", "file.DDE",
@@ -212,7 +212,7 @@ class TestEllipticalKeysAuth(TestWithKeysAuth):
     def test_fixed_sign_verify_elliptical(self):
         public_key = "cdf2fa12bef915b85d94a9f210f2e432542f249b8225736d923fb07ac7ce38fa29dd060f1ea49c75881b6222d26db1c8b0dd1ad4e934263cc00ed03f9a781444"
         private_key = "1aab847dd0aa9c3993fea3c858775c183a588ac328e5deb9ceeee3b4ac6ef078"
-        expected_result = "c76bd0e19f1b3e2587b9ff9c6230fe0eed7d25de95fdfd4719e13c1be4fadcbe405f700743f9d2ff32843bd249891e929e478e716afd4b5aa081c68e732d369901"
+        expected_result = "7a79eb9afc377ab42ac1a5edf89f14c6da8d7e2d2522780bc1946c1f7109cd6b2c64c990f38482515824944c5743a2dae3fe31519c8f777ec1c0e2554330e7ca00"
 
         EllipticalKeysAuth.set_keys_dir(self.path)
         ek = EllipticalKeysAuth(self.path)
@@ -41,6 +41,39 @@ class TestDockerConfigManager(unittest.TestCase):
         self.assertFalse('cpuset' in cm.container_host_config)
         self.assertFalse('mem_limit' in cm.container_host_config)
 
+    def test_slot_host_config(self):
+        cm = DockerConfigManager()
+        cm.container_host_config['cpuset'] = '0,1,2,3'
+        cm.container_host_config['mem_limit'] = 4096000
+
+        assert cm.slot_host_config(0, 1) == cm.container_host_config
+
+        first = cm.slot_host_config(0, 2)
+        second = cm.slot_host_config(1, 2)
+        assert first['cpuset'] == '0,1'
+        assert second['cpuset'] == '2,3'
+        assert first['mem_limit'] == second['mem_limit'] == 2048000
+        assert cm.container_host_config['cpuset'] == '0,1,2,3'
+
+        cm.container_host_config['cpuset'] = '0'
+        assert cm.slot_host_config(1, 2)['cpuset'] == '0'
+        assert cm.slot_host_config(1, 2)['mem_limit'] == 4096000
+
+    def test_slot_host_config_uneven(self):
+        cm = DockerConfigManager()
+        cm.container_host_config['cpuset'] = '0,1,2,3,4'
+        cm.container_host_config['mem_limit'] = 6000000
+
+        configs = [cm.slot_host_config(i, 3) for i in range(3)]
+        assert [c['cpuset'] for c in configs] == ['0,1', '2,3', '4']
+        assert all(c['mem_limit'] == 2000000 for c in configs)
+
+        # no more slots than cores
+        cm.container_host_config['cpuset'] = '0,1,2'
+        configs = [cm.slot_host_config(i, 4) for i in range(3)]
+        assert [c['cpuset'] for c in configs] == ['0', '1', '2']
+        assert all(c['mem_limit'] == 2000000 for c in configs)
+
     def test_try(self):
         cm = DockerConfigManager()
         with cm._try():
@@ -5,7 +5,10 @@ import uuid
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from threading import Thread
 
-from requests.exceptions import HTTPError
+import numpy
+from mock import Mock
+
+from requests.exceptions import HTTPError, ReadTimeout
 
 from golem.http.stream import StreamMonitor, ChunkStream, StreamFileObject
 
@@ -45,6 +48,36 @@ class MockHttpServer(BaseHTTPRequestHandler):
         return httpd
 
 
+class MockChunkedHttpServer(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = ''
+    chunk_size = 1000
+    extension = ''
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        for i in xrange(0, len(self.data), self.chunk_size):
+            chunk = self.data[i:i + self.chunk_size]
+            self.wfile.write('{:x}{}\r\n'.format(len(chunk), self.extension))
+            self.wfile.write(chunk + '\r\n')
+        self.wfile.write('0\r\n\r\n')
+
+    def log_message(self, *_):
+        pass
+
+    @staticmethod
+    def serve():
+        httpd = HTTPServer(('127.0.0.1', 0), MockChunkedHttpServer)
+        thread = Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return httpd
+
+
 class MockIterator:
     def __init__(self, src, chunk):
         self.src = src
@@ -105,6 +138,75 @@ class TestStreamMonitor(unittest.TestCase):
         httpd.server_close()
 
 
+class TestStreamMonitorDeadlines(unittest.TestCase):
+
+    def setUp(self):
+        self.default_timeout = StreamMonitor.stream_timeout
+        StreamMonitor.stream_timeout = 0.2
+
+    def tearDown(self):
+        StreamMonitor.stream_timeout = self.default_timeout
+
+    @staticmethod
+    def _stream():
+        return Mock(timestamp=time.time(), done=False)
+
+    @staticmethod
+    def _wait_for(condition, timeout=3.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_idle_stream(self):
+        idle, active, done = self._stream(), self._stream(), self._stream()
+        done.done = True
+        for stream in (idle, active, done):
+            StreamMonitor.monitor(stream)
+
+        start = time.time()
+        while time.time() - start < 0.5:
+            active.timestamp = time.time()
+            time.sleep(0.01)
+
+        assert idle.cancel.called
+        assert not active.cancel.called
+        assert not done.cancel.called
+        assert self._wait_for(lambda: active.cancel.called)
+        assert time.time() - start < 1.5
+
+    def test_earlier_deadline(self):
+        StreamMonitor.stream_timeout = 60
+        late = self._stream()
+        StreamMonitor.monitor(late)
+
+        # the monitor waiting for the first deadline is woken up
+        StreamMonitor.stream_timeout = 0.1
+        early = self._stream()
+        StreamMonitor.monitor(early)
+
+        assert self._wait_for(lambda: early.cancel.called, timeout=1.0)
+        assert not late.cancel.called
+
+    def test_cancel_read(self):
+        httpd = MockHttpServer.serve()
+        stream = ChunkStream(('127.0.0.1', MockHttpServer.port), '/',
+                             timeouts=(1000, 60000))
+        stream.connect()
+        StreamMonitor.monitor(stream)
+        start = time.time()
+
+        try:
+            with self.assertRaises(ReadTimeout):
+                stream.read(1024)
+            # the read is not waiting for the read timeout
+            assert time.time() - start < 2.0
+            assert stream.done
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
 class TestSocketStream(unittest.TestCase):
 
     def testFailedConnection(self):
@@ -173,6 +275,64 @@ class TestSocketStream(unittest.TestCase):
         httpd.server_close()
 
 
+class TestChunkedRead(unittest.TestCase):
+
+    def setUp(self):
+        MockChunkedHttpServer.data = numpy.random.RandomState(0).bytes(100000)
+        self.httpd = MockChunkedHttpServer.serve()
+        self.addr = ('127.0.0.1', self.httpd.server_address[1])
+
+    def tearDown(self):
+        MockChunkedHttpServer.extension = ''
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _read_all(self, count):
+        stream = ChunkStream(self.addr, '/')
+        stream.connect()
+        parts = []
+        try:
+            while True:
+                data = stream.read(count)
+                if data is None:
+                    break
+                parts.append(data)
+        finally:
+            stream.disconnect()
+        return parts, stream
+
+    def test_read(self):
+        parts, stream = self._read_all(4096)
+        assert ''.join(parts) == MockChunkedHttpServer.data
+        # chunk boundaries are kept
+        assert all(len(part) <= MockChunkedHttpServer.chunk_size
+                   for part in parts)
+        assert stream.data_read == len(MockChunkedHttpServer.data)
+        assert stream.content_size == 0
+        assert stream.done
+
+    def test_small_reads(self):
+        # separators are split between receives
+        parts, _ = self._read_all(3)
+        assert ''.join(parts) == MockChunkedHttpServer.data
+        assert all(isinstance(part, str) for part in parts)
+
+    def test_chunk_extension(self):
+        MockChunkedHttpServer.extension = ';name=value'
+        parts, _ = self._read_all(4096)
+        assert ''.join(parts) == MockChunkedHttpServer.data
+
+    def test_iterator(self):
+        stream = ChunkStream(self.addr, '/')
+        stream.connect()
+        try:
+            assert ''.join(stream) == MockChunkedHttpServer.data
+        finally:
+            stream.disconnect()
+        # consumed data does not stay in the buffer
+        assert len(stream.buf) <= ChunkStream._compact_size
+
+
 class TestStreamFileObject(unittest.TestCase):
 
     def test(self):
@@ -46,7 +46,8 @@ class TestMessages(unittest.TestCase, PEP8MixIn):
             price=price,
             max_resource_size=max_resource_size,
             max_memory_size=max_memory_size,
-            num_cores=num_cores)
+            num_cores=num_cores,
+            max_subtasks=3)
         expected = {
             'NODE_NAME': node_id,
             'TASK_ID': task_id,
@@ -55,6 +56,7 @@ class TestMessages(unittest.TestCase, PEP8MixIn):
             'MAX_MEM': max_memory_size,
             'NUM_CORES': num_cores,
             'PRICE': price,
+            'MAX_SUBTASKS': 3,
         }
         self.assertEquals(expected, msg.dict_repr())
 
@@ -429,6 +431,20 @@ class TestMessages(unittest.TestCase, PEP8MixIn):
         }
         self.assertEquals(expected, msg.dict_repr())
 
+    def test_message_partial_task_result_hash(self):
+        subtask_id = 'test-si-{}'.format(uuid.uuid4())
+        msg = message.MessagePartialTaskResultHash(
+            subtask_id=subtask_id, multihash='hash', secret='secret',
+            options={'option': 1}, sequence=3)
+        expected = {
+            'SUB_TASK_ID': subtask_id,
+            'MULTIHASH': 'hash',
+            'SECRET': 'secret',
+            'OPTIONS': {'option': 1},
+            'SEQUENCE': 3,
+        }
+        self.assertEquals(expected, msg.dict_repr())
+
     def test_message_push(self):
         resource = 'test-r-{}'.format(uuid.uuid4())
         copies = random.randint(-10**10, 10**10)
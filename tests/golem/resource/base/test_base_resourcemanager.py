@@ -1,10 +1,13 @@
 import os
+import time
 import unittest
 import uuid
 
-from mock import patch
+from mock import Mock, patch
 
+from golem.resource.base.downloadqueue import DownloadKind
 from golem.resource.base.resourcesmanager import ResourceCache, ResourceStorage, TestResourceManager, FileResource
+from golem.resource.client import TestClient
 from golem.resource.dirmanager import DirManager
 from golem.tools.testdirfixture import TestDirFixture
 
@@ -278,6 +281,123 @@ class TestAbstractResourceManager(_Common.ResourceSetUp):
         assert not self.resource_manager.storage.cache.get_prefix(self.task_id)
         assert not self.resource_manager.storage.get_resources(self.task_id)
 
+    def test_pull_stored_resource(self):
+        rm = self.resource_manager
+        rm.add_file(self.test_dir_file, self.task_id)
+        resource = rm.storage.get_resources(self.task_id)[0]
+        entry = [os.path.basename(self.test_dir_file), resource.hash]
+
+        new_task = str(uuid.uuid4())
+        success, error = Mock(), Mock()
+        with patch.object(TestClient, 'get_file') as get_file:
+            rm.pull_resource(entry, new_task, success, error, async=False)
+
+        assert not get_file.called
+        success.assert_called_with(entry, new_task)
+        assert not error.called
+        path = rm.storage.get_path(entry[0], new_task)
+        assert os.path.samefile(path, self.test_dir_file)
+        assert rm.storage.chunk_store.get_task_objects(new_task)
+
+        rm.remove_task(self.task_id)
+        rm.remove_task(new_task)
+        assert not rm.storage.chunk_store.get_task_objects(new_task)
+        assert os.path.exists(path)
+
+    def test_pull_resource_stores_download(self):
+        rm = self.resource_manager
+        entry = ['file', TestClient().add(self.test_dir_file)['Hash']]
+        rm.pull_resource(entry, self.task_id, Mock(), Mock(), async=False)
+
+        path = rm.storage.get_path('file', self.task_id)
+        objects = rm.storage.chunk_store.get_alias(entry[1])
+        assert objects
+        assert os.path.samefile(
+            path, rm.storage.chunk_store.object_path(objects.values()[0]))
+
+    def test_pull_resource_queue(self):
+        rm = self.resource_manager
+        rm.config.max_concurrent_downloads = 1
+        rm.config.max_concurrent_result_downloads = 1
+        pulls = []
+
+        def pull(resource, task_id, **kwargs):
+            pulls.append((resource.hash, kwargs['success']))
+
+        def entry(name):
+            return [name, 'hash_' + name]
+
+        deadline = time.time() + 60
+        with patch.object(rm, '_AbstractResourceManager__pull',
+                          side_effect=pull):
+            rm.pull_resource(entry('first'), self.task_id, Mock(), Mock(),
+                             pin=False)
+            rm.pull_resource(entry('later'), self.task_id, Mock(), Mock(),
+                             pin=False)
+            rm.pull_resource(entry('urgent'), self.task_id, Mock(), Mock(),
+                             pin=False, deadline=deadline)
+            # results have their own download slots
+            rm.pull_resource(entry('result'), self.task_id, Mock(), Mock(),
+                             pin=False, kind=DownloadKind.RESULT,
+                             deadline=deadline)
+            assert [p[0] for p in pulls] == ['hash_first', 'hash_result']
+
+            stats = rm.get_download_stats()
+            assert stats[DownloadKind.RESOURCE]['queued'] == 2
+            assert stats[DownloadKind.RESOURCE]['active'] == 1
+            assert stats[DownloadKind.RESULT]['active'] == 1
+
+            # a finished download starts the most urgent waiting one
+            pulls[0][1](None)
+            assert pulls[-1][0] == 'hash_urgent'
+            pulls[-1][1](None)
+            assert pulls[-1][0] == 'hash_later'
+
+        stats = rm.get_download_stats()[DownloadKind.RESOURCE]
+        assert stats['queued'] == 0
+        assert stats['active'] == 1
+        assert stats['started'] == 2
+
+    def test_pull_resource_queue_duplicates(self):
+        rm = self.resource_manager
+        rm.config.max_concurrent_downloads = 1
+        pulls = []
+        downloaded = set()
+
+        def pull(resource, task_id, **kwargs):
+            pulls.append((resource.hash, kwargs['success']))
+
+        def finish(i):
+            downloaded.add(pulls[i][0])
+            pulls[i][1](None)
+
+        def entry(name):
+            return [name, 'hash_' + name]
+
+        successes = [Mock() for _ in range(4)]
+        with patch.object(rm, '_AbstractResourceManager__pull',
+                          side_effect=pull), \
+                patch.object(rm.storage, 'has_resource',
+                             side_effect=lambda r: r.hash in downloaded):
+            for name, success in zip(['first', 'dup', 'dup', 'other'],
+                                     successes):
+                rm.pull_resource(entry(name), self.task_id, success, Mock(),
+                                 pin=False)
+            assert [p[0] for p in pulls] == ['hash_first']
+
+            finish(0)
+            assert [p[0] for p in pulls] == ['hash_first', 'hash_dup']
+            # the duplicate is already downloaded and gives its slot
+            # to the next waiting download
+            finish(1)
+            assert [p[0] for p in pulls] == ['hash_first', 'hash_dup',
+                                             'hash_other']
+            assert all(success.called for success in successes[:3])
+
+        stats = rm.get_download_stats()[DownloadKind.RESOURCE]
+        assert stats['queued'] == 0
+        assert stats['active'] == 1
+
     def test_command_failed(self):
         with patch('golem.resource.base.resourcesmanager.logger') as logger:
             self.resource_manager.command_failed(Exception('Unknown error'),
@@ -0,0 +1,85 @@
+import time
+import unittest
+
+from golem.resource.base.downloadqueue import DownloadKind, DownloadQueue
+from golem.testutils import PEP8MixIn
+
+
+class TestDownloadQueue(unittest.TestCase, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/base/downloadqueue.py']
+
+    def setUp(self):
+        self.queue = DownloadQueue({DownloadKind.RESOURCE: 1,
+                                    DownloadKind.RESULT: 2})
+
+    def test_budgets(self):
+        assert self.queue.try_start(DownloadKind.RESOURCE)
+        assert not self.queue.try_start(DownloadKind.RESOURCE)
+        assert self.queue.try_start(DownloadKind.RESULT)
+        assert self.queue.try_start(DownloadKind.RESULT)
+        assert not self.queue.try_start(DownloadKind.RESULT)
+
+        self.queue.finish(DownloadKind.RESOURCE)
+        assert self.queue.try_start(DownloadKind.RESOURCE)
+
+        # unlimited
+        self.queue.budgets[DownloadKind.RESOURCE] = 0
+        assert self.queue.try_start(DownloadKind.RESOURCE)
+
+    def test_rank(self):
+        now = time.time()
+        queue = self.queue
+        urgent = queue.push(DownloadKind.RESOURCE, 'urgent', deadline=now + 60)
+        relaxed = queue.push(DownloadKind.RESOURCE, 'relaxed',
+                             deadline=now + 600)
+        unknown = queue.push(DownloadKind.RESOURCE, 'unknown')
+        large = queue.push(DownloadKind.RESOURCE, 'large', deadline=now + 60,
+                           size=1024 ** 3)
+        result = queue.push(DownloadKind.RESULT, 'result', deadline=now + 60)
+
+        for entry in (urgent, relaxed, unknown, large, result):
+            entry.queued = now
+        ranked = sorted([urgent, relaxed, unknown, large, result],
+                        key=lambda e: queue.rank(e, now))
+        assert [e.params for e in ranked] == \
+            ['result', 'urgent', 'relaxed', 'large', 'unknown']
+
+    def test_aging(self):
+        now = time.time()
+        old = self.queue.push(DownloadKind.RESOURCE, 'old')
+        new = self.queue.push(DownloadKind.RESOURCE, 'new',
+                              deadline=now + 600)
+        old.queued = now - 2 * DownloadQueue.DEFAULT_SLACK
+        new.queued = now
+        assert self.queue.pop().params == 'old'
+
+    def test_pop(self):
+        assert self.queue.pop() is None
+        self.queue.try_start(DownloadKind.RESOURCE)
+        resource = self.queue.push(DownloadKind.RESOURCE, 'resource',
+                                   deadline=time.time())
+        result = self.queue.push(DownloadKind.RESULT, 'result')
+        assert len(self.queue) == 2
+
+        # no slot for resources
+        assert self.queue.pop() is result
+        assert self.queue.pop() is None
+        self.queue.finish(DownloadKind.RESOURCE)
+        assert self.queue.pop() is resource
+        assert not self.queue.try_start(DownloadKind.RESOURCE)
+
+    def test_stats(self):
+        entry = self.queue.push(DownloadKind.RESULT, 'result')
+        self.queue.push(DownloadKind.RESULT, 'other')
+        entry.queued -= 10
+        stats = self.queue.get_stats()[DownloadKind.RESULT]
+        assert stats['queued'] == 2
+        assert stats['active'] == 0
+
+        assert self.queue.pop() is entry
+        stats = self.queue.get_stats()[DownloadKind.RESULT]
+        assert stats['queued'] == 1
+        assert stats['active'] == 1
+        assert stats['started'] == 1
+        assert stats['max_wait'] >= 10
+        assert stats['average_wait'] == stats['max_wait']
@@ -0,0 +1,189 @@
+import os
+import re
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Lock, Thread
+
+import numpy
+from requests.exceptions import HTTPError
+
+from golem.resource.chunkstore import chunk_hash
+from golem.resource.http.filerequest import DownloadFileRequest
+from golem.testutils import TempDirFixture
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    data = ''
+    # number of bytes sent in responses before the connection is broken
+    breaks = []
+    accept_ranges = True
+    received = []
+    lock = Lock()
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        range_header = self.headers.getheader('Range')
+        with self.lock:
+            self.received.append(range_header)
+            limit = self.breaks.pop(0) if self.breaks and send_body else None
+
+        if self.path != '/hash':
+            self.send_error(404)
+            return
+
+        size = len(self.data)
+        start, end = 0, size - 1
+
+        if range_header and self.accept_ranges:
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes {}-{}/{}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        if send_body:
+            body = self.data[start:end + 1]
+            self.wfile.write(body[:limit] if limit is not None else body)
+
+    def log_message(self, *_):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestDownloadFileRequest(TempDirFixture):
+
+    def setUp(self):
+        super(TestDownloadFileRequest, self).setUp()
+        RangeHandler.data = numpy.random.RandomState(0).bytes(1000000)
+        RangeHandler.breaks = []
+        RangeHandler.received = []
+        RangeHandler.accept_ranges = True
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        thread = Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.dst = os.path.join(self.tempdir, 'scene.blend')
+        self.ranges = [[chunk_hash(RangeHandler.data[i:i + 100000]), 100000]
+                       for i in xrange(0, 1000000, 100000)]
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        super(TestDownloadFileRequest, self).tearDown()
+
+    def _read(self):
+        with open(self.dst, 'rb') as f:
+            return f.read()
+
+    def _write_part(self, data):
+        with open(self.dst + DownloadFileRequest.PART_EXT, 'wb') as f:
+            f.write(data)
+
+    def _run(self, **kwargs):
+        return DownloadFileRequest('hash', self.dst, **kwargs).run(self.url)
+
+    def test_download(self):
+        assert self._run() == self.dst
+        assert self._read() == RangeHandler.data
+        assert os.listdir(self.tempdir) == ['scene.blend']
+        assert RangeHandler.received == [None]
+
+    def test_resume(self):
+        RangeHandler.breaks = [300000, 200000]
+        self._run()
+        assert self._read() == RangeHandler.data
+        assert RangeHandler.received == [None, 'bytes=300000-',
+                                         'bytes=500000-']
+
+    def test_resume_previous_run(self):
+        self._write_part(RangeHandler.data[:400000])
+        self._run()
+        assert self._read() == RangeHandler.data
+        assert RangeHandler.received == ['bytes=400000-']
+
+    def test_complete_part(self):
+        self._write_part(RangeHandler.data)
+        self._run()
+        assert self._read() == RangeHandler.data
+        assert RangeHandler.received == ['bytes=1000000-']
+
+    def test_ranges_ignored(self):
+        RangeHandler.accept_ranges = False
+        self._write_part('\0' * 400000)
+        self._run()
+        assert self._read() == RangeHandler.data
+
+    def test_invalid_ranges(self):
+        data = RangeHandler.data
+        # data of the second range is damaged
+        self._write_part(data[:150000] + '\0' + data[150001:450000])
+        self._run(ranges=self.ranges)
+        assert self._read() == RangeHandler.data
+        assert RangeHandler.received == ['bytes=100000-']
+
+        # invalid data received is downloaded again
+        os.remove(self.dst)
+        RangeHandler.received = []
+        RangeHandler.data = data[:700000] + '\0' + data[700001:]
+        with self.assertRaises(IOError):
+            self._run(ranges=self.ranges, max_resumes=2)
+        assert RangeHandler.received[1:] == ['bytes=700000-'] * 2
+
+    def test_no_progress(self):
+        RangeHandler.breaks = [100000] + [0] * 10
+        with self.assertRaises(IOError):
+            self._run(max_resumes=3)
+        # the first request and 3 resumes
+        assert len(RangeHandler.received) == 4
+        assert not os.path.exists(self.dst)
+
+        # continued when run again
+        RangeHandler.received = []
+        RangeHandler.breaks = []
+        self._run()
+        assert self._read() == RangeHandler.data
+        assert RangeHandler.received == ['bytes=100000-']
+
+    def test_http_error(self):
+        request = DownloadFileRequest('other', self.dst)
+        with self.assertRaises(HTTPError):
+            request.run(self.url)
+        assert len(RangeHandler.received) == 1
+
+    def test_parallel(self):
+        RangeHandler.breaks = [0, 50000]
+        self._run(parallel_size=500000, range_size=100000,
+                  ranges=self.ranges)
+        assert self._read() == RangeHandler.data
+        ranges = [r for r in RangeHandler.received if r]
+        assert len(ranges) == 12
+        assert 'bytes=100000-199999' in ranges
+        assert os.listdir(self.tempdir) == ['scene.blend']
+
+    def test_parallel_small_file(self):
+        self._run(parallel_size=2000000)
+        assert self._read() == RangeHandler.data
+        # HEAD and GET
+        assert RangeHandler.received == [None, None]
@@ -2,9 +2,11 @@ import os
 import unittest
 import uuid
 
-from golem.resource.client import file_multihash
+from mock import patch
 
-from golem.resource.http.resourcesmanager import HTTPResourceManagerClient
+from golem.resource.client import file_multihash, ClientOptions
+
+from golem.resource.http.resourcesmanager import HTTPResourceManagerClient, SERVERS
 from golem.testutils import TempDirFixture
 
 
@@ -42,3 +44,41 @@ class TestHTTPClient(TempDirFixture):
 
         assert os.stat(self.src_file).st_size == os.stat(dst_path).st_size
         assert file_multihash(self.src_file) == file_multihash(dst_path)
+
+    def test_build_options(self):
+        options = HTTPResourceManagerClient.build_options('node_id')
+        server = options.get(HTTPResourceManagerClient.CLIENT_ID,
+                             HTTPResourceManagerClient.VERSION,
+                             HTTPResourceManagerClient.OPTION_SERVER)
+        servers = options.get(HTTPResourceManagerClient.CLIENT_ID,
+                              HTTPResourceManagerClient.VERSION,
+                              HTTPResourceManagerClient.OPTION_SERVERS)
+        assert servers[0] == server
+        assert sorted(servers) == sorted(SERVERS)
+
+    def test_get_file_many_servers(self):
+        client = HTTPResourceManagerClient()
+        options = ClientOptions(client.CLIENT_ID, client.VERSION,
+                                {client.OPTION_SERVERS: ['http://a', 'http://b']})
+        kwargs = dict(filename=self.dst_file_name, filepath=self.dst_file_path,
+                      client_options=options)
+
+        with patch.object(client, '_download_multi') as download_multi, \
+                patch.object(client, '_download') as download:
+            client.get_file('hash', **kwargs)
+            assert download_multi.call_args[0][2] == ['http://a', 'http://b']
+            assert not download.called
+
+            # a single server is used when downloading from many fails
+            download_multi.side_effect = IOError
+            client.get_file('hash', **kwargs)
+            assert download.called
+
+    @patch('golem.resource.http.resourcesmanager.DownloadFileRequest')
+    def test_download_options(self, request):
+        client = HTTPResourceManagerClient(timeout=(2000, 4000))
+        client._download('hash', self.src_file)
+        kwargs = request.call_args[1]
+        assert kwargs['timeout'] == (2.0, 4.0)
+        assert kwargs['parallel_size'] == client.PARALLEL_DOWNLOAD_SIZE
+        assert request.return_value.run.called
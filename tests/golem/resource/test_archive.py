@@ -0,0 +1,107 @@
+import os
+import zipfile
+
+import numpy
+from mock import patch
+
+from golem.resource import archive
+from golem.resource.archive import ArchiveBuilder
+from golem.resource.resource import TaskResourceHeader, compress_dir, \
+    decompress_dir
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class WriteOnlyStream(object):
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+
+class TestArchiveBuilder(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/archive.py']
+
+    def setUp(self):
+        super(TestArchiveBuilder, self).setUp()
+        self.src_dir = os.path.join(self.tempdir, 'src')
+        os.makedirs(os.path.join(self.src_dir, 'textures'))
+
+    def _write(self, name, data):
+        path = os.path.join(self.src_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_compress_type(self):
+        builder = ArchiveBuilder()
+        text = self._write('scene.blend', 'BLENDER' * 100)
+        gzipped = self._write('packed.blend', '\x1f\x8b' + 'data' * 100)
+        image = self._write('textures/img.EXR', 'data' * 100)
+        assert builder.compress_type(text) == zipfile.ZIP_DEFLATED
+        assert builder.compress_type(gzipped) == zipfile.ZIP_STORED
+        assert builder.compress_type(image) == zipfile.ZIP_STORED
+
+    def test_parallel_deflate(self):
+        random = numpy.random.RandomState(0)
+        # compressible, but not trivially
+        data = random.randint(0, 16, 5 * 1024 * 1024 + 123) \
+            .astype(numpy.uint8).tostring()
+        path = self._write('scene.blend', data)
+
+        builder = ArchiveBuilder(workers=4)
+        builder.PARALLEL_SIZE = builder.BLOCK_SIZE = 1024 * 1024
+        builder.add(path, 'scene.blend')
+        stream = WriteOnlyStream()
+        with patch('golem.resource.archive._deflate_block',
+                   wraps=archive._deflate_block) as deflate:
+            builder.write(stream)
+        assert deflate.call_count == 6
+
+        archive_path = os.path.join(self.tempdir, 'archive.zip')
+        with open(archive_path, 'wb') as f:
+            f.write(''.join(stream.data))
+        with zipfile.ZipFile(archive_path) as zf:
+            assert zf.testzip() is None
+            info = zf.getinfo('scene.blend')
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            assert info.compress_size < len(data)
+            assert zf.read('scene.blend') == data
+
+    def test_compress_dir(self):
+        self._write('scene.blend', 'BLENDER' * 1000)
+        self._write('textures/img.png', '\x89PNG' + 'data' * 1000)
+        header = TaskResourceHeader.build('src', self.src_dir)
+        output_dir = os.path.join(self.tempdir, 'out')
+        os.makedirs(output_dir)
+
+        cwd = os.getcwd()
+        with patch('os.chdir') as chdir:
+            archive_path = compress_dir(self.src_dir, header, output_dir)
+        assert not chdir.called
+        assert os.getcwd() == cwd
+        assert os.path.dirname(archive_path) == output_dir
+
+        with zipfile.ZipFile(archive_path) as zf:
+            compress_types = {i.filename: i.compress_type
+                              for i in zf.infolist()}
+        assert compress_types == {
+            'scene.blend': zipfile.ZIP_DEFLATED,
+            os.path.join('textures', 'img.png'): zipfile.ZIP_STORED
+        }
+
+        dst_dir = os.path.join(self.tempdir, 'dst')
+        decompress_dir(dst_dir, archive_path)
+        assert TaskResourceHeader.build('src', dst_dir) == header
+
+        # files hardlinked into the directory are replaced, not overwritten
+        stored = os.path.join(self.tempdir, 'stored')
+        with open(stored, 'wb') as f:
+            f.write('stored')
+        os.remove(os.path.join(dst_dir, 'scene.blend'))
+        os.link(stored, os.path.join(dst_dir, 'scene.blend'))
+        decompress_dir(dst_dir, archive_path)
+        assert TaskResourceHeader.build('src', dst_dir) == header
+        with open(stored, 'rb') as f:
+            assert f.read() == 'stored'
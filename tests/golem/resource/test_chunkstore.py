@@ -0,0 +1,162 @@
+import os
+from cStringIO import StringIO
+
+import numpy
+from mock import Mock
+
+from golem.resource.chunkstore import ChunkStore, FileManifest, iter_chunks, \
+    MAX_CHUNK_SIZE, MIN_CHUNK_SIZE
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+def random_data(size, seed=0):
+    return numpy.random.RandomState(seed).bytes(size)
+
+
+class TestChunking(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/chunkstore.py']
+
+    def test_iter_chunks(self):
+        data = random_data(3 * 1024 * 1024)
+        chunks = list(iter_chunks(StringIO(data)))
+        assert ''.join(chunks) == data
+        assert len(chunks) > 2
+        assert all(MIN_CHUNK_SIZE < len(c) <= MAX_CHUNK_SIZE
+                   for c in chunks[:-1])
+        # boundaries do not depend on the size of reads
+        assert list(iter_chunks(StringIO(data), read_size=100000)) == chunks
+
+        assert list(iter_chunks(StringIO(''))) == []
+        assert list(iter_chunks(StringIO('abc'))) == ['abc']
+        zeros = list(iter_chunks(StringIO('\0' * (2 * MAX_CHUNK_SIZE + 1))))
+        assert [len(c) for c in zeros] == [MAX_CHUNK_SIZE, MAX_CHUNK_SIZE, 1]
+
+    def test_insertion_changes_few_chunks(self):
+        data = random_data(4 * 1024 * 1024)
+        changed = data[:2000000] + 'inserted' + data[2000000:]
+        chunks = list(iter_chunks(StringIO(data)))
+        new_chunks = list(iter_chunks(StringIO(changed)))
+        assert len(set(new_chunks) - set(chunks)) <= 2
+
+    def test_manifest(self):
+        path = os.path.join(self.tempdir, 'file')
+        with open(path, 'wb') as f:
+            f.write(random_data(1024 * 1024))
+        manifest = FileManifest.build(path)
+        assert manifest.size == 1024 * 1024
+        assert sum(size for _, size in manifest.chunks) == manifest.size
+        assert FileManifest.from_dict(manifest.to_dict()) == manifest
+
+
+class TestChunkStore(TempDirFixture):
+
+    def setUp(self):
+        super(TestChunkStore, self).setUp()
+        self.store = ChunkStore(os.path.join(self.tempdir, 'store'))
+        self.data = random_data(2 * 1024 * 1024)
+
+    def _write(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_add_and_materialize(self):
+        path = self._write('scene.blend', self.data)
+        object_id = self.store.add_file(path, 'task1')
+        assert self.store.has_object(object_id)
+        assert os.path.samefile(path, self.store.object_path(object_id))
+
+        dst = os.path.join(self.tempdir, 'task2', 'scene.blend')
+        assert self.store.materialize(object_id, dst, 'task2')
+        assert os.path.samefile(dst, path)
+        assert self.store.get_task_objects('task2') == [object_id]
+        assert not self.store.materialize('unknown', dst, 'task2')
+
+        # the index is persistent
+        store = ChunkStore(self.store.root_dir)
+        assert store.has_object(object_id)
+        assert store.get_manifest(object_id) == FileManifest.build(path)
+
+    def test_relink(self):
+        first = self._write('first', self.data)
+        second = self._write('second', self.data)
+        object_id = self.store.add_file(first, 'task1')
+        self.store.add_file(second, 'task2')
+        assert not os.path.samefile(first, second)
+        assert self.store.add_file(second, 'task2', relink=True) == object_id
+        assert os.path.samefile(first, second)
+
+    def test_release(self):
+        path = self._write('scene.blend', self.data)
+        object_id = self.store.add_file(path, 'task1')
+        self.store.add_file(path, 'task2')
+        self.store.add_alias('hash', {'scene.blend': object_id})
+
+        assert self.store.release('task1') == []
+        assert self.store.has_object(object_id)
+        assert self.store.release('task2') == [object_id]
+        assert not self.store.has_object(object_id)
+        assert not os.path.exists(self.store.object_path(object_id))
+        assert self.store.get_alias('hash') is None
+        # files of tasks are left untouched
+        assert os.path.exists(path)
+
+    def test_alias(self):
+        path = self._write('scene.blend', self.data)
+        object_id = self.store.add_file(path, 'task1')
+        assert self.store.get_alias('hash') is None
+        self.store.add_alias('hash', {'scene.blend': object_id})
+        assert self.store.get_alias('hash') == {'scene.blend': object_id}
+
+    def test_modified_object(self):
+        path = self._write('scene.blend', self.data)
+        object_id = self.store.add_file(path, 'task1')
+        self.store.add_alias('hash', {'scene.blend': object_id})
+        # modified in place through a link
+        with open(path, 'r+b') as f:
+            f.write('changed')
+        assert self.store.get_alias('hash') is None
+        assert not self.store.has_object(object_id)
+
+    def test_chunks(self):
+        path = self._write('scene.blend', self.data)
+        object_id = self.store.add_file(path, 'task1')
+        manifest = self.store.get_manifest(object_id)
+        digests = [d for d, _ in manifest.chunks]
+        assert self.store.missing_chunks(digests + ['unknown']) == ['unknown']
+        assert ''.join(self.store.read_chunk(d) for d in digests) == self.data
+        assert self.store.read_chunk('unknown') is None
+
+    def test_assemble(self):
+        path = self._write('scene.blend', self.data)
+        self.store.add_file(path, 'task1')
+
+        changed = self.data[:1000000] + 'inserted' + self.data[1000000:]
+        changed_path = self._write('changed.blend', changed)
+        manifest = FileManifest.build(changed_path)
+        chunks = dict(zip([d for d, _ in manifest.chunks],
+                          iter_chunks(StringIO(changed))))
+        fetch = Mock(side_effect=lambda digest: chunks[digest])
+
+        dst = os.path.join(self.tempdir, 'task2', 'scene.blend')
+        fetched = self.store.assemble(manifest, dst, fetch, 'task2')
+        assert 0 < fetched < len(manifest.chunks)
+        assert fetch.call_count == fetched
+        with open(dst, 'rb') as f:
+            assert f.read() == changed
+        assert self.store.has_object(manifest.hash)
+
+        # already stored
+        fetch.reset_mock()
+        dst = os.path.join(self.tempdir, 'task3', 'scene.blend')
+        assert self.store.assemble(manifest, dst, fetch, 'task3') == 0
+        assert not fetch.called
+
+    def test_assemble_invalid_chunk(self):
+        manifest = FileManifest.build(self._write('file', self.data))
+        dst = os.path.join(self.tempdir, 'dst')
+        with self.assertRaises(ValueError):
+            self.store.assemble(manifest, dst, lambda _: 'invalid', 'task')
+        assert not os.path.exists(dst)
+        assert os.listdir(self.tempdir) == ['file']
@@ -0,0 +1,114 @@
+import os
+import time
+
+from mock import Mock, patch
+
+from golem.resource.dircache import TaskDirCache
+from golem.resource.dirmanager import DirManager
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class TestTaskDirCache(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/dircache.py']
+
+    def setUp(self):
+        super(TestTaskDirCache, self).setUp()
+        self.dir_manager = DirManager(self.tempdir)
+        self.cache = TaskDirCache(self.dir_manager, quota=10000,
+                                  low_watermark=0.5)
+
+    def _add_task(self, task_id, size, mtime=None):
+        res_dir = self.dir_manager.get_task_resource_dir(task_id)
+        path = os.path.join(res_dir, 'scene.blend')
+        with open(path, 'wb') as f:
+            f.write('\0' * size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+            os.utime(res_dir, (mtime, mtime))
+        return path
+
+    def _exists(self, task_id):
+        return os.path.isdir(os.path.join(self.tempdir, task_id))
+
+    def test_usage(self):
+        path = self._add_task('task1', 1000)
+        self._add_task('task2', 2000)
+        self.dir_manager.get_resource_dir()
+        os.makedirs(os.path.join(self.tempdir, 'other'))
+        assert self.cache.get_usage() == {'task1': 1000, 'task2': 2000}
+
+        # shared files are counted for every task
+        os.link(path, os.path.join(
+            self.dir_manager.get_task_output_dir('task2'), 'scene.blend'))
+        assert self.cache.get_usage() == {'task1': 1000, 'task2': 3000}
+
+    def test_under_quota(self):
+        self._add_task('task1', 5000)
+        self._add_task('task2', 5000)
+        assert self.cache.enforce() == []
+        assert self._exists('task1') and self._exists('task2')
+
+    def test_evicts_least_recently_used(self):
+        now = time.time()
+        self._add_task('task1', 3000, mtime=now - 300)
+        self._add_task('task2', 3000, mtime=now - 100)
+        self._add_task('task3', 3000, mtime=now - 200)
+        self.cache.touch('task1')
+        self.cache.low_watermark = 0.7
+        listener = Mock()
+        self.cache.add_eviction_listener(listener)
+
+        self._add_task('task4', 3000)
+        # evicted down to the low watermark
+        with patch('twisted.internet.reactor', create=True) as reactor:
+            assert self.cache.enforce() == ['task3', 'task2']
+        # listeners are called in the reactor thread
+        assert not listener.called
+        for call in reactor.callFromThread.call_args_list:
+            call[0][0](*call[0][1:])
+        assert not self._exists('task2') and not self._exists('task3')
+        assert self._exists('task1') and self._exists('task4')
+        assert [c[0][0] for c in listener.call_args_list] == ['task3',
+                                                              'task2']
+        assert sorted(os.listdir(self.tempdir)) == ['task1', 'task4']
+
+    def test_pinned(self):
+        self._add_task('task1', 6000)
+        self._add_task('task2', 6000)
+        self.cache.pin('task1')
+        self.cache.pin('task1')
+        self.cache.pin('task2')
+
+        assert self.cache.enforce() == []
+        self.cache.unpin('task1')
+        assert self.cache.is_pinned('task1')
+        self.cache.unpin('task2')
+        assert self.cache.enforce() == ['task2']
+        assert self._exists('task1')
+
+    def test_shared_files(self):
+        path = self._add_task('task1', 6000)
+        os.link(path, os.path.join(
+            self.dir_manager.get_task_resource_dir('task2'), 'linked.blend'))
+        self._add_task('task2', 5000)
+        self.cache.touch('task2')
+        # removing task1 frees nothing while its file is linked in task2
+        assert self.cache.enforce() == ['task1', 'task2']
+
+    def test_free_space(self):
+        self._add_task('task1', 1000)
+        self._add_task('task2', 1000)
+        self.cache.quota = 0
+        self.cache.min_free = 10 * 1024
+        with patch('golem.resource.dircache.free_partition_space',
+                   return_value=100):
+            assert self.cache.enforce() == []
+        with patch('golem.resource.dircache.free_partition_space',
+                   return_value=9):
+            assert sorted(self.cache.enforce()) == ['task1', 'task2']
+
+    def test_interrupted_removal(self):
+        removed = os.path.join(self.tempdir, TaskDirCache.EVICTED_PREFIX + 'x')
+        os.makedirs(os.path.join(removed, 'resources'))
+        assert self.cache.get_usage() == {}
+        assert not os.path.exists(removed)
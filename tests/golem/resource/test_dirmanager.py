@@ -105,6 +105,15 @@ class TestDirManager(TestDirFixture):
         outDir = dm.get_task_output_dir(task_id, create=True)
         self.assertTrue(os.path.isdir(outDir))
 
+    def testGetChunkStoreDir(self):
+        dm = DirManager(self.path)
+        storeDir = dm.get_chunk_store_dir()
+        expectedDir = os.path.join(self.path, 'golemres', 'chunks')
+        self.assertEquals(os.path.normpath(storeDir), expectedDir)
+        self.assertTrue(os.path.isdir(storeDir))
+        shutil.rmtree(storeDir)
+        self.assertEquals(dm.get_chunk_store_dir(create=False), "")
+
     def testClearTemporary(self):
         dm = DirManager(self.path)
         task_id = '12345'
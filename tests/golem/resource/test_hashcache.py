@@ -0,0 +1,112 @@
+import os
+import time
+
+from mock import patch
+
+from golem.core.simplehash import SimpleHash
+from golem.resource.hashcache import FileHashCache
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class _HashCalls(list):
+    """ Records hashed paths; Mock.call_count is not thread-safe, while
+    files are hashed in parallel """
+
+    def __init__(self):
+        super(_HashCalls, self).__init__()
+        self.hash_file = SimpleHash.hash_file_base64
+
+    def __call__(self, path):
+        self.append(path)
+        return self.hash_file(path)
+
+
+class TestFileHashCache(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/hashcache.py']
+
+    def setUp(self):
+        super(TestFileHashCache, self).setUp()
+        self.cache = FileHashCache()
+
+    def _write(self, name, data, age=10.0):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def _hash_calls(self):
+        return patch('golem.resource.hashcache.SimpleHash.hash_file_base64',
+                     new=_HashCalls())
+
+    def test_get_hash(self):
+        path = self._write('file', 'data')
+        expected = SimpleHash.hash_file_base64(path)
+
+        with self._hash_calls() as hashed:
+            assert self.cache.get_hash(path) == expected
+            assert self.cache.get_hash(path) == expected
+            assert len(hashed) == 1
+
+            # modified
+            self._write('file', 'new data')
+            new_hash = self.cache.get_hash(path)
+            assert len(hashed) == 2
+        assert new_hash == SimpleHash.hash_file_base64(path)
+
+    def test_recently_modified(self):
+        path = self._write('file', 'data', age=0)
+        with self._hash_calls() as hashed:
+            self.cache.get_hash(path)
+            self.cache.get_hash(path)
+            assert len(hashed) == 2
+
+    def test_scan(self):
+        paths = [self._write('file{}'.format(i), str(i)) for i in range(10)]
+        self.cache.get_hash(paths[0])
+
+        with self._hash_calls() as hashed:
+            hashes = self.cache.scan(paths)
+            assert sorted(hashed) == sorted(paths[1:])
+        assert hashes == {p: SimpleHash.hash_file_base64(p) for p in paths}
+
+        with self.assertRaises(IOError):
+            self.cache.scan([os.path.join(self.tempdir, 'missing')])
+
+    def test_persistence(self):
+        path = self._write('file', 'data')
+        self.cache.initialize(self.tempdir)
+        self.cache.get_hash(path)
+        assert os.path.exists(self.cache.index_path)
+
+        cache = FileHashCache()
+        cache.initialize(self.tempdir)
+        expected = SimpleHash.hash_file_base64(path)
+        with self._hash_calls() as hashed:
+            assert cache.get_hash(path) == expected
+            assert not hashed
+
+        with open(cache.index_path, 'w') as f:
+            f.write('invalid')
+        cache.initialize(self.tempdir)
+        assert cache.get_hash(path) == SimpleHash.hash_file_base64(path)
+
+    def test_invalidate_and_prune(self):
+        first = self._write('first', 'data')
+        second = self._write('second', 'data')
+        self.cache.scan([first, second])
+
+        with self._hash_calls() as hashed:
+            self.cache.invalidate(first)
+            self.cache.scan([first, second])
+            assert len(hashed) == 1
+
+            self.cache.invalidate()
+            self.cache.scan([first, second])
+            assert len(hashed) == 3
+
+        os.remove(first)
+        self.cache.prune()
+        assert os.path.abspath(first) not in self.cache._entries
+        assert os.path.abspath(second) in self.cache._entries
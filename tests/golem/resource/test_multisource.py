@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+import numpy
+from mock import Mock, patch
+
+from golem.resource.chunkstore import ChunkStore, FileManifest
+from golem.resource.multisource import ChunkSource, HTTPRangeSource, \
+    MultiSourceDownloader
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class MemorySource(ChunkSource):
+
+    def __init__(self, name, data, delay=0.0, fail=False, corrupt=False):
+        super(MemorySource, self).__init__(name)
+        self.data = data
+        self.delay = delay
+        self.fail = fail
+        self.corrupt = corrupt
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def fetch(self, offset, size):
+        with self.lock:
+            self.fetched.append(offset)
+        time.sleep(self.delay)
+        if self.fail:
+            raise IOError("Source unavailable")
+        data = self.data[offset:offset + size]
+        if self.corrupt:
+            return '\0' * len(data)
+        return data
+
+
+class TestMultiSourceDownloader(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/multisource.py']
+
+    def setUp(self):
+        super(TestMultiSourceDownloader, self).setUp()
+        self.data = numpy.random.RandomState(0).bytes(2 * 1024 * 1024)
+        self.dst = os.path.join(self.tempdir, 'dst', 'scene.blend')
+
+    def _manifest(self, data):
+        path = os.path.join(self.tempdir, 'src')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return FileManifest.build(path)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_ranges(self):
+        sources = [MemorySource('a', self.data), MemorySource('b', self.data)]
+        downloader = MultiSourceDownloader(sources, piece_size=100000)
+        fetched = downloader.download_ranges(len(self.data), self.dst)
+        assert self._read(self.dst) == self.data
+        assert sum(fetched.values()) == 21
+        # both sources were used
+        assert all(fetched.values())
+        assert os.listdir(os.path.dirname(self.dst)) == ['scene.blend']
+
+    def test_verify(self):
+        sources = [MemorySource('a', self.data)]
+        downloader = MultiSourceDownloader(sources, piece_size=100000)
+        with self.assertRaises(ValueError):
+            downloader.download_ranges(len(self.data), self.dst,
+                                       verify=lambda _: False)
+        assert not os.listdir(os.path.dirname(self.dst))
+
+    def test_manifest(self):
+        manifest = self._manifest(self.data)
+        sources = [MemorySource('a', self.data), MemorySource('b', self.data)]
+        fetched = MultiSourceDownloader(sources).download_manifest(
+            manifest, self.dst)
+        assert sum(fetched.values()) == len(manifest.chunks)
+        assert self._read(self.dst) == self.data
+
+    def test_manifest_chunk_store(self):
+        store = ChunkStore(os.path.join(self.tempdir, 'store'))
+        old_path = os.path.join(self.tempdir, 'old')
+        with open(old_path, 'wb') as f:
+            f.write(self.data)
+        store.add_file(old_path, 'task1')
+
+        changed = self.data[:1000000] + 'inserted' + self.data[1000000:]
+        manifest = self._manifest(changed)
+        source = MemorySource('a', changed)
+        fetched = MultiSourceDownloader([source]).download_manifest(
+            manifest, self.dst, chunk_store=store, task_id='task2')
+
+        assert 0 < fetched['a'] < len(manifest.chunks)
+        assert self._read(self.dst) == changed
+        assert store.has_object(manifest.hash)
+
+    def test_invalid_pieces(self):
+        manifest = self._manifest(self.data)
+        corrupt = MemorySource('corrupt', self.data, corrupt=True)
+        valid = MemorySource('valid', self.data, delay=0.01)
+        downloader = MultiSourceDownloader([corrupt, valid], max_errors=2)
+        fetched = downloader.download_manifest(manifest, self.dst)
+        assert fetched == {'corrupt': 0, 'valid': len(manifest.chunks)}
+        # dropped after max_errors
+        assert len(corrupt.fetched) <= 2 + downloader.per_source
+        assert self._read(self.dst) == self.data
+
+    def test_no_sources_left(self):
+        sources = [MemorySource('a', self.data, fail=True),
+                   MemorySource('b', self.data, fail=True)]
+        downloader = MultiSourceDownloader(sources, piece_size=100000)
+        with self.assertRaises(IOError):
+            downloader.download_ranges(len(self.data), self.dst)
+        assert not os.listdir(os.path.dirname(self.dst))
+
+    def test_slow_source_dropped(self):
+        fast = MemorySource('fast', self.data)
+        slow = MemorySource('slow', self.data, delay=0.2)
+        downloader = MultiSourceDownloader([fast, slow], piece_size=50000,
+                                           min_samples=1)
+        fetched = downloader.download_ranges(len(self.data), self.dst)
+        assert self._read(self.dst) == self.data
+        assert fetched['slow'] <= 2 * downloader.per_source
+        assert fetched['fast'] > fetched['slow']
+
+    def test_no_sources(self):
+        with self.assertRaises(ValueError):
+            MultiSourceDownloader([])
+
+
+class TestHTTPRangeSource(TempDirFixture):
+
+    @patch('golem.resource.multisource.requests')
+    def test_fetch(self, requests):
+        requests.codes.partial_content = 206
+        requests.get.return_value = Mock(status_code=206, content='data')
+        source = HTTPRangeSource('http://host/hash', timeout=5)
+        assert source.fetch(100, 4) == 'data'
+        kwargs = requests.get.call_args[1]
+        assert kwargs['headers'] == {'Range': 'bytes=100-103'}
+        assert kwargs['timeout'] == 5
+
+        # servers ignoring ranges are not used
+        requests.get.return_value = Mock(status_code=200, content='data')
+        with self.assertRaises(IOError):
+            source.fetch(100, 4)
+
+    @patch('golem.resource.multisource.requests')
+    def test_get_size(self, requests):
+        requests.head.return_value = Mock(headers={'Content-Length': '123'})
+        assert HTTPRangeSource('http://host/hash').get_size() == 123
@@ -1,54 +1,114 @@
-import os
-from golem.resource.resource import TaskResourceHeader, TaskResource
-from golem.resource.dirmanager import DirManager
-from test_dirmanager import TestDirFixture
-
-
-class TestTaskResourceHeader(TestDirFixture):
-    def setUp(self):
-        TestDirFixture.setUp(self)
-
-        self.dir_manager = DirManager(self.path)
-        res_path = self.dir_manager.get_task_resource_dir('task2')
-
-        self.file1 = os.path.join(res_path, 'file1')
-        self.file2 = os.path.join(res_path, 'file2')
-        self.dir1 = os.path.join(res_path, 'dir1')
-        self.file3 = os.path.join(self.dir1, 'file3')
-        open(self.file1, 'w').close()
-        open(self.file2, 'w').close()
-        if not os.path.isdir(self.dir1):
-            os.mkdir(self.dir1)
-        open(self.file3, 'w').close()
-
-    def testBuild(self):
-        dir_name = self.dir_manager.get_task_resource_dir("task2")
-        header = TaskResourceHeader.build("resource", dir_name)
-        self.assertEquals(len(header.files_data), 2)
-        self.assertEquals(len(header.sub_dir_headers[0].files_data), 1)
-
-    def testBuildFromChosen(self):
-        dir_name = self.dir_manager.get_task_resource_dir('task2')
-        header = TaskResourceHeader.build_from_chosen("resource", dir_name, [self.file1, self.file3])
-        header2 = TaskResourceHeader.build_header_delta_from_header(TaskResourceHeader("resource"), dir_name,
-                                                                    [self.file1, self.file3])
-        self.assertTrue(header == header2)
-        self.assertEquals(header.dir_name, header2.dir_name)
-        self.assertEquals(header.files_data, header2.files_data)
-
-        with self.assertRaises(TypeError):
-            TaskResourceHeader.build_header_delta_from_chosen(None, None)
-
-        self.assertEqual(TaskResourceHeader.build_header_delta_from_chosen(header, self.path),
-                         TaskResourceHeader(header.dir_name))
-
-        with self.assertRaises(TypeError):
-            TaskResourceHeader.build_parts_header_delta_from_chosen(None, None, None)
-        with self.assertRaises(TypeError):
-            TaskResourceHeader.build_header_delta_from_header(None, None, None)
-
-
-class TestTaskResource(TestDirFixture):
-
-    def testInit(self):
-        self.assertIsNotNone(TaskResource(self.path))
+import os
+
+import numpy
+from mock import patch
+from twisted.internet.defer import maybeDeferred
+
+from golem.resource.resource import TaskResourceHeader, TaskResource
+from golem.resource.dirmanager import DirManager
+from golem.resource.hashcache import file_hash_cache
+from test_dirmanager import TestDirFixture
+
+
+class TestTaskResourceHeader(TestDirFixture):
+    def setUp(self):
+        TestDirFixture.setUp(self)
+
+        self.dir_manager = DirManager(self.path)
+        res_path = self.dir_manager.get_task_resource_dir('task2')
+
+        self.file1 = os.path.join(res_path, 'file1')
+        self.file2 = os.path.join(res_path, 'file2')
+        self.dir1 = os.path.join(res_path, 'dir1')
+        self.file3 = os.path.join(self.dir1, 'file3')
+        open(self.file1, 'w').close()
+        open(self.file2, 'w').close()
+        if not os.path.isdir(self.dir1):
+            os.mkdir(self.dir1)
+        open(self.file3, 'w').close()
+
+    def testBuild(self):
+        dir_name = self.dir_manager.get_task_resource_dir("task2")
+        header = TaskResourceHeader.build("resource", dir_name)
+        self.assertEquals(len(header.files_data), 2)
+        self.assertEquals(len(header.sub_dir_headers[0].files_data), 1)
+
+    @patch('golem.resource.resource.threads.deferToThread', side_effect=maybeDeferred)
+    def testBuildAsync(self, _):
+        dir_name = self.dir_manager.get_task_resource_dir("task2")
+        headers = []
+        TaskResourceHeader.build_async("resource", dir_name).addCallback(headers.append)
+        assert headers == [TaskResourceHeader.build("resource", dir_name)]
+
+    def testBuildFromChosen(self):
+        dir_name = self.dir_manager.get_task_resource_dir('task2')
+        header = TaskResourceHeader.build_from_chosen("resource", dir_name, [self.file1, self.file3])
+        header2 = TaskResourceHeader.build_header_delta_from_header(TaskResourceHeader("resource"), dir_name,
+                                                                    [self.file1, self.file3])
+        self.assertTrue(header == header2)
+        self.assertEquals(header.dir_name, header2.dir_name)
+        self.assertEquals(header.files_data, header2.files_data)
+
+        with self.assertRaises(TypeError):
+            TaskResourceHeader.build_header_delta_from_chosen(None, None)
+
+        self.assertEqual(TaskResourceHeader.build_header_delta_from_chosen(header, self.path),
+                         TaskResourceHeader(header.dir_name))
+
+        with self.assertRaises(TypeError):
+            TaskResourceHeader.build_parts_header_delta_from_chosen(None, None, None)
+        with self.assertRaises(TypeError):
+            TaskResourceHeader.build_header_delta_from_header(None, None, None)
+
+    def testBuildPartsHeaderDelta(self):
+        dir_name = self.dir_manager.get_task_resource_dir('task2')
+        data = numpy.random.RandomState(0).bytes(1000000)
+        large = os.path.join(self.dir1, 'large')
+        with open(large, 'wb') as f:
+            f.write(data)
+
+        header = TaskResourceHeader.build("resource", dir_name, signatures=True)
+        # signatures of large files only
+        assert len(header.files_data[0]) == 2
+        large_data = header.sub_dir_headers[0].files_data
+        large_data = [f for f in large_data if f[0] == 'large'][0]
+        assert isinstance(large_data[2], dict)
+        assert 'large' in header.to_string()
+        assert str(large_data[2]['block_size']) not in header.to_string()
+
+        with open(large, 'wb') as f:
+            f.write(data[:500000] + 'X' + data[500001:])
+        with open(self.file1, 'w') as f:
+            f.write('changed')
+
+        res_parts = {self.file1: ['part1'], self.file2: ['part2'], large: ['part3', 'part4']}
+        delta, parts = TaskResourceHeader.build_parts_header_delta_from_chosen(header, dir_name, res_parts)
+        assert parts == ['part1']
+        assert [f[0] for f in delta.files_data] == ['file1']
+        large_data = delta.sub_dir_headers[0].files_data
+        assert len(large_data) == 1
+        assert large_data[0][:3] == ('large', file_hash_cache.get_hash(large), [])
+        assert large_data[0][3]['size'] == 1000000
+
+        # without signatures whole files are sent
+        header = TaskResourceHeader.build("resource", dir_name)
+        with open(large, 'wb') as f:
+            f.write(data)
+        _, parts = TaskResourceHeader.build_parts_header_delta_from_chosen(header, dir_name, res_parts)
+        assert parts == ['part3', 'part4']
+
+
+class TestTaskResource(TestDirFixture):
+
+    def testInit(self):
+        self.assertIsNotNone(TaskResource(self.path))
+
+    def testWriteFileKeepsLinks(self):
+        path = os.path.join(self.path, 'file')
+        stored = os.path.join(self.path, 'stored')
+        with open(stored, 'wb') as f:
+            f.write('stored')
+        os.link(stored, path)
+        TaskResource.write_file(path, 'new')
+        assert TaskResource.read_file(path) == 'new'
+        assert TaskResource.read_file(stored) == 'stored'
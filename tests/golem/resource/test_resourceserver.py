@@ -1,6 +1,13 @@
+import os
+
+import numpy
 from mock import Mock
-from golem.testutils import TempDirFixture
+
+from golem.core.simplehash import SimpleHash
+from golem.resource.resource import TaskResourceHeader
 from golem.resource.resourceserver import ResourceServer
+from golem.resource.rsyncdelta import FileDelta, FileSignature
+from golem.testutils import TempDirFixture
 
 
 class TestResourceServer(TempDirFixture):
@@ -10,3 +17,50 @@ class TestResourceServer(TempDirFixture):
         client.datadir = self.tempdir
         rs = ResourceServer(Mock(), Mock(), client)
         assert rs.dir_manager.root_path == client.datadir
+
+    def test_unpack_delta(self):
+        client = Mock()
+        client.datadir = self.tempdir
+        rs = ResourceServer(Mock(), Mock(), client)
+        rs.resource_manager = Mock()
+
+        data = numpy.random.RandomState(0).bytes(1000000)
+        new_data = data[:1000] + 'changed' + data[1000:]
+        dest_dir = os.path.join(self.tempdir, 'resources')
+        os.makedirs(dest_dir)
+        paths = [os.path.join(dest_dir, name) for name in ['old', 'new']]
+        for path, contents in zip(paths, [data, new_data]):
+            with open(path, 'wb') as f:
+                f.write(contents)
+
+        signature = FileSignature.build(paths[0])
+        delta = FileDelta.build(signature, paths[1]).to_dict()
+        new_hash = SimpleHash.hash_file_base64(paths[1])
+        os.remove(paths[1])
+
+        header = TaskResourceHeader('resources')
+        header.files_data = [('old', 'invalid hash', [], delta),
+                             ('other', 'hash', ['part'])]
+        assert not rs.unpack_delta(dest_dir, header, 'task')
+        # not replaced with invalid data; the stale file is removed, so
+        # the next request fetches it whole
+        assert not os.path.exists(paths[0])
+        assert not os.path.exists(paths[0] + '.delta')
+        rs.resource_manager.connect_file.assert_called_once_with(
+            ['part'], os.path.join(dest_dir, 'other'))
+
+        # failures in subdirectories are reported as well
+        sub_header = TaskResourceHeader('sub')
+        sub_header.files_data = [('missing', new_hash, [], delta)]
+        header.files_data = []
+        header.sub_dir_headers = [sub_header]
+        assert not rs.unpack_delta(dest_dir, header, 'task')
+
+        with open(paths[0], 'wb') as f:
+            f.write(data)
+        header.files_data = [('old', new_hash, [], delta)]
+        header.sub_dir_headers = []
+        assert rs.unpack_delta(dest_dir, header, 'task')
+        with open(paths[0], 'rb') as f:
+            assert f.read() == new_data
+        assert sorted(os.listdir(dest_dir)) == ['old', 'sub']
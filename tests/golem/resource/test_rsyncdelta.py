@@ -0,0 +1,117 @@
+import os
+
+import numpy
+
+from golem.resource import rsyncdelta
+from golem.resource.rsyncdelta import FileDelta, FileSignature, \
+    build_delta, build_signature, rolling_checksums
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class TestRsyncDelta(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/resource/rsyncdelta.py']
+
+    def setUp(self):
+        super(TestRsyncDelta, self).setUp()
+        self.data = numpy.random.RandomState(0).bytes(1000000)
+        self.old = self._write('old', self.data)
+
+    def _write(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _check_delta(self, new_data, block_size=None):
+        signature = FileSignature.build(self.old, block_size)
+        new = self._write('new', new_data)
+        delta = FileDelta.from_dict(
+            FileDelta.build(FileSignature.from_dict(signature.to_dict()),
+                            new).to_dict())
+
+        dst = os.path.join(self.tempdir, 'dst')
+        delta.apply(self.old, dst)
+        assert self._read(dst) == new_data
+        return delta
+
+    def test_block_size(self):
+        assert rsyncdelta.block_size_for(0) == rsyncdelta.MIN_BLOCK_SIZE
+        assert rsyncdelta.block_size_for(10 ** 8) == 9 * 1024
+        assert rsyncdelta.block_size_for(10 ** 12) == \
+            rsyncdelta.MAX_BLOCK_SIZE
+
+    def test_rolling_checksums(self):
+        data = self.data[:10000]
+        checksums = rolling_checksums(data, 1000)
+        assert len(checksums) == 9001
+
+        def checksum(block):
+            a = sum(ord(c) for c in block)
+            b = sum((len(block) - i) * ord(c) for i, c in enumerate(block))
+            return (a & 0xffff) | ((b & 0xffff) << 16)
+
+        for offset in [0, 1, 4567, 9000]:
+            assert checksums[offset] == checksum(data[offset:offset + 1000])
+        assert not len(rolling_checksums(data[:999], 1000))
+
+    def test_signature(self):
+        signature = FileSignature.build(self.old, 4096)
+        assert len(signature.weak) == 1000000 // 4096
+        assert len(signature.strong) == \
+            len(signature.weak) * rsyncdelta.STRONG_SIZE
+        assert signature.weak[1] == rolling_checksums(
+            self.data[4096:8192], 4096)[0]
+
+        invalid = signature.to_dict()
+        invalid['strong'] = invalid['strong'][1:]
+        with self.assertRaises(ValueError):
+            FileSignature.from_dict(invalid)
+
+    def test_same_file(self):
+        delta = self._check_delta(self.data, 4096)
+        # whole blocks are copied, the tail is sent
+        assert delta.ops[0] == [FileDelta.COPY, 0, 244]
+        assert delta.literal_size == 1000000 - 244 * 4096
+
+    def test_modified_file(self):
+        data = self.data
+        new_data = data[:100000] + 'inserted' + data[100000:300000] + \
+            'X' + data[300001:700000] + data[710000:]
+        delta = self._check_delta(new_data, 4096)
+        assert delta.literal_size < 5 * 4096
+
+    def test_reordered_blocks(self):
+        data = self.data
+        new_data = data[500000:] + data[:500000]
+        delta = self._check_delta(new_data, 4096)
+        assert delta.literal_size < 3 * 4096
+
+    def test_other_files(self):
+        self._check_delta('')
+        self._check_delta(self.data[:100])
+        self._check_delta(self.data + self.data[:5000])
+        delta = self._check_delta(os.urandom(100000))
+        assert not any(op[0] == FileDelta.COPY for op in delta.ops)
+
+    def test_apply_missing_blocks(self):
+        delta = self._check_delta(self.data, 4096)
+        basis = self._write('basis', self.data[:500000])
+        with self.assertRaises(ValueError):
+            delta.apply(basis, os.path.join(self.tempdir, 'dst'))
+
+    def test_build_delta(self):
+        assert build_signature(self._write('small', 'data')) is None
+        signature = build_signature(self.old)
+
+        new = self._write('new', self.data[:400000] + 'X' +
+                          self.data[400001:])
+        assert build_delta(signature, new).literal_size < 50000
+
+        # deltas are not sent if most data is changed
+        other = self._write('other', os.urandom(1000000))
+        assert build_delta(signature, other) is None
+        assert build_delta({'block_size': 1024}, new) is None
@@ -1,8 +1,12 @@
 import os
 import shutil
 import uuid
+import zipfile
 
-from golem.core.fileencrypt import FileEncryptor
+from mock import patch
+
+from golem.core.fileencrypt import AESFileEncryptor, AESGCMFileEncryptor, \
+    FileEncryptor
 from golem.resource.dirmanager import DirManager
 from golem.task.result.resultpackage import ZipPackager, EncryptingPackager, EncryptingTaskResultPackager, \
     ExtractedPackage
@@ -98,6 +102,33 @@ class TestZipPackager(TestDirFixture):
         self.assertTrue(len(files) == len(self.file_list))
         shutil.rmtree(out_dir)
 
+    def testCreateNonSeekable(self):
+
+        class WriteOnly(object):
+            def __init__(self, dst):
+                self.dst = dst
+
+            def write(self, data):
+                self.dst.write(data)
+
+            def tell(self):
+                return self.dst.tell()
+
+            def flush(self):
+                self.dst.flush()
+
+        zp = ZipPackager()
+        with open(self.out_path, 'wb') as dst:
+            with zp.stream_generator(WriteOnly(dst)) as zf:
+                for file_path in self.files:
+                    zp.write_disk_file(zf, file_path,
+                                       os.path.basename(file_path))
+
+        with zipfile.ZipFile(self.out_path) as zf:
+            assert zf.testzip() is None
+            assert zf.read('out_file') == "File contents"
+            assert zf.read('dir_file') == "Dir file contents"
+
 
 class TestEncryptingPackager(TestDirFixture):
 
@@ -124,6 +155,48 @@ class TestEncryptingPackager(TestDirFixture):
         self.assertTrue(len(files) == len(self.file_list))
         shutil.rmtree(self.out_dir)
 
+    def testNoTemporaryFiles(self):
+        ep = EncryptingPackager(self.secret, chunk_size=2)
+        ep.create(self.out_path, self.files, self.pickle_files)
+        assert os.listdir(self.out_dir) == [os.path.basename(self.out_path)]
+
+        out_dir = os.path.join(self.res_dir, 'extracted')
+        files, _ = ep.extract(self.out_path, output_dir=out_dir)
+        assert os.path.exists(self.out_path)
+        assert sorted(os.listdir(out_dir)) == sorted(files)
+        with open(os.path.join(out_dir, 'dir_file')) as f:
+            assert f.read() == "Dir file contents"
+
+    def testExtractCorrupted(self):
+        ep = EncryptingPackager(self.secret)
+        ep.create(self.out_path, self.files, self.pickle_files)
+        with open(self.out_path, 'r+b') as f:
+            f.seek(AESGCMFileEncryptor.header_len + 1)
+            f.write('\0\0')
+
+        with self.assertRaises(ValueError):
+            ep.extract(self.out_path)
+
+    def testExtractLegacyPackage(self):
+        zip_path = self.out_path + '.zip'
+        ZipPackager().create(zip_path, self.files, self.pickle_files)
+        # packages of format version 0 start with the salt prefix
+        with patch.object(AESFileEncryptor, 'gen_header',
+                          side_effect=lambda: _legacy_header()):
+            AESFileEncryptor.encrypt(zip_path, self.out_path, self.secret)
+
+        with open(self.out_path, 'rb') as f:
+            assert f.read(AESFileEncryptor.salt_prefix_len) == \
+                AESFileEncryptor.salt_prefix
+
+        files, _ = EncryptingPackager(self.secret).extract(self.out_path)
+        self.assertTrue(len(files) == len(self.file_list))
+
+
+def _legacy_header():
+    salt = AESFileEncryptor.gen_salt(AESFileEncryptor.block_size)
+    return AESFileEncryptor.salt_prefix + salt, salt
+
 
 class TestEncryptingTaskResultPackager(TestDirFixture):
 
@@ -0,0 +1,106 @@
+import threading
+from unittest import TestCase
+
+from mock import Mock
+from twisted.internet.defer import Deferred
+
+from golem.core.threads import wait_for
+from golem.task.result.resultpipeline import ResultPipeline, StageStats
+from golem.testutils import PEP8MixIn
+from golem.tools.testwithreactor import TestWithReactor
+
+
+class TestStageStats(TestCase):
+
+    def test_stats(self):
+        stats = StageStats()
+        assert stats.average_time() == 0.0
+        stats.started()
+        stats.started()
+        assert stats.pending == 2
+        stats.finished(1.0)
+        stats.finished(3.0, success=False)
+        assert stats.to_dict() == dict(pending=0, processed=1, failed=1,
+                                       average_time=2.0, max_time=3.0)
+
+
+class TestResultPipeline(TestWithReactor, PEP8MixIn):
+    PEP8_FILES = ['golem/task/result/resultpipeline.py']
+
+    def test_verify(self):
+        pipeline = ResultPipeline()
+        reactor_thread = threading.current_thread()
+
+        def method(value):
+            assert threading.current_thread() != reactor_thread
+            return value * 2
+
+        assert wait_for(pipeline.verify("task", method, 21)) == 42
+        stats = pipeline.get_stats()[ResultPipeline.VERIFY]
+        assert stats['processed'] == 1
+        assert stats['pending'] == 0
+
+        def failing():
+            raise ValueError("Wrong result")
+
+        with self.assertRaises(ValueError):
+            wait_for(pipeline.verify("task", failing))
+        assert pipeline.stats[ResultPipeline.VERIFY].failed == 1
+
+    def test_verify_task_order(self):
+        pipeline = ResultPipeline(max_workers=2)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def blocking(name):
+            release.wait(10)
+            calls.append(name)
+            return name
+
+        def instant(name):
+            calls.append(name)
+            return name
+
+        first = pipeline.verify("task", blocking, "first")
+        second = pipeline.verify("task", instant, "second")
+        # results of other tasks are not blocked
+        assert wait_for(pipeline.verify("task2", instant, "other")) == \
+            "other"
+        assert calls == ["other"]
+
+        release.set()
+        assert wait_for(second) == "second"
+        assert wait_for(first) == "first"
+        assert calls == ["other", "first", "second"]
+
+        pipeline.task_removed("task")
+        assert "task" not in pipeline._task_locks
+
+    def test_submit_backpressure(self):
+        pipeline = ResultPipeline(max_pending=1)
+        first, second = Deferred(), Deferred()
+        jobs = [Mock(return_value=first), Mock(return_value=second)]
+
+        pipeline.submit(jobs[0])
+        assert jobs[0].called
+        assert pipeline.is_congested()
+
+        pipeline.submit(jobs[1])
+        assert not jobs[1].called
+
+        first.callback(None)
+        assert jobs[1].called
+        second.callback(None)
+        assert not pipeline.is_congested()
+
+    def test_measure(self):
+        pipeline = ResultPipeline()
+        deferred = pipeline.measure(ResultPipeline.DOWNLOAD, Deferred())
+        assert pipeline.stats[ResultPipeline.DOWNLOAD].pending == 1
+        deferred.callback("result")
+        assert pipeline.stats[ResultPipeline.DOWNLOAD].processed == 1
+
+        start = pipeline.stage_started(ResultPipeline.DOWNLOAD)
+        pipeline.stage_finished(ResultPipeline.DOWNLOAD, start, False)
+        assert pipeline.stats[ResultPipeline.DOWNLOAD].failed == 1
@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+
+from golem.task.partialresults import PartialResultsWatcher
+from golem.testutils import PEP8MixIn, TempDirFixture
+
+
+class TestPartialResultsWatcher(TempDirFixture, PEP8MixIn):
+    PEP8_FILES = ['golem/task/partialresults.py']
+
+    def _write(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_check(self):
+        watcher = PartialResultsWatcher(self.tempdir, None)
+        assert watcher.check() == []
+
+        tile1 = self._write('tile1.png', 'tile')
+        # files being written are skipped
+        self._write('.tile2.png', 'tile')
+        assert watcher.check() == [tile1]
+        assert watcher.check() == []
+
+        tile2 = self._write('tile2.png', 'tile')
+        assert watcher.check() == [tile2]
+
+        # an updated snapshot is reported again
+        self._write('tile1.png', 'newer tile')
+        assert watcher.check() == [tile1]
+
+    def test_run(self):
+        reported = []
+        called = threading.Event()
+
+        def callback(files):
+            reported.extend(files)
+            called.set()
+
+        watcher = PartialResultsWatcher(self.tempdir, callback, interval=0.01)
+        watcher.start()
+        try:
+            path = self._write('tile.png', 'tile')
+            assert called.wait(5)
+        finally:
+            watcher.stop()
+        assert reported == [path]
+
+        # no more checks after stopping
+        self._write('tile2.png', 'tile')
+        time.sleep(0.05)
+        assert reported == [path]
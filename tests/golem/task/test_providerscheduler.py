@@ -0,0 +1,89 @@
+import time
+from unittest import TestCase
+
+from mock import patch
+
+from golem.task.providerscheduler import ProviderScheduler, \
+    ProviderStats, SchedulingVerdict
+from golem.testutils import PEP8MixIn
+
+
+class TestProviderStats(TestCase):
+
+    def test_failure_ratio(self):
+        stats = ProviderStats()
+        assert stats.failure_ratio() == 0.0
+        stats.computed = 3
+        stats.failed = 1
+        assert stats.failure_ratio() == 0.25
+
+
+class TestProviderScheduler(TestCase, PEP8MixIn):
+    PEP8_FILES = ['golem/task/providerscheduler.py']
+
+    def setUp(self):
+        self.ps = ProviderScheduler()
+
+    def test_unknown_providers(self):
+        assert self.ps.verdict("task", "node1", 1) == SchedulingVerdict.ASSIGN
+        assert self.ps.verdict("task", "node2", 1) == SchedulingVerdict.ASSIGN
+        assert self.ps.verdict("task", "node3") == SchedulingVerdict.ASSIGN
+
+    def test_subtask_finished(self):
+        self.ps.subtask_finished("task", "node", 10.0)
+        assert self.ps.providers["node"].durations["task"] == 10.0
+        self.ps.subtask_finished("task", "node", 20.0)
+        assert self.ps.providers["node"].durations["task"] == 15.0
+        assert self.ps.providers["node"].computed == 2
+
+    def test_decline_failing(self):
+        for _ in range(ProviderScheduler.MIN_RESULTS):
+            self.ps.subtask_failed("bad")
+        # no other provider to compute the task
+        assert self.ps.verdict("task", "bad", 10) == SchedulingVerdict.ASSIGN
+
+        self.ps.verdict("task", "good", 10)
+        assert self.ps.verdict("task", "bad", 10) == SchedulingVerdict.DECLINE
+
+        # the other provider is not active anymore
+        with patch('golem.task.providerscheduler.time.time',
+                   return_value=time.time() + 2 * self.ps.ACTIVE_TIMEOUT):
+            assert self.ps.verdict("task", "bad", 10) == \
+                SchedulingVerdict.ASSIGN
+
+    def test_defer_slow(self):
+        self.ps.subtask_finished("task", "fast", 10.0)
+        self.ps.subtask_finished("task", "slow", 40.0)
+        self.ps.verdict("task", "fast", 10)
+
+        assert self.ps.verdict("task", "slow", 10) == SchedulingVerdict.ASSIGN
+        # the fast provider computes 4 subtasks in the meantime
+        assert self.ps.verdict("task", "slow", 4) == SchedulingVerdict.DEFER
+        assert self.ps.verdict("task", "fast", 1) == SchedulingVerdict.ASSIGN
+
+    def test_reserve_last_subtasks(self):
+        self.ps.subtask_finished("task", "known", 10.0)
+        self.ps.verdict("task", "known", 10)
+
+        assert self.ps.verdict("task", "new", 2) == SchedulingVerdict.ASSIGN
+        assert self.ps.verdict("task", "new", 1) == SchedulingVerdict.DEFER
+        # durations are kept per task
+        assert self.ps.verdict("task2", "new", 1) == SchedulingVerdict.ASSIGN
+
+    def test_nothing_left(self):
+        self.ps.subtask_finished("task", "fast", 10.0)
+        self.ps.subtask_finished("task", "slow", 40.0)
+        self.ps.verdict("task", "fast", 10)
+
+        # speculative copies of running parts are given to every provider
+        assert self.ps.verdict("task", "slow", 0) == SchedulingVerdict.ASSIGN
+        assert self.ps.verdict("task", "new", 0) == SchedulingVerdict.ASSIGN
+
+    def test_task_removed(self):
+        self.ps.subtask_finished("task", "node", 10.0)
+        self.ps.verdict("task", "node", 10)
+        self.ps.task_removed("task")
+        stats = self.ps.providers["node"]
+        assert "task" not in stats.durations
+        assert "task" not in stats.last_seen
+        assert stats.computed == 1
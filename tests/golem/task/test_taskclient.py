@@ -26,3 +26,18 @@ class TestTaskClient(unittest.TestCase):
 
         tc.reject()
         assert tc.rejected()
+
+    def test_cancel(self):
+        tc = TaskClient(str(uuid.uuid4()))
+        tc.start()
+        tc.cancel()
+        assert not tc.started()
+        assert not tc.finishing()
+
+        tc.start()
+        tc.finish()
+        tc.cancel(finishing=True)
+        assert not tc.started()
+        assert not tc.finishing()
+        assert not tc.accepted()
+        assert not tc.rejected()
@@ -3,6 +3,8 @@ import os
 import random
 import time
 
+from twisted.internet.defer import maybeDeferred
+
 from golem.client import ClientTaskComputerEventListener
 from golem.clientconfigdescriptor import ClientConfigDescriptor
 from golem.core.common import timeout_to_deadline
@@ -15,6 +17,14 @@ from golem.tools.testdirfixture import TestDirFixture
 
 @ci_skip
 class TestTaskComputer(TestDirFixture, LogTestCase):
+    def setUp(self):
+        super(TestTaskComputer, self).setUp()
+        # build resource headers synchronously
+        patcher = mock.patch('golem.resource.resource.threads.deferToThread',
+                             side_effect=maybeDeferred)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_init(self):
         task_server = mock.MagicMock()
         task_server.get_task_computer_root.return_value = self.path
@@ -88,6 +98,30 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
 
         tc.resource_request_rejected(subtask_id, 'reason')
 
+    def test_delta_failure(self):
+        task_server = mock.MagicMock()
+        task_server.config_desc = config_desc()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.unpack_delta.return_value = False
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+
+        ctd = ComputeTaskDef()
+        ctd.task_id = "xyz"
+        ctd.subtask_id = "xxyyzz"
+        ctd.deadline = timeout_to_deadline(10)
+        assert tc.task_given(ctd)
+        tc.wait_for_resources("xyz", mock.Mock())
+
+        # stale resources are not used for computing
+        assert not tc.task_resource_collected("xyz")
+        assert not tc.current_computations
+        assert tc.delta is None
+        assert task_server.send_task_failed.call_args[0][:2] == \
+            ("xxyyzz", "xyz")
+        assert not tc.assigned_subtasks
+        assert not tc.subtasks_waiting_for_resources
+        assert "xyz" not in tc.task_to_subtask_mapping
+
     def test_computation(self):
         task_server = mock.MagicMock()
         task_server.get_task_computer_root.return_value = self.path
@@ -226,6 +260,238 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         tc.lock_config(False)
         client.lock_config.assert_called_with(False)
 
+    def test_concurrent_slots(self):
+        task_server = mock.MagicMock()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.config_desc = config_desc()
+        task_server.config_desc.max_concurrent_subtasks = 2
+        task_server.config_desc.accept_tasks = True
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        tc.support_direct_computation = True
+        results = []
+        task_server.send_results.side_effect = \
+            lambda subtask_id, *_: results.append(subtask_id)
+        assert len(tc.slots) == 2
+        assert tc.has_free_slot()
+
+        ctd = ComputeTaskDef()
+        ctd.task_id = "xyz"
+        ctd.return_address = "10.10.10.10"
+        ctd.return_port = 10203
+        ctd.key_id = "key"
+        ctd.task_owner = "owner"
+        ctd.src_code = "import time\ntime.sleep(0.5)\n" \
+                       "output={'data': 1, 'result_type': 0}"
+        ctd.extra_data = {}
+        ctd.short_description = "sleep"
+        ctd.deadline = timeout_to_deadline(10)
+
+        for subtask_id in ["sub1", "sub2"]:
+            ctd.subtask_id = subtask_id
+            tc.task_given(ctd)
+            assert tc.task_resource_collected("xyz")
+
+        assert len(tc.current_computations) == 2
+        task_threads = list(tc.current_computations)
+        assert not tc.has_free_slot()
+        assert tc.counting_task == "xyz"
+        stats = tc.get_slot_stats()
+        assert [s['index'] for s in stats] == [0, 1]
+        assert sorted(s['subtask_id'] for s in stats) == ["sub1", "sub2"]
+
+        tc.last_task_request = 0
+        tc.run()
+        task_server.request_task.assert_not_called()
+
+        for task_thread in task_threads:
+            task_thread.join()
+        assert not tc.counting_task
+        assert tc.has_free_slot()
+        assert sorted(results) == ["sub1", "sub2"]
+        stats = tc.get_slot_stats()
+        assert all(s['computed_tasks'] == 1 for s in stats)
+        assert all(s['subtask_id'] is None for s in stats)
+
+        tc.run()
+        task_server.request_task.assert_called_with()
+
+    def test_batch_given(self):
+        task_server = mock.MagicMock()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.config_desc = config_desc()
+        task_server.config_desc.max_concurrent_subtasks = 3
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        tc.support_direct_computation = True
+        assert tc.free_slots() == 3
+
+        ctds = []
+        for subtask_id in ["sub1", "sub2"]:
+            ctd = ComputeTaskDef()
+            ctd.task_id = "xyz"
+            ctd.subtask_id = subtask_id
+            ctd.return_address = "10.10.10.10"
+            ctd.return_port = 10203
+            ctd.key_id = "key"
+            ctd.task_owner = "owner"
+            ctd.src_code = "output={'data': 1, 'result_type': 0}"
+            ctd.extra_data = {}
+            ctd.short_description = "batch"
+            ctd.deadline = timeout_to_deadline(10)
+            ctds.append(ctd)
+            assert tc.task_given(ctd)
+
+        # resources are requested once for the whole batch
+        assert task_server.request_resource.call_count == 1
+        assert tc.dir_cache.is_pinned("xyz")
+        assert tc.subtasks_waiting_for_resources["xyz"] == ["sub1", "sub2"]
+        assert tc.free_slots() == 1
+
+        assert tc.task_resource_collected("xyz")
+        assert task_server.unpack_delta.call_count == 1
+        assert "xyz" not in tc.subtasks_waiting_for_resources
+        task_threads = list(tc.current_computations)
+        assert len(task_threads) == 2
+        for task_thread in task_threads:
+            task_thread.join()
+        sent = sorted(c[0][0] for c in task_server.send_results.call_args_list)
+        assert sent == ["sub1", "sub2"]
+        # the task directories are kept until the results are sent
+        assert tc.dir_cache.is_pinned("xyz")
+        tc.task_result_sent("xyz")
+        assert tc.dir_cache.is_pinned("xyz")
+        tc.task_result_sent("xyz")
+        assert not tc.dir_cache.is_pinned("xyz")
+
+        ctds[0].subtask_id = "sub3"
+        ctds[1].subtask_id = "sub4"
+        tc.task_given(ctds[0])
+        tc.task_given(ctds[1])
+        assert task_server.request_resource.call_count == 2
+        tc.task_resource_failure("xyz", "reason")
+        failed = [c[0][0] for c in task_server.send_task_failed.call_args_list]
+        assert failed == ["sub3", "sub4"]
+        assert not tc.subtasks_waiting_for_resources
+        assert not tc.assigned_subtasks
+        assert not tc.dir_cache.is_pinned("xyz")
+
+    def test_waiting_ttl_expired(self):
+        task_server = mock.MagicMock()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.config_desc = config_desc()
+        task_server.config_desc.max_concurrent_subtasks = 2
+        task_server.config_desc.accept_tasks = True
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+
+        for subtask_id in ["sub1", "sub2"]:
+            ctd = ComputeTaskDef()
+            ctd.task_id = "xyz"
+            ctd.subtask_id = subtask_id
+            ctd.deadline = timeout_to_deadline(10)
+            assert tc.task_given(ctd)
+        assert tc.dir_cache.is_pinned("xyz")
+        assert tc.free_slots() == 1
+
+        # resources did not arrive in time
+        tc.waiting_for_task = "xyz"
+        tc.waiting_ttl = 0
+        tc.last_checking = time.time() - 1
+        tc.run()
+        assert not tc.subtasks_waiting_for_resources
+        assert not tc.assigned_subtasks
+        assert not tc.task_to_subtask_mapping
+        assert not tc.dir_cache.is_pinned("xyz")
+        assert tc.free_slots() == 2
+        assert not tc.waiting_for_task
+
+    def test_dir_cache(self):
+        task_server = mock.MagicMock()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.config_desc = config_desc()
+        task_server.config_desc.max_resource_size = 1024
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        dir_cache = tc.dir_cache
+        assert dir_cache.quota == 1024 * 1024
+        dir_cache.pin("xyz")
+
+        task_server.config_desc.max_resource_size = 2048
+        tc.change_config(task_server.config_desc)
+        assert tc.dir_cache is dir_cache
+        assert dir_cache.dir_manager is tc.dir_manager
+        assert dir_cache.quota == 2048 * 1024
+        assert dir_cache.is_pinned("xyz")
+
+        with mock.patch('golem.task.taskcomputer.async_run') as async_run:
+            tc.run()
+            assert not async_run.called
+            tc.last_dir_cache_check = 0
+            tc.run()
+            assert async_run.call_args[0][0].method == dir_cache.enforce
+
+    def test_partial_results_computed(self):
+        task_server = mock.MagicMock()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.config_desc = config_desc()
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+
+        ctd = ComputeTaskDef()
+        ctd.task_id = "xyz"
+        ctd.subtask_id = "xxyyzz"
+        ctd.return_address = "10.10.10.10"
+        ctd.return_port = 10203
+        ctd.key_id = "key"
+        ctd.task_owner = "owner"
+        ctd.stream_partial_results = True
+        tc.assigned_subtasks["xxyyzz"] = ctd
+
+        task_thread = mock.Mock(subtask_id="xxyyzz")
+        with mock.patch('twisted.internet.reactor.callFromThread') as call_from_thread:
+            tc.partial_results_computed(task_thread, ["/tmp/tile.png"])
+            # results are queued in the reactor thread
+            assert not task_server.send_partial_results.called
+            func, args = call_from_thread.call_args[0][0], call_from_thread.call_args[0][1:]
+            func(*args)
+        task_server.send_partial_results.assert_called_once_with(
+            "xxyyzz", "xyz", ["/tmp/tile.png"], "10.10.10.10", 10203, "key", "owner", "ABC")
+
+        # the subtask is not computed anymore
+        task_thread.subtask_id = "aabbcc"
+        with mock.patch('twisted.internet.reactor.callFromThread',
+                        side_effect=lambda f, *args: f(*args)):
+            tc.partial_results_computed(task_thread, ["/tmp/tile.png"])
+        assert task_server.send_partial_results.call_count == 1
+
+    def test_change_slots_config(self):
+        task_server = mock.MagicMock()
+        task_server.config_desc = config_desc()
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        assert len(tc.slots) == 1
+
+        task_server.config_desc.max_concurrent_subtasks = 4
+        tc.change_slots_config(task_server.config_desc)
+        assert len(tc.slots) == 4
+        assert [s.index for s in tc.slots] == [0, 1, 2, 3]
+
+        tc.slots[3].reserve("xyz", "xxyyzz")
+        task_server.config_desc.max_concurrent_subtasks = 2
+        tc.change_slots_config(task_server.config_desc)
+        assert tc.max_concurrent_subtasks == 2
+        assert [s.index for s in tc.slots] == [0, 1, 3]
+
+        thread = mock.MagicMock(subtask_id="xxyyzz", end_time=time.time(),
+                                start_time=time.time())
+        tc.task_computed(thread)
+        assert [s.index for s in tc.slots] == [0, 1]
+
+        task_server.config_desc.max_concurrent_subtasks = "wrong"
+        tc.change_slots_config(task_server.config_desc)
+        assert tc.max_concurrent_subtasks == 1
+
+        # no more slots than cores
+        task_server.config_desc.max_concurrent_subtasks = 4
+        task_server.config_desc.num_cores = 3
+        tc.change_slots_config(task_server.config_desc)
+        assert tc.max_concurrent_subtasks == 3
+
     @staticmethod
     def __wait_for_tasks(tc):
         [t.join() for t in tc.current_computations]
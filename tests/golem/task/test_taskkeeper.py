@@ -341,6 +341,30 @@ class TestCompTaskKeeper(LogTestCase, PEP8MixIn, TempDirFixture):
         ctk.request_failure("xyz")
         self.assertEqual(ctk.active_tasks["xyz"].requests, 1)
 
+    def test_release_requests(self):
+        ctk = CompTaskKeeper(Path(self.path), False)
+        th = get_task_header()
+        ctk.add_request(th, 5, num_subtasks=4)
+        ctd = ComputeTaskDef()
+        ctd.task_id = "xyz"
+        ctd.subtask_id = "abc"
+        assert ctk.receive_subtask(ctd)
+        assert ctk.active_tasks["xyz"].requests == 3
+
+        # the owner assigned fewer subtasks than requested
+        ctk.release_requests("xyz")
+        assert ctk.active_tasks["xyz"].requests == 0
+        ctd2 = ComputeTaskDef()
+        ctd2.task_id = "xyz"
+        ctd2.subtask_id = "def"
+        assert not ctk.receive_subtask(ctd2)
+        with self.assertLogs(logger, level="WARNING"):
+            ctk.release_requests("unknown")
+
+        ctk.add_request(th, 5, num_subtasks=4)
+        ctk.request_failure("xyz", 4)
+        assert ctk.active_tasks["xyz"].requests == 0
+
     def test_receive_subtask_problems(self):
         ctk = CompTaskKeeper(Path(self.path), False)
         th = get_task_header()
@@ -1,5 +1,6 @@
 import random
 import shutil
+import threading
 import time
 import uuid
 
@@ -149,6 +150,115 @@ class TestTaskManager(LogTestCase, TestDirFixtureWithReactor):
         assert self.tm.tasks.get("xyz") is None
         assert self.tm.tasks_states.get("xyz") is None
 
+    @patch('golem.task.taskbase.Task.needs_computation', return_value=True)
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_get_next_subtasks(self, mock_addr, nc_mock):
+        mock_addr.return_value = self.addr_return
+        task_mock = self._get_task_mock()
+        wait_for(self.tm.add_new_task(task_mock), 20)
+        self.tm.tasks_states["xyz"].status = self.tm.activeStatus[0]
+
+        def get_extra_data(subtask_id):
+            ctd = ComputeTaskDef()
+            ctd.task_id = "xyz"
+            ctd.subtask_id = subtask_id
+            return Task.ExtraData(should_wait=False, ctd=ctd)
+
+        # single subtask is assigned with query_extra_data
+        task_mock.query_extra_data_batch = Mock()
+        ctds, wrong_task, wait = self.tm.get_next_subtasks("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert [ctd.subtask_id for ctd in ctds] == ["xxyyzz"]
+        assert not task_mock.query_extra_data_batch.called
+
+        wrong_task_extra_data = get_extra_data("s4")
+        wrong_task_extra_data.ctd.task_id = "abc"
+        task_mock.query_extra_data_batch.return_value = [get_extra_data("s1"), get_extra_data("s2"),
+                                                         get_extra_data("xxyyzz"), wrong_task_extra_data,
+                                                         get_extra_data("s3")]
+        task_mock.computation_failed = Mock()
+        ctds, wrong_task, wait = self.tm.get_next_subtasks("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10",
+                                                           max_subtasks=100)
+        assert task_mock.query_extra_data_batch.call_args[0][4] == TaskManager.MAX_SUBTASKS_PER_REQUEST
+        # incorrect subtasks are skipped, new ones are given back to the task
+        assert [ctd.subtask_id for ctd in ctds] == ["s1", "s2", "s3"]
+        task_mock.computation_failed.assert_called_once_with("s4")
+        assert "s4" not in self.tm.subtask2task_mapping
+        assert not wrong_task
+        assert not wait
+        for ctd in ctds:
+            assert ctd.task_owner == task_mock.header.task_owner
+            assert self.tm.subtask2task_mapping[ctd.subtask_id] == "xyz"
+            assert ctd.subtask_id in self.tm.tasks_states["xyz"].subtask_states
+
+        task_mock.query_extra_data_batch.return_value = [Task.ExtraData(should_wait=True)]
+        ctds, wrong_task, wait = self.tm.get_next_subtasks("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10",
+                                                           max_subtasks=2)
+        assert ctds == []
+        assert wait
+
+        # invalid numbers of subtasks requested by the node
+        task_mock.query_extra_data_batch.reset_mock()
+        for max_subtasks in ["8", None, True, 1.5, 0, -3]:
+            self.tm.get_next_subtasks("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10",
+                                      max_subtasks=max_subtasks)
+        assert not task_mock.query_extra_data_batch.called
+
+        ctds, wrong_task, wait = self.tm.get_next_subtasks("DEF", "DEF", "abc", 1000, 10, 5, 10, 2, "10.10.10.10",
+                                                           max_subtasks=2)
+        assert ctds == []
+        assert wrong_task
+
+    @patch('golem.task.taskmanager.TaskManager.dump_task')
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_provider_scheduler(self, mock_addr, dump_mock):
+        mock_addr.return_value = self.addr_return
+        task_mock = self._get_task_mock()
+        task_mock.computation_finished = Mock()
+        task_mock.computation_failed = Mock()
+        task_mock.verify_subtask = Mock(return_value=True)
+        task_mock.finished_computation = Mock(return_value=False)
+        task_mock.get_duplicated_subtasks = Mock(return_value=[])
+        task_mock.needs_computation = Mock(return_value=True)
+        task_mock.get_tasks_left = Mock(return_value=10)
+        wait_for(self.tm.add_new_task(task_mock))
+        scheduler = self.tm.provider_scheduler
+
+        ctd, _, _ = self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert ctd.subtask_id == "xxyyzz"
+        self.tm.tasks_states["xyz"].subtask_states["xxyyzz"].time_started = time.time() - 10
+        assert self.tm.computed_task_received("xxyyzz", [], 0)
+        assert scheduler.providers["DEF"].computed == 1
+        assert 10 <= scheduler.providers["DEF"].durations["xyz"] < 20
+
+        # the last subtask is reserved for the provider with known performance
+        task_mock.get_tasks_left.return_value = 1
+        ctd.subtask_id = "aabbcc"
+        ctds, wrong_task, wait = self.tm.get_next_subtasks("GHI", "GHI", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert ctds == []
+        assert not wrong_task
+        assert wait
+        ctds, _, _ = self.tm.get_next_subtasks("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert [c.subtask_id for c in ctds] == ["aabbcc"]
+
+        assert self.tm.task_computation_failure("aabbcc", "error")
+        assert scheduler.providers["DEF"].failed == 1
+
+        # speculative phase: all parts are assigned, copies of the running
+        # ones are given to providers with unknown performance as well
+        task_mock.get_tasks_left.return_value = 0
+        ctd.subtask_id = "ddeeff"
+        ctds, wrong_task, wait = self.tm.get_next_subtasks("GHI", "GHI", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert [c.subtask_id for c in ctds] == ["ddeeff"]
+        assert not wrong_task
+        assert not wait
+        ctd.subtask_id = "gghhii"
+        ctd_, wrong_task, wait = self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert ctd_.subtask_id == "gghhii"
+        assert not wait
+
+        self.tm.delete_task("xyz")
+        assert "xyz" not in scheduler.providers["DEF"].durations
+
     @patch("golem.task.taskmanager.get_external_address")
     def test_get_and_set_value(self, mock_addr):
         mock_addr.return_value = self.addr_return
@@ -319,6 +429,111 @@ class TestTaskManager(LogTestCase, TestDirFixtureWithReactor):
         assert ctd.subtask_id == "sss4"
         assert self.tm.computed_task_received("sss4", [], 0)
 
+    @patch('golem.task.taskmanager.TaskManager.dump_task')
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_verify_computed_task(self, mock_addr, dump_mock):
+        mock_addr.return_value = self.addr_return
+        task_mock = self._get_task_mock()
+        task_mock.computation_finished = Mock()
+        task_mock.verify_subtask = Mock(return_value=True)
+        task_mock.finished_computation = Mock(return_value=False)
+        task_mock.get_duplicated_subtasks = Mock(return_value=[])
+        task_mock.needs_computation = Mock(return_value=True)
+        wait_for(self.tm.add_new_task(task_mock))
+
+        threads = []
+        task_mock.verify_results = Mock(side_effect=lambda *args: threads.append(
+            threading.current_thread()) or args[1:])
+        task_mock.computation_finished.side_effect = lambda *_: threads.append(
+            threading.current_thread())
+
+        ctd, _, _ = self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert wait_for(self.tm.verify_computed_task("xxyyzz", [], 0))
+        task_mock.verify_results.assert_called_with("xxyyzz", [], 0)
+        task_mock.computation_finished.assert_called_with("xxyyzz", [], 0)
+        # verified in a worker thread, the task is updated on the reactor thread
+        assert threads[0].name.startswith('PoolThread')
+        assert not threads[1].name.startswith('PoolThread')
+        assert self.tm.get_subtask_status("xxyyzz") == SubtaskStatus.finished
+        assert self.tm.result_pipeline.stats['verify'].processed == 1
+
+        # result of a subtask that is not computed anymore
+        task_mock.computation_finished.reset_mock()
+        assert not wait_for(self.tm.verify_computed_task("xxyyzz", [], 0))
+        assert not task_mock.computation_finished.called
+
+        # result not accepted by the task
+        ctd.subtask_id = "aabbcc"
+        self.tm.get_next_subtask("GHI", "GHI", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        task_mock.verify_subtask.return_value = False
+        assert not wait_for(self.tm.verify_computed_task("aabbcc", [], 0))
+        assert self.tm.get_subtask_status("aabbcc") == SubtaskStatus.failure
+
+    @patch('golem.task.taskmanager.TaskManager.dump_task')
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_partial_results_received(self, mock_addr, dump_mock):
+        mock_addr.return_value = self.addr_return
+        task_mock = self._get_task_mock()
+        task_mock.partial_results_received = Mock(return_value=True)
+        task_mock.needs_computation = Mock(return_value=True)
+        wait_for(self.tm.add_new_task(task_mock))
+        self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        self.tm.notice_task_updated = Mock()
+
+        assert wait_for(self.tm.partial_results_received("xxyyzz", ["tile.png"]))
+        task_mock.partial_results_received.assert_called_with("xxyyzz", ["tile.png"])
+        self.tm.notice_task_updated.assert_called_with("xyz")
+        # partial results are not verified results
+        assert self.tm.result_pipeline.stats['verify'].processed == 0
+
+        task_mock.partial_results_received.side_effect = ValueError
+        assert not wait_for(self.tm.partial_results_received("xxyyzz", ["tile.png"]))
+        assert not wait_for(self.tm.partial_results_received("unknown", ["tile.png"]))
+
+    @patch('golem.task.taskmanager.TaskManager.dump_task')
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_computed_task_received_cancels_duplicates(self, mock_addr, dump_mock):
+        mock_addr.return_value = self.addr_return
+        task_mock = self._get_task_mock()
+        task_mock.computation_finished = Mock()
+        task_mock.verify_subtask = Mock(return_value=True)
+        task_mock.finished_computation = Mock(return_value=False)
+        task_mock.get_duplicated_subtasks = Mock(return_value=["aabbcc"])
+        task_mock.needs_computation = Mock(return_value=True)
+        wait_for(self.tm.add_new_task(task_mock))
+
+        ctd, _, _ = self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2,
+                                             "10.10.10.10")
+        assert ctd.subtask_id == "xxyyzz"
+        ctd.subtask_id = "aabbcc"
+        self.tm.get_next_subtask("GHI", "GHI", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        ss = self.tm.tasks_states["xyz"].subtask_states["aabbcc"]
+        ss.time_started = time.time() - 100
+        ss.computer.price = 36
+        assert self.tm.get_subtask_status("aabbcc") == SubtaskStatus.starting
+
+        assert self.tm.computed_task_received("xxyyzz", [], 0)
+        task_mock.get_duplicated_subtasks.assert_called_with("xxyyzz")
+        assert self.tm.get_subtask_status("xxyyzz") == SubtaskStatus.finished
+        assert self.tm.get_subtask_status("aabbcc") == SubtaskStatus.cancelled
+        assert ss.computation_time >= 100
+        assert ss.value > 0
+        assert self.tm.get_subtask_status("unknown") is None
+
+        # node is not paid for the time after cancellation
+        value = ss.value
+        self.tm.set_computation_time("aabbcc", 1000)
+        assert 100 <= ss.computation_time < 1000
+        assert ss.value == value
+        self.tm.set_computation_time("aabbcc", 50)
+        assert ss.computation_time == 50
+        assert ss.value < value
+
+        # cancelled subtask does not time out
+        ss.deadline = get_timestamp_utc() - 1
+        assert self.tm.check_timeouts() == []
+        assert self.tm.get_subtask_status("aabbcc") == SubtaskStatus.cancelled
+
     @patch("golem.task.taskmanager.get_external_address")
     def test_task_result_incoming(self, mock_addr):
         mock_addr.return_value = self.addr_return
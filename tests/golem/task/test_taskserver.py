@@ -16,7 +16,7 @@ from golem.core.threads import wait_for
 from golem.core.variables import APP_VERSION
 from golem.network.p2p.node import Node
 from golem.task.taskbase import ComputeTaskDef, TaskHeader
-from golem.task.taskserver import TaskServer, WaitingTaskResult, logger
+from golem.task.taskserver import TaskServer, WaitingTaskResult, WaitingPartialResult, logger
 from golem.task.taskserver import TASK_CONN_TYPES
 from golem.tools.assertlogs import LogTestCase
 from golem.tools.testwithappconfig import TestWithKeysAuth
@@ -165,7 +165,7 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         self.assertEqual(session.conn_id, "abc")
         self.assertEqual(ts.task_sessions["xyz"], session)
         session.send_hello.assert_called_with()
-        session.request_task.assert_called_with("nodename", "xyz", 1010, 30, 3, 1, 2)
+        session.request_task.assert_called_with("nodename", "xyz", 1010, 30, 3, 1, 2, 1)
 
     def test_change_config(self):
         ccd = self._get_config_desc()
@@ -362,6 +362,78 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         self.assertTrue(ts._add_pending_request.called)
         self.assertEqual(ts.failures_to_send, {})
 
+    @patch("golem.task.taskserver.Trust")
+    def test_send_partial_results(self, _):
+        ccd = self._get_config_desc()
+        ts = TaskServer(Node(), ccd, Mock(), self.client,
+                        use_docker_machine_manager=False)
+        self.ts = ts
+        ts.network = Mock()
+        ts.task_computer = Mock()
+        ts.task_manager = Mock()
+        ts.task_manager.check_timeouts.return_value = []
+        ts.task_keeper = Mock()
+        ts.task_connections_helper = Mock()
+        ts._add_pending_request = Mock()
+
+        args = ("xyz", "10.10.10.10", 10101, "key", "owner", "node_name")
+        ts.send_partial_results("xxyyzz", args[0], ["/a/tile1.png"], *args[1:])
+        ts.send_partial_results("xxyyzz", args[0], ["/a/tile2.png", "/a/tile1.png"], *args[1:])
+        wpr = ts.partial_results_to_send["xxyyzz"]
+        self.assertIsInstance(wpr, WaitingPartialResult)
+        self.assertEqual(wpr.result, ["/a/tile1.png", "/a/tile2.png"])
+
+        ts.sync_network()
+        ts._add_pending_request.assert_called_once_with(
+            TASK_CONN_TYPES['partial_result'], "owner", 10101, "key",
+            {'waiting_partial_result': wpr})
+        self.assertEqual(ts.partial_results_to_send, {})
+
+        session = Mock()
+        ts.task_sessions["xxyyzz"] = session
+        ts.send_partial_results("xxyyzz", args[0], ["/a/tile3.png"], *args[1:])
+        ts.sync_network()
+        session.send_partial_result_hash.assert_called_once_with(ANY)
+        self.assertEqual(ts._add_pending_request.call_count, 1)
+
+        self.assertEqual(ts.next_partial_result_sequence("xxyyzz"), 1)
+        self.assertEqual(ts.next_partial_result_sequence("xxyyzz"), 2)
+
+        # the final result supersedes partial results
+        ts.send_partial_results("xxyyzz", args[0], ["/a/tile4.png"], *args[1:])
+        ts.send_results("xxyyzz", "xyz", {"data": [], "result_type": 1}, 40,
+                        "10.10.10.10", 10101, "key", "owner", "node_name")
+        self.assertEqual(ts.partial_results_to_send, {})
+        ts.send_partial_results("xxyyzz", args[0], ["/a/tile5.png"], *args[1:])
+        self.assertEqual(ts.partial_results_to_send, {})
+
+        with patch.object(ts.task_computer, 'task_result_sent') as result_sent:
+            ts.task_result_sent("xxyyzz")
+            # the task directories are released once
+            ts.task_result_sent("xxyyzz")
+            result_sent.assert_called_once_with("xyz")
+        self.assertEqual(ts.next_partial_result_sequence("xxyyzz"), 1)
+
+    def test_conn_for_partial_result(self):
+        ccd = self._get_config_desc()
+        ts = TaskServer(Node(), ccd, Mock(), self.client,
+                        use_docker_machine_manager=False)
+        self.ts = ts
+        ts._mark_connected = Mock()
+        ts.remove_pending_conn = Mock()
+        ts.remove_responses = Mock()
+        wpr = WaitingPartialResult("xyz", "xxyyzz", "10.10.10.10", 10101, "key", "owner")
+
+        session = Mock()
+        ts.conn_established_for_type[TASK_CONN_TYPES['partial_result']](session, "conn_id", wpr)
+        self.assertEqual(session.key_id, "key")
+        session.send_hello.assert_called_once_with()
+        session.send_partial_result_hash.assert_called_once_with(wpr, disconnect=True)
+
+        ts.conn_final_failure_for_type[TASK_CONN_TYPES['partial_result']]("conn_id", wpr)
+        ts.remove_pending_conn.assert_called_with("conn_id")
+        ts.remove_responses.assert_called_with("conn_id")
+
     def test_add_task_session(self):
         ccd = self._get_config_desc()
         ts = TaskServer(Node(), ccd, Mock(), self.client,
@@ -644,6 +716,20 @@ class TestTaskServer2(TestWithKeysAuth, TestDirFixtureWithReactor):
         ts.client.transaction_system.add_payment_info.assert_called_with("xyz", "xxyyzz", expected_value, account_info)
         self.assertGreater(trust.COMPUTED.increase.call_count, prev_calls)
 
+        assert ts.task_manager.is_subtask_paid("xxyyzz")
+
+        # the subtask is paid for only once
+        ts.client.transaction_system.add_payment_info.reset_mock()
+        ts.pay_for_subtask("xxyyzz", account_info)
+        assert not ts.client.transaction_system.add_payment_info.called
+
+        # payment only, trust is not changed
+        ts.task_manager.tasks_states["xyz"].subtask_states["xxyyzz"].paid = False
+        prev_calls = trust.COMPUTED.increase.call_count
+        ts.pay_for_subtask("xxyyzz", account_info)
+        ts.client.transaction_system.add_payment_info.assert_called_with("xyz", "xxyyzz", expected_value, account_info)
+        self.assertEqual(trust.COMPUTED.increase.call_count, prev_calls)
+
     @patch("golem.task.taskmanager.TaskManager.dump_task")
     @patch("golem.task.taskmanager.get_external_address")
     @patch("golem.task.taskserver.Trust")
@@ -6,6 +6,8 @@ import uuid
 
 from apps.core.task.coretask import TaskResourceHeader
 from mock import Mock, MagicMock, patch
+from pathlib import Path
+from twisted.internet.defer import Deferred, fail, succeed
 
 from golem.core.databuffer import DataBuffer
 from golem.core.keysauth import KeysAuth, EllipticalKeysAuth
@@ -17,10 +19,13 @@ from golem.network.transport.message import (MessageWantToComputeTask, MessageCa
                                              MessageReportComputedTask, MessageHello,
                                              MessageSubtaskResultRejected, MessageSubtaskResultAccepted,
                                              MessageTaskResultHash, MessageGetTaskResult, MessageCannotComputeTask,
-                                             Message)
+                                             MessagePartialTaskResultHash, Message)
 from golem.network.transport.tcpnetwork import BasicProtocol
+from golem.task.result.resultpipeline import ResultPipeline
 from golem.task.taskbase import ComputeTaskDef, result_types
-from golem.task.taskserver import WaitingTaskResult
+from golem.task.taskkeeper import CompTaskKeeper
+from golem.task.taskserver import WaitingPartialResult, WaitingTaskResult
+from golem.task.taskstate import SubtaskStatus
 from golem.task.tasksession import TaskSession, logger, TASK_PROTOCOL_ID
 from golem.testutils import PEP8MixIn
 from golem.testutils import TempDirFixture
@@ -113,7 +118,7 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         ts2.can_be_unsigned.append(mt.TYPE)
         ts2.task_server.should_accept_provider.return_value = False
         ts2.task_server.config_desc.max_price = 100
-        ts2.task_manager.get_next_subtask.return_value = ("CTD", False, False)
+        ts2.task_manager.get_next_subtasks.return_value = (["CTD"], False, False)
         ts2.interpret(mt)
         ms = ts2.conn.send_message.call_args[0][0]
         self.assertIsInstance(ms, MessageCannotAssignTask)
@@ -122,7 +127,7 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         ts2.interpret(mt)
         ms = ts2.conn.send_message.call_args[0][0]
         self.assertIsInstance(ms, MessageTaskToCompute)
-        ts2.task_manager.get_next_subtask.return_value = ("CTD", True, False)
+        ts2.task_manager.get_next_subtasks.return_value = (["CTD"], True, False)
         ts2.interpret(mt)
         ms = ts2.conn.send_message.call_args[0][0]
         self.assertIsInstance(ms, MessageCannotAssignTask)
@@ -135,6 +140,24 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         ts2._react_to_cannot_compute_task(MessageCannotComputeTask("CTD"))
         assert not ts2.task_manager.task_computation_failure.called
 
+    def test_request_task_batch(self):
+        ts = TaskSession(Mock())
+        ts.verified = True
+        ts.request_task("ABC", "xyz", 1030, 30, 3, 1, 8, 3)
+        mt = ts.conn.send_message.call_args[0][0]
+        self.assertEqual(mt.max_subtasks, 3)
+
+        ts2 = TaskSession(Mock())
+        ts2.verified = True
+        ts2.key_id = "DEF"
+        ts2.task_server.should_accept_provider.return_value = True
+        ts2.task_manager.get_next_subtasks.return_value = (["CTD1", "CTD2"], False, False)
+        ts2._react_to_want_to_compute_task(mt)
+        assert ts2.task_manager.get_next_subtasks.call_args[0][-1] == 3
+        sent = [c[0][0] for c in ts2.conn.send_message.call_args_list]
+        assert [m.compute_task_def for m in sent] == ["CTD1", "CTD2"]
+        assert all(isinstance(m, MessageTaskToCompute) for m in sent)
+
     def test_send_report_computed_task(self):
         ts = TaskSession(Mock())
         ts.verified = True
@@ -211,7 +234,8 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         ts = TaskSession(conn)
         ts.task_server = Mock()
         ts.task_manager = Mock()
-        ts.task_manager.verify_subtask.return_value = True
+        ts.task_manager.verify_computed_task.side_effect = \
+            lambda *_: succeed(True)
 
         extra_data = dict(
             # the result is explicitly serialized using cPickle
@@ -238,6 +262,45 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         assert ts.msgs_to_send[0].__class__ == MessageSubtaskResultAccepted
         assert conn.close.called
 
+        # result not accepted by the task
+        ts.task_manager.verify_computed_task.side_effect = \
+            lambda *_: succeed(False)
+        conn.close.called = False
+        ts.msgs_to_send = []
+
+        ts.result_received(extra_data, decrypt=False)
+
+        assert isinstance(ts.msgs_to_send[0], MessageSubtaskResultRejected)
+        assert conn.close.called
+
+        # verification error
+        ts.task_manager.verify_computed_task.side_effect = \
+            lambda *_: fail(ValueError("Wrong result"))
+        conn.close.called = False
+        ts.msgs_to_send = []
+
+        ts.result_received(extra_data, decrypt=False)
+
+        assert isinstance(ts.msgs_to_send[0], MessageSubtaskResultRejected)
+        ts.task_manager.task_computation_failure.assert_called_with(
+            'xxyyzz', 'Error verifying task result')
+        assert conn.close.called
+
+        # verification in progress
+        ts.task_manager.verify_computed_task.side_effect = None
+        ts.task_manager.verify_computed_task.return_value = deferred = \
+            Deferred()
+        conn.close.called = False
+        ts.msgs_to_send = []
+
+        ts.result_received(extra_data, decrypt=False)
+
+        assert not ts.msgs_to_send
+        assert not conn.close.called
+        deferred.callback(True)
+        assert isinstance(ts.msgs_to_send[0], MessageSubtaskResultAccepted)
+        assert conn.close.called
+
         extra_data.update(dict(
             subtask_id=None,
         ))
@@ -249,6 +312,44 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         assert not ts.msgs_to_send
         assert conn.close.called
 
+    def test_cancelled_subtask_result(self):
+        conn = Mock()
+        ts = TaskSession(conn)
+        ts.task_server = Mock()
+        ts.task_manager = Mock()
+        ts.task_manager.get_subtask_status.return_value = \
+            SubtaskStatus.cancelled
+        ts.task_manager.subtask2task_mapping = {"xxyyzz": "xyz"}
+        ts.key_id = "KEY_ID"
+
+        # report from a node that did not compute the subtask is dropped
+        ts.task_manager.get_node_id_for_subtask.return_value = "OTHER_KEY_ID"
+        ms = MessageReportComputedTask(subtask_id="xxyyzz",
+                                       computation_time=100)
+        ts._react_to_report_computed_task(ms)
+        assert not ts.task_server.receive_subtask_computation_time.called
+        assert not ts.task_server.pay_for_subtask.called
+        assert not ts.msgs_to_send
+        assert conn.close.called
+
+        conn.reset_mock()
+        ts.task_manager.get_node_id_for_subtask.return_value = "KEY_ID"
+        ts._react_to_report_computed_task(ms)
+        ts.task_server.receive_subtask_computation_time.assert_called_with(
+            "xxyyzz", 100)
+        assert ts.task_server.pay_for_subtask.called
+        assert not ts.task_server.accept_result.called
+        assert isinstance(ts.msgs_to_send[0], MessageSubtaskResultAccepted)
+        assert conn.close.called
+
+        ts.msgs_to_send = []
+        ts.result_received(dict(result_type=result_types['data'],
+                                subtask_id="xxyyzz"), decrypt=False)
+        assert not ts.task_manager.verify_computed_task.called
+        assert not ts.task_server.reject_result.called
+        assert not ts.task_server.accept_result.called
+        assert isinstance(ts.msgs_to_send[0], MessageSubtaskResultAccepted)
+
     def test_react_to_task_result_hash(self):
 
         def create_pull_package(result):
@@ -262,8 +363,10 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
 
         conn = Mock()
         ts = TaskSession(conn)
-        ts.result_received = Mock()
+        ts.result_received = Mock(side_effect=lambda *_, **__: succeed(None))
         ts.task_manager.subtask2task_mapping = dict()
+        ts.task_manager.result_pipeline = ResultPipeline()
+        stats = ts.task_manager.result_pipeline.stats
 
         subtask_id = 'xxyyzz'
         secret = 'pass'
@@ -277,16 +380,67 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         ts.task_manager.task_result_manager.pull_package = create_pull_package(True)
         ts._react_to_task_result_hash(msg)
         assert ts.result_received.called
+        assert stats['download'].processed == 1
 
         ts.task_manager.task_result_manager.pull_package = create_pull_package(False)
         ts._react_to_task_result_hash(msg)
         assert ts.task_server.reject_result.called
         assert ts.task_manager.task_computation_failure.called
+        assert stats['download'].failed == 1
+        assert stats['download'].pending == 0
+        assert not ts.task_manager.result_pipeline.is_congested()
 
         msg.subtask_id = "UNKNOWN"
         with self.assertLogs(logger, level="ERROR"):
             ts._react_to_task_result_hash(msg)
 
+    def test_react_to_partial_task_result_hash(self):
+        conn = Mock()
+        ts = TaskSession(conn)
+        ts.key_id = 'provider'
+        ts.task_manager.get_node_id_for_subtask.return_value = 'provider'
+        ts.task_manager.subtask2task_mapping = {'xxyyzz': 'xyz'}
+        ts.task_manager.tasks = {'xyz': Mock(tmp_dir=self.path)}
+        ts.task_manager.result_pipeline = ResultPipeline()
+        pull_package = ts.task_manager.task_result_manager.pull_package
+
+        msg = MessagePartialTaskResultHash(subtask_id='xxyyzz', secret='pass', multihash='multihash',
+                                           options=None, sequence=2)
+        ts._react_to_partial_task_result_hash(msg)
+        assert pull_package.call_count == 1
+        kwargs = pull_package.call_args[1]
+        assert kwargs['package_name'] == 'xyz.xxyyzz.partial2'
+        assert kwargs['output_dir'] == os.path.join(self.path, 'partial', '2')
+
+        extracted = Mock()
+        extracted.to_extra_data.return_value = {'result': ['/tmp/tile.png']}
+        kwargs['success'](extracted)
+        ts.task_manager.partial_results_received.assert_called_with('xxyyzz', ['/tmp/tile.png'])
+        # partial results are never rejected
+        kwargs['error'](Exception('Pull failed'))
+        assert not ts.task_manager.task_computation_failure.called
+        assert not conn.close.called
+
+        # node that does not compute the subtask
+        ts.task_manager.get_node_id_for_subtask.return_value = 'other'
+        ts._react_to_partial_task_result_hash(msg)
+        assert pull_package.call_count == 1
+
+        # sequence numbers are a part of the output path
+        ts.task_manager.get_node_id_for_subtask.return_value = 'provider'
+        for sequence in [-1, '../..', 1.5, None, True]:
+            msg.sequence = sequence
+            ts._react_to_partial_task_result_hash(msg)
+        assert pull_package.call_count == 1
+        msg.sequence = 2
+
+        # results to verify are waiting
+        ts.task_manager.get_node_id_for_subtask.return_value = 'provider'
+        ts.task_manager.result_pipeline = ResultPipeline(max_pending=1)
+        ts.task_manager.result_pipeline.submit(Deferred)
+        ts._react_to_partial_task_result_hash(msg)
+        assert pull_package.call_count == 1
+
     def test_react_to_task_to_compute(self):
         conn = Mock()
         ts = TaskSession(conn)
@@ -437,6 +591,53 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
         ts.task_computer.task_given.assert_called_with(ctd)
         conn.close.assert_not_called()
 
+    def test_react_to_task_to_compute_batch(self):
+        conn = Mock()
+        ts = TaskSession(conn)
+        ts.key_id = "KEY_ID"
+        ts.task_manager = Mock()
+        ts.task_manager.comp_task_keeper = CompTaskKeeper(Path(self.path),
+                                                          persist=False)
+        ts.task_computer = Mock()
+        ts.task_server = Mock()
+
+        env = Mock()
+        env.docker_images = [DockerImage("dockerix/xii", tag="323")]
+        env.allow_custom_main_program_file = False
+        env.get_source_code.return_value = "print 'Hello world'"
+        ts.task_server.get_environment_by_id.return_value = env
+
+        header = Mock()
+        header.task_id = "TASKID"
+        ts.task_manager.comp_task_keeper.add_request(header, 10, 2)
+
+        def __ctd(subtask_id):
+            ctd = ComputeTaskDef()
+            ctd.task_id = "TASKID"
+            ctd.subtask_id = subtask_id
+            ctd.key_id = "KEY_ID"
+            ctd.task_owner = Node()
+            ctd.task_owner.key = "KEY_ID"
+            ctd.return_address = "10.10.10.10"
+            ctd.return_port = 1112
+            ctd.docker_images = [DockerImage("dockerix/xii", tag="323")]
+            return ctd
+
+        # Both subtasks of a batch are accepted
+        ctds = [__ctd("SUBTASK1"), __ctd("SUBTASK2")]
+        for ctd in ctds:
+            ts._react_to_task_to_compute(MessageTaskToCompute(ctd))
+        assert ts.task_computer.task_given.call_count == 2
+        for ctd in ctds:
+            ts.task_computer.task_given.assert_any_call(ctd)
+        ts.task_computer.session_closed.assert_not_called()
+        conn.close.assert_not_called()
+
+        # A subtask over the requested number is refused
+        ts._react_to_task_to_compute(MessageTaskToCompute(__ctd("SUBTASK3")))
+        assert ts.task_computer.task_given.call_count == 2
+        ts.task_computer.session_closed.assert_called_with()
+
     def test_get_resource(self):
         conn = BasicProtocol()
         conn.transport = Mock()
@@ -451,6 +652,45 @@ class TestTaskSession(LogTestCase, TempDirFixture, PEP8MixIn):
 
         assert Message.deserialize_message(db.buffered_data)
 
+    def test_react_to_delta_parts(self):
+        ts = TaskSession(Mock())
+        ts.task_id = 'xyz'
+        ts.task_server = Mock()
+        ts.task_computer = Mock()
+        header = TaskResourceHeader("resources")
+
+        msg = message.MessageDeltaParts('xyz', header, ['part'], 'node',
+                                        Node(), '10.0.0.1', 40102)
+        ts._react_to_delta_parts(msg)
+        # all subtasks of the request were received before the resources
+        ts.task_manager.comp_task_keeper.release_requests.assert_called_with(
+            'xyz')
+        ts.task_computer.wait_for_resources.assert_called_with('xyz', header)
+        assert ts.task_server.pull_resources.call_count == 1
+        assert ts.task_server.add_resource_peer.call_count == 1
+        assert not ts.task_computer.task_resource_collected.called
+
+        # all changes sent as deltas in the header
+        ts.task_server.reset_mock()
+        msg = message.MessageDeltaParts('xyz', header, [], 'node', Node(),
+                                        '10.0.0.1', 40102)
+        ts._react_to_delta_parts(msg)
+        ts.task_computer.task_resource_collected.assert_called_with('xyz')
+        assert not ts.task_server.pull_resources.called
+
+    def test_request_answered_without_subtasks(self):
+        ts = TaskSession(Mock())
+        ts.task_id = 'xyz'
+        ts._react_to_waiting_for_results(message.MessageWaitingForResults())
+        ts.task_manager.comp_task_keeper.release_requests.assert_called_with(
+            'xyz')
+
+        ts.task_manager.reset_mock()
+        ts._react_to_cannot_assign_task(
+            MessageCannotAssignTask(task_id='abc', reason='no subtasks'))
+        ts.task_manager.comp_task_keeper.release_requests.assert_called_with(
+            'abc')
+
     def test_verify(self):
         keys_auth = EllipticalKeysAuth(self.path)
         conn = Mock()
@@ -525,3 +765,30 @@ class TestCreatePackage(unittest.TestCase):
 
         assert ts.send.called
         assert ts.dropped.called
+
+    @patch('golem.task.tasksession.async_run', side_effect=executor_success)
+    def test_send_partial_result_hash(self, async_run):
+        ts = self.ts
+        ts.task_server.next_partial_result_sequence.return_value = 3
+        wpr = WaitingPartialResult('xyz', self.subtask_id, '10.10.10.10', 10101, 'owner_key', 'owner')
+        wpr.add_files(['/tmp/tile.png'])
+
+        ts.send_partial_result_hash(wpr)
+        request = async_run.call_args[0][0]
+        assert request.kwargs['package_name'] == 'xyz.xxyyzz.partial3'
+        msg = ts.send.call_args[0][0]
+        assert isinstance(msg, MessagePartialTaskResultHash)
+        assert msg.multihash == 'multihash'
+        assert msg.sequence == 3
+        assert not ts.dropped.called
+
+        ts.send_partial_result_hash(wpr, disconnect=True)
+        assert ts.dropped.called
+
+    @patch('golem.task.tasksession.async_run', side_effect=executor_error)
+    def test_send_partial_result_hash_error(self, _):
+        ts = self.ts
+        wpr = WaitingPartialResult('xyz', self.subtask_id, '10.10.10.10', 10101, 'owner_key', 'owner')
+        ts.send_partial_result_hash(wpr)
+        assert not ts.send.called
+        assert not ts.task_server.task_result_sent.called
@@ -233,6 +233,22 @@ class TestClient(TestWithDatabase):
         status = c.get_status()
         self.assertIn("Not accepting tasks", status)
 
+    def test_get_task_stats(self, *_):
+        self.client = Client(datadir=self.path, transaction_system=False,
+                             connect_to_known_hosts=False, use_docker_machine_manager=False,
+                             use_monitor=False)
+        c = self.client
+        c.task_server = MagicMock()
+        slots = [dict(index=0, subtask_id="xxyyzz", progress=0.5, computed_tasks=1)]
+        c.task_server.task_computer.get_slot_stats.return_value = slots
+        pipeline_stats = dict(verify=dict(pending=1, processed=2))
+        c.task_server.task_manager.result_pipeline.get_stats.return_value = \
+            pipeline_stats
+        stats = c.get_task_stats()
+        assert stats[u'slots'] == slots
+        assert stats[u'result_pipeline'] == pipeline_stats
+        assert u'subtasks_computed' in stats
+
     def test_quit(self, *_):
         self.client = Client(datadir=self.path)
         self.client.db = None